@@ -0,0 +1,93 @@
+"""
+Ejecución de llamadas bloqueantes a GCP fuera del event loop
+Los clientes de Cloud Storage y Pub/Sub son síncronos; esta capa los ejecuta
+en un pool de hilos acotado con timeout por llamada para que una petición lenta
+no bloquee al resto de peticiones del worker de uvicorn
+"""
+
+import asyncio
+import contextvars
+import functools
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class GCPCallTimeout(Exception):
+    """La llamada a GCP superó el tiempo máximo configurado"""
+
+
+class BlockingIOExecutor:
+    """
+    Pool de hilos acotado para llamadas síncronas a clientes GCP
+
+    Args:
+        max_workers: Número máximo de llamadas concurrentes; 0 ejecuta las
+            llamadas directamente en el event loop (solo para comparativas)
+        timeout: Segundos máximos por llamada por defecto
+    """
+
+    def __init__(self, max_workers: int = 32, timeout: Optional[float] = 30.0):
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self._executor = None
+        if max_workers > 0:
+            self._executor = ThreadPoolExecutor(
+                max_workers=max_workers,
+                thread_name_prefix='gcp-io'
+            )
+
+    async def run(self, func: Callable[..., Any], *args,
+                  timeout: Optional[float] = None, **kwargs) -> Any:
+        """
+        Ejecuta una llamada bloqueante y espera su resultado sin bloquear el loop
+
+        La llamada hereda las variables de contexto (p. ej. la traza activa).
+
+        Args:
+            func: Función síncrona a ejecutar
+            timeout: Segundos máximos para esta llamada (por defecto el del pool)
+
+        Returns:
+            Any: Resultado de la función
+
+        Raises:
+            GCPCallTimeout: Si la llamada no termina a tiempo
+        """
+        call = functools.partial(func, *args, **kwargs)
+        if self._executor is None:
+            return call()
+
+        loop = asyncio.get_running_loop()
+        context = contextvars.copy_context()
+        future = loop.run_in_executor(self._executor, context.run, call)
+        limit = self.timeout if timeout is None else timeout
+
+        try:
+            return await asyncio.wait_for(future, limit)
+        except asyncio.TimeoutError:
+            name = getattr(func, '__qualname__', repr(func))
+            logger.warning(f"Timeout de {limit}s en llamada a GCP: {name}")
+            raise GCPCallTimeout(f"Tiempo de espera agotado en llamada a GCP: {name}")
+
+    def shutdown(self):
+        """Libera los hilos del pool"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+
+
+def create_executor_from_env() -> BlockingIOExecutor:
+    """
+    Construye el executor a partir del entorno
+
+    Variables de entorno:
+        GCP_IO_MAX_WORKERS: Llamadas concurrentes a GCP por worker (por defecto 32)
+        GCP_IO_TIMEOUT: Timeout por llamada en segundos (por defecto 30)
+    """
+    return BlockingIOExecutor(
+        max_workers=int(os.environ.get('GCP_IO_MAX_WORKERS', 32)),
+        timeout=float(os.environ.get('GCP_IO_TIMEOUT', 30))
+    )
@@ -0,0 +1,141 @@
+"""
+Deduplicación de documentos por contenido
+Cuando se sube un documento cuyo SHA-256 ya se procesó por completo, el nuevo
+nombre se enlaza a los resultados existentes (OCR, extracción y backup) en
+lugar de volver a ejecutar el pipeline
+"""
+
+import threading
+from typing import Any, Dict, Optional
+
+from shared.status_index import StatusIndex, list_backup_paths
+
+# Campos del registro canónico que comparte un documento duplicado
+LINKED_FIELDS = (
+    'ocr_completed',
+    'ocr_result_path',
+    'ocr_result_generation',
+    'backup_completed',
+    'backup_path',
+    'extraction_completed',
+    'extracted_info_path',
+    'extracted_info_generation',
+    'extracted_info_sections',
+    'document_type'
+)
+
+
+class DeduplicationStats:
+    """Contadores de aciertos y fallos de deduplicación del proceso"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+
+    def record_hit(self, size: int):
+        with self._lock:
+            self.hits += 1
+            self.bytes_saved += size
+
+    def record_miss(self):
+        with self._lock:
+            self.misses += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / total, 4) if total else 0.0,
+                'bytes_saved': self.bytes_saved
+            }
+
+
+def register_upload(index: StatusIndex, file_name: str, sha256: str,
+                    **fields) -> Optional[Dict[str, Any]]:
+    """
+    Registra un documento subido en el índice resolviendo duplicados
+
+    Args:
+        index: Índice de estado
+        file_name: Nombre único del documento subido
+        sha256: Hash del contenido
+        **fields: Campos adicionales del registro (tamaño, tipo, fecha...)
+
+    Returns:
+        Dict: Registro canónico si el documento es un duplicado ya procesado,
+        None si debe procesarse normalmente
+    """
+    owner = index.get_hash_owner(sha256)
+    canonical = index.get(owner) if owner else None
+
+    if canonical and canonical.get('status') == 'completed':
+        linked = {field: canonical.get(field) for field in LINKED_FIELDS}
+        index.update(file_name, sha256=sha256, duplicate_of=owner, **linked, **fields)
+        index.update(owner, duplicates=[file_name])
+        return canonical
+
+    index.update(file_name, sha256=sha256, **fields)
+    if owner and canonical is None:
+        # El documento canónico se eliminó: el nuevo pasa a ser el propietario
+        index.set_hash_owner(sha256, file_name)
+    else:
+        index.set_hash_owner(sha256, file_name, only_if_absent=True)
+    return None
+
+
+def owns_results(record: Dict[str, Any]) -> bool:
+    """
+    Indica si los resultados y backups de un documento pueden borrarse con él
+
+    Es la misma decisión que toma `release_document`, sin modificar el índice.
+    """
+    if record.get('duplicate_of'):
+        return False
+    return not [name for name in record.get('duplicates') or [] if name != record['file_name']]
+
+
+def release_document(index: StatusIndex, record: Dict[str, Any]) -> bool:
+    """
+    Actualiza las referencias compartidas antes de eliminar un documento
+
+    Si otros documentos enlazan a sus resultados, el primero de ellos hereda
+    la propiedad (y las rutas de backup) para que sigan siendo accesibles.
+
+    Args:
+        index: Índice de estado
+        record: Registro del documento a eliminar
+
+    Returns:
+        bool: True si los resultados y backups del documento pueden borrarse
+    """
+    file_name = record['file_name']
+    sha256 = record.get('sha256')
+
+    owner = record.get('duplicate_of')
+    if owner:
+        if index.get(owner) is not None:
+            index.update(owner, discard={'duplicates': [file_name]})
+        return False
+
+    duplicates = [name for name in record.get('duplicates') or [] if name != file_name]
+    if duplicates:
+        heir, rest = duplicates[0], duplicates[1:]
+        index.update(
+            heir,
+            duplicate_of=None,
+            duplicates=rest,
+            backup_paths=list_backup_paths(record)
+        )
+        for name in rest:
+            index.update(name, duplicate_of=heir)
+        if sha256:
+            index.set_hash_owner(sha256, heir)
+        return False
+
+    if sha256 and index.get_hash_owner(sha256) == file_name:
+        index.delete_hash_owner(sha256)
+    return True
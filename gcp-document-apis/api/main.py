@@ -3,19 +3,44 @@ API Principal para Procesamiento de Documentos
 Orquesta todo el flujo de trabajo: OCR, Backup y Extracción de Información
 """
 
+import asyncio
 import json
 import logging
+import mimetypes
 import os
-from datetime import datetime
-from typing import Dict, Any, List, Optional
+import secrets
+import shutil
+import tarfile
+import tempfile
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Any, BinaryIO, List, Optional
 
-from fastapi import FastAPI, File, UploadFile, HTTPException, BackgroundTasks
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, File, Form, UploadFile, HTTPException, BackgroundTasks, Depends, Query, Request, Response
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
-import uvicorn
 
-from google.cloud import storage
-from google.cloud import pubsub_v1
+from google.api_core.exceptions import NotFound
+
+from blocking_io import GCPCallTimeout, create_executor_from_env
+from deduplication import DeduplicationStats, owns_results, register_upload, release_document
+from notifications import (NOTIFIED_EVENTS, CompletionBroker, create_notifier_from_env, format_sse,
+                           notification_from_event, notification_from_record, validate_callback_url)
+from result_cache import cache_key, create_cache_from_env
+from shared import clients
+from shared.backup_layout import append_manifest
+from shared.batch_extraction import EXTRACTION_MODE_BATCH, EXTRACTION_MODE_SYNC
+from shared.naming import INCOMING_PREFIX, is_staging_object
+from shared.publishing import PublishMetrics
+from shared.rate_limit import RateLimiter
+from shared.restore import REPROCESS_FROM_OCR, RESTORE_MAX_PER_SECOND, RestoreJob
+from shared.result_format import (SECTIONS, decode_sections, is_compact_result, merge_sections, project_result,
+                                  read_sections)
+from shared.routing import EXTRACTION_COMPLETED, START_OCR, decode_pubsub_event
+from shared.tracing import (TRACE_ATTRIBUTE, TRACE_HEADER, adopt_trace, current_trace_id, metrics, span,
+                            trace_context)
+from shared.status_index import list_backup_paths
+from streaming import HashingReader, aligned_chunk_size
 
 # Configuración de logging
 logging.basicConfig(level=logging.INFO)
@@ -28,9 +53,130 @@ app = FastAPI(
     version="1.0.0"
 )
 
-# Inicializar clientes GCP
-storage_client = storage.Client()
-publisher = pubsub_v1.PublisherClient()
+# Los clientes de GCP (Cloud Storage, el índice de estado y el publicador de
+# Pub/Sub) se crean en el primer uso (shared/clients.py); ver warm_up_clients
+
+# Pool acotado para las llamadas bloqueantes a GCP
+gcp_io = create_executor_from_env()
+
+# Notificaciones push a clientes (SSE en /events) y webhooks de finalización
+completion_broker = CompletionBroker()
+webhooks = create_notifier_from_env()
+
+# Contadores de deduplicación por contenido
+dedupe_stats = DeduplicationStats()
+
+# Trabajos de restauración de este worker; comparten el límite de ritmo
+restore_jobs: Dict[str, RestoreJob] = {}
+restore_limiter = RateLimiter(RESTORE_MAX_PER_SECOND)
+
+# Caché de resultados de OCR y extracción indexada por generación del objeto
+result_cache = create_cache_from_env()
+
+def publishing_snapshot() -> Dict[str, Any]:
+    """Métricas del publicador; a cero si este worker aún no ha publicado"""
+    current = clients.publisher.peek()
+    return current.metrics.snapshot() if current is not None else PublishMetrics().snapshot()
+
+# Métricas HTTP y del worker exportadas en /metrics
+http_request_duration = metrics.histogram(
+    'http_request_duration_seconds',
+    'Duración de las peticiones HTTP por endpoint'
+)
+metrics.gauge(
+    'dedupe_uploads',
+    'Subidas resueltas por deduplicación (hit) o procesadas (miss)',
+    lambda: {
+        (('result', 'hit'),): dedupe_stats.snapshot()['hits'],
+        (('result', 'miss'),): dedupe_stats.snapshot()['misses']
+    }
+)
+metrics.gauge(
+    'pubsub_messages',
+    'Mensajes de Pub/Sub publicados, fallidos y pendientes de confirmar',
+    lambda: {
+        (('state', state),): publishing_snapshot()[state]
+        for state in ('published', 'failed', 'outstanding')
+    }
+)
+metrics.gauge(
+    'result_cache_lookups',
+    'Consultas a la caché de resultados por nivel',
+    lambda: {
+        (('result', result),): result_cache.snapshot()[result]
+        for result in ('memory_hits', 'disk_hits', 'misses')
+    }
+)
+metrics.gauge('result_cache_bytes', 'Bytes en la caché de resultados en memoria',
+              lambda: result_cache.snapshot()['bytes'])
+metrics.gauge('event_stream_subscribers', 'Clientes conectados a /events',
+              lambda: completion_broker.snapshot()['subscribers'])
+metrics.gauge(
+    'webhook_deliveries',
+    'Webhooks de finalización entregados y fallidos',
+    lambda: {(('result', result),): count for result, count in webhooks.snapshot().items()}
+)
+
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    """
+    Abre una traza por petición (o continúa la de la cabecera X-Trace-Id)
+    y mide su duración por endpoint
+    """
+    with trace_context(request.headers.get(TRACE_HEADER)) as trace_id:
+        started_at = time.perf_counter()
+        status_code = 500
+        try:
+            response = await call_next(request)
+            status_code = response.status_code
+            response.headers[TRACE_HEADER] = trace_id
+            return response
+        finally:
+            endpoint = request.scope.get('endpoint')
+            http_request_duration.observe(
+                time.perf_counter() - started_at,
+                method=request.method,
+                endpoint=getattr(endpoint, '__name__', 'unmatched'),
+                status=status_code
+            )
+
+@app.on_event("startup")
+async def warm_up_clients():
+    """
+    Crea en segundo plano el cliente de Cloud Storage y el índice de estado
+
+    La API acepta peticiones sin esperarlos; el publicador de Pub/Sub se crea
+    con la primera subida.
+    """
+    async def warm_up():
+        try:
+            await gcp_io.run(clients.status_index)
+        except Exception as e:
+            logger.warning(f"No se pudieron crear los clientes de GCP al arrancar: {str(e)}")
+    
+    app.state.client_warm_up = asyncio.create_task(warm_up())
+
+@app.on_event("shutdown")
+def cancel_restore_jobs():
+    """Deja de reencolar documentos de los trabajos de restauración en curso"""
+    for job in restore_jobs.values():
+        job.cancel()
+
+@app.on_event("shutdown")
+def shutdown_gcp_io():
+    """Libera el pool de llamadas a GCP al detener la API"""
+    gcp_io.shutdown()
+
+@app.on_event("shutdown")
+def flush_publisher():
+    """Espera a que se confirmen los mensajes pendientes antes de detener la API"""
+    if clients.publisher.peek() is not None:
+        clients.publisher().flush()
+
+@app.on_event("shutdown")
+def shutdown_webhooks():
+    """Termina las entregas de webhooks en curso antes de detener la API"""
+    webhooks.shutdown()
 
 # Modelos Pydantic
 class DocumentUploadResponse(BaseModel):
@@ -38,6 +184,23 @@ class DocumentUploadResponse(BaseModel):
     file_name: str
     upload_path: str
     status: str
+    size: Optional[int] = None
+    sha256: Optional[str] = None
+    duplicate_of: Optional[str] = None
+
+class BatchUploadItem(BaseModel):
+    filename: str
+    status: str
+    file_name: Optional[str] = None
+    sha256: Optional[str] = None
+    duplicate_of: Optional[str] = None
+    error: Optional[str] = None
+
+class BatchUploadResponse(BaseModel):
+    total: int
+    succeeded: int
+    failed: int
+    results: List[BatchUploadItem]
 
 class ProcessingStatus(BaseModel):
     file_name: str
@@ -54,6 +217,17 @@ class DocumentInfo(BaseModel):
     extracted_info: Optional[Dict[str, Any]]
     backup_path: Optional[str]
 
+class RestoreRequest(BaseModel):
+    stage: str = REPROCESS_FROM_OCR
+    document_type: Optional[str] = None
+    date_from: Optional[str] = None
+    date_to: Optional[str] = None
+    sha256: Optional[str] = None
+    file_names: Optional[List[str]] = None
+    limit: Optional[int] = None
+    dry_run: bool = False
+    extraction_mode: Optional[str] = None
+
 # Configuración
 PROJECT_ID = os.environ.get('GOOGLE_CLOUD_PROJECT')
 STORAGE_BUCKET = os.environ.get('STORAGE_BUCKET_NAME', 'document-processing')
@@ -61,6 +235,44 @@ BACKUP_BUCKET = os.environ.get('BACKUP_BUCKET_NAME', 'document-backup')
 RESULT_BUCKET = os.environ.get('RESULT_BUCKET_NAME', 'document-results')
 PUBSUB_TOPIC = os.environ.get('PUBSUB_TOPIC_NAME', 'document-processing')
 
+# Tipos de archivo admitidos
+ALLOWED_EXTENSIONS = ['.pdf', '.jpg', '.jpeg', '.png', '.tiff', '.bmp']
+
+# Subidas por lotes: máximo de archivos por petición y subidas simultáneas
+BATCH_MAX_FILES = int(os.environ.get('BATCH_MAX_FILES', 500))
+BATCH_UPLOAD_CONCURRENCY = int(os.environ.get('BATCH_UPLOAD_CONCURRENCY', 8))
+
+# Subidas en streaming: tamaño de bloque de la subida reanudable y timeout
+UPLOAD_CHUNK_SIZE = aligned_chunk_size(float(os.environ.get('UPLOAD_CHUNK_SIZE_MB', 8)))
+UPLOAD_TIMEOUT = float(os.environ.get('UPLOAD_TIMEOUT', 600))
+
+# Paginación de /documents
+DEFAULT_PAGE_SIZE = int(os.environ.get('DOCUMENTS_PAGE_SIZE', 50))
+MAX_PAGE_SIZE = int(os.environ.get('DOCUMENTS_MAX_PAGE_SIZE', 500))
+
+# Streams de /events: duración máxima, intervalo de keepalive y de comprobación
+# del índice (por si la notificación push llegó a otra instancia de la API)
+EVENTS_MAX_WAIT = float(os.environ.get('EVENTS_MAX_WAIT', 300))
+EVENTS_KEEPALIVE = float(os.environ.get('EVENTS_KEEPALIVE', 15))
+EVENTS_RECHECK_INTERVAL = float(os.environ.get('EVENTS_RECHECK_INTERVAL', 60))
+
+# Token opcional que Pub/Sub incluye en la URL de la suscripción push
+PUSH_VERIFICATION_TOKEN = os.environ.get('PUSH_VERIFICATION_TOKEN')
+
+# Trabajos de restauración terminados que se conservan para consulta
+RESTORE_JOBS_KEPT = int(os.environ.get('RESTORE_JOBS_KEPT', 100))
+
+# Token (cabecera `Authorization: Bearer`) que exigen los endpoints /restore;
+# sin él los endpoints quedan deshabilitados, porque la API es pública
+RESTORE_API_TOKEN = os.environ.get('RESTORE_API_TOKEN')
+
+# Si hay desplegado un sondeo de la extracción por lotes (info-extractor-batches):
+# sin él, los documentos restaurados con extraction_mode = batch nunca se extraerían
+EXTRACTION_BATCH_POLL = os.environ.get('EXTRACTION_BATCH_POLL', 'true').lower() == 'true'
+
+# Campo de GET /info que selecciona el texto OCR junto a las secciones de la extracción
+INFO_OCR_FIELD = 'ocr_text'
+
 @app.get("/")
 async def root():
     """Endpoint raíz con información de la API"""
@@ -70,9 +282,15 @@ async def root():
         "status": "running",
         "endpoints": {
             "upload": "/upload",
+            "upload_batch": "/upload/batch",
+            "upload_archive": "/upload/archive",
             "status": "/status/{file_name}",
+            "events": "/events/{file_name}",
             "info": "/info/{file_name}",
             "list": "/documents",
+            "restore": "/restore",
+            "stats": "/stats",
+            "metrics": "/metrics",
             "health": "/health"
         }
     }
@@ -82,8 +300,8 @@ async def health_check():
     """Verificación de salud de la API"""
     try:
         # Verificar conexión a GCP
-        bucket = storage_client.bucket(STORAGE_BUCKET)
-        bucket.reload()
+        bucket = clients.storage().bucket(STORAGE_BUCKET)
+        await gcp_io.run(bucket.reload)
         
         return {
             "status": "healthy",
@@ -91,6 +309,8 @@ async def health_check():
             "gcp_connection": "ok",
             "storage_bucket": STORAGE_BUCKET
         }
+    except GCPCallTimeout as e:
+        raise HTTPException(status_code=504, detail=str(e))
     except Exception as e:
         logger.error(f"Health check failed: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Health check failed: {str(e)}")
@@ -98,7 +318,8 @@ async def health_check():
 @app.post("/upload", response_model=DocumentUploadResponse)
 async def upload_document(
     background_tasks: BackgroundTasks,
-    file: UploadFile = File(...)
+    file: UploadFile = File(...),
+    callback_url: Optional[str] = Form(None)
 ):
     """
     Sube un documento y inicia el procesamiento automático
@@ -107,76 +328,323 @@ async def upload_document(
     1. OCR usando Google Cloud Vision API
     2. Backup y clasificación en Google Cloud Storage
     3. Extracción de información usando Google Cloud Document AI
+    
+    Si se indica `callback_url`, la API envía un POST a esa URL cuando el
+    documento termina de procesarse. El progreso también puede seguirse en
+    GET /events/{file_name}.
     """
     try:
-        # Validar archivo
-        if not file.filename:
-            raise HTTPException(status_code=400, detail="Nombre de archivo requerido")
-        
-        # Validar tipo de archivo
-        allowed_extensions = ['.pdf', '.jpg', '.jpeg', '.png', '.tiff', '.bmp']
-        file_extension = os.path.splitext(file.filename)[1].lower()
-        
-        if file_extension not in allowed_extensions:
-            raise HTTPException(
-                status_code=400, 
-                detail=f"Tipo de archivo no soportado. Permitidos: {', '.join(allowed_extensions)}"
-            )
-        
-        # Crear nombre único para el archivo
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        unique_filename = f"{timestamp}_{file.filename}"
+        await file.seek(0)
+        return await store_document(file.file, file.filename, file.content_type, background_tasks,
+                                    callback_url=callback_url)
         
-        # Subir archivo al bucket de procesamiento
-        bucket = storage_client.bucket(STORAGE_BUCKET)
-        blob = bucket.blob(unique_filename)
+    except HTTPException:
+        raise
+    except GCPCallTimeout as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error subiendo documento: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error subiendo documento: {str(e)}")
+
+@app.post("/upload/batch", response_model=BatchUploadResponse)
+async def upload_documents_batch(
+    background_tasks: BackgroundTasks,
+    files: List[UploadFile] = File(...),
+    callback_url: Optional[str] = Form(None)
+):
+    """
+    Sube varios documentos en una sola petición multipart
+    
+    Los archivos se envían a Cloud Storage en paralelo (como máximo
+    BATCH_UPLOAD_CONCURRENCY a la vez). Un archivo inválido o fallido no
+    interrumpe el resto: cada uno tiene su propio resultado en la respuesta.
+    """
+    if len(files) > BATCH_MAX_FILES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Demasiados archivos en el lote ({len(files)}), máximo {BATCH_MAX_FILES}"
+        )
+    
+    semaphore = asyncio.Semaphore(BATCH_UPLOAD_CONCURRENCY)
+    
+    async def store_one(upload: UploadFile) -> BatchUploadItem:
+        async with semaphore:
+            await upload.seek(0)
+            return await store_batch_item(upload.file, upload.filename, upload.content_type, background_tasks,
+                                          callback_url)
+    
+    results = await asyncio.gather(*(store_one(upload) for upload in files))
+    return build_batch_response(results)
+
+@app.post("/upload/archive", response_model=BatchUploadResponse)
+async def upload_documents_archive(
+    background_tasks: BackgroundTasks,
+    archive: UploadFile = File(...),
+    callback_url: Optional[str] = Form(None)
+):
+    """
+    Sube un archivo tar (opcionalmente comprimido) y procesa cada documento que contiene
+    
+    Los miembros se extraen uno a uno a ficheros temporales y se suben en
+    paralelo; como máximo hay BATCH_UPLOAD_CONCURRENCY extraídos a la vez, de
+    modo que el disco y la memoria usados no dependen del tamaño del archivo.
+    """
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(BATCH_UPLOAD_CONCURRENCY)
+    tasks = []
+    
+    def store_member(spool, filename: str) -> asyncio.Task:
+        task = asyncio.create_task(store_batch_item(spool, filename, mimetypes.guess_type(filename)[0],
+                                                    background_tasks, callback_url))
         
-        # Leer contenido del archivo
-        content = await file.read()
-        blob.upload_from_string(content, content_type=file.content_type)
+        # Un callback y no un `finally` en la tarea: también se ejecuta si la
+        # tarea se cancela antes de empezar
+        def release(_):
+            spool.close()
+            semaphore.release()
         
-        logger.info(f"Documento subido exitosamente: {unique_filename}")
+        task.add_done_callback(release)
+        return task
+    
+    try:
+        await archive.seek(0)
+        tar = await loop.run_in_executor(None, lambda: tarfile.open(fileobj=archive.file, mode='r:*'))
+    except tarfile.TarError as e:
+        raise HTTPException(status_code=400, detail=f"Archivo tar inválido: {str(e)}")
+    
+    with tar:
+        try:
+            for member in tar:
+                if not member.isfile():
+                    continue
+                if len(tasks) >= BATCH_MAX_FILES:
+                    raise HTTPException(
+                        status_code=400,
+                        detail=f"Demasiados archivos en el lote, máximo {BATCH_MAX_FILES}"
+                    )
+                
+                await semaphore.acquire()
+                try:
+                    spool = await loop.run_in_executor(None, extract_tar_member, tar, member)
+                except BaseException:
+                    semaphore.release()
+                    raise
+                tasks.append(store_member(spool, os.path.basename(member.name)))
+        except BaseException as e:
+            # Abortar las subidas en curso si el archivo no puede leerse entero
+            # (o la petición se cancela)
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            if isinstance(e, tarfile.TarError):
+                raise HTTPException(status_code=400, detail=f"Archivo tar inválido: {str(e)}")
+            raise
         
-        # Iniciar procesamiento en background
-        background_tasks.add_task(
-            start_document_processing,
+        results = await asyncio.gather(*tasks)
+    
+    return build_batch_response(results)
+
+def extract_tar_member(tar: tarfile.TarFile, member: tarfile.TarInfo) -> BinaryIO:
+    """Copia un miembro del tar a un fichero temporal (en memoria hasta 8 MB)"""
+    spool = tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024)
+    shutil.copyfileobj(tar.extractfile(member), spool, UPLOAD_CHUNK_SIZE)
+    spool.seek(0)
+    return spool
+
+async def store_batch_item(file_obj: BinaryIO, filename: Optional[str], content_type: Optional[str],
+                           background_tasks: BackgroundTasks,
+                           callback_url: Optional[str] = None) -> BatchUploadItem:
+    """Sube un documento de un lote capturando su error sin interrumpir el resto"""
+    try:
+        response = await store_document(
+            file_obj,
+            filename,
+            content_type,
+            background_tasks,
+            unique_suffix=secrets.token_hex(4),
+            callback_url=callback_url
+        )
+        return BatchUploadItem(
+            filename=filename or "",
+            status=response.status,
+            file_name=response.file_name,
+            sha256=response.sha256,
+            duplicate_of=response.duplicate_of
+        )
+    except HTTPException as e:
+        return BatchUploadItem(filename=filename or "", status="error", error=str(e.detail))
+    except Exception as e:
+        logger.error(f"Error subiendo {filename} en lote: {str(e)}")
+        return BatchUploadItem(filename=filename or "", status="error", error=str(e))
+
+def build_batch_response(results: List[BatchUploadItem]) -> BatchUploadResponse:
+    """Resume los resultados individuales de un lote"""
+    failed = sum(1 for item in results if item.status == "error")
+    return BatchUploadResponse(
+        total=len(results),
+        succeeded=len(results) - failed,
+        failed=failed,
+        results=results
+    )
+
+async def store_document(file_obj: BinaryIO, filename: Optional[str], content_type: Optional[str],
+                         background_tasks: BackgroundTasks,
+                         unique_suffix: Optional[str] = None,
+                         callback_url: Optional[str] = None) -> DocumentUploadResponse:
+    """
+    Valida, sube y registra un documento, y programa su procesamiento
+    
+    Args:
+        file_obj: Fichero binario posicionado al inicio
+        filename: Nombre original del archivo
+        content_type: Tipo de contenido declarado
+        background_tasks: Tareas en background de la petición
+        unique_suffix: Sufijo para evitar colisiones de nombres dentro de un lote
+        callback_url: Webhook al que notificar la finalización del procesamiento
+    
+    Returns:
+        DocumentUploadResponse: Resultado de la subida
+    """
+    # Validar archivo
+    if not filename:
+        raise HTTPException(status_code=400, detail="Nombre de archivo requerido")
+    
+    # Validar tipo de archivo
+    file_extension = os.path.splitext(filename)[1].lower()
+    
+    if file_extension not in ALLOWED_EXTENSIONS:
+        raise HTTPException(
+            status_code=400, 
+            detail=f"Tipo de archivo no soportado. Permitidos: {', '.join(ALLOWED_EXTENSIONS)}"
+        )
+    
+    if callback_url:
+        try:
+            # La validación resuelve el host: se hace fuera del event loop
+            await asyncio.get_running_loop().run_in_executor(None, validate_callback_url, callback_url)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    
+    # Crear nombre único para el archivo
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    if unique_suffix:
+        unique_filename = f"{timestamp}_{unique_suffix}_{filename}"
+    else:
+        unique_filename = f"{timestamp}_{filename}"
+    
+    # Subir archivo a la zona de staging del bucket de procesamiento;
+    # el OCR no se dispara hasta publicarlo con su nombre definitivo
+    bucket = clients.storage().bucket(STORAGE_BUCKET)
+    blob = bucket.blob(f"{INCOMING_PREFIX}{unique_filename}")
+    blob.chunk_size = UPLOAD_CHUNK_SIZE
+    
+    # Enviar el fichero temporal por bloques con subida reanudable,
+    # calculando los checksums a medida que se lee
+    reader = HashingReader(file_obj)
+    with span('upload.stream', file_name=unique_filename) as attributes:
+        await gcp_io.run(
+            blob.upload_from_file,
+            reader,
+            content_type=content_type,
+            rewind=False,
+            timeout=UPLOAD_TIMEOUT
+        )
+        attributes['bytes'] = reader.bytes_read
+    
+    # Verificar integridad con el MD5 calculado por Cloud Storage
+    if blob.md5_hash and blob.md5_hash != reader.md5_base64:
+        await gcp_io.run(delete_blob_if_exists, blob)
+        raise HTTPException(
+            status_code=502,
+            detail=f"Checksum no coincide tras subir {unique_filename}"
+        )
+    
+    logger.info(f"Documento subido exitosamente: {unique_filename} ({reader.bytes_read} bytes)")
+    
+    # Registrar el documento en el índice antes de publicarlo, enlazándolo
+    # a los resultados existentes si el mismo contenido ya se procesó
+    # (la traza se guarda en el registro para que el OCR, activado por
+    # Cloud Storage y no por Pub/Sub, pueda continuarla)
+    with span('upload.register', file_name=unique_filename):
+        canonical = await gcp_io.run(
+            register_upload,
+            clients.status_index(),
             unique_filename,
-            file.content_type
+            reader.sha256_hex,
+            content_type=content_type,
+            size=reader.bytes_read,
+            md5_hash=reader.md5_base64,
+            uploaded_at=datetime.now().isoformat(),
+            callback_url=callback_url,
+            **{TRACE_ATTRIBUTE: current_trace_id()}
         )
+    
+    # Publicar el documento con su nombre definitivo (copia en el servidor)
+    with span('upload.publish_object', file_name=unique_filename):
+        await gcp_io.run(bucket.copy_blob, blob, bucket, unique_filename)
+        await gcp_io.run(delete_blob_if_exists, blob)
+    
+    if canonical:
+        dedupe_stats.record_hit(reader.bytes_read)
+        logger.info(f"Documento duplicado: {unique_filename} reutiliza resultados de {canonical['file_name']}")
+        
+        # El duplicado ya está completo: el webhook se envía sin esperar al pipeline
+        if callback_url:
+            webhooks.submit(callback_url, notification_from_event(EXTRACTION_COMPLETED, {'file_name': unique_filename}))
         
         return DocumentUploadResponse(
-            message="Documento subido exitosamente. El procesamiento ha comenzado.",
+            message="Documento ya procesado anteriormente. Se reutilizan sus resultados.",
             file_name=unique_filename,
             upload_path=f"gs://{STORAGE_BUCKET}/{unique_filename}",
-            status="uploaded"
+            status="completed",
+            size=reader.bytes_read,
+            sha256=reader.sha256_hex,
+            duplicate_of=canonical['file_name']
         )
-        
-    except Exception as e:
-        logger.error(f"Error subiendo documento: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Error subiendo documento: {str(e)}")
+    
+    dedupe_stats.record_miss()
+    
+    # Iniciar procesamiento en background
+    background_tasks.add_task(
+        start_document_processing,
+        unique_filename,
+        content_type,
+        reader.bytes_read
+    )
+    
+    return DocumentUploadResponse(
+        message="Documento subido exitosamente. El procesamiento ha comenzado.",
+        file_name=unique_filename,
+        upload_path=f"gs://{STORAGE_BUCKET}/{unique_filename}",
+        status="uploaded",
+        size=reader.bytes_read,
+        sha256=reader.sha256_hex
+    )
 
-async def start_document_processing(file_name: str, content_type: str):
+async def start_document_processing(file_name: str, content_type: str, size: Optional[int] = None):
     """
     Inicia el procesamiento del documento en el flujo de trabajo
     
     Args:
         file_name: Nombre del archivo a procesar
         content_type: Tipo de contenido del archivo
+        size: Tamaño en bytes (la extracción decide con él si envía los bytes o la URI)
     """
     try:
         logger.info(f"Iniciando procesamiento para: {file_name}")
         
-        # Publicar mensaje en Pub/Sub para iniciar OCR
-        topic_path = publisher.topic_path(PROJECT_ID, PUBSUB_TOPIC)
-        
+        # Publicar mensaje en Pub/Sub para iniciar OCR y esperar su confirmación
         message_data = {
             'file_name': file_name,
             'content_type': content_type,
+            'size': size,
             'timestamp': datetime.now().isoformat(),
-            'action': 'start_ocr'
+            'action': START_OCR
         }
         
-        publisher.publish(topic_path, json.dumps(message_data).encode('utf-8'))
+        # La primera publicación crea el publicador en el pool (importa Pub/Sub)
+        publisher = await gcp_io.run(clients.publisher)
+        await gcp_io.run(publisher.publish_event, START_OCR, message_data)
         logger.info(f"Mensaje publicado en Pub/Sub para: {file_name}")
         
     except Exception as e:
@@ -188,184 +656,598 @@ async def get_processing_status(file_name: str):
     Obtiene el estado del procesamiento de un documento específico
     """
     try:
-        # Verificar archivo original
-        bucket = storage_client.bucket(STORAGE_BUCKET)
-        original_blob = bucket.blob(file_name)
+        # Consultar el índice de estado (una sola búsqueda por clave)
+        record = await gcp_io.run(clients.status_index().get, file_name)
         
-        if not original_blob.exists():
+        if record is None:
             raise HTTPException(status_code=404, detail="Documento no encontrado")
         
-        # Verificar estado de OCR
-        ocr_bucket = storage_client.bucket(RESULT_BUCKET)
-        ocr_blob = ocr_bucket.blob(f"ocr_results/{file_name.replace('.', '_')}_ocr.txt")
-        ocr_completed = ocr_blob.exists()
-        
-        # Verificar estado de backup
-        backup_bucket = storage_client.bucket(BACKUP_BUCKET)
-        backup_exists = False
-        backup_path = None
-        
-        # Buscar en diferentes tipos de documento
-        for doc_type in ['invoice', 'contract', 'identification', 'report', 'general']:
-            blobs = list(backup_bucket.list_blobs(prefix=f"{doc_type}/"))
-            for blob in blobs:
-                if file_name in blob.name:
-                    backup_exists = True
-                    backup_path = blob.name
-                    break
-            if backup_exists:
-                break
-        
-        # Verificar estado de extracción
-        extraction_blob = ocr_bucket.blob(f"extracted_info/{file_name.replace('.', '_')}_info.json")
-        extraction_completed = extraction_blob.exists()
-        
         return ProcessingStatus(
             file_name=file_name,
-            status="completed" if all([ocr_completed, backup_exists, extraction_completed]) else "processing",
-            ocr_completed=ocr_completed,
-            backup_completed=backup_exists,
-            extraction_completed=extraction_completed,
+            status=record['status'],
+            ocr_completed=bool(record.get('ocr_completed')),
+            backup_completed=bool(record.get('backup_completed')),
+            extraction_completed=bool(record.get('extraction_completed')),
             timestamp=datetime.now().isoformat()
         )
         
+    except HTTPException:
+        raise
+    except GCPCallTimeout as e:
+        raise HTTPException(status_code=504, detail=str(e))
     except Exception as e:
         logger.error(f"Error obteniendo estado para {file_name}: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error obteniendo estado: {str(e)}")
 
+@app.get("/events/{file_name}")
+async def stream_document_events(
+    file_name: str,
+    timeout: Optional[float] = Query(None, gt=0, description="Segundos máximos del stream")
+):
+    """
+    Stream de Server-Sent Events con el progreso de un documento
+    
+    Envía primero el estado actual (`status`) y después un evento por cada
+    etapa completada (`ocr_completed`, `backup_completed`,
+    `extraction_completed`). El stream se cierra cuando el documento se
+    completa o al agotar `timeout` (evento `timeout`); el cliente puede
+    reconectarse y recibirá de nuevo el estado actual.
+    """
+    # Suscribirse antes de leer el índice para no perder una notificación intermedia
+    queue = completion_broker.subscribe(file_name)
+    try:
+        record = await gcp_io.run(clients.status_index().get, file_name)
+    except GCPCallTimeout as e:
+        completion_broker.unsubscribe(file_name, queue)
+        raise HTTPException(status_code=504, detail=str(e))
+    except Exception as e:
+        completion_broker.unsubscribe(file_name, queue)
+        logger.error(f"Error abriendo eventos para {file_name}: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error abriendo eventos: {str(e)}")
+    
+    if record is None:
+        completion_broker.unsubscribe(file_name, queue)
+        raise HTTPException(status_code=404, detail="Documento no encontrado")
+    
+    max_wait = min(timeout or EVENTS_MAX_WAIT, EVENTS_MAX_WAIT)
+    
+    async def events():
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + max_wait
+        last_check = loop.time()
+        try:
+            notification = notification_from_record(file_name, record)
+            yield format_sse(notification['event'], notification)
+            
+            while notification['status'] != 'completed':
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    yield format_sse('timeout', {'event': 'timeout', 'file_name': file_name})
+                    return
+                
+                try:
+                    notification = await asyncio.wait_for(queue.get(), min(EVENTS_KEEPALIVE, remaining))
+                except asyncio.TimeoutError:
+                    if loop.time() - last_check < EVENTS_RECHECK_INTERVAL:
+                        yield ": keepalive\n\n"
+                        continue
+                    
+                    # La notificación pudo llegar a otra instancia: confirmar en el índice
+                    last_check = loop.time()
+                    current = await gcp_io.run(clients.status_index().get, file_name)
+                    if current is None:
+                        yield format_sse('deleted', {'event': 'deleted', 'file_name': file_name})
+                        return
+                    if current['status'] != 'completed':
+                        yield ": keepalive\n\n"
+                        continue
+                    notification = notification_from_record(file_name, current)
+                
+                yield format_sse(notification['event'], notification)
+        finally:
+            completion_broker.unsubscribe(file_name, queue)
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.post("/events/pubsub", status_code=204)
+async def receive_pipeline_event(request: Request, token: Optional[str] = None):
+    """
+    Endpoint de las suscripciones push de Pub/Sub a los eventos de etapa
+    
+    Reenvía cada evento a los streams de /events abiertos en esta instancia y,
+    cuando el documento se completa, a su webhook. Los mensajes no válidos se
+    confirman igualmente (204) para que Pub/Sub no los reintente.
+    """
+    if PUSH_VERIFICATION_TOKEN and not secrets.compare_digest(token or '', PUSH_VERIFICATION_TOKEN):
+        raise HTTPException(status_code=403, detail="Token de verificación inválido")
+    
+    try:
+        envelope = await request.json()
+        message = envelope['message']
+        adopt_trace((message.get('attributes') or {}).get(TRACE_ATTRIBUTE))
+        event_name, message_data = decode_pubsub_event(message)
+    except Exception as e:
+        logger.warning(f"Mensaje push no válido descartado: {str(e)}")
+        return Response(status_code=204)
+    
+    try:
+        await gcp_io.run(handle_pipeline_event, event_name, message_data)
+    except GCPCallTimeout as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error notificando {event_name}: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error notificando evento: {str(e)}")
+    
+    return Response(status_code=204)
+
+def handle_pipeline_event(event_name: Optional[str], message_data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    Notifica un evento de etapa a los suscriptores del documento
+    
+    Se ejecuta fuera del event loop: al completarse el documento consulta el
+    índice para obtener el webhook registrado en la subida.
+    
+    Args:
+        event_name: Nombre del evento del pipeline
+        message_data: Contenido del mensaje de Pub/Sub
+    
+    Returns:
+        Dict: Notificación enviada, o None si el evento no se notifica
+    """
+    file_name = message_data.get('file_name')
+    if event_name not in NOTIFIED_EVENTS or not file_name:
+        return None
+    
+    notification = notification_from_event(event_name, message_data)
+    completion_broker.publish(file_name, notification)
+    
+    # Con etapas en paralelo el documento lo completa la última etapa en terminar
+    if notification['status'] == 'completed':
+        record = clients.status_index().get(file_name)
+        if record and record.get('callback_url'):
+            webhooks.submit(record['callback_url'], notification)
+    
+    return notification
+
 @app.get("/info/{file_name}", response_model=DocumentInfo)
-async def get_document_info(file_name: str):
+async def get_document_info(
+    file_name: str,
+    fields: Optional[str] = Query(
+        None,
+        description="Secciones separadas por comas: ocr_text, " + ", ".join(SECTIONS)
+    )
+):
     """
     Obtiene toda la información extraída de un documento
+    
+    Con `fields` solo se leen las secciones indicadas del resultado de
+    extracción (y el texto OCR si se pide `ocr_text`).
     """
     try:
-        # Verificar que el documento existe
-        bucket = storage_client.bucket(STORAGE_BUCKET)
-        original_blob = bucket.blob(file_name)
+        requested = parse_info_fields(fields)
+        
+        # Consultar el índice de estado
+        record = await gcp_io.run(clients.status_index().get, file_name)
         
-        if not original_blob.exists():
+        if record is None:
             raise HTTPException(status_code=404, detail="Documento no encontrado")
         
         # Obtener texto OCR
         ocr_text = None
-        ocr_bucket = storage_client.bucket(RESULT_BUCKET)
-        ocr_blob = ocr_bucket.blob(f"ocr_results/{file_name.replace('.', '_')}_ocr.txt")
-        
-        if ocr_blob.exists():
-            ocr_text = ocr_blob.download_as_text()
+        include_ocr = requested is None or INFO_OCR_FIELD in requested
+        if include_ocr and record.get('ocr_completed') and record.get('ocr_result_path'):
+            ocr_text = await gcp_io.run(
+                read_result_text,
+                record['ocr_result_path'],
+                record.get('ocr_result_generation')
+            )
         
         # Obtener información extraída
         extracted_info = None
-        extraction_blob = ocr_bucket.blob(f"extracted_info/{file_name.replace('.', '_')}_info.json")
-        
-        if extraction_blob.exists():
-            extracted_info = json.loads(extraction_blob.download_as_text())
+        sections = None if requested is None else [field for field in requested if field != INFO_OCR_FIELD]
+        if sections != [] and record.get('extraction_completed') and record.get('extracted_info_path'):
+            extracted_info = await gcp_io.run(read_extracted_info, record, sections)
         
         # Determinar tipo de documento
-        document_type = "general"
+        document_type = record.get('document_type') or "general"
         if extracted_info and 'document_type' in extracted_info:
             document_type = extracted_info['document_type']
         
-        # Obtener ruta de backup
-        backup_path = None
-        backup_bucket = storage_client.bucket(BACKUP_BUCKET)
-        
-        for doc_type in ['invoice', 'contract', 'identification', 'report', 'general']:
-            blobs = list(backup_bucket.list_blobs(prefix=f"{doc_type}/"))
-            for blob in blobs:
-                if file_name in blob.name:
-                    backup_path = blob.name
-                    break
-            if backup_path:
-                break
-        
         return DocumentInfo(
             file_name=file_name,
             document_type=document_type,
             ocr_text=ocr_text,
             extracted_info=extracted_info,
-            backup_path=backup_path
+            backup_path=record.get('backup_path')
         )
         
+    except HTTPException:
+        raise
+    except GCPCallTimeout as e:
+        raise HTTPException(status_code=504, detail=str(e))
     except Exception as e:
         logger.error(f"Error obteniendo información para {file_name}: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error obteniendo información: {str(e)}")
 
+def parse_info_fields(fields: Optional[str]) -> Optional[List[str]]:
+    """Valida la proyección de GET /info; None equivale a todas las secciones"""
+    if fields is None:
+        return None
+    requested = [field.strip() for field in fields.split(',') if field.strip()]
+    unknown = [field for field in requested if field != INFO_OCR_FIELD and field not in SECTIONS]
+    if unknown:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Campos no soportados: {', '.join(unknown)}. Permitidos: {INFO_OCR_FIELD}, {', '.join(SECTIONS)}"
+        )
+    return requested
+
+def read_extracted_info(record: Dict[str, Any], sections: Optional[List[str]] = None) -> Dict[str, Any]:
+    """
+    Lee el resultado de extracción de un documento, completo o solo algunas secciones
+    
+    Cada sección se cachea por separado; las que faltan se descargan con
+    peticiones por rango. Los resultados en el formato JSON anterior se leen
+    completos y se proyectan en memoria.
+    
+    Args:
+        record: Registro del índice de estado del documento
+        sections: Secciones a devolver (None para todas)
+    
+    Returns:
+        Dict: Información extraída
+    """
+    path = record['extracted_info_path']
+    generation = record.get('extracted_info_generation')
+    if not is_compact_result(path):
+        return project_result(json.loads(read_result_text(path, generation)), sections)
+    
+    blob = clients.storage().bucket(RESULT_BUCKET).blob(path)
+    if generation is None:
+        blob.reload()
+        generation = blob.generation
+    
+    wanted = list(SECTIONS) if sections is None else sections
+    found = {}
+    for section in wanted:
+        cached = result_cache.get(cache_key(RESULT_BUCKET, f"{path}/{section}", generation))
+        if cached is not None:
+            found[section] = json.loads(cached)
+    
+    missing = [section for section in wanted if section not in found]
+    if missing:
+        index = record.get('extracted_info_sections')
+        with span('info.download_sections', path=path, sections=','.join(missing)):
+            if index:
+                downloaded = read_sections(blob, index, missing)
+            else:
+                downloaded = {
+                    section: data for section, data in decode_sections(blob.download_as_bytes()).items()
+                    if section in missing
+                }
+        for section, data in downloaded.items():
+            result_cache.put(cache_key(RESULT_BUCKET, f"{path}/{section}", generation), json.dumps(data, ensure_ascii=False))
+        found.update(downloaded)
+    
+    return merge_sections(found)
+
+def read_result_text(path: str, generation: Optional[int] = None) -> str:
+    """
+    Lee un resultado del bucket de resultados pasando por la caché
+    
+    Args:
+        path: Ruta del objeto en el bucket de resultados
+        generation: Generación registrada en el índice; si falta se consulta
+            en los metadatos del objeto (más barato que descargarlo)
+    
+    Returns:
+        str: Contenido del objeto
+    """
+    blob = clients.storage().bucket(RESULT_BUCKET).blob(path)
+    if generation is None:
+        blob.reload()
+        generation = blob.generation
+    
+    cached = result_cache.get(cache_key(RESULT_BUCKET, path, generation))
+    if cached is not None:
+        return cached
+    
+    with span('info.download_result', path=path):
+        text = blob.download_as_text()
+    result_cache.put(cache_key(RESULT_BUCKET, path, blob.generation or generation), text)
+    return text
+
 @app.get("/documents")
-async def list_documents():
+async def list_documents(
+    page_size: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    page_token: Optional[str] = None,
+    status: Optional[str] = None,
+    document_type: Optional[str] = None,
+    date_from: Optional[str] = Query(None, description="Fecha inicial YYYY-MM-DD"),
+    date_to: Optional[str] = Query(None, description="Fecha final YYYY-MM-DD (inclusive)")
+):
     """
-    Lista todos los documentos procesados
+    Lista los documentos procesados con paginación por cursor
+    
+    Cada página lista como máximo `page_size` objetos del bucket y resuelve su
+    estado con una única consulta agrupada al índice, por lo que el tiempo de
+    respuesta depende del tamaño de página y no del tamaño del bucket.
+    
+    Los filtros de fecha se aplican en el listado (los nombres empiezan por la
+    fecha de subida); los de estado y tipo se aplican sobre la página, que
+    puede devolver menos de `page_size` documentos. Se debe seguir
+    `next_page_token` hasta que sea nulo.
     """
     try:
-        bucket = storage_client.bucket(STORAGE_BUCKET)
-        blobs = list(bucket.list_blobs())
+        list_kwargs = {
+            'max_results': page_size,
+            'page_size': page_size,
+            'page_token': page_token,
+            'fields': 'items(name,size,timeCreated,contentType),nextPageToken'
+        }
+        
+        # Los nombres únicos empiezan por YYYYMMDD, así que el rango de fechas
+        # se traduce en offsets del listado
+        if date_from:
+            list_kwargs['start_offset'] = parse_date_filter(date_from).strftime('%Y%m%d')
+        if date_to:
+            end_date = parse_date_filter(date_to) + timedelta(days=1)
+            list_kwargs['end_offset'] = end_date.strftime('%Y%m%d')
+        
+        bucket = clients.storage().bucket(STORAGE_BUCKET)
+        iterator = bucket.list_blobs(**list_kwargs)
+        page = await gcp_io.run(lambda: list(next(iterator.pages, [])))
+        blobs = [blob for blob in page if not is_staging_object(blob.name)]
+        
+        # Resolver el estado de toda la página en una sola pasada
+        records = await gcp_io.run(clients.status_index().get_many, [blob.name for blob in blobs])
         
         documents = []
         for blob in blobs:
-            # Obtener información básica del documento
-            doc_info = {
-                'file_name': blob.name,
-                'size': blob.size,
-                'created': blob.time_created.isoformat(),
-                'content_type': blob.content_type
-            }
+            record = records.get(blob.name)
+            doc_status = record['status'] if record else "unknown"
+            doc_type = (record or {}).get('document_type') or "general"
             
-            # Verificar estado de procesamiento
-            status = await get_processing_status(blob.name)
-            doc_info['status'] = status.status
+            if status and doc_status != status:
+                continue
+            if document_type and doc_type != document_type:
+                continue
             
-            documents.append(doc_info)
+            documents.append({
+                'file_name': blob.name,
+                'size': blob.size,
+                'created': blob.time_created.isoformat() if blob.time_created else None,
+                'content_type': blob.content_type,
+                'document_type': doc_type,
+                'status': doc_status
+            })
         
         return {
             "total_documents": len(documents),
-            "documents": documents
+            "documents": documents,
+            "page_size": page_size,
+            "next_page_token": iterator.next_page_token
         }
         
+    except HTTPException:
+        raise
+    except GCPCallTimeout as e:
+        raise HTTPException(status_code=504, detail=str(e))
     except Exception as e:
         logger.error(f"Error listando documentos: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error listando documentos: {str(e)}")
 
+def parse_date_filter(value: str) -> datetime:
+    """Convierte un filtro de fecha YYYY-MM-DD validando su formato"""
+    try:
+        return datetime.strptime(value, '%Y-%m-%d')
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Fecha inválida '{value}', formato esperado YYYY-MM-DD")
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """
+    Métricas de este worker en formato de texto de Prometheus
+    """
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/stats")
+async def get_stats():
+    """
+    Contadores de este worker de la API
+    """
+    return {
+        "deduplication": dedupe_stats.snapshot(),
+        "publishing": publishing_snapshot(),
+        "result_cache": result_cache.snapshot(),
+        "event_streams": completion_broker.snapshot(),
+        "webhooks": webhooks.snapshot(),
+        "timestamp": datetime.now().isoformat()
+    }
+
+def delete_blob_if_exists(blob) -> bool:
+    """Elimina un blob ignorando que ya no exista (p. ej. por lifecycle)"""
+    try:
+        blob.delete()
+        return True
+    except NotFound:
+        return False
+
 @app.delete("/documents/{file_name}")
-async def delete_document(file_name: str):
+async def delete_document(
+    file_name: str,
+    dry_run: bool = Query(False, description="Solo listar los archivos que se eliminarían")
+):
     """
     Elimina un documento y todos sus archivos relacionados
+    
+    Los archivos (original, resultados y backups registrados en el índice) se
+    eliminan en paralelo. Con `dry_run=true` solo se devuelven sus rutas.
     """
     try:
-        # Eliminar archivo original
-        bucket = storage_client.bucket(STORAGE_BUCKET)
-        original_blob = bucket.blob(file_name)
+        # Consultar el índice de estado
+        record = await gcp_io.run(clients.status_index().get, file_name)
         
-        if not original_blob.exists():
+        if record is None:
             raise HTTPException(status_code=404, detail="Documento no encontrado")
         
-        original_blob.delete()
+        # Los resultados compartidos con documentos duplicados se conservan
+        if dry_run:
+            shares_results = not owns_results(record)
+        else:
+            shares_results = not await gcp_io.run(release_document, clients.status_index(), record)
         
-        # Eliminar archivos de OCR
-        ocr_bucket = storage_client.bucket(RESULT_BUCKET)
-        ocr_blob = ocr_bucket.blob(f"ocr_results/{file_name.replace('.', '_')}_ocr.txt")
-        if ocr_blob.exists():
-            ocr_blob.delete()
+        targets = [(STORAGE_BUCKET, file_name)]
+        if not shares_results:
+            # Archivos de OCR y de extracción, y backups registrados en el índice
+            targets.extend(
+                (RESULT_BUCKET, path)
+                for path in [record.get('ocr_result_path'), record.get('extracted_info_path')]
+                if path
+            )
+            targets.extend((BACKUP_BUCKET, path) for path in list_backup_paths(record))
         
-        # Eliminar archivos de extracción
-        extraction_blob = ocr_bucket.blob(f"extracted_info/{file_name.replace('.', '_')}_info.json")
-        if extraction_blob.exists():
-            extraction_blob.delete()
+        paths = [f"gs://{bucket_name}/{path}" for bucket_name, path in targets]
+        if dry_run:
+            return {
+                "message": f"Simulación: se eliminarían {len(paths)} archivos de {file_name}",
+                "dry_run": True,
+                "shared_results_kept": shares_results,
+                "files": paths
+            }
         
-        # Eliminar archivos de backup
-        backup_bucket = storage_client.bucket(BACKUP_BUCKET)
-        for doc_type in ['invoice', 'contract', 'identification', 'report', 'general']:
-            blobs = list(backup_bucket.list_blobs(prefix=f"{doc_type}/"))
-            for blob in blobs:
-                if file_name in blob.name:
-                    blob.delete()
+        deleted = await asyncio.gather(*(
+            gcp_io.run(delete_blob_if_exists, clients.storage().bucket(bucket_name).blob(path))
+            for bucket_name, path in targets
+        ))
         
-        return {"message": f"Documento {file_name} eliminado exitosamente"}
+        # Marcar el backup como eliminado en el manifiesto de su partición
+        if not shares_results and record.get('backup_manifest'):
+            await gcp_io.run(
+                append_manifest,
+                clients.storage().bucket(BACKUP_BUCKET),
+                record['backup_manifest'],
+                [{'file_name': file_name, 'deleted': True, 'deleted_at': datetime.now().isoformat()}]
+            )
+        
+        await gcp_io.run(clients.status_index().delete, file_name)
         
+        return {
+            "message": f"Documento {file_name} eliminado exitosamente",
+            "deleted_files": [path for path, existed in zip(paths, deleted) if existed]
+        }
+        
+    except HTTPException:
+        raise
+    except GCPCallTimeout as e:
+        raise HTTPException(status_code=504, detail=str(e))
     except Exception as e:
         logger.error(f"Error eliminando documento {file_name}: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error eliminando documento: {str(e)}")
 
+def require_restore_token(request: Request):
+    """Rechaza las peticiones a /restore sin el token RESTORE_API_TOKEN"""
+    if not RESTORE_API_TOKEN:
+        raise HTTPException(status_code=403, detail="Restauración deshabilitada: RESTORE_API_TOKEN no configurado")
+    
+    scheme, _, token = request.headers.get('authorization', '').partition(' ')
+    if scheme.lower() != 'bearer' or not secrets.compare_digest(token.strip(), RESTORE_API_TOKEN):
+        raise HTTPException(status_code=401, detail="Token de restauración inválido",
+                            headers={"WWW-Authenticate": "Bearer"})
+
+@app.post("/restore", status_code=202, dependencies=[Depends(require_restore_token)])
+async def restore_documents(restore: RestoreRequest):
+    """
+    Restaura documentos desde el backup y los reprocesa desde una etapa
+    
+    Los documentos se seleccionan por tipo, rango de fechas de subida, hash o
+    nombre, y se reencolan en `stage` (`ocr`, `backup` o `extraction`). El
+    trabajo se ejecuta en segundo plano en esta instancia a un ritmo limitado
+    (RESTORE_MAX_PER_SECOND, compartido por todos sus trabajos) y su progreso
+    se consulta en GET /restore/{job_id}. Con `dry_run` el trabajo solo cuenta
+    la selección, sin copiar ni reencolar. `extraction_mode: batch` envía la extracción de los documentos
+    a lotes de Document AI en lugar de una petición síncrona por documento.
+    """
+    try:
+        publisher = await gcp_io.run(clients.publisher)
+        job = RestoreJob(
+            clients.storage(),
+            clients.status_index(),
+            publisher,
+            backup_bucket=BACKUP_BUCKET,
+            processing_bucket=STORAGE_BUCKET,
+            result_bucket=RESULT_BUCKET,
+            stage=restore.stage,
+            document_type=restore.document_type,
+            date_from=parse_date_filter(restore.date_from) if restore.date_from else None,
+            date_to=parse_date_filter(restore.date_to) if restore.date_to else None,
+            sha256=restore.sha256,
+            file_names=restore.file_names,
+            limit=restore.limit,
+            dry_run=restore.dry_run,
+            limiter=restore_limiter,
+            extraction_mode=restore.extraction_mode
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    mode = restore.extraction_mode or os.environ.get('EXTRACTION_MODE', EXTRACTION_MODE_SYNC)
+    if not restore.dry_run and mode == EXTRACTION_MODE_BATCH and not EXTRACTION_BATCH_POLL:
+        raise HTTPException(
+            status_code=400,
+            detail="Extracción por lotes no disponible: el sondeo de lotes no está desplegado (extraction_batch_poll)"
+        )
+    
+    try:
+        # La simulación también se ejecuta en segundo plano: la selección recorre
+        # los manifiestos del rango y puede superar el timeout de una llamada a GCP
+        
+        # Se conservan los trabajos más recientes para consultar su resultado
+        finished = [job_id for job_id, old in restore_jobs.items() if old.finished_at]
+        for job_id in finished[:max(0, len(restore_jobs) - RESTORE_JOBS_KEPT)]:
+            restore_jobs.pop(job_id, None)
+        
+        restore_jobs[job.job_id] = job
+        job.start()
+        logger.info(f"Trabajo de restauración {job.job_id} iniciado desde la etapa {restore.stage}")
+        return job.to_dict()
+        
+    except HTTPException:
+        raise
+    except GCPCallTimeout as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error iniciando restauración: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error iniciando restauración: {str(e)}")
+
+@app.get("/restore/{job_id}", dependencies=[Depends(require_restore_token)])
+async def get_restore_job(job_id: str):
+    """
+    Progreso de un trabajo de restauración de este worker
+    """
+    job = restore_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Trabajo de restauración no encontrado")
+    return job.to_dict()
+
+@app.delete("/restore/{job_id}", dependencies=[Depends(require_restore_token)])
+async def cancel_restore_job(job_id: str):
+    """
+    Cancela un trabajo de restauración; los documentos ya reencolados siguen su curso
+    """
+    job = restore_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Trabajo de restauración no encontrado")
+    job.cancel()
+    return job.to_dict()
+
 if __name__ == "__main__":
+    import uvicorn
+    
     uvicorn.run(
         "main:app",
         host=os.environ.get("API_HOST", "0.0.0.0"),
@@ -0,0 +1,347 @@
+"""
+Notificaciones de progreso por push para clientes de la API
+Los mensajes de finalización de cada etapa llegan a la API por una suscripción
+push de Pub/Sub y se reenvían a los clientes conectados a GET /events/{file_name}
+(Server-Sent Events) y, al completarse el documento, al webhook registrado en la
+subida, de modo que los clientes no necesitan consultar /status periódicamente
+"""
+
+import asyncio
+import hashlib
+import hmac
+import http.client
+import ipaddress
+import json
+import logging
+import os
+import socket
+import ssl
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, Optional, Set, Tuple
+from urllib.parse import urlparse
+
+from shared.pipeline_graph import STAGE_EVENTS
+from shared.routing import BACKUP_COMPLETED, EXTRACTION_COMPLETED, OCR_COMPLETED
+
+logger = logging.getLogger(__name__)
+
+# Eventos de etapa que se notifican a los clientes, en orden
+NOTIFIED_EVENTS = (OCR_COMPLETED, BACKUP_COMPLETED, EXTRACTION_COMPLETED)
+
+# Campo de progreso del índice que marca cada evento
+EVENT_STAGE_FIELDS = {
+    OCR_COMPLETED: 'ocr_completed',
+    BACKUP_COMPLETED: 'backup_completed',
+    EXTRACTION_COMPLETED: 'extraction_completed'
+}
+
+# Cabecera con la firma HMAC-SHA256 del cuerpo de cada webhook
+SIGNATURE_HEADER = 'X-Document-Signature'
+
+# Hosts a los que se permiten webhooks, separados por comas; un `.` inicial
+# admite también los subdominios (vacío: cualquier host con IP pública)
+WEBHOOK_ALLOWED_HOSTS = [host.strip().lower() for host in os.environ.get('WEBHOOK_ALLOWED_HOSTS', '').split(',')
+                         if host.strip()]
+
+# Nombres del servidor de metadatos de GCP, rechazados aunque se resuelvan a otra IP
+METADATA_HOSTS = {'metadata', 'metadata.google.internal'}
+
+
+def notification_from_record(file_name: str, record: Dict[str, Any], event: str = 'status') -> Dict[str, Any]:
+    """Notificación con el estado completo de un documento según el índice"""
+    notification = {'event': event, 'file_name': file_name, 'status': record.get('status', 'processing')}
+    for field in EVENT_STAGE_FIELDS.values():
+        notification[field] = bool(record.get(field))
+    return notification
+
+
+def notification_from_event(event_name: str, message_data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Notificación de un mensaje de finalización de etapa
+
+    Las etapas publican las etapas terminadas según el índice y el estado del
+    documento (`completed_stages` y `document_status`), ya que con etapas en
+    paralelo el documento lo completa la última en terminar. Los mensajes sin
+    esos campos siguen el orden secuencial: un evento implica que las
+    anteriores terminaron y la extracción completa el documento.
+    """
+    if 'completed_stages' in message_data:
+        completed = {STAGE_EVENTS[stage] for stage in message_data['completed_stages'] if stage in STAGE_EVENTS}
+        completed.add(event_name)
+        status = message_data.get('document_status') or 'processing'
+    else:
+        completed = set(NOTIFIED_EVENTS[:NOTIFIED_EVENTS.index(event_name) + 1])
+        status = 'completed' if event_name == EXTRACTION_COMPLETED else 'processing'
+    notification = {
+        'event': event_name,
+        'file_name': message_data.get('file_name'),
+        'status': status
+    }
+    for stage_event, field in EVENT_STAGE_FIELDS.items():
+        notification[field] = stage_event in completed
+    return notification
+
+
+def format_sse(event: str, data: Dict[str, Any]) -> str:
+    """Serializa un evento en formato text/event-stream"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def host_allowed(host: str, allowed_hosts: Iterable[str]) -> bool:
+    """Comprueba un host contra la lista de permitidos (`.dominio` admite subdominios)"""
+    for allowed in allowed_hosts:
+        if allowed.startswith('.'):
+            if host == allowed[1:] or host.endswith(allowed):
+                return True
+        elif host == allowed:
+            return True
+    return False
+
+
+def resolve_public_address(host: str, port: int) -> str:
+    """
+    Resuelve un host y comprueba que todas sus direcciones sean públicas
+
+    Se rechazan las direcciones privadas, de loopback, link-local (incluido el
+    servidor de metadatos 169.254.169.254), reservadas y multicast, para que un
+    webhook no alcance servicios internos del proyecto.
+
+    Returns:
+        str: Primera dirección resuelta, a la que se conecta la entrega
+
+    Raises:
+        ValueError: Si el host no se resuelve o alguna dirección no es pública
+    """
+    try:
+        infos = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    except socket.gaierror as e:
+        raise ValueError(f"No se pudo resolver el host del callback {host}: {e}")
+    addresses = [info[4][0] for info in infos]
+    if not addresses:
+        raise ValueError(f"No se pudo resolver el host del callback {host}")
+    for address in addresses:
+        ip = ipaddress.ip_address(address.split('%', 1)[0])
+        if isinstance(ip, ipaddress.IPv6Address) and ip.ipv4_mapped:
+            ip = ip.ipv4_mapped
+        if not ip.is_global or ip.is_multicast:
+            raise ValueError(f"El host del callback {host} apunta a una dirección no pública ({ip})")
+    return addresses[0]
+
+
+def validate_callback_url(url: str, allowed_hosts: Optional[Iterable[str]] = None) -> str:
+    """
+    Comprueba que la URL de un webhook sea https absoluta hacia un host público
+
+    Args:
+        url: URL del webhook
+        allowed_hosts: Hosts permitidos (por defecto WEBHOOK_ALLOWED_HOSTS)
+
+    Returns:
+        str: Dirección IP resuelta del host
+
+    Raises:
+        ValueError: Si la URL no es válida o el host no está permitido
+    """
+    parsed = urlparse(url)
+    try:
+        host, port = parsed.hostname, parsed.port
+    except ValueError:
+        raise ValueError(f"URL de callback inválida: {url}")
+    if parsed.scheme != 'https' or not host:
+        raise ValueError(f"URL de callback inválida (se requiere https): {url}")
+    if parsed.username or parsed.password:
+        raise ValueError(f"URL de callback con credenciales no permitida: {url}")
+
+    host = host.lower().rstrip('.')
+    allowed_hosts = WEBHOOK_ALLOWED_HOSTS if allowed_hosts is None else list(allowed_hosts)
+    if allowed_hosts and not host_allowed(host, allowed_hosts):
+        raise ValueError(f"Host de callback no permitido: {host}")
+    if host in METADATA_HOSTS:
+        raise ValueError(f"Host de callback no permitido: {host}")
+    return resolve_public_address(host, port or 443)
+
+
+class PinnedHTTPSConnection(http.client.HTTPSConnection):
+    """
+    Conexión https a una dirección ya validada
+
+    Conecta a `address` en lugar de volver a resolver el host, de modo que un
+    cambio de DNS entre la validación y la entrega no desvíe el webhook a una
+    dirección interna; el certificado se sigue verificando contra el host.
+    """
+
+    def __init__(self, host: str, address: str, port: Optional[int] = None, timeout: float = 10.0):
+        super().__init__(host, port=port, timeout=timeout, context=ssl.create_default_context())
+        self.address = address
+
+    def connect(self):
+        sock = socket.create_connection((self.address, self.port), self.timeout)
+        self.sock = self._context.wrap_socket(sock, server_hostname=self.host)
+
+
+class CompletionBroker:
+    """
+    Difusión en memoria de notificaciones a los clientes suscritos a un documento
+
+    `publish` puede llamarse desde cualquier hilo: cada notificación se entrega
+    en el event loop del suscriptor.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers: Dict[str, Set[Tuple[asyncio.AbstractEventLoop, asyncio.Queue]]] = {}
+        self.published = 0
+        self.delivered = 0
+
+    def subscribe(self, file_name: str) -> asyncio.Queue:
+        """Registra una cola para las notificaciones del documento (llamar desde el event loop)"""
+        queue: asyncio.Queue = asyncio.Queue()
+        with self._lock:
+            self._subscribers.setdefault(file_name, set()).add((asyncio.get_running_loop(), queue))
+        return queue
+
+    def unsubscribe(self, file_name: str, queue: asyncio.Queue):
+        with self._lock:
+            subscribers = self._subscribers.get(file_name, set())
+            subscribers.difference_update({entry for entry in subscribers if entry[1] is queue})
+            if not subscribers:
+                self._subscribers.pop(file_name, None)
+
+    def publish(self, file_name: str, notification: Dict[str, Any]) -> int:
+        """
+        Entrega una notificación a los suscriptores del documento
+
+        Returns:
+            int: Número de suscriptores que la recibieron
+        """
+        with self._lock:
+            subscribers = list(self._subscribers.get(file_name, ()))
+            self.published += 1
+            self.delivered += len(subscribers)
+        for loop, queue in subscribers:
+            try:
+                loop.call_soon_threadsafe(queue.put_nowait, notification)
+            except RuntimeError:
+                # El event loop del suscriptor ya se cerró
+                self.unsubscribe(file_name, queue)
+        return len(subscribers)
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                'documents': len(self._subscribers),
+                'subscribers': sum(len(subscribers) for subscribers in self._subscribers.values()),
+                'published': self.published,
+                'delivered': self.delivered
+            }
+
+
+class WebhookNotifier:
+    """
+    Entrega de webhooks en segundo plano con reintentos
+
+    Los errores 5xx, 429 y de red se reintentan con backoff exponencial; el
+    resto de respuestas no 2xx (incluidas las redirecciones, que no se siguen)
+    se descartan. Cada intento vuelve a validar la URL y conecta a la dirección
+    comprobada. Si se configura un secreto, cada petición lleva la firma
+    HMAC-SHA256 del cuerpo en `X-Document-Signature`.
+
+    Args:
+        secret: Clave de firma (opcional)
+        timeout: Segundos máximos por intento
+        max_retries: Reintentos tras el primer intento
+        backoff: Espera inicial entre reintentos
+        max_workers: Entregas simultáneas
+    """
+
+    def __init__(self, secret: Optional[str] = None, timeout: float = 10.0, max_retries: int = 3,
+                 backoff: float = 1.0, max_workers: int = 4):
+        self.secret = secret
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='webhooks')
+        self._lock = threading.Lock()
+        self.delivered = 0
+        self.failed = 0
+
+    def submit(self, url: str, payload: Dict[str, Any]):
+        """Programa la entrega sin bloquear al llamante"""
+        self._executor.submit(self.deliver, url, payload)
+
+    def deliver(self, url: str, payload: Dict[str, Any]) -> bool:
+        """
+        Envía el webhook esperando su confirmación
+
+        Returns:
+            bool: True si el receptor respondió 2xx
+        """
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        headers = {'Content-Type': 'application/json'}
+        if self.secret:
+            digest = hmac.new(self.secret.encode('utf-8'), body, hashlib.sha256).hexdigest()
+            headers[SIGNATURE_HEADER] = f"sha256={digest}"
+
+        parsed = urlparse(url)
+        path = parsed.path or '/'
+        if parsed.query:
+            path = f"{path}?{parsed.query}"
+
+        for attempt in range(self.max_retries + 1):
+            try:
+                # Se valida en cada intento: el DNS pudo cambiar desde la subida
+                address = validate_callback_url(url)
+                connection = PinnedHTTPSConnection(parsed.hostname, address, port=parsed.port, timeout=self.timeout)
+                try:
+                    connection.request('POST', path, body=body, headers=headers)
+                    status = connection.getresponse().status
+                finally:
+                    connection.close()
+                if 200 <= status < 300:
+                    with self._lock:
+                        self.delivered += 1
+                    return True
+                retryable = status == 429 or status >= 500
+                error = f"HTTP {status}"
+            except ValueError as e:
+                retryable = False
+                error = str(e)
+            except (http.client.HTTPException, OSError) as e:
+                retryable = True
+                error = str(e)
+
+            if not retryable or attempt == self.max_retries:
+                break
+            time.sleep(self.backoff * (2 ** attempt))
+
+        with self._lock:
+            self.failed += 1
+        logger.warning(f"Webhook a {url} fallido para {payload.get('file_name')}: {error}")
+        return False
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return {'delivered': self.delivered, 'failed': self.failed}
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+
+def create_notifier_from_env() -> WebhookNotifier:
+    """
+    Construye el notificador de webhooks a partir del entorno
+
+    Variables de entorno:
+        WEBHOOK_SECRET: Clave de firma de los webhooks (sin firma si no se define)
+        WEBHOOK_TIMEOUT: Segundos máximos por intento (por defecto 10)
+        WEBHOOK_RETRIES: Reintentos por webhook (por defecto 3)
+        WEBHOOK_ALLOWED_HOSTS: Hosts permitidos en las URL de callback (lo lee
+            `validate_callback_url`)
+    """
+    return WebhookNotifier(
+        secret=os.environ.get('WEBHOOK_SECRET') or None,
+        timeout=float(os.environ.get('WEBHOOK_TIMEOUT', 10)),
+        max_retries=int(os.environ.get('WEBHOOK_RETRIES', 3))
+    )
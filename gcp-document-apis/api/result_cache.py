@@ -0,0 +1,206 @@
+"""
+Caché de resultados de OCR y extracción para GET /info
+LRU en memoria acotada en bytes y con TTL, con un nivel opcional en disco local
+compartido por los workers de uvicorn de la misma instancia. Las claves incluyen
+la generación del objeto en Cloud Storage, de modo que cuando una etapa reescribe
+un resultado la entrada antigua deja de consultarse y caduca sola
+"""
+
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def cache_key(bucket_name: str, path: str, generation: Any) -> str:
+    """Clave de caché de un objeto en una generación concreta"""
+    return f"{bucket_name}/{path}#{generation}"
+
+
+class DiskCacheTier:
+    """
+    Nivel en disco local: un fichero por clave escrito de forma atómica
+
+    Args:
+        directory: Directorio de la caché (compartido entre workers)
+        max_bytes: Tamaño máximo aproximado del directorio
+        ttl: Segundos de validez de cada entrada
+    """
+
+    # Cada cuántas escrituras se revisa el tamaño del directorio
+    PRUNE_EVERY = 100
+
+    def __init__(self, directory: str, max_bytes: int, ttl: float):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._writes = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, hashlib.sha1(key.encode('utf-8')).hexdigest())
+
+    def get(self, key: str) -> Optional[str]:
+        path = self._path(key)
+        try:
+            if time.time() - os.path.getmtime(path) > self.ttl:
+                os.remove(path)
+                return None
+            with open(path, 'r', encoding='utf-8') as cached_file:
+                return cached_file.read()
+        except OSError:
+            return None
+
+    def put(self, key: str, value: str):
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix='.tmp-')
+            with os.fdopen(fd, 'w', encoding='utf-8') as tmp_file:
+                tmp_file.write(value)
+            os.replace(tmp_path, self._path(key))
+        except OSError as e:
+            logger.warning(f"No se pudo escribir en la caché de disco: {str(e)}")
+            return
+
+        with self._lock:
+            self._writes += 1
+            should_prune = self._writes % self.PRUNE_EVERY == 0
+        if should_prune:
+            self.prune()
+
+    def prune(self):
+        """Elimina entradas caducadas y las más antiguas si se supera el tamaño"""
+        entries = []
+        now = time.time()
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            if now - stat.st_mtime > self.ttl:
+                self._remove(path)
+            else:
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            self._remove(path)
+            total -= size
+
+    @staticmethod
+    def _remove(path: str):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+class ResultCache:
+    """
+    LRU en memoria acotada en bytes con TTL y nivel opcional en disco
+
+    Args:
+        max_bytes: Tamaño máximo de los valores en memoria
+        ttl: Segundos de validez de cada entrada
+        disk_tier: Nivel en disco consultado tras un fallo en memoria
+    """
+
+    def __init__(self, max_bytes: int, ttl: float, disk_tier: Optional[DiskCacheTier] = None):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.disk_tier = disk_tier
+        self._entries: 'OrderedDict[str, Tuple[str, int, float]]' = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.stats = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'evictions': 0}
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, size, expires_at = entry
+                if expires_at > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.stats['memory_hits'] += 1
+                    return value
+                self._pop(key)
+
+        if self.disk_tier is not None:
+            value = self.disk_tier.get(key)
+            if value is not None:
+                self._put_memory(key, value)
+                with self._lock:
+                    self.stats['disk_hits'] += 1
+                return value
+
+        with self._lock:
+            self.stats['misses'] += 1
+        return None
+
+    def put(self, key: str, value: str):
+        self._put_memory(key, value)
+        if self.disk_tier is not None:
+            self.disk_tier.put(key, value)
+
+    def _put_memory(self, key: str, value: str):
+        size = len(value.encode('utf-8'))
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self._pop(key)
+            self._entries[key] = (value, size, time.monotonic() + self.ttl)
+            self._size += size
+            while self._size > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._pop(oldest)
+                self.stats['evictions'] += 1
+
+    def _pop(self, key: str):
+        _, size, _ = self._entries.pop(key)
+        self._size -= size
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                **self.stats,
+                'entries': len(self._entries),
+                'bytes': self._size,
+                'max_bytes': self.max_bytes
+            }
+
+
+def create_cache_from_env() -> ResultCache:
+    """
+    Construye la caché a partir del entorno
+
+    Variables de entorno:
+        RESULT_CACHE_MAX_MB: Tamaño máximo en memoria por worker (por defecto 64)
+        RESULT_CACHE_TTL: Segundos de validez de cada entrada (por defecto 300)
+        RESULT_CACHE_DIR: Directorio del nivel en disco (desactivado si no se define)
+        RESULT_CACHE_DISK_MAX_MB: Tamaño máximo del nivel en disco (por defecto 512)
+    """
+    ttl = float(os.environ.get('RESULT_CACHE_TTL', 300))
+    disk_tier = None
+    if os.environ.get('RESULT_CACHE_DIR'):
+        disk_tier = DiskCacheTier(
+            os.environ['RESULT_CACHE_DIR'],
+            max_bytes=int(float(os.environ.get('RESULT_CACHE_DISK_MAX_MB', 512)) * 1024 * 1024),
+            ttl=ttl
+        )
+
+    return ResultCache(
+        max_bytes=int(float(os.environ.get('RESULT_CACHE_MAX_MB', 64)) * 1024 * 1024),
+        ttl=ttl,
+        disk_tier=disk_tier
+    )
@@ -0,0 +1,86 @@
+"""
+Lectura en streaming de archivos subidos
+Envuelve el fichero temporal de `UploadFile` para calcular checksums mientras
+el cliente de Cloud Storage lo envía por bloques, sin una segunda lectura
+"""
+
+import base64
+import hashlib
+import io
+from typing import BinaryIO
+
+# Las subidas reanudables requieren bloques múltiplos de 256 KB
+CHUNK_ALIGNMENT = 256 * 1024
+
+
+def aligned_chunk_size(size_mb: float) -> int:
+    """Convierte un tamaño en MB al múltiplo de 256 KB más cercano (mínimo 256 KB)"""
+    size = int(size_mb * 1024 * 1024)
+    return max(CHUNK_ALIGNMENT, (size // CHUNK_ALIGNMENT) * CHUNK_ALIGNMENT)
+
+
+class HashingReader(io.RawIOBase):
+    """
+    Lector que calcula MD5 y SHA-256 de los bytes que pasan por él
+
+    Las subidas reanudables pueden retroceder (`seek`) para reenviar un bloque;
+    solo se resumen los bytes que superan la posición más alta ya leída, así el
+    checksum corresponde exactamente al contenido del fichero.
+
+    Args:
+        raw: Fichero binario de origen posicionado al inicio
+    """
+
+    def __init__(self, raw: BinaryIO):
+        super().__init__()
+        self._raw = raw
+        self._position = 0
+        self._hashed = 0
+        self._md5 = hashlib.md5()
+        self._sha256 = hashlib.sha256()
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        self._position = self._raw.seek(offset, whence)
+        return self._position
+
+    def read(self, size: int = -1) -> bytes:
+        data = self._raw.read(size)
+        start = self._position
+        self._position += len(data)
+
+        if self._position > self._hashed:
+            new_data = data[max(0, self._hashed - start):]
+            self._md5.update(new_data)
+            self._sha256.update(new_data)
+            self._hashed = self._position
+
+        return data
+
+    def readinto(self, buffer) -> int:
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    @property
+    def bytes_read(self) -> int:
+        """Bytes distintos leídos del fichero"""
+        return self._hashed
+
+    @property
+    def md5_base64(self) -> str:
+        """MD5 en base64, el formato de `Blob.md5_hash`"""
+        return base64.b64encode(self._md5.digest()).decode('ascii')
+
+    @property
+    def sha256_hex(self) -> str:
+        """SHA-256 en hexadecimal del contenido leído"""
+        return self._sha256.hexdigest()
@@ -0,0 +1,135 @@
+"""
+Benchmark de carga de la API contra un backend de almacenamiento falso
+Lanza subidas y consultas de estado concurrentes sobre la aplicación FastAPI
+en proceso y reporta latencias p50/p95/p99 por tipo de petición
+
+Las peticiones llegan a ritmo constante (carga en lazo abierto) y la latencia se
+mide desde el instante programado de llegada, de modo que el tiempo que una
+petición pasa esperando a un event loop bloqueado también cuenta.
+
+Uso:
+    python benchmarks/api_load.py --rate 300 --requests 1000 --latency 0.05
+    python benchmarks/api_load.py --inline   # llamadas GCP en el event loop (referencia)
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import time
+from typing import Dict, List
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+sys.path.insert(0, os.path.join(ROOT_DIR, 'api'))
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """Percentil por rango más cercano"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def load_app(latency: float, inline: bool):
+    """Importa la API sustituyendo los clientes GCP por dobles en memoria"""
+    from google.cloud import pubsub_v1, storage
+
+    from local.fakes import FakePublisher, FakeStorageClient
+
+    fake_storage = FakeStorageClient(latency=latency)
+    fake_publisher = FakePublisher(latency=latency)
+    storage.Client = lambda *args, **kwargs: fake_storage
+    pubsub_v1.PublisherClient = lambda *args, **kwargs: fake_publisher
+
+    os.environ['STATUS_INDEX_BACKEND'] = 'gcs'
+    if inline:
+        os.environ['GCP_IO_MAX_WORKERS'] = '0'
+
+    import main
+    return main.app
+
+
+async def run_benchmark(args) -> Dict[str, List[float]]:
+    import httpx
+
+    app = load_app(args.latency, args.inline)
+    transport = httpx.ASGITransport(app=app)
+    latencies: Dict[str, List[float]] = {'upload': [], 'status': []}
+    uploaded: List[str] = []
+    payload = os.urandom(args.file_size)
+
+    async with httpx.AsyncClient(transport=transport, base_url='http://bench') as client:
+        async def upload(index: int, arrival: float):
+            files = {'file': (f"doc_{index}.pdf", payload, 'application/pdf')}
+            response = await client.post('/upload', files=files)
+            latencies['upload'].append(time.perf_counter() - arrival)
+            response.raise_for_status()
+            uploaded.append(response.json()['file_name'])
+
+        async def poll(arrival: float):
+            file_name = random.choice(uploaded)
+            response = await client.get(f"/status/{file_name}")
+            latencies['status'].append(time.perf_counter() - arrival)
+            response.raise_for_status()
+
+        # Documentos iniciales para que haya estado que consultar
+        for index in range(10):
+            await upload(-index - 1, time.perf_counter())
+        latencies['upload'].clear()
+
+        semaphore = asyncio.Semaphore(args.concurrency)
+
+        async def one_request(index: int, arrival: float):
+            async with semaphore:
+                if random.random() < args.upload_ratio:
+                    await upload(index, arrival)
+                else:
+                    await poll(arrival)
+
+        start = time.perf_counter()
+        tasks = []
+        for index in range(args.requests):
+            arrival = start + index / args.rate
+            delay = arrival - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(one_request(index, arrival)))
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - start
+
+    print(f"Modo: {'inline (event loop)' if args.inline else 'pool de hilos'}")
+    print(f"Peticiones: {args.requests} | Ritmo: {args.rate:.0f} req/s | Concurrencia máx.: {args.concurrency} | "
+          f"Latencia GCS simulada: {args.latency * 1000:.0f} ms | Duración: {elapsed:.2f} s "
+          f"| {args.requests / elapsed:.1f} req/s servidas")
+    for operation, values in latencies.items():
+        if not values:
+            continue
+        print(f"  {operation:<7} n={len(values):<5} "
+              f"p50={percentile(values, 50) * 1000:8.1f} ms  "
+              f"p95={percentile(values, 95) * 1000:8.1f} ms  "
+              f"p99={percentile(values, 99) * 1000:8.1f} ms  "
+              f"media={statistics.mean(values) * 1000:8.1f} ms")
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=500, help='Número total de peticiones')
+    parser.add_argument('--rate', type=float, default=200, help='Peticiones por segundo que llegan a la API')
+    parser.add_argument('--concurrency', type=int, default=200, help='Máximo de peticiones en vuelo')
+    parser.add_argument('--latency', type=float, default=0.02, help='Latencia simulada por llamada GCS (s)')
+    parser.add_argument('--upload-ratio', type=float, default=0.2, help='Proporción de subidas frente a consultas')
+    parser.add_argument('--file-size', type=int, default=64 * 1024, help='Tamaño de cada documento (bytes)')
+    parser.add_argument('--inline', action='store_true', help='Ejecutar las llamadas GCP en el event loop')
+    args = parser.parse_args()
+
+    asyncio.run(run_benchmark(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""
+Coste y aciertos del clasificador de tipo de documento (shared/classification.py)
+Genera textos sintéticos de cada tipo (palabras comunes con algunas palabras
+clave) y textos sin tipo, mide microsegundos por KB de texto y compara los
+aciertos con la clasificación anterior por subcadenas
+
+Uso:
+    python benchmarks/classification.py --sizes 1 10 100 --documents 500
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from shared.classification import CLASSIFIER_MAX_CHARS, DEFAULT_MODEL, DocumentClassifier
+
+FILLER = (
+    "el la de que y en un se no por con su para como está tiene lo todo pero más hace puede "
+    "dice este otro cuando muy sin sobre también hasta hay donde desde durante uno ni contra "
+    "the of and to in is that for it as was with be by on not he this are or his from at"
+).split()
+
+# Palabras que la clasificación anterior confundía (`id` aparece dentro de muchas palabras)
+DISTRACTORS = ['identidad', 'sidra', 'ida', 'idea', 'rapidez', 'providencia', 'validez', 'billete']
+
+
+def reference_classify(text: str) -> str:
+    """Clasificación anterior por subcadenas"""
+    text_lower = text.lower()
+    if any(word in text_lower for word in ['factura', 'invoice', 'bill', 'recibo']):
+        return 'invoice'
+    elif any(word in text_lower for word in ['contrato', 'contract', 'acuerdo']):
+        return 'contract'
+    elif any(word in text_lower for word in ['identificación', 'id', 'passport', 'dni']):
+        return 'identification'
+    elif any(word in text_lower for word in ['reporte', 'report', 'informe']):
+        return 'report'
+    return 'general'
+
+
+def synthetic_text(rng: random.Random, label: str, size: int) -> str:
+    """Texto de unos `size` bytes con palabras clave del tipo (o ninguna si es `general`)"""
+    keywords = list(DEFAULT_MODEL['labels'][label]['keywords']) if label != 'general' else []
+    words = []
+    length = 0
+    while length < size:
+        draw = rng.random()
+        if keywords and draw < 0.02:
+            word = rng.choice(keywords).upper() if rng.random() < 0.3 else rng.choice(keywords)
+        elif draw < 0.05:
+            word = rng.choice(DISTRACTORS)
+        else:
+            word = rng.choice(FILLER)
+        if rng.random() < 0.1:
+            word += rng.choice(',.:;')
+        words.append(word)
+        length += len(word) + 1
+    return ' '.join(words)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1, 10, 100], help='Tamaños de texto en KB')
+    parser.add_argument('--documents', type=int, default=500, help='Documentos por tamaño')
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    classifier = DocumentClassifier.from_model(DEFAULT_MODEL)
+    labels = list(DEFAULT_MODEL['labels']) + ['general']
+
+    print(f"Se analizan como máximo {CLASSIFIER_MAX_CHARS} caracteres por documento")
+    print(f"{'KB':>6} {'us/doc':>9} {'us/KB':>8} {'aciertos':>9} {'anterior':>9}")
+    for size in args.sizes:
+        corpus = [(label, synthetic_text(rng, label, size * 1024))
+                  for label in (rng.choice(labels) for _ in range(args.documents))]
+
+        start = time.perf_counter()
+        predicted = [classifier.classify(text) for _, text in corpus]
+        elapsed = time.perf_counter() - start
+
+        analyzed_kb = sum(min(len(text), CLASSIFIER_MAX_CHARS) for _, text in corpus) / 1024
+        accuracy = sum(prediction == label for prediction, (label, _) in zip(predicted, corpus)) / len(corpus)
+        reference = sum(reference_classify(text) == label for label, text in corpus) / len(corpus)
+        print(f"{size:>6} {elapsed / len(corpus) * 1e6:>9.1f} {elapsed / analyzed_kb * 1e6:>8.1f} "
+              f"{accuracy:>9.1%} {reference:>9.1%}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,247 @@
+"""
+Arranque en frío de la API y de cada Cloud Function
+Cada punto de entrada se mide en un intérprete nuevo: tiempo de importar su
+main.py (lo que Cloud Functions y Cloud Run ejecutan antes de la primera
+petición), de la primera petición y de la segunda, y qué librerías de
+google-cloud quedaron importadas. Los clientes se sustituyen por los dobles en
+memoria de local/fakes.py en el momento en que se importa su librería, así que
+los costes de importación son los reales y no se necesitan credenciales; la
+creación de clientes reales (credenciales, canales gRPC) no se mide.
+
+`--root` mide otro árbol del repositorio (p. ej. un worktree de una versión
+anterior) para comparar.
+
+Uso:
+    python benchmarks/cold_start.py --repeat 5
+    python benchmarks/cold_start.py --entry ocr_processor --root /tmp/version-anterior
+"""
+
+import argparse
+import asyncio
+import base64
+import importlib.abc
+import importlib.util
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from typing import Any, Callable, Dict, List
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROCESSING_BUCKET = 'document-processing'
+RESULT_BUCKET = 'document-results'
+DOCUMENT = 'doc.pdf'
+DOCUMENT_TEXT = "Factura 2024-001\fTotal a pagar: 1.210,00 EUR (IVA incluido)".encode('utf-8')
+
+# Librerías de google-cloud de los clientes del pipeline
+CLIENT_LIBRARIES = ('google.cloud.storage', 'google.cloud.vision', 'google.cloud.documentai_v1',
+                    'google.cloud.pubsub_v1')
+
+ENVIRONMENT = {
+    'GOOGLE_CLOUD_PROJECT': 'local-project',
+    'STORAGE_BUCKET_NAME': PROCESSING_BUCKET,
+    'RESULT_BUCKET_NAME': RESULT_BUCKET,
+    'BACKUP_BUCKET_NAME': 'document-backup',
+    'STATUS_INDEX_BACKEND': 'gcs',
+    'STATUS_INDEX_BUCKET': RESULT_BUCKET,
+    'DOCUMENT_AI_PROCESSOR_ID': 'local-processor',
+    'PIPELINE_MODE': 'parallel'
+}
+
+
+def pubsub_event(message: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        'data': base64.b64encode(json.dumps(message).encode('utf-8')).decode('ascii'),
+        'attributes': {'event': message['status']}
+    }
+
+
+# Escenarios por punto de entrada: (fichero, función, evento); la API usa peticiones HTTP
+SCENARIOS = {
+    'ocr_processor': {
+        'staging': ('functions/ocr_processor/main.py', 'process_document',
+                    {'bucket': PROCESSING_BUCKET, 'name': f"_incoming/{DOCUMENT}"}),
+        'document': ('functions/ocr_processor/main.py', 'process_document',
+                     {'bucket': PROCESSING_BUCKET, 'name': DOCUMENT, 'contentType': 'application/pdf',
+                      'size': len(DOCUMENT_TEXT)})
+    },
+    'backup_manager': {
+        'ignored': ('functions/backup_manager/main.py', 'backup_document',
+                    pubsub_event({'file_name': DOCUMENT, 'status': 'start_ocr'})),
+        'document': ('functions/backup_manager/main.py', 'backup_document',
+                     pubsub_event({'file_name': DOCUMENT, 'document_type': 'invoice', 'status': 'ocr_completed',
+                                   'ocr_result_path': 'ocr_results/doc_pdf_ocr.txt'}))
+    },
+    'info_extractor': {
+        'ignored': ('functions/info_extractor/main.py', 'extract_document_info',
+                    pubsub_event({'file_name': DOCUMENT, 'status': 'ocr_completed'})),
+        'document': ('functions/info_extractor/main.py', 'extract_document_info',
+                     pubsub_event({'file_name': DOCUMENT, 'status': 'start_ocr'}))
+    },
+    'api': {
+        'status': ('api/main.py', 'GET', f"/status/{DOCUMENT}"),
+        'upload': ('api/main.py', 'POST', '/upload')
+    }
+}
+
+
+class FakeClients:
+    """Dobles creados al construir el primer cliente; Cloud Storage trae el documento de prueba"""
+
+    def __init__(self):
+        self.storage = None
+
+    def storage_client(self, *args, **kwargs):
+        if self.storage is None:
+            from local.fakes import FakeStorageClient
+
+            self.storage = FakeStorageClient()
+            self.storage.bucket(PROCESSING_BUCKET).blob(DOCUMENT).upload_from_string(
+                DOCUMENT_TEXT, content_type='application/pdf')
+            self.storage.bucket(RESULT_BUCKET).blob('ocr_results/doc_pdf_ocr.txt').upload_from_string(
+                DOCUMENT_TEXT.decode('utf-8'), content_type='text/plain')
+        return self.storage
+
+    @staticmethod
+    def double(name: str) -> Callable:
+        def create(*args, **kwargs):
+            from local import fakes
+            return getattr(fakes, name)()
+        return create
+
+
+class ReplaceClientsOnImport(importlib.abc.MetaPathFinder):
+    """Sustituye la clase del cliente justo después de importar su librería"""
+
+    def __init__(self, replacements: Dict[str, Dict[str, Callable]]):
+        self.replacements = replacements
+        self._resolving = set()
+
+    def find_spec(self, name, path, target=None):
+        if name not in self.replacements or name in self._resolving:
+            return None
+        self._resolving.add(name)
+        try:
+            spec = importlib.util.find_spec(name)
+        finally:
+            self._resolving.discard(name)
+        exec_module = spec.loader.exec_module
+
+        def exec_and_replace(module):
+            exec_module(module)
+            for attribute, value in self.replacements[name].items():
+                setattr(module, attribute, value)
+
+        spec.loader.exec_module = exec_and_replace
+        return spec
+
+
+def run_request(module, scenario) -> Any:
+    path, target, payload = scenario
+    if path != 'api/main.py':
+        return getattr(module, target)(payload, None)
+
+    import httpx
+
+    async def request():
+        transport = httpx.ASGITransport(app=module.app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://cold-start') as client:
+            if target == 'POST':
+                files = {'file': (DOCUMENT, DOCUMENT_TEXT, 'application/pdf')}
+                response = await client.post(payload, files=files)
+            else:
+                response = await client.get(payload)
+            return response.status_code
+
+    return asyncio.run(request())
+
+
+def measure(root: str, entry: str, scenario_name: str) -> Dict[str, Any]:
+    """Se ejecuta en el proceso hijo: importa el punto de entrada y atiende dos peticiones"""
+    os.environ.update(ENVIRONMENT)
+    sys.path.insert(0, ROOT_DIR)
+    sys.path.insert(0, root)
+    scenario = SCENARIOS[entry][scenario_name]
+    if entry == 'api':
+        sys.path.insert(0, os.path.join(root, 'api'))
+        # El cliente HTTP de la prueba no forma parte del arranque de la API
+        import httpx  # noqa: F401
+
+    doubles = FakeClients()
+    sys.meta_path.insert(0, ReplaceClientsOnImport({
+        'google.cloud.storage': {'Client': doubles.storage_client},
+        'google.cloud.vision': {'ImageAnnotatorClient': FakeClients.double('FakeVisionClient')},
+        'google.cloud.documentai_v1': {'DocumentProcessorServiceClient': FakeClients.double('FakeDocumentAIClient')},
+        'google.cloud.pubsub_v1': {'PublisherClient': FakeClients.double('FakePublisher')}
+    }))
+
+    started_at = time.perf_counter()
+    spec = importlib.util.spec_from_file_location(f"{entry}_main", os.path.join(root, scenario[0]))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    imported_at = time.perf_counter()
+    imported_libraries = [name for name in CLIENT_LIBRARIES if name in sys.modules]
+
+    result = run_request(module, scenario)
+    first_at = time.perf_counter()
+    run_request(module, scenario)
+    second_at = time.perf_counter()
+
+    return {
+        'import': imported_at - started_at,
+        'first': first_at - imported_at,
+        'second': second_at - first_at,
+        'libraries_at_import': imported_libraries,
+        'libraries': [name for name in CLIENT_LIBRARIES if name in sys.modules],
+        'result': str(result)[:60]
+    }
+
+
+def run_child(root: str, entry: str, scenario: str) -> Dict[str, Any]:
+    output = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--child', entry, scenario, '--root', root],
+        check=True, capture_output=True, text=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def short_names(libraries: List[str]) -> str:
+    return ','.join(name.rsplit('.', 1)[-1].replace('_v1', '') for name in libraries) or '-'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--entry', nargs='+', choices=list(SCENARIOS), default=list(SCENARIOS),
+                        help='Puntos de entrada a medir')
+    parser.add_argument('--repeat', type=int, default=3, help='Procesos por escenario (se usa la mediana)')
+    parser.add_argument('--root', default=ROOT_DIR, help='Árbol del repositorio a medir')
+    parser.add_argument('--child', nargs=2, metavar=('ENTRY', 'SCENARIO'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        # Los logs de las funciones van a stderr; la última línea de stdout es el resultado
+        import logging
+        logging.disable(logging.CRITICAL)
+        print(json.dumps(measure(os.path.abspath(args.root), *args.child)))
+        return
+
+    print(f"Árbol: {os.path.abspath(args.root)} | mediana de {args.repeat} procesos")
+    print(f"{'punto de entrada':<16} {'escenario':<9} {'import (ms)':>11} {'1ª (ms)':>8} {'2ª (ms)':>8} "
+          f"{'total (ms)':>10}  librerías al importar / tras la 1ª petición")
+    for entry in args.entry:
+        for scenario in SCENARIOS[entry]:
+            runs = [run_child(args.root, entry, scenario) for _ in range(args.repeat)]
+
+            def median_ms(key: str) -> float:
+                return statistics.median(run[key] for run in runs) * 1000
+
+            print(f"{entry:<16} {scenario:<9} {median_ms('import'):>11.0f} {median_ms('first'):>8.0f} "
+                  f"{median_ms('second'):>8.1f} {median_ms('import') + median_ms('first'):>10.0f}  "
+                  f"{short_names(runs[0]['libraries_at_import'])} / {short_names(runs[0]['libraries'])}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+"""
+Benchmark de rendimiento del pipeline completo en local
+Sube un corpus sintético por la API y lo procesa con las tres Cloud Functions en
+memoria (`local/pipeline.py`), y reporta documentos por segundo, latencia por etapa
+(p50/p95/p99 de duración y de espera en cola), latencia de extremo a extremo y
+memoria por documento. Cada tamaño de corpus se ejecuta en un proceso nuevo para
+que la medida de memoria no arrastre la ejecución anterior. Con varios `--modes`
+compara el grafo de etapas paralelo con la cadena secuencial original, y con
+varios `--runtimes`, las Cloud Functions por evento con el worker de pull
+(worker/main.py), en el que cada invocación es un grupo de mensajes.
+
+Uso:
+    python benchmarks/pipeline_throughput.py --documents 100 1000 10000
+    python benchmarks/pipeline_throughput.py --documents 1000 --latency 0.01 --failure-rate 0.01 --retries 3
+    python benchmarks/pipeline_throughput.py --documents 500 --latency 0.01 --modes sequential parallel
+    python benchmarks/pipeline_throughput.py --documents 1000 --latency 0.01 --runtimes functions worker
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import random
+import resource
+import statistics
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from typing import Any, Dict, List
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from api_load import percentile
+
+STAGES = ('ocr_processor', 'backup_manager', 'info_extractor')
+
+WORDS = ('factura', 'contrato', 'total', 'cliente', 'importe', 'fecha', 'firma',
+         'cláusula', 'proveedor', 'documento', 'página', 'referencia', 'IVA', 'pago')
+
+
+def make_corpus(documents: int, pages: int, words_per_page: int, seed: int = 7) -> List[bytes]:
+    """Documentos sintéticos únicos: texto UTF-8 con páginas separadas por \\f"""
+    rng = random.Random(seed)
+    corpus = []
+    for index in range(documents):
+        page_texts = [
+            f"Documento {index} página {page} " + ' '.join(rng.choice(WORDS) for _ in range(words_per_page))
+            for page in range(1, pages + 1)
+        ]
+        corpus.append('\f'.join(page_texts).encode('utf-8'))
+    return corpus
+
+
+def max_rss_bytes() -> int:
+    """Memoria residente máxima del proceso (ru_maxrss está en KB en Linux)"""
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return usage if sys.platform == 'darwin' else usage * 1024
+
+
+def run_corpus(options: Dict[str, Any]) -> Dict[str, Any]:
+    """Ejecuta un corpus completo en este proceso y devuelve sus métricas"""
+    sys.path.insert(0, ROOT_DIR)
+    # Los fallos simulados se cuentan en el informe; sus trazas solo ensucian la salida
+    logging.disable(logging.ERROR)
+
+    from local.pipeline import LocalPipeline
+
+    corpus = make_corpus(options['documents'], options['pages'], options['words_per_page'])
+    pipeline = LocalPipeline(
+        latency=options['latency'],
+        workers=options['workers'],
+        failure_rate=options['failure_rate'],
+        retries=options['retries'],
+        mode=options['mode'],
+        runtime=options['runtime']
+    )
+    baseline_rss = max_rss_bytes()
+
+    start = time.perf_counter()
+    uploaded = asyncio.run(pipeline.upload(corpus, concurrency=options['upload_concurrency']))
+    pipeline.drain()
+    elapsed = time.perf_counter() - start
+    pipeline.shutdown()
+
+    return {
+        'mode': options['mode'],
+        'runtime': options['runtime'],
+        'documents': options['documents'],
+        'uploaded': len(uploaded),
+        'completed': len(pipeline.completed_at),
+        'elapsed': elapsed,
+        'rss_per_document': (max_rss_bytes() - baseline_rss) / max(1, options['documents']),
+        'invocations': dict(pipeline.invocations),
+        'failures': dict(pipeline.failures),
+        'durations': {stage: pipeline.durations.get(stage, []) for stage in STAGES},
+        'queue_waits': {stage: pipeline.queue_waits.get(stage, []) for stage in STAGES},
+        'end_to_end': pipeline.end_to_end_latencies()
+    }
+
+
+def format_percentiles(values: List[float]) -> str:
+    if not values:
+        return 'sin datos'
+    return (f"p50={percentile(values, 50) * 1000:8.1f} ms  "
+            f"p95={percentile(values, 95) * 1000:8.1f} ms  "
+            f"p99={percentile(values, 99) * 1000:8.1f} ms  "
+            f"media={statistics.mean(values) * 1000:8.1f} ms")
+
+
+def report(result: Dict[str, Any]):
+    documents = result['documents']
+    print(f"\n=== {documents} documentos ({result['mode']}, {result['runtime']}) ===")
+    print(f"Subidos: {result['uploaded']} | Completados: {result['completed']} | "
+          f"Duración: {result['elapsed']:.2f} s | {result['completed'] / result['elapsed']:.1f} docs/s | "
+          f"Memoria: {result['rss_per_document'] / 1024:.1f} KB/doc")
+    for stage in STAGES:
+        invocations = result['invocations'].get(stage, 0)
+        failures = result['failures'].get(stage, 0)
+        print(f"  {stage:<15} invocaciones={invocations:<7} fallos={failures:<5}")
+        print(f"    duración    {format_percentiles(result['durations'][stage])}")
+        print(f"    cola        {format_percentiles(result['queue_waits'][stage])}")
+    print(f"  {'extremo a extremo':<15} {format_percentiles(result['end_to_end'])}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--documents', type=int, nargs='+', default=[100, 1000],
+                        help='Tamaños de corpus a ejecutar (100 a 100000)')
+    parser.add_argument('--pages', type=int, default=3, help='Páginas por documento')
+    parser.add_argument('--words-per-page', type=int, default=200, help='Palabras por página')
+    parser.add_argument('--latency', type=float, default=0.0, help='Latencia simulada por llamada GCP (s)')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='Proporción de llamadas GCP que fallan')
+    parser.add_argument('--retries', type=int, default=3, help='Reintentos de una invocación fallida')
+    parser.add_argument('--workers', type=int, default=32, help='Invocaciones de funciones simultáneas')
+    parser.add_argument('--upload-concurrency', type=int, default=32, help='Subidas simultáneas')
+    parser.add_argument('--modes', nargs='+', choices=('parallel', 'sequential'), default=['parallel'],
+                        help='Grafos de etapas a ejecutar (PIPELINE_MODE)')
+    parser.add_argument('--runtimes', nargs='+', choices=('functions', 'worker'), default=['functions'],
+                        help='Ejecución de las etapas (stage_runtime en terraform)')
+    args = parser.parse_args()
+
+    runs = ((documents, mode, runtime) for documents in args.documents for mode in args.modes
+            for runtime in args.runtimes)
+    for documents, mode, runtime in runs:
+        options = {
+            'mode': mode,
+            'runtime': runtime,
+            'documents': documents,
+            'pages': args.pages,
+            'words_per_page': args.words_per_page,
+            'latency': args.latency,
+            'failure_rate': args.failure_rate,
+            'retries': args.retries,
+            'workers': args.workers,
+            'upload_concurrency': args.upload_concurrency
+        }
+        with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as executor:
+            report(executor.submit(run_corpus, options).result())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+"""
+Invocaciones de cada Cloud Function por documento subido
+Ejecuta el pipeline completo en memoria con el despliegue original (todas las
+etapas suscritas a un único tema) y con un tema por evento, y compara cuántas
+veces se invoca cada función y cuántas de esas invocaciones no hacen nada
+
+Uso:
+    python benchmarks/stage_invocations.py --documents 200
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import sys
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+FUNCTIONS = ('ocr_processor', 'backup_manager', 'info_extractor')
+
+
+def run_mode(routed: bool, documents: int, latency: float):
+    from local.pipeline import LocalPipeline
+
+    pipeline = LocalPipeline(routed=routed, latency=latency)
+    corpus = [f"Documento {index}\fPágina 2 del documento {index}".encode('utf-8') for index in range(documents)]
+    asyncio.run(pipeline.upload(corpus))
+    pipeline.drain()
+    pipeline.shutdown()
+
+    print(f"\n{'Un tema por evento' if routed else 'Tema único (original)'} - {documents} documentos")
+    print(f"  {'función':<16} {'invocaciones':>12} {'por doc':>8} {'sin trabajo':>12} {'fallos':>7}")
+    for name in FUNCTIONS:
+        invocations = pipeline.invocations[name]
+        print(f"  {name:<16} {invocations:>12} {invocations / documents:>8.2f} "
+              f"{pipeline.no_ops[name]:>12} {pipeline.failures[name]:>7}")
+    total = sum(pipeline.invocations[name] for name in FUNCTIONS)
+    print(f"  {'total':<16} {total:>12} {total / documents:>8.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--documents', type=int, default=100, help='Documentos a subir')
+    parser.add_argument('--latency', type=float, default=0.0, help='Latencia simulada por llamada GCP (s)')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    logging.getLogger().setLevel(logging.WARNING)
+
+    run_mode(False, args.documents, args.latency)
+    run_mode(True, args.documents, args.latency)
+
+
+if __name__ == '__main__':
+    main()
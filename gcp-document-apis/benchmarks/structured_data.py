@@ -0,0 +1,182 @@
+"""
+Post-procesado de respuestas grandes de Document AI en info_extractor
+Genera documentos sintéticos (páginas con campos de formulario, tablas y
+entidades anclados a `document.text` por segmentos) y compara la extracción de
+una sola pasada (shared/structured_data.py) con la anterior, que recorría las
+páginas dos veces y las entidades una vez más por tipo a través de proto-plus.
+Comprueba además que ambas producen el mismo resultado
+
+Uso:
+    python benchmarks/structured_data.py --pages 10 100 300
+    python benchmarks/structured_data.py --pages 300 --tables 4 --rows 30 --repeat 5
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from google.cloud import documentai_v1 as documentai
+
+from shared.structured_data import TYPE_SPECIFIC_FIELDS, extract_structured_data
+
+ENTITY_TYPES = ('contract_number', 'start_date', 'end_date', 'parties', 'amount', 'signature', 'clause')
+
+
+class TextBuilder:
+    """Acumula el texto del documento y devuelve anclajes a cada fragmento"""
+
+    def __init__(self):
+        self.parts = []
+        self.length = 0
+
+    def anchor(self, value: str) -> documentai.Document.TextAnchor:
+        start = self.length
+        self.parts.append(value + '\n')
+        self.length += len(value) + 1
+        return documentai.Document.TextAnchor(
+            text_segments=[documentai.Document.TextAnchor.TextSegment(start_index=start, end_index=start + len(value))]
+        )
+
+    def text(self) -> str:
+        return ''.join(self.parts)
+
+
+def layout(builder: TextBuilder, value: str, confidence: float = 0.9) -> documentai.Document.Page.Layout:
+    return documentai.Document.Page.Layout(text_anchor=builder.anchor(value), confidence=confidence)
+
+
+def synthetic_document(pages: int, fields: int, tables: int, rows: int, columns: int,
+                       entities: int) -> documentai.Document:
+    """Documento con la forma de una respuesta de Document AI para un contrato largo"""
+    builder = TextBuilder()
+    page_list = []
+    entity_list = []
+    for page_index in range(pages):
+        form_fields = [
+            documentai.Document.Page.FormField(
+                field_name=layout(builder, f"Campo {page_index}.{index}"),
+                field_value=layout(builder, f"Valor del campo {index} en la página {page_index + 1}")
+            )
+            for index in range(fields)
+        ]
+        page_tables = []
+        for table_index in range(tables):
+            def row(row_index):
+                return documentai.Document.Page.Table.TableRow(cells=[
+                    documentai.Document.Page.Table.TableCell(
+                        layout=layout(builder, f"T{table_index} F{row_index} C{column}")
+                    )
+                    for column in range(columns)
+                ])
+            page_tables.append(documentai.Document.Page.Table(
+                header_rows=[row('h')],
+                body_rows=[row(row_index) for row_index in range(rows)]
+            ))
+        page_list.append(documentai.Document.Page(
+            page_number=page_index + 1,
+            form_fields=form_fields,
+            tables=page_tables
+        ))
+        for index in range(entities):
+            entity_type = ENTITY_TYPES[(page_index + index) % len(ENTITY_TYPES)]
+            entity_list.append(documentai.Document.Entity(
+                type_=entity_type,
+                mention_text=f"{entity_type} {page_index}.{index}",
+                confidence=0.8,
+                page_anchor=documentai.Document.PageAnchor(
+                    page_refs=[documentai.Document.PageAnchor.PageRef(page=page_index)]
+                )
+            ))
+    return documentai.Document(text=builder.text(), pages=page_list, entities=entity_list)
+
+
+def reference_extract(document: documentai.Document, document_type: str):
+    """
+    Extracción anterior: dos recorridos de las páginas y uno más de las
+    entidades por tipo, leyendo cada campo a través de proto-plus (con las rutas
+    de anclaje corregidas para que funcione sobre respuestas reales)
+    """
+    def content(anchor):
+        return ''.join(document.text[segment.start_index:segment.end_index] for segment in anchor.text_segments)
+
+    extracted_data = {
+        'document_type': document_type,
+        'text': document.text,
+        'pages': len(document.pages),
+        'entities': {},
+        'key_value_pairs': {},
+        'tables': []
+    }
+    for entity in document.entities:
+        if entity.type_ not in extracted_data['entities']:
+            extracted_data['entities'][entity.type_] = []
+        extracted_data['entities'][entity.type_].append({
+            'text': entity.mention_text,
+            'confidence': entity.confidence,
+            'page_anchor': entity.page_anchor.page_refs[0].page if entity.page_anchor.page_refs else None
+        })
+    for page in document.pages:
+        for form_field in page.form_fields:
+            extracted_data['key_value_pairs'][content(form_field.field_name.text_anchor)] = {
+                'value': content(form_field.field_value.text_anchor),
+                'confidence': form_field.field_name.confidence,
+                'page': page.page_number
+            }
+    for page in document.pages:
+        for table in page.tables:
+            table_data = []
+            for row in table.header_rows:
+                table_data.append([content(cell.layout.text_anchor) for cell in row.cells])
+            for row in table.body_rows:
+                table_data.append([content(cell.layout.text_anchor) for cell in row.cells])
+            extracted_data['tables'].append({'page': page.page_number, 'data': table_data})
+    if document_type in TYPE_SPECIFIC_FIELDS:
+        key, common_fields = TYPE_SPECIFIC_FIELDS[document_type]
+        specific = {}
+        for entity in document.entities:
+            entity_type = entity.type_.lower()
+            if any(field in entity_type for field in common_fields):
+                specific[entity_type] = {'value': entity.mention_text, 'confidence': entity.confidence}
+        extracted_data[key] = specific
+    return extracted_data
+
+
+def timed(function, document, document_type: str, repeat: int):
+    durations = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(document, document_type)
+        durations.append(time.perf_counter() - start)
+    return statistics.median(durations), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pages', type=int, nargs='+', default=[10, 100, 300], help='Páginas por documento')
+    parser.add_argument('--fields', type=int, default=20, help='Campos de formulario por página')
+    parser.add_argument('--tables', type=int, default=2, help='Tablas por página')
+    parser.add_argument('--rows', type=int, default=15, help='Filas por tabla')
+    parser.add_argument('--columns', type=int, default=5, help='Columnas por tabla')
+    parser.add_argument('--entities', type=int, default=10, help='Entidades por página')
+    parser.add_argument('--type', default='contract', help='Tipo de documento')
+    parser.add_argument('--repeat', type=int, default=3, help='Repeticiones por medición (se usa la mediana)')
+    args = parser.parse_args()
+
+    print(f"{'páginas':>8} {'anterior (s)':>13} {'una pasada (s)':>15} {'aceleración':>12}")
+    for pages in args.pages:
+        document = synthetic_document(pages, args.fields, args.tables, args.rows, args.columns, args.entities)
+        reference_time, expected = timed(reference_extract, document, args.type, args.repeat)
+        single_pass_time, result = timed(extract_structured_data, document, args.type, args.repeat)
+        if result != expected:
+            raise SystemExit(f"Los resultados difieren para {pages} páginas")
+        print(f"{pages:>8} {reference_time:>13.3f} {single_pass_time:>15.3f} {reference_time / single_pass_time:>11.1f}x")
+
+
+if __name__ == '__main__':
+    main()
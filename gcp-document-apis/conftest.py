@@ -0,0 +1,3 @@
+"""
+Configuración de pytest: los tests importan `shared` y `local` desde la raíz del repositorio
+"""
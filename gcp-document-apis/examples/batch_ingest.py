@@ -0,0 +1,293 @@
+"""
+Ingesta masiva de documentos
+Sube miles de documentos en paralelo con reintentos y un fichero de checkpoint,
+de modo que una carga interrumpida se reanuda donde se quedó
+
+Uso:
+    python batch_ingest.py /datos/escaneados --workers 16
+    python batch_ingest.py --manifest rutas.txt --batch-size 20
+    python batch_ingest.py --archive lote_2024.tar.gz
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, Any, Iterator, List, Set
+
+import requests
+
+from example_usage import DocumentProcessorClient
+
+ALLOWED_EXTENSIONS = ('.pdf', '.jpg', '.jpeg', '.png', '.tiff', '.bmp')
+
+# Códigos HTTP que merece la pena reintentar
+RETRYABLE_STATUS = (429, 500, 502, 503, 504)
+
+
+class Checkpoint:
+    """
+    Registro JSON-lines de los archivos ya subidos
+
+    Args:
+        path: Ruta del fichero de checkpoint
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self.completed: Set[str] = set()
+
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as checkpoint_file:
+                for line in checkpoint_file:
+                    try:
+                        self.completed.add(json.loads(line)['path'])
+                    except (ValueError, KeyError):
+                        # Línea truncada por una interrupción a mitad de escritura
+                        continue
+
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def record(self, path: str, result: Dict[str, Any]):
+        entry = {
+            'path': path,
+            'file_name': result.get('file_name'),
+            'status': result.get('status'),
+            'duplicate_of': result.get('duplicate_of')
+        }
+        with self._lock:
+            self._file.write(json.dumps(entry) + '\n')
+            self._file.flush()
+            self.completed.add(path)
+
+    def close(self):
+        self._file.close()
+
+
+class Progress:
+    """Contadores de progreso impresos como mucho cada `interval` segundos"""
+
+    def __init__(self, total: int, interval: float = 2.0):
+        self.total = total
+        self.interval = interval
+        self.uploaded = 0
+        self.duplicates = 0
+        self.failed = 0
+        self._start = time.time()
+        self._last_report = 0.0
+        self._lock = threading.Lock()
+
+    def update(self, uploaded: int = 0, duplicates: int = 0, failed: int = 0):
+        with self._lock:
+            self.uploaded += uploaded
+            self.duplicates += duplicates
+            self.failed += failed
+            now = time.time()
+            if now - self._last_report >= self.interval:
+                self._last_report = now
+                self.report()
+
+    def report(self):
+        done = self.uploaded + self.duplicates + self.failed
+        elapsed = max(time.time() - self._start, 1e-6)
+        rate = done / elapsed
+        eta = (self.total - done) / rate if rate else 0
+        print(f"📦 {done}/{self.total} | subidos: {self.uploaded} | duplicados: {self.duplicates} "
+              f"| fallidos: {self.failed} | {rate:.1f} docs/s | ETA {eta:.0f} s", flush=True)
+
+
+def discover_files(sources: List[str], manifest: str = None) -> Iterator[str]:
+    """
+    Enumera los archivos admitidos de directorios, rutas sueltas y un manifiesto
+
+    Args:
+        sources: Directorios o archivos
+        manifest: Fichero con una ruta por línea
+
+    Yields:
+        Ruta absoluta de cada documento
+    """
+    paths = list(sources)
+    if manifest:
+        with open(manifest, 'r', encoding='utf-8') as manifest_file:
+            paths.extend(line.strip() for line in manifest_file if line.strip())
+
+    for source in paths:
+        if os.path.isdir(source):
+            for root, _, names in os.walk(source):
+                for name in sorted(names):
+                    if name.lower().endswith(ALLOWED_EXTENSIONS):
+                        yield os.path.abspath(os.path.join(root, name))
+        elif source.lower().endswith(ALLOWED_EXTENSIONS):
+            yield os.path.abspath(source)
+        else:
+            print(f"⚠️  Ignorado (tipo no soportado): {source}", file=sys.stderr)
+
+
+def with_retries(func, retries: int, backoff: float):
+    """
+    Ejecuta `func` reintentando errores de red y respuestas 429/5xx
+
+    Espera exponencial con jitter: backoff * 2^intento * [0.5, 1.5)
+    """
+    for attempt in range(retries + 1):
+        try:
+            return func()
+        except requests.HTTPError as e:
+            if e.response is None or e.response.status_code not in RETRYABLE_STATUS or attempt == retries:
+                raise
+        except (requests.ConnectionError, requests.Timeout):
+            if attempt == retries:
+                raise
+        time.sleep(backoff * (2 ** attempt) * (0.5 + random.random()))
+
+
+def chunked(items: List[str], size: int) -> Iterator[List[str]]:
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def ingest_files(api_url: str, files: List[str], checkpoint: Checkpoint, workers: int,
+                 batch_size: int, retries: int, backoff: float) -> Progress:
+    """
+    Sube los archivos pendientes con un pool de hilos
+
+    Con `batch_size` > 1 cada petición envía varios archivos a /upload/batch;
+    si no, cada archivo va en su propia petición a /upload.
+    """
+    pending = [path for path in files if path not in checkpoint.completed]
+    progress = Progress(len(pending))
+    print(f"🚀 {len(files)} documentos encontrados, {len(files) - len(pending)} ya subidos, "
+          f"{len(pending)} pendientes")
+
+    # requests.Session no es seguro entre hilos: un cliente por hilo
+    local = threading.local()
+
+    def client() -> DocumentProcessorClient:
+        if not hasattr(local, 'client'):
+            local.client = DocumentProcessorClient(api_url)
+        return local.client
+
+    def record(path: str, result: Dict[str, Any]):
+        if result.get('status') == 'error':
+            print(f"❌ {path}: {result.get('error')}", file=sys.stderr)
+            progress.update(failed=1)
+            return
+        checkpoint.record(path, result)
+        if result.get('duplicate_of'):
+            progress.update(duplicates=1)
+        else:
+            progress.update(uploaded=1)
+
+    def upload_group(group: List[str]):
+        if batch_size > 1:
+            response = with_retries(lambda: client().upload_documents(group), retries, backoff)
+            for path, result in zip(group, response['results']):
+                record(path, result)
+        else:
+            path = group[0]
+            record(path, with_retries(lambda: client().upload_document(path), retries, backoff))
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(upload_group, group): group
+            for group in chunked(pending, max(1, batch_size))
+        }
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except Exception as e:
+                group = futures[future]
+                print(f"❌ Fallo definitivo en {len(group)} archivo(s) ({group[0]}...): {str(e)}",
+                      file=sys.stderr)
+                progress.update(failed=len(group))
+
+    progress.report()
+    return progress
+
+
+def ingest_archives(api_url: str, archives: List[str], checkpoint: Checkpoint,
+                    retries: int, backoff: float) -> Progress:
+    """
+    Sube archivos tar completos a /upload/archive, uno por petición
+
+    Un archivo solo se marca en el checkpoint si se subieron todos sus documentos.
+    """
+    pending = [os.path.abspath(path) for path in archives if os.path.abspath(path) not in checkpoint.completed]
+    progress = Progress(len(pending), interval=0)
+    client = DocumentProcessorClient(api_url)
+
+    def upload_archive(path: str) -> Dict[str, Any]:
+        with open(path, 'rb') as archive:
+            response = client.session.post(f"{client.base_url}/upload/archive", files={'archive': archive})
+            response.raise_for_status()
+        return response.json()
+
+    for path in pending:
+        try:
+            summary = with_retries(lambda: upload_archive(path), retries, backoff)
+        except Exception as e:
+            print(f"❌ {path}: {str(e)}", file=sys.stderr)
+            progress.update(failed=1)
+            continue
+
+        print(f"📦 {path}: {summary['succeeded']}/{summary['total']} documentos subidos")
+        for item in summary['results']:
+            if item['status'] == 'error':
+                print(f"   ❌ {item['filename']}: {item['error']}", file=sys.stderr)
+        if summary['succeeded'] < summary['total']:
+            # Sin checkpoint el archivo se reenvía completo al reanudar; los
+            # documentos ya subidos se resuelven como duplicados por su hash
+            progress.update(failed=1)
+            continue
+        checkpoint.record(path, {'status': 'uploaded'})
+        progress.update(uploaded=1)
+
+    return progress
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('sources', nargs='*', help='Directorios o archivos a subir')
+    parser.add_argument('--manifest', help='Fichero con una ruta de documento por línea')
+    parser.add_argument('--archive', action='append', default=[], help='Archivo tar(.gz) a subir entero (repetible)')
+    parser.add_argument('--api-url', default=os.environ.get('API_URL', 'http://localhost:8000'))
+    parser.add_argument('--workers', type=int, default=8, help='Peticiones simultáneas')
+    parser.add_argument('--batch-size', type=int, default=1, help='Archivos por petición (>1 usa /upload/batch)')
+    parser.add_argument('--retries', type=int, default=5, help='Reintentos por petición')
+    parser.add_argument('--backoff', type=float, default=1.0, help='Espera base entre reintentos (s)')
+    parser.add_argument('--checkpoint', default='.batch_ingest_checkpoint.jsonl',
+                        help='Fichero de checkpoint para reanudar')
+    args = parser.parse_args()
+
+    if not args.sources and not args.manifest and not args.archive:
+        parser.error('Indica directorios, --manifest o --archive')
+
+    checkpoint = Checkpoint(args.checkpoint)
+    failed = 0
+    try:
+        if args.sources or args.manifest:
+            files = list(dict.fromkeys(discover_files(args.sources, args.manifest)))
+            failed += ingest_files(args.api_url, files, checkpoint, args.workers,
+                                   args.batch_size, args.retries, args.backoff).failed
+        if args.archive:
+            failed += ingest_archives(args.api_url, args.archive, checkpoint,
+                                      args.retries, args.backoff).failed
+    except KeyboardInterrupt:
+        print(f"\n⏹️  Interrumpido. Vuelve a ejecutar con el mismo --checkpoint para reanudar.")
+        sys.exit(130)
+    finally:
+        checkpoint.close()
+
+    if failed:
+        print(f"⚠️  {failed} fallidos: vuelve a ejecutar el comando para reintentarlos")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
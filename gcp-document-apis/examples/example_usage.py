@@ -7,14 +7,26 @@ import requests
 import json
 import time
 import os
-from typing import Dict, Any
+from typing import Dict, Any, Iterator, List, Optional
 
 class DocumentProcessorClient:
     """Cliente para interactuar con la API de procesamiento de documentos"""
     
-    def __init__(self, base_url: str):
+    def __init__(self, base_url: str, restore_token: Optional[str] = None):
+        """
+        Args:
+            base_url: URL de la API
+            restore_token: Token de los endpoints /restore (por defecto RESTORE_API_TOKEN)
+        """
         self.base_url = base_url.rstrip('/')
         self.session = requests.Session()
+        self.restore_token = restore_token or os.environ.get('RESTORE_API_TOKEN')
+    
+    def _restore_headers(self) -> Dict[str, str]:
+        """Cabecera Authorization que exigen los endpoints /restore"""
+        if not self.restore_token:
+            raise ValueError("Los endpoints /restore requieren restore_token o RESTORE_API_TOKEN")
+        return {'Authorization': f"Bearer {self.restore_token}"}
     
     def upload_document(self, file_path: str) -> Dict[str, Any]:
         """
@@ -36,6 +48,28 @@ class DocumentProcessorClient:
             
         return response.json()
     
+    def upload_documents(self, file_paths: List[str]) -> Dict[str, Any]:
+        """
+        Sube varios documentos en una sola petición a /upload/batch
+        
+        Args:
+            file_paths: Rutas de los archivos a subir
+        
+        Returns:
+            Dict con el resumen del lote y el resultado de cada archivo
+        """
+        files = []
+        try:
+            for file_path in file_paths:
+                files.append(('files', (os.path.basename(file_path), open(file_path, 'rb'))))
+            response = self.session.post(f"{self.base_url}/upload/batch", files=files)
+            response.raise_for_status()
+        finally:
+            for _, (_, file) in files:
+                file.close()
+        
+        return response.json()
+    
     def get_processing_status(self, file_name: str) -> Dict[str, Any]:
         """
         Obtiene el estado del procesamiento de un documento
@@ -51,33 +85,66 @@ class DocumentProcessorClient:
         
         return response.json()
     
-    def get_document_info(self, file_name: str) -> Dict[str, Any]:
+    def get_document_info(self, file_name: str, fields: Optional[List[str]] = None) -> Dict[str, Any]:
         """
         Obtiene toda la información extraída de un documento
         
         Args:
             file_name: Nombre del archivo
+            fields: Secciones a devolver (ocr_text, summary, entities,
+                key_value_pairs, tables, text); todas si se omite
             
         Returns:
             Dict con toda la información del documento
         """
-        response = self.session.get(f"{self.base_url}/info/{file_name}")
+        params = {'fields': ','.join(fields)} if fields else None
+        response = self.session.get(f"{self.base_url}/info/{file_name}", params=params)
         response.raise_for_status()
         
         return response.json()
     
-    def list_documents(self) -> Dict[str, Any]:
+    def list_documents(self, page_size: int = 50, page_token: Optional[str] = None,
+                       **filters) -> Dict[str, Any]:
         """
-        Lista todos los documentos procesados
+        Lista una página de documentos procesados
+        
+        Args:
+            page_size: Número máximo de documentos por página
+            page_token: Cursor devuelto por la página anterior
+            **filters: Filtros opcionales (status, document_type, date_from, date_to)
         
         Returns:
-            Dict con la lista de documentos
+            Dict con la lista de documentos y el cursor de la siguiente página
         """
-        response = self.session.get(f"{self.base_url}/documents")
+        params = {'page_size': page_size, **filters}
+        if page_token:
+            params['page_token'] = page_token
+        
+        response = self.session.get(f"{self.base_url}/documents", params=params)
         response.raise_for_status()
         
         return response.json()
     
+    def iter_documents(self, page_size: int = 50, **filters) -> Iterator[Dict[str, Any]]:
+        """
+        Recorre todos los documentos siguiendo los cursores de paginación
+        
+        Args:
+            page_size: Número máximo de documentos por página
+            **filters: Filtros opcionales (status, document_type, date_from, date_to)
+        
+        Yields:
+            Dict con la información de cada documento
+        """
+        page_token = None
+        while True:
+            page = self.list_documents(page_size=page_size, page_token=page_token, **filters)
+            yield from page['documents']
+            
+            page_token = page.get('next_page_token')
+            if not page_token:
+                break
+    
     def delete_document(self, file_name: str) -> Dict[str, Any]:
         """
         Elimina un documento y todos sus archivos relacionados
@@ -93,31 +160,122 @@ class DocumentProcessorClient:
         
         return response.json()
     
+    def restore_documents(self, stage: str = 'ocr', dry_run: bool = False, **filters) -> Dict[str, Any]:
+        """
+        Restaura documentos desde el backup y los reprocesa desde una etapa
+        
+        Args:
+            stage: Etapa desde la que se reprocesa ('ocr', 'backup' o 'extraction')
+            dry_run: Solo contar los documentos seleccionados, sin reprocesarlos
+            **filters: document_type, date_from, date_to (YYYY-MM-DD), sha256, file_names, limit
+            
+        Returns:
+            Dict con el trabajo de restauración; su selección y progreso se
+            consultan con get_restore_job
+        """
+        response = self.session.post(
+            f"{self.base_url}/restore",
+            json={'stage': stage, 'dry_run': dry_run, **filters},
+            headers=self._restore_headers()
+        )
+        response.raise_for_status()
+        
+        return response.json()
+    
+    def get_restore_job(self, job_id: str) -> Dict[str, Any]:
+        """
+        Obtiene el progreso de un trabajo de restauración
+        
+        Args:
+            job_id: Identificador devuelto por restore_documents
+            
+        Returns:
+            Dict con los contadores del trabajo
+        """
+        response = self.session.get(f"{self.base_url}/restore/{job_id}", headers=self._restore_headers())
+        response.raise_for_status()
+        
+        return response.json()
+    
+    def upload_document_with_callback(self, file_path: str, callback_url: str) -> Dict[str, Any]:
+        """
+        Sube un documento registrando un webhook de finalización
+        
+        Args:
+            file_path: Ruta al archivo a subir
+            callback_url: URL que recibirá un POST cuando el documento se complete
+            
+        Returns:
+            Dict con la respuesta de la API
+        """
+        with open(file_path, 'rb') as file:
+            response = self.session.post(
+                f"{self.base_url}/upload",
+                files={'file': file},
+                data={'callback_url': callback_url}
+            )
+            response.raise_for_status()
+        
+        return response.json()
+    
+    def iter_events(self, file_name: str, timeout: Optional[float] = None) -> Iterator[Dict[str, Any]]:
+        """
+        Recibe los eventos de progreso de un documento (Server-Sent Events)
+        
+        Args:
+            file_name: Nombre del archivo
+            timeout: Duración máxima del stream en segundos
+            
+        Yields:
+            Dict con cada notificación (`status`, `ocr_completed`, ...)
+        """
+        params = {'timeout': timeout} if timeout else None
+        # El stream usa su propia conexión: una conexión reutilizada del pool
+        # puede cerrarla el servidor por su keep-alive a mitad del stream
+        with requests.Session() as stream_session:
+            stream_session.headers.update(self.session.headers)
+            with stream_session.get(f"{self.base_url}/events/{file_name}", params=params,
+                                    stream=True, timeout=(10, 60)) as response:
+                response.raise_for_status()
+                for line in response.iter_lines(decode_unicode=True):
+                    if line and line.startswith('data:'):
+                        yield json.loads(line[len('data:'):])
+    
     def wait_for_completion(self, file_name: str, timeout: int = 300, check_interval: int = 10) -> Dict[str, Any]:
         """
         Espera a que el procesamiento de un documento se complete
         
+        Bloquea sobre el stream de eventos de la API en lugar de consultar el
+        estado periódicamente; si la conexión se corta, se reconecta.
+        
         Args:
             file_name: Nombre del archivo
             timeout: Tiempo máximo de espera en segundos
-            check_interval: Intervalo entre verificaciones en segundos
+            check_interval: Espera antes de reconectar tras un error de conexión
             
         Returns:
             Dict con el estado final del procesamiento
         """
-        start_time = time.time()
+        deadline = time.time() + timeout
         
-        while time.time() - start_time < timeout:
-            status = self.get_processing_status(file_name)
-            
-            if status['status'] == 'completed':
-                print(f"✅ Procesamiento completado para {file_name}")
-                return status
-            
-            print(f"⏳ Procesando {file_name}... OCR: {status['ocr_completed']}, "
-                  f"Backup: {status['backup_completed']}, Extracción: {status['extraction_completed']}")
-            
-            time.sleep(check_interval)
+        while time.time() < deadline:
+            try:
+                for event in self.iter_events(file_name, timeout=max(1, deadline - time.time())):
+                    if event['event'] == 'deleted':
+                        raise RuntimeError(f"El documento {file_name} fue eliminado")
+                    if event['event'] == 'timeout':
+                        break
+                    
+                    if event['status'] == 'completed':
+                        print(f"✅ Procesamiento completado para {file_name}")
+                        return self.get_processing_status(file_name)
+                    
+                    print(f"⏳ Procesando {file_name}... OCR: {event['ocr_completed']}, "
+                          f"Backup: {event['backup_completed']}, Extracción: {event['extraction_completed']}")
+            except (requests.exceptions.ConnectionError, requests.exceptions.ChunkedEncodingError,
+                    requests.exceptions.Timeout) as e:
+                print(f"🔌 Conexión de eventos interrumpida ({e}), reconectando...")
+                time.sleep(min(check_interval, max(0, deadline - time.time())))
         
         raise TimeoutError(f"Tiempo de espera agotado para {file_name}")
 
@@ -143,8 +301,8 @@ def main():
         
         # 2. Listar documentos existentes
         print("\n2. Listando documentos existentes...")
-        documents = client.list_documents()
-        print(f"📄 Total de documentos: {documents['total_documents']}")
+        documents = client.list_documents(page_size=5)
+        print(f"📄 Documentos en la primera página: {documents['total_documents']}")
         
         for doc in documents['documents'][:5]:  # Mostrar solo los primeros 5
             print(f"   - {doc['file_name']} ({doc['status']})")
@@ -197,6 +355,7 @@ def main():
         print(f"   Endpoints disponibles:")
         print(f"   - POST /upload - Subir documentos")
         print(f"   - GET /status/{'{file_name}'} - Estado del procesamiento")
+        print(f"   - GET /events/{'{file_name}'} - Eventos de progreso (SSE)")
         print(f"   - GET /info/{'{file_name}'} - Información del documento")
         print(f"   - GET /documents - Listar documentos")
         print(f"   - DELETE /documents/{'{file_name}'} - Eliminar documento")
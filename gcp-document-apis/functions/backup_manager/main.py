@@ -3,27 +3,49 @@ Backup Manager Cloud Function
 Gestiona el backup y clasificación automática de documentos en Google Cloud Storage
 """
 
+import base64
 import json
 import logging
 import os
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional
 
-from google.cloud import storage
-from google.cloud import pubsub_v1
+from shared import clients
+from shared.backup_layout import (BUNDLE_CONTENT_TYPE, MANIFEST_DIR, append_bundle_member, append_manifest,
+                                  backup_object_path, build_bundle, bundle_path, document_day, iter_partitions,
+                                  latest_entries, manifest_objects, manifest_path, partition_prefix,
+                                  read_manifest_entries)
+from shared.bulk_delete import DeletionReport, delete_blobs
+from shared.object_copy import copy_object
+from shared.pipeline_graph import STAGE_BACKUP, ready_to_run, stage_progress
+from shared.routing import BACKUP_COMPLETED, decode_pubsub_event
+from shared.tracing import TRACE_ATTRIBUTE, current_trace_id, span, trace_context, traced_function
 
 # Configuración de logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Inicializar clientes
-storage_client = storage.Client()
-publisher = pubsub_v1.PublisherClient()
+# Borrado de backups antiguos: objetos por petición batch y lotes en paralelo
+CLEANUP_BATCH_SIZE = int(os.environ.get('CLEANUP_BATCH_SIZE', 100))
+CLEANUP_MAX_WORKERS = int(os.environ.get('CLEANUP_MAX_WORKERS', 8))
 
+# Documentos de un mismo mensaje copiados en paralelo
+BACKUP_COPY_WORKERS = int(os.environ.get('BACKUP_COPY_WORKERS', 8))
+
+# Empaquetar original, OCR y extracción en un único objeto tar por documento
+BACKUP_BUNDLE = os.environ.get('BACKUP_BUNDLE', 'false').lower() == 'true'
+BACKUP_BUNDLE_MAX_BYTES = int(float(os.environ.get('BACKUP_BUNDLE_MAX_MB', 32)) * 1024 * 1024)
+
+@traced_function('backup')
 def backup_document(event: Dict[str, Any], context) -> str:
     """
     Función principal que gestiona el backup y clasificación de documentos
     
+    El mensaje describe un documento o, en `documents`, varios; los de un
+    mismo mensaje se copian en paralelo y se registran con una sola escritura
+    por manifiesto.
+    
     Args:
         event: Evento de Pub/Sub con información del documento
         context: Contexto de la función
@@ -31,133 +53,320 @@ def backup_document(event: Dict[str, Any], context) -> str:
     Returns:
         str: Resultado del backup
     """
+    file_name = None
     try:
         # Decodificar mensaje de Pub/Sub
-        if 'data' in event:
-            message_data = json.loads(event['data'].decode('utf-8'))
-        else:
-            message_data = event
-            
-        file_name = message_data.get('file_name')
-        ocr_result_path = message_data.get('ocr_result_path')
-        document_type = message_data.get('document_type', 'general')
-        
-        logger.info(f"Procesando backup para documento: {file_name}")
-        
-        # Configurar buckets
-        source_bucket_name = os.environ.get('STORAGE_BUCKET_NAME', 'document-processing')
-        backup_bucket_name = os.environ.get('BACKUP_BUCKET_NAME', 'document-backup')
-        
-        source_bucket = storage_client.bucket(source_bucket_name)
-        backup_bucket = storage_client.bucket(backup_bucket_name)
-        
-        # Crear estructura de directorios para backup
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        backup_path = f"{document_type}/{timestamp}/{file_name}"
-        
-        # Copiar documento original al bucket de backup
-        source_blob = source_bucket.blob(file_name)
-        backup_blob = backup_bucket.blob(backup_path)
+        event_name, message_data = decode_pubsub_event(event)
+        documents = message_data.get('documents') or [message_data]
+        file_name = ', '.join(str(document.get('file_name')) for document in documents)
         
-        # Copiar archivo
-        backup_bucket.copy_blob(source_blob, backup_bucket, backup_path)
-        logger.info(f"Documento original copiado a: {backup_path}")
-        
-        # Si hay resultado de OCR, también hacer backup
-        if ocr_result_path:
-            ocr_backup_path = f"{document_type}/{timestamp}/{file_name.replace('.', '_')}_ocr.txt"
-            ocr_source_blob = source_bucket.blob(ocr_result_path)
-            ocr_backup_blob = backup_bucket.blob(ocr_backup_path)
-            
-            backup_bucket.copy_blob(ocr_source_blob, backup_bucket, ocr_backup_path)
-            logger.info(f"Resultado OCR copiado a: {ocr_backup_path}")
-        
-        # Crear metadatos del backup
-        metadata = {
-            'original_file': file_name,
-            'backup_timestamp': timestamp,
-            'document_type': document_type,
-            'backup_path': backup_path,
-            'ocr_result_path': ocr_backup_path if ocr_result_path else None,
-            'status': 'backup_completed'
-        }
+        # El backup se ejecuta cuando el grafo del pipeline lo dispara (tras el OCR)
+        if not ready_to_run(STAGE_BACKUP, event_name,
+                            lambda: clients.status_index().get(documents[0].get('file_name'))):
+            logger.info(f"Evento {event_name} ignorado por el backup ({file_name})")
+            return f"Evento {event_name} ignorado"
         
-        # Guardar metadatos como archivo JSON
-        metadata_path = f"{document_type}/{timestamp}/metadata.json"
-        metadata_blob = backup_bucket.blob(metadata_path)
-        metadata_blob.upload_from_string(
-            json.dumps(metadata, indent=2),
-            content_type='application/json'
-        )
-        
-        # Publicar mensaje de backup completado
-        topic_name = os.environ.get('PUBSUB_TOPIC_NAME', 'document-processing')
-        topic_path = publisher.topic_path(os.environ.get('GOOGLE_CLOUD_PROJECT'), topic_name)
-        
-        backup_message = {
-            'file_name': file_name,
-            'backup_path': backup_path,
-            'document_type': document_type,
-            'timestamp': timestamp,
-            'status': 'backup_completed'
-        }
+        logger.info(f"Procesando backup para documento: {file_name}")
+        results = backup_documents(documents)
         
-        publisher.publish(topic_path, json.dumps(backup_message).encode('utf-8'))
+        # Un fallo reintenta el mensaje completo: las rutas son deterministas y
+        # las entradas repetidas del manifiesto se resuelven por la más reciente
+        failed = [result for result in results if result.get('error')]
+        if failed:
+            raise RuntimeError(
+                f"Backup fallido para {len(failed)} de {len(results)} documentos: "
+                + '; '.join(f"{result['file_name']}: {result['error']}" for result in failed)
+            )
         
-        logger.info(f"Backup completado exitosamente para {file_name}")
-        return f"Backup completado para {file_name} en {backup_path}"
+        if len(results) == 1:
+            return f"Backup completado para {file_name} en {results[0]['backup_path']}"
+        return f"Backup completado para {len(results)} documentos"
         
     except Exception as e:
         logger.error(f"Error en backup para {file_name}: {str(e)}")
         raise e
 
-def organize_by_document_type(document_type: str, file_name: str) -> str:
+def backup_documents(documents: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
     """
-    Organiza documentos por tipo en el bucket de backup
+    Hace el backup de varios documentos: copias en paralelo, una escritura por
+    manifiesto y después índice y mensajes de cada documento
     
     Args:
-        document_type: Tipo de documento identificado
-        file_name: Nombre del archivo
+        documents: Mensajes `ocr_completed` (file_name, ocr_result_path, document_type...)
     
     Returns:
-        str: Ruta organizada del documento
+        List: Resultado por documento (file_name, backup_path o error)
     """
-    # Mapeo de tipos de documento a directorios
-    type_mapping = {
-        'invoice': 'facturas',
-        'contract': 'contratos',
-        'identification': 'identificaciones',
-        'report': 'reportes',
-        'general': 'general'
+    source_bucket_name = os.environ.get('STORAGE_BUCKET_NAME', 'document-processing')
+    backup_bucket_name = os.environ.get('BACKUP_BUCKET_NAME', 'document-backup')
+    result_bucket_name = os.environ.get('RESULT_BUCKET_NAME', 'document-results')
+    buckets = {
+        'source': clients.storage().bucket(source_bucket_name),
+        'backup': clients.storage().bucket(backup_bucket_name),
+        'result': clients.storage().bucket(result_bucket_name)
     }
     
-    # Obtener directorio correspondiente
-    directory = type_mapping.get(document_type, 'general')
+    # Los hilos del pool no heredan la traza activa: cada documento lleva la suya
+    trace_id = current_trace_id()
+    plans = [plan_backup(document, document.get(TRACE_ATTRIBUTE) or trace_id) for document in documents]
     
-    # Crear ruta organizada
-    timestamp = datetime.now().strftime('%Y%m%d')
-    organized_path = f"{directory}/{timestamp}/{file_name}"
+    def run(function, plan):
+        if plan.get('error'):
+            return
+        with trace_context(plan['trace_id']):
+            try:
+                function(plan, buckets)
+            except Exception as e:
+                logger.error(f"Error en backup para {plan['file_name']}: {str(e)}")
+                plan['error'] = str(e)
     
-    return organized_path
+    with ThreadPoolExecutor(max_workers=max(1, min(BACKUP_COPY_WORKERS, len(plans)))) as executor:
+        list(executor.map(lambda plan: run(copy_document, plan), plans))
+        
+        # Una escritura por manifiesto para todas las entradas del mensaje
+        by_manifest: Dict[str, List[Dict[str, Any]]] = {}
+        for plan in plans:
+            if not plan.get('error'):
+                by_manifest.setdefault(plan['manifest'], []).append(plan)
+        for manifest, grouped in by_manifest.items():
+            try:
+                with span('backup.manifest', file_name=grouped[0]['file_name'], documents=len(grouped)):
+                    append_manifest(buckets['backup'], manifest, [plan['entry'] for plan in grouped])
+            except Exception as e:
+                logger.error(f"Error registrando backups en {manifest}: {str(e)}")
+                for plan in grouped:
+                    plan['error'] = str(e)
+        
+        list(executor.map(lambda plan: run(complete_backup, plan), plans))
+    
+    return [
+        {'file_name': plan['file_name'], 'backup_path': plan.get('backup_path'), 'error': plan.get('error')}
+        for plan in plans
+    ]
+
+def plan_backup(document: Dict[str, Any], trace_id: Optional[str]) -> Dict[str, Any]:
+    """
+    Decide rutas y formato del backup de un documento
+    
+    Los documentos de hasta BACKUP_BUNDLE_MAX_MB se empaquetan en un único
+    objeto tar si BACKUP_BUNDLE está activo; el resto se copia objeto a objeto.
+    """
+    file_name = document.get('file_name')
+    document_type = document.get('document_type') or 'general'
+    
+    # Partición del día de la subida: los reintentos escriben en las mismas rutas
+    partition = partition_prefix(document_type, document_day(file_name or ''))
+    return {
+        'file_name': file_name,
+        'document_type': document_type,
+        'ocr_result_path': document.get('ocr_result_path'),
+        'sha256': document.get('sha256'),
+        'size': document.get('size'),
+        'trace_id': trace_id,
+        'partition': partition,
+        'manifest': manifest_path(partition, file_name or ''),
+        'error': None if file_name else 'Mensaje sin file_name'
+    }
 
-def cleanup_old_backups(bucket_name: str, days_to_keep: int = 30):
+def copy_document(plan: Dict[str, Any], buckets: Dict[str, Any]):
+    """
+    Copia el original y el OCR de un documento al bucket de backup y prepara su entrada de manifiesto
+    
+    Las copias se hacen en el servidor con `rewrite` (los bytes no pasan por
+    la función); en modo paquete se leen los dos ficheros y se escribe un
+    único objeto, lo que reduce objetos y peticiones en el bucket de backup.
+    """
+    file_name = plan['file_name']
+    ocr_result_path = plan['ocr_result_path']
+    partition = plan['partition']
+    
+    size = plan['size']
+    if BACKUP_BUNDLE and size is None:
+        source = buckets['source'].get_blob(file_name)
+        size = source.size if source is not None else None
+    
+    if BACKUP_BUNDLE and size is not None and size <= BACKUP_BUNDLE_MAX_BYTES:
+        with span('backup.bundle', file_name=file_name) as attributes:
+            members = [('original', file_name, buckets['source'].blob(file_name).download_as_bytes())]
+            if ocr_result_path:
+                members.append(('ocr', ocr_member_name(file_name), buckets['result'].blob(ocr_result_path).download_as_bytes()))
+            data, index = build_bundle(members)
+            bundle = buckets['backup'].blob(bundle_path(partition, file_name))
+            bundle.upload_from_string(data, content_type=BUNDLE_CONTENT_TYPE)
+            attributes['bytes'] = len(data)
+        copies = [('bundle', bundle, {'members': index})]
+        plan['backup_bundle'] = bundle.name
+        logger.info(f"Backup empaquetado en: {bundle.name}")
+    else:
+        backup_path = backup_object_path(partition, file_name, file_name)
+        with span('backup.copy_original', file_name=file_name):
+            copies = [('original', copy_object(buckets['source'].blob(file_name), buckets['backup'], backup_path), {})]
+        logger.info(f"Documento original copiado a: {backup_path}")
+        
+        # El OCR se lee del bucket de resultados, donde lo escribe ocr_processor
+        if ocr_result_path:
+            ocr_backup_path = backup_object_path(partition, file_name, ocr_member_name(file_name))
+            with span('backup.copy_ocr', file_name=file_name):
+                copies.append(('ocr', copy_object(buckets['result'].blob(ocr_result_path), buckets['backup'], ocr_backup_path), {}))
+            logger.info(f"Resultado OCR copiado a: {ocr_backup_path}")
+    
+    # Entrada del manifiesto de la partición (sustituye al metadata.json por backup)
+    plan['backup_path'] = copies[0][1].name
+    plan['backup_paths'] = [blob.name for _, blob, _ in copies]
+    plan['entry'] = {
+        'file_name': file_name,
+        'document_type': plan['document_type'],
+        'sha256': plan['sha256'],
+        'backup_timestamp': datetime.now().isoformat(),
+        'sources': {
+            'original': f"gs://{buckets['source'].name}/{file_name}",
+            'ocr': f"gs://{buckets['result'].name}/{ocr_result_path}" if ocr_result_path else None
+        },
+        'objects': [
+            {
+                'kind': kind,
+                'path': blob.name,
+                'size': blob.size,
+                'md5_hash': blob.md5_hash,
+                'generation': blob.generation,
+                **extra
+            }
+            for kind, blob, extra in copies
+        ]
+    }
+
+def complete_backup(plan: Dict[str, Any], buckets: Dict[str, Any]):
+    """Registra el backup de un documento en el índice y publica `backup_completed`"""
+    file_name = plan['file_name']
+    
+    # Registrar backup completado en el índice de estado
+    fields = {}
+    if plan.get('backup_bundle'):
+        fields['backup_bundle'] = plan['backup_bundle']
+    with span('backup.index_update', file_name=file_name):
+        record = clients.status_index().update(
+            file_name,
+            backup_completed=True,
+            backup_path=plan['backup_path'],
+            backup_paths=plan['backup_paths'],
+            backup_manifest=plan['manifest'],
+            document_type=plan['document_type'],
+            **fields
+        )
+    
+    # Si la extracción terminó antes, su resultado se añade aquí al paquete; si
+    # no, lo añade la extracción al ver el paquete en el índice
+    if plan.get('backup_bundle') and record.get('extraction_completed') and record.get('extracted_info_path'):
+        append_extraction_to_bundle(plan['backup_bundle'], record['extracted_info_path'], buckets)
+    
+    # Publicar mensaje de backup completado
+    backup_message = {
+        'file_name': file_name,
+        'backup_path': plan['backup_path'],
+        'document_type': plan['document_type'],
+        'backup_manifest': plan['manifest'],
+        # Un reprocesado en modo secuencial pasa su modo de extracción a la extracción
+        'extraction_mode': record.get('extraction_mode'),
+        'status': BACKUP_COMPLETED,
+        **stage_progress(record)
+    }
+    
+    clients.publisher().publish_event(BACKUP_COMPLETED, backup_message)
+    logger.info(f"Backup completado exitosamente para {file_name}")
+
+def append_extraction_to_bundle(bundle: str, extracted_info_path: str, buckets: Dict[str, Any]):
+    """Añade al paquete del backup el resultado de una extracción ya terminada"""
+    try:
+        with span('backup.bundle_append', path=bundle):
+            data = buckets['result'].blob(extracted_info_path).download_as_bytes()
+            append_bundle_member(buckets['backup'], bundle, os.path.basename(extracted_info_path), data)
+    except Exception as e:
+        logger.warning(f"No se pudo añadir la extracción al paquete {bundle}: {str(e)}")
+
+def ocr_member_name(file_name: str) -> str:
+    """Nombre del resultado de OCR dentro del backup de un documento"""
+    return f"{file_name.replace('.', '_')}_ocr.txt"
+
+def cleanup_old_backups(bucket_name: str, days_to_keep: int = 30, dry_run: bool = False) -> Dict[str, Any]:
     """
     Limpia backups antiguos para ahorrar espacio
     
+    Las particiones `{tipo}/{yyyy}/{mm}/{dd}` se recorren en orden desde la
+    más antigua de cada tipo consultando un único objeto por partición
+    (`iter_partitions`), y el recorrido de un tipo se detiene en la primera
+    partición dentro del periodo de retención. De cada partición caducada se leen solo sus manifiestos,
+    que enumeran los objetos a borrar, así que nunca se listan los backups.
+    El día de corte se conserva entero.
+    
     Args:
         bucket_name: Nombre del bucket de backup
         days_to_keep: Días a mantener los backups
+        dry_run: Solo informar de lo que se eliminaría
+    
+    Returns:
+        Dict: Informe con particiones, objetos y bytes eliminados (o a eliminar)
     """
-    try:
-        bucket = storage_client.bucket(bucket_name)
-        cutoff_date = datetime.now() - timedelta(days=days_to_keep)
+    bucket = clients.storage().bucket(bucket_name)
+    cutoff_day = (datetime.now() - timedelta(days=days_to_keep)).replace(hour=0, minute=0, second=0, microsecond=0)
+    report = DeletionReport(dry_run=dry_run)
+    partitions = []
+    
+    # Particiones anteriores al día de corte, de la más antigua a la más reciente por tipo
+    for document_type, day in iter_partitions(bucket, day_to=cutoff_day - timedelta(days=1)):
+        partition = partition_prefix(document_type, day)
+        entries = list(latest_entries(read_manifest_entries(bucket, partition)).values())
+        manifests = list(bucket.list_blobs(prefix=f"{partition}/{MANIFEST_DIR}/"))
         
-        blobs = bucket.list_blobs()
-        for blob in blobs:
-            # Verificar fecha de creación
-            if blob.time_created < cutoff_date:
-                blob.delete()
-                logger.info(f"Backup antiguo eliminado: {blob.name}")
-                
-    except Exception as e:
-        logger.error(f"Error limpiando backups antiguos: {str(e)}")
+        # Los manifiestos se borran al final para poder repetir una limpieza interrumpida
+        for blobs in ([bucket.blob(path) for path in manifest_objects(entries)], manifests):
+            delete_blobs(
+                clients.storage(),
+                blobs,
+                dry_run=dry_run,
+                batch_size=CLEANUP_BATCH_SIZE,
+                max_workers=CLEANUP_MAX_WORKERS,
+                report=report
+            )
+        report.record_bytes(sum(item.get('size') or 0 for entry in entries for item in entry.get('objects') or []))
+        partitions.append(partition)
+        
+        progress = report.to_dict()
+        logger.info(
+            f"Partición {partition} {'revisada' if dry_run else 'eliminada'} ({len(entries)} backups): "
+            f"{progress['matched']} objetos ({progress['bytes']} bytes) acumulados, "
+            f"{progress['failed']} fallidos"
+        )
+    
+    summary = report.to_dict()
+    summary.update(
+        bucket=bucket_name,
+        cutoff=cutoff_day.strftime('%Y-%m-%d'),
+        partitions=partitions
+    )
+    return summary
+
+def cleanup_backups(event: Dict[str, Any], context) -> str:
+    """
+    Punto de entrada programado (Cloud Scheduler → Pub/Sub) para limpiar backups
+    
+    El mensaje admite `days_to_keep` y `dry_run`; sin mensaje se conservan 30 días.
+    
+    Args:
+        event: Evento de Pub/Sub con los parámetros de la limpieza
+        context: Contexto de la función
+    
+    Returns:
+        str: Resumen de la limpieza
+    """
+    options = {}
+    if event.get('data'):
+        options = json.loads(base64.b64decode(event['data']).decode('utf-8'))
+    
+    summary = cleanup_old_backups(
+        os.environ.get('BACKUP_BUCKET_NAME', 'document-backup'),
+        days_to_keep=int(options.get('days_to_keep', 30)),
+        dry_run=bool(options.get('dry_run', False))
+    )
+    action = 'a eliminar' if summary['dry_run'] else 'eliminados'
+    return (f"Limpieza de backups anteriores a {summary['cutoff']}: {summary['matched']} objetos {action} "
+            f"en {len(summary['partitions'])} particiones, {summary['failed']} fallidos")
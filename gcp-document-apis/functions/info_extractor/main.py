@@ -3,24 +3,35 @@ Information Extractor Cloud Function
 Extrae información estructurada de documentos usando Google Cloud Document AI
 """
 
-import json
 import logging
 import os
-from typing import Dict, Any, List
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Optional
 
-from google.cloud import documentai_v1 as documentai
-from google.cloud import storage
-from google.cloud import pubsub_v1
+from shared import clients
+from shared.backup_layout import append_bundle_member
+from shared.batch_extraction import (EXTRACT_BATCH_MAX_ATTEMPTS, EXTRACT_BATCH_WORKERS, EXTRACTION_MODE_BATCH,
+                                     ExtractionBatchQueue, extraction_mode)
+from shared.classification import create_classifier_from_env
+from shared.pipeline_graph import STAGE_EXTRACTION, ready_to_run, stage_progress
+from shared.result_format import RESULT_CONTENT_TYPE, encode_result, result_path
+from shared.routing import EXTRACTION_COMPLETED, decode_pubsub_event
+from shared.structured_data import extract_structured_data
+from shared.tracing import TRACE_ATTRIBUTE, current_trace_id, span, trace_context, traced_function
 
 # Configuración de logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Inicializar clientes
-documentai_client = documentai.DocumentProcessorServiceClient()
-storage_client = storage.Client()
-publisher = pubsub_v1.PublisherClient()
+# Los clientes de GCP se crean en el primer uso (shared/clients.py)
+classifier = create_classifier_from_env()
 
+# Hasta este tamaño el documento viaja en la petición; por encima, Document AI
+# lo lee de Cloud Storage (gs://) y los bytes no pasan por la función
+EXTRACT_INLINE_MAX_BYTES = int(float(os.environ.get('EXTRACT_INLINE_MAX_MB', 1)) * 1024 * 1024)
+
+@traced_function('extract')
 def extract_document_info(event: Dict[str, Any], context) -> str:
     """
     Función principal que extrae información estructurada de documentos
@@ -34,83 +45,80 @@ def extract_document_info(event: Dict[str, Any], context) -> str:
     """
     try:
         # Decodificar mensaje de Pub/Sub
-        if 'data' in event:
-            message_data = json.loads(event['data'].decode('utf-8'))
-        else:
-            message_data = event
-            
+        event_name, message_data = decode_pubsub_event(event)
         file_name = message_data.get('file_name')
-        document_type = message_data.get('document_type', 'general')
-        
-        logger.info(f"Extrayendo información de documento: {file_name}")
         
-        # Configurar Document AI
-        project_id = os.environ.get('GOOGLE_CLOUD_PROJECT')
-        location = os.environ.get('DOCUMENT_AI_LOCATION', 'us')
-        processor_id = os.environ.get('DOCUMENT_AI_PROCESSOR_ID')
+        # La extracción se ejecuta con el evento que le asigna el grafo del pipeline
+        if not ready_to_run(STAGE_EXTRACTION, event_name, lambda: clients.status_index().get(file_name)):
+            logger.info(f"Evento {event_name} ignorado por la extracción ({file_name})")
+            return f"Evento {event_name} ignorado"
         
-        if not processor_id:
-            logger.warning("No se configuró PROCESSOR_ID, usando procesador general")
-            processor_id = "general-processor"
+        # El tipo viene del OCR (en el mensaje o en el índice); si la extracción
+        # arranca en paralelo con el OCR, se clasifica el texto de Document AI
+        document_type = message_data.get('document_type')
+        if not document_type:
+            with span('extract.index_lookup', file_name=file_name):
+                document_type = (clients.status_index().get(file_name) or {}).get('document_type')
         
-        # Construir nombre del procesador
-        processor_name = documentai_client.processor_path(project_id, location, processor_id)
+        logger.info(f"Extrayendo información de documento: {file_name}")
         
-        # Descargar documento del bucket
         bucket_name = os.environ.get('STORAGE_BUCKET_NAME', 'document-processing')
-        bucket = storage_client.bucket(bucket_name)
-        blob = bucket.blob(file_name)
+        bucket = clients.storage().bucket(bucket_name)
+        gcs_uri = f"gs://{bucket_name}/{file_name}"
         
-        # Leer contenido del documento
-        document_content = blob.download_as_bytes()
+        # Tamaño y tipo del documento: del mensaje o de los metadatos del objeto
+        size = int(message_data.get('size') or 0)
+        mime_type = message_data.get('content_type')
+        if not size or not mime_type:
+            with span('extract.metadata', file_name=file_name):
+                blob = bucket.get_blob(file_name)
+            if blob is None:
+                raise Exception(f"Documento {file_name} no encontrado en {bucket_name}")
+            size = blob.size or 0
+            mime_type = mime_type or blob.content_type
+        mime_type = mime_type or 'application/pdf'
         
-        # Configurar documento para Document AI
-        raw_document = documentai.RawDocument(
-            content=document_content,
-            mime_type=blob.content_type or 'application/pdf'
-        )
+        # En modo por lotes el documento queda pendiente: lo envía a Document AI
+        # el mensaje que complete un lote o el sondeo periódico al cumplirse la ventana
+        if extraction_mode(message_data) == EXTRACTION_MODE_BATCH:
+            queue = extraction_batch_queue()
+            with span('extract.batch_enqueue', file_name=file_name) as attributes:
+                queue.enqueue(file_name, gcs_uri, mime_type, document_type=document_type,
+                              **{TRACE_ATTRIBUTE: current_trace_id()})
+                attributes['batches_submitted'] = len(queue.flush())
+            return f"Documento {file_name} pendiente de extracción por lotes"
         
-        # Procesar documento
-        request = documentai.ProcessRequest(
-            name=processor_name,
-            raw_document=raw_document
-        )
-        
-        result = documentai_client.process_document(request=request)
-        document = result.document
-        
-        # Extraer información estructurada
-        extracted_info = extract_structured_data(document, document_type)
-        
-        # Guardar información extraída
-        result_bucket_name = os.environ.get('RESULT_BUCKET_NAME', 'extracted-info')
-        result_bucket = storage_client.bucket(result_bucket_name)
-        
-        # Crear archivo de resultado
-        result_file_name = f"extracted_info/{file_name.replace('.', '_')}_info.json"
-        result_blob = result_bucket.blob(result_file_name)
-        
-        # Guardar información extraída como JSON
-        result_blob.upload_from_string(
-            json.dumps(extracted_info, indent=2, ensure_ascii=False),
-            content_type='application/json'
-        )
+        # La librería de Document AI solo se importa si hay que extraer
+        from google.cloud import documentai_v1 as documentai
         
-        logger.info(f"Información extraída exitosamente de {file_name}")
-        
-        # Publicar mensaje de extracción completada
-        topic_name = os.environ.get('PUBSUB_TOPIC_NAME', 'document-processing')
-        topic_path = publisher.topic_path(project_id, topic_name)
+        if size > EXTRACT_INLINE_MAX_BYTES:
+            # Document AI lee el documento de Cloud Storage
+            request = documentai.ProcessRequest(
+                name=get_processor_name(),
+                gcs_document=documentai.GcsDocument(
+                    gcs_uri=gcs_uri,
+                    mime_type=mime_type
+                )
+            )
+        else:
+            # Los documentos pequeños se descargan y viajan en la petición
+            with span('extract.download', file_name=file_name) as attributes:
+                document_content = bucket.blob(file_name).download_as_bytes()
+                attributes['bytes'] = len(document_content)
+            
+            request = documentai.ProcessRequest(
+                name=get_processor_name(),
+                raw_document=documentai.RawDocument(
+                    content=document_content,
+                    mime_type=mime_type
+                )
+            )
         
-        extraction_message = {
-            'file_name': file_name,
-            'extracted_info_path': result_file_name,
-            'document_type': document_type,
-            'status': 'extraction_completed',
-            'extracted_fields': list(extracted_info.keys())
-        }
+        with span('extract.documentai', file_name=file_name,
+                  source='gcs' if size > EXTRACT_INLINE_MAX_BYTES else 'bytes'):
+            result = clients.documentai().process_document(request=request)
         
-        publisher.publish(topic_path, json.dumps(extraction_message).encode('utf-8'))
+        complete_extraction(file_name, result.document, document_type)
         
         return f"Extracción completada exitosamente para {file_name}"
         
@@ -118,130 +126,187 @@ def extract_document_info(event: Dict[str, Any], context) -> str:
         logger.error(f"Error extrayendo información de {file_name}: {str(e)}")
         raise e
 
-def extract_structured_data(document: documentai.Document, document_type: str) -> Dict[str, Any]:
+@traced_function('extract_batches')
+def process_extraction_batches(event: Dict[str, Any], context) -> str:
     """
-    Extrae información estructurada del documento procesado
+    Sondeo periódico de la extracción por lotes (Cloud Scheduler -> Pub/Sub)
+    
+    Envía los pendientes cuya ventana se cumplió y consulta, sin esperarla, la
+    operación de cada lote enviado. Los resultados de los lotes terminados se
+    reparten por documento con el mismo guardado que la extracción síncrona.
     
     Args:
-        document: Documento procesado por Document AI
-        document_type: Tipo de documento
+        event: Evento de Pub/Sub del programador (su contenido no se usa)
+        context: Contexto de la función
     
     Returns:
-        Dict: Información extraída estructurada
+        str: Resumen de lotes enviados y documentos repartidos
     """
-    extracted_data = {
-        'document_type': document_type,
-        'text': document.text,
-        'pages': len(document.pages),
-        'entities': {},
-        'key_value_pairs': {},
-        'tables': []
-    }
+    queue = extraction_batch_queue()
+    with span('extract.batch_flush') as attributes:
+        submitted = queue.flush()
+        attributes['batches'] = len(submitted)
     
-    # Extraer entidades
-    for entity in document.entities:
-        entity_type = entity.type_
-        entity_text = entity.mention_text
+    outcomes: Counter = Counter()
+    running = 0
+    for job in queue.jobs():
+        with span('extract.batch_poll', batch_id=job['batch_id']):
+            results = queue.poll(job)
+        if results is None:
+            running += 1
+            continue
         
-        if entity_type not in extracted_data['entities']:
-            extracted_data['entities'][entity_type] = []
-        
-        extracted_data['entities'][entity_type].append({
-            'text': entity_text,
-            'confidence': entity.confidence,
-            'page_anchor': entity.page_anchor.page if entity.page_anchor else None
-        })
-    
-    # Extraer pares clave-valor
-    for page in document.pages:
-        for form_field in page.form_fields:
-            field_name = form_field.field_name.text_anchor.content
-            field_value = form_field.field_value.text_anchor.content
-            
-            extracted_data['key_value_pairs'][field_name] = {
-                'value': field_value,
-                'confidence': form_field.field_name.confidence,
-                'page': page.page_number
-            }
-    
-    # Extraer tablas
-    for page in document.pages:
-        for table in page.tables:
-            table_data = []
-            for row in table.header_rows:
-                row_data = []
-                for cell in row.cells:
-                    row_data.append(cell.text_anchor.content)
-                table_data.append(row_data)
+        with ThreadPoolExecutor(max_workers=max(1, min(EXTRACT_BATCH_WORKERS, len(results)))) as executor:
+            outcomes.update(executor.map(lambda result: complete_batch_document(queue, *result), results))
+        queue.finish(job)
+        logger.info(f"Lote {job['batch_id']} repartido: {len(results)} documentos")
+    
+    return (
+        f"{len(submitted)} lotes enviados, {running} en curso; {outcomes['completed']} documentos extraídos, "
+        f"{outcomes['requeued']} reencolados y {outcomes['failed']} fallidos"
+    )
+
+def extraction_batch_queue() -> ExtractionBatchQueue:
+    """Cola de extracción por lotes en el bucket de resultados"""
+    result_bucket_name = os.environ.get('RESULT_BUCKET_NAME', 'extracted-info')
+    return ExtractionBatchQueue(
+        clients.storage().bucket(result_bucket_name),
+        clients.documentai(),
+        get_processor_name()
+    )
+
+def get_processor_name() -> str:
+    """Ruta del procesador de Document AI configurado"""
+    project_id = os.environ.get('GOOGLE_CLOUD_PROJECT')
+    location = os.environ.get('DOCUMENT_AI_LOCATION', 'us')
+    processor_id = os.environ.get('DOCUMENT_AI_PROCESSOR_ID')
+    
+    if not processor_id:
+        logger.warning("No se configuró PROCESSOR_ID, usando procesador general")
+        processor_id = "general-processor"
+    
+    return clients.documentai().processor_path(project_id, location, processor_id)
+
+def complete_batch_document(queue: ExtractionBatchQueue, document: Dict[str, Any],
+                            output_uri: Optional[str], error: Optional[str]) -> str:
+    """
+    Guarda el resultado de un documento de un lote terminado
+    
+    Un documento fallido vuelve a quedar pendiente hasta agotar
+    EXTRACT_BATCH_MAX_ATTEMPTS envíos; después el error queda en el índice.
+    
+    Returns:
+        str: 'completed', 'requeued' o 'failed'
+    """
+    file_name = document['file_name']
+    with trace_context(document.get(TRACE_ATTRIBUTE)):
+        try:
+            if error:
+                raise Exception(f"Error en Document AI: {error}")
+            with span('extract.batch_read', file_name=file_name):
+                processed = queue.read_document(output_uri)
             
-            for row in table.body_rows:
-                row_data = []
-                for cell in row.cells:
-                    row_data.append(cell.text_anchor.content)
-                table_data.append(row_data)
+            # Si el OCR terminó mientras el documento esperaba, su tipo ya está en el índice
+            document_type = document.get('document_type')
+            if not document_type:
+                with span('extract.index_lookup', file_name=file_name):
+                    document_type = (clients.status_index().get(file_name) or {}).get('document_type')
             
-            extracted_data['tables'].append({
-                'page': page.page_number,
-                'data': table_data
-            })
-    
-    # Extraer información específica por tipo de documento
-    if document_type == 'invoice':
-        extracted_data.update(extract_invoice_specific_data(document))
-    elif document_type == 'contract':
-        extracted_data.update(extract_contract_specific_data(document))
-    elif document_type == 'identification':
-        extracted_data.update(extract_id_specific_data(document))
-    
-    return extracted_data
+            complete_extraction(file_name, processed, document_type)
+            return 'completed'
+        except Exception as e:
+            attempts = document.get('attempts', 1)
+            if attempts < EXTRACT_BATCH_MAX_ATTEMPTS:
+                logger.warning(f"Extracción por lotes fallida para {file_name} ({attempts}/"
+                               f"{EXTRACT_BATCH_MAX_ATTEMPTS}), se reencola: {str(e)}")
+                queue.requeue([{**document, 'attempts': attempts + 1}])
+                return 'requeued'
+            logger.error(f"Extracción por lotes fallida para {file_name}: {str(e)}")
+            clients.status_index().update(file_name, extraction_error=str(e))
+            return 'failed'
 
-def extract_invoice_specific_data(document: documentai.Document) -> Dict[str, Any]:
-    """Extrae información específica de facturas"""
-    invoice_data = {}
-    
-    # Buscar campos comunes en facturas
-    common_fields = ['invoice_number', 'date', 'total_amount', 'vendor_name', 'customer_name']
-    
-    for entity in document.entities:
-        entity_type = entity.type_.lower()
-        if any(field in entity_type for field in common_fields):
-            invoice_data[entity_type] = {
-                'value': entity.mention_text,
-                'confidence': entity.confidence
-            }
-    
-    return {'invoice_specific': invoice_data}
-
-def extract_contract_specific_data(document: documentai.Document) -> Dict[str, Any]:
-    """Extrae información específica de contratos"""
-    contract_data = {}
-    
-    # Buscar campos comunes en contratos
-    common_fields = ['contract_number', 'start_date', 'end_date', 'parties', 'amount']
-    
-    for entity in document.entities:
-        entity_type = entity.type_.lower()
-        if any(field in entity_type for field in common_fields):
-            contract_data[entity_type] = {
-                'value': entity.mention_text,
-                'confidence': entity.confidence
-            }
-    
-    return {'contract_specific': contract_data}
+def complete_extraction(file_name: str, document, document_type: Optional[str]):
+    """
+    Guarda la información extraída de un documento procesado por Document AI,
+    la registra en el índice y publica `extraction_completed`
+    
+    Args:
+        file_name: Nombre del documento
+        document: Documento procesado (respuesta síncrona o salida de un lote)
+        document_type: Tipo asignado por el OCR; sin él se clasifica el texto de Document AI
+    """
+    # El tipo clasificado aquí no se registra: el del OCR es el de referencia
+    type_fields = {'document_type': document_type} if document_type else {}
+    if not document_type:
+        with span('extract.classify', file_name=file_name) as attributes:
+            document_type = classifier.classify(document.text)
+            attributes['document_type'] = document_type
+    
+    # Extraer información estructurada
+    with span('extract.structured_data', file_name=file_name, pages=len(document.pages)):
+        extracted_info = extract_structured_data(document, document_type)
+    
+    # Guardar información extraída
+    result_bucket_name = os.environ.get('RESULT_BUCKET_NAME', 'extracted-info')
+    result_bucket = clients.storage().bucket(result_bucket_name)
+    
+    # Crear archivo de resultado
+    result_file_name = result_path(file_name)
+    result_blob = result_bucket.blob(result_file_name)
+    
+    # Guardar información extraída comprimida y separada por secciones
+    result_data, sections = encode_result(extracted_info)
+    with span('extract.upload', file_name=file_name) as attributes:
+        result_blob.upload_from_string(result_data, content_type=RESULT_CONTENT_TYPE)
+        attributes['bytes'] = len(result_data)
+    
+    logger.info(f"Información extraída exitosamente de {file_name}")
+    
+    # Registrar extracción completada en el índice de estado
+    with span('extract.index_update', file_name=file_name):
+        record = clients.status_index().update(
+            file_name,
+            extraction_completed=True,
+            extracted_info_path=result_file_name,
+            extracted_info_generation=result_blob.generation,
+            extracted_info_sections=sections,
+            **type_fields
+        )
+    
+    # Si el backup ya se empaquetó, la extracción se añade al mismo paquete;
+    # si aún no, la añade el backup al terminar
+    if record.get('backup_bundle'):
+        append_to_backup_bundle(record['backup_bundle'], file_name, result_blob.name, result_data)
+    
+    # Publicar mensaje de extracción completada
+    extraction_message = {
+        'file_name': file_name,
+        'extracted_info_path': result_file_name,
+        'document_type': document_type,
+        'status': EXTRACTION_COMPLETED,
+        'extracted_fields': list(extracted_info.keys()),
+        **stage_progress(record)
+    }
+    
+    clients.publisher().publish_event(EXTRACTION_COMPLETED, extraction_message)
 
-def extract_id_specific_data(document: documentai.Document) -> Dict[str, Any]:
-    """Extrae información específica de documentos de identificación"""
-    id_data = {}
-    
-    # Buscar campos comunes en IDs
-    common_fields = ['id_number', 'name', 'date_of_birth', 'expiry_date', 'nationality']
-    
-    for entity in document.entities:
-        entity_type = entity.type_.lower()
-        if any(field in entity_type for field in common_fields):
-            id_data[entity_type] = {
-                'value': entity.mention_text,
-                'confidence': entity.confidence
-            }
-    
-    return {'id_specific': id_data}
+def append_to_backup_bundle(bundle: str, file_name: str, member_name: str, data: bytes):
+    """
+    Añade la información extraída al paquete del backup del documento
+    
+    Un fallo no detiene la extracción: el resultado ya está guardado en el
+    bucket de resultados y el paquete conserva el original y el OCR.
+    """
+    backup_bucket_name = os.environ.get('BACKUP_BUCKET_NAME', 'document-backup')
+    try:
+        with span('extract.bundle_append', file_name=file_name):
+            appended = append_bundle_member(
+                clients.storage().bucket(backup_bucket_name),
+                bundle,
+                os.path.basename(member_name),
+                data
+            )
+        if not appended:
+            logger.warning(f"Paquete de backup {bundle} no encontrado para {file_name}")
+    except Exception as e:
+        logger.warning(f"No se pudo añadir la extracción al paquete {bundle}: {str(e)}")
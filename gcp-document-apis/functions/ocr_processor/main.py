@@ -7,21 +7,49 @@ import base64
 import json
 import logging
 import os
-from typing import Dict, Any
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Tuple, Union
 
-from google.cloud import vision
-from google.cloud import storage
-from google.cloud import pubsub_v1
+from shared import clients
+from shared.classification import create_classifier_from_env
+from shared.naming import is_staging_object
+from shared.pipeline_graph import STAGE_OCR, stage_progress
+from shared.routing import OCR_COMPLETED
+from shared.tracing import TRACE_ATTRIBUTE, adopt_trace, span, traced_function
 
 # Configuración de logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Inicializar clientes
-vision_client = vision.ImageAnnotatorClient()
-storage_client = storage.Client()
-publisher = pubsub_v1.PublisherClient()
+# Los clientes de GCP se crean en el primer uso (shared/clients.py): los
+# eventos que no llegan al OCR no importan Vision ni Pub/Sub
+classifier = create_classifier_from_env()
 
+# Formatos multipágina soportados por la anotación de ficheros de Vision
+MULTIPAGE_MIME_TYPES = {
+    '.pdf': 'application/pdf',
+    '.tif': 'image/tiff',
+    '.tiff': 'image/tiff'
+}
+
+# Vision admite como máximo 5 páginas por petición síncrona de fichero
+SYNC_PAGES_PER_REQUEST = 5
+
+# Configuración del OCR multipágina
+OCR_MAX_CONCURRENT_BATCHES = int(os.environ.get('OCR_MAX_CONCURRENT_BATCHES', 4))
+OCR_SYNC_MAX_PAGES = int(os.environ.get('OCR_SYNC_MAX_PAGES', 30))
+OCR_SYNC_MAX_BYTES = int(float(os.environ.get('OCR_SYNC_MAX_MB', 20)) * 1024 * 1024)
+OCR_ASYNC_BATCH_SIZE = int(os.environ.get('OCR_ASYNC_BATCH_SIZE', 20))
+OCR_ASYNC_TIMEOUT = int(os.environ.get('OCR_ASYNC_TIMEOUT', 480))
+
+# Hasta este tamaño el documento viaja en la petición; por encima, Vision lo
+# lee de Cloud Storage (gs://) y los bytes no pasan por la función
+OCR_INLINE_MAX_BYTES = int(float(os.environ.get('OCR_INLINE_MAX_MB', 1)) * 1024 * 1024)
+
+# Contenido de un documento para Vision: sus bytes o su URI gs://
+DocumentSource = Union[bytes, str]
+
+@traced_function('ocr')
 def process_document(event: Dict[str, Any], context) -> str:
     """
     Función principal que procesa documentos para OCR
@@ -38,53 +66,113 @@ def process_document(event: Dict[str, Any], context) -> str:
         bucket_name = event['bucket']
         file_name = event['name']
         
-        logger.info(f"Procesando documento: {file_name} en bucket: {bucket_name}")
+        # Las subidas en staging se procesan cuando la API las publica
+        if is_staging_object(file_name):
+            return f"Objeto en staging ignorado: {file_name}"
         
-        # Descargar archivo del bucket
-        bucket = storage_client.bucket(bucket_name)
-        blob = bucket.blob(file_name)
+        # Los duplicados ya procesados comparten resultados con su original
+        with span('ocr.index_lookup', file_name=file_name):
+            record = clients.status_index().get(file_name)
+        # Los eventos de Cloud Storage no llevan atributos: la traza viene del índice
+        adopt_trace((record or {}).get(TRACE_ATTRIBUTE))
+        if record and record.get('duplicate_of'):
+            logger.info(f"{file_name} es duplicado de {record['duplicate_of']}, se omite el OCR")
+            return f"Documento duplicado, OCR omitido para {file_name}"
         
-        # Leer contenido del archivo
-        content = blob.download_as_bytes()
+        # Un documento restaurado para reprocesarse desde una etapa posterior conserva su OCR
+        if record and record.get('reprocess_stage') not in (None, STAGE_OCR) and record.get('ocr_completed'):
+            logger.info(f"{file_name} restaurado para reprocesar desde {record['reprocess_stage']}, se omite el OCR")
+            return f"Documento restaurado, OCR omitido para {file_name}"
         
-        # Crear imagen para Vision API
-        image = vision.Image(content=content)
+        # Un evento repetido (reentrega de Pub/Sub) no rehace el OCR ya terminado;
+        # reprocesar desde el OCR desmarca `ocr_completed` antes de disparar el evento
+        if record and record.get('ocr_completed'):
+            logger.info(f"{file_name} ya tiene el OCR completado, se omite")
+            return f"Documento ya procesado, OCR omitido para {file_name}"
         
-        # Realizar OCR
-        response = vision_client.text_detection(image=image)
+        logger.info(f"Procesando documento: {file_name} en bucket: {bucket_name}")
         
-        if response.error.message:
-            raise Exception(f"Error en Vision API: {response.error.message}")
+        result_bucket_name = os.environ.get('RESULT_BUCKET_NAME', 'ocr-results')
+        mime_type = get_multipage_mime_type(file_name, event.get('contentType'))
+        size = int(event.get('size') or 0)
+        gcs_uri = f"gs://{bucket_name}/{file_name}"
         
-        # Extraer texto
-        texts = response.text_annotations
-        if texts:
-            extracted_text = texts[0].description
+        if mime_type and size > OCR_SYNC_MAX_BYTES:
+            # Documentos grandes: anotación asíncrona leyendo directamente de GCS
+            with span('ocr.vision', file_name=file_name, mode='async'):
+                extracted_text = ocr_document_async(
+                    gcs_uri,
+                    mime_type,
+                    result_bucket_name,
+                    file_name
+                )
+        else:
+            if size > OCR_INLINE_MAX_BYTES:
+                # Vision lee el documento de Cloud Storage
+                source = gcs_uri
+            else:
+                # Los documentos pequeños se descargan y viajan en la petición
+                with span('ocr.download', file_name=file_name) as attributes:
+                    bucket = clients.storage().bucket(bucket_name)
+                    blob = bucket.blob(file_name)
+                    source = blob.download_as_bytes()
+                    attributes['bytes'] = len(source)
+            
+            with span('ocr.vision', file_name=file_name, mode='sync' if mime_type else 'image',
+                      source='bytes' if isinstance(source, bytes) else 'gcs'):
+                if mime_type:
+                    extracted_text = ocr_document_sync(
+                        source,
+                        mime_type,
+                        gcs_uri,
+                        result_bucket_name,
+                        file_name
+                    )
+                else:
+                    extracted_text = ocr_image(source)
+        
+        if extracted_text:
             logger.info(f"Texto extraído exitosamente de {file_name}")
             
             # Guardar resultado en bucket de resultados
-            result_bucket_name = os.environ.get('RESULT_BUCKET_NAME', 'ocr-results')
-            result_bucket = storage_client.bucket(result_bucket_name)
+            result_bucket = clients.storage().bucket(result_bucket_name)
             
             # Crear nombre del archivo de resultado
             result_file_name = f"ocr_results/{file_name.replace('.', '_')}_ocr.txt"
             result_blob = result_bucket.blob(result_file_name)
             
             # Guardar texto extraído
-            result_blob.upload_from_string(extracted_text, content_type='text/plain')
+            with span('ocr.upload', file_name=file_name, chars=len(extracted_text)):
+                result_blob.upload_from_string(extracted_text, content_type='text/plain')
             
-            # Publicar mensaje en Pub/Sub para procesamiento posterior
-            topic_name = os.environ.get('PUBSUB_TOPIC_NAME', 'document-processing')
-            topic_path = publisher.topic_path(os.environ.get('GOOGLE_CLOUD_PROJECT'), topic_name)
+            # Clasificar el documento para el backup y la extracción
+            with span('ocr.classify', file_name=file_name) as attributes:
+                document_type = classifier.classify(extracted_text)
+                attributes['document_type'] = document_type
             
+            # Registrar OCR completado en el índice de estado
+            with span('ocr.index_update', file_name=file_name):
+                updated = clients.status_index().update(
+                    file_name,
+                    ocr_completed=True,
+                    ocr_result_path=result_file_name,
+                    ocr_result_generation=result_blob.generation,
+                    document_type=document_type
+                )
+            
+            # Publicar mensaje en Pub/Sub para procesamiento posterior
             message_data = {
                 'file_name': file_name,
                 'ocr_result_path': result_file_name,
+                'sha256': (record or {}).get('sha256'),
+                'size': size or None,
+                'document_type': document_type,
                 'extracted_text': extracted_text[:1000],  # Primeros 1000 caracteres
-                'status': 'ocr_completed'
+                'status': OCR_COMPLETED,
+                **stage_progress(updated)
             }
             
-            publisher.publish(topic_path, json.dumps(message_data).encode('utf-8'))
+            clients.publisher().publish_event(OCR_COMPLETED, message_data)
             
             return f"OCR completado exitosamente para {file_name}"
         else:
@@ -95,26 +183,167 @@ def process_document(event: Dict[str, Any], context) -> str:
         logger.error(f"Error procesando documento {file_name}: {str(e)}")
         raise e
 
-def classify_document_type(text: str) -> str:
+def get_multipage_mime_type(file_name: str, content_type: str = None) -> str:
     """
-    Clasifica el tipo de documento basado en el contenido extraído
+    Devuelve el tipo MIME si el documento es multipágina (PDF/TIFF)
     
     Args:
-        text: Texto extraído del documento
+        file_name: Nombre del archivo
+        content_type: Tipo de contenido declarado en Cloud Storage
     
     Returns:
-        str: Tipo de documento identificado
+        str: Tipo MIME para Vision o None si es una imagen simple
+    """
+    if content_type in MULTIPAGE_MIME_TYPES.values():
+        return content_type
+    extension = os.path.splitext(file_name)[1].lower()
+    return MULTIPAGE_MIME_TYPES.get(extension)
+
+def ocr_image(source: DocumentSource) -> str:
     """
-    text_lower = text.lower()
-    
-    # Clasificación simple basada en palabras clave
-    if any(word in text_lower for word in ['factura', 'invoice', 'bill', 'recibo']):
-        return 'invoice'
-    elif any(word in text_lower for word in ['contrato', 'contract', 'acuerdo']):
-        return 'contract'
-    elif any(word in text_lower for word in ['identificación', 'id', 'passport', 'dni']):
-        return 'identification'
-    elif any(word in text_lower for word in ['reporte', 'report', 'informe']):
-        return 'report'
+    Realiza OCR de una imagen de una sola página
+    
+    Args:
+        source: Bytes de la imagen o su URI gs://
+    
+    Returns:
+        str: Texto extraído (vacío si no hay texto)
+    """
+    from google.cloud import vision
+    
+    if isinstance(source, bytes):
+        image = vision.Image(content=source)
     else:
-        return 'general'
+        image = vision.Image(source=vision.ImageSource(image_uri=source))
+    response = clients.vision().text_detection(image=image)
+    
+    if response.error.message:
+        raise Exception(f"Error en Vision API: {response.error.message}")
+    
+    texts = response.text_annotations
+    return texts[0].description if texts else ''
+
+def annotate_pages(source: DocumentSource, mime_type: str,
+                   pages: List[int] = None) -> Tuple[List[Tuple[int, str]], int]:
+    """
+    Anota de forma síncrona un lote de hasta 5 páginas de un PDF/TIFF
+    
+    Args:
+        source: Bytes del documento o su URI gs://
+        mime_type: Tipo MIME del documento
+        pages: Números de página (desde 1) a procesar; vacío para las 5 primeras
+    
+    Returns:
+        Tuple: Lista de (página, texto) y número total de páginas del documento
+    """
+    from google.cloud import vision
+    
+    if isinstance(source, bytes):
+        input_config = vision.InputConfig(content=source, mime_type=mime_type)
+    else:
+        input_config = vision.InputConfig(gcs_source=vision.GcsSource(uri=source), mime_type=mime_type)
+    
+    request = vision.AnnotateFileRequest(
+        input_config=input_config,
+        features=[vision.Feature(type_=vision.Feature.Type.DOCUMENT_TEXT_DETECTION)],
+        pages=pages or []
+    )
+    file_response = clients.vision().batch_annotate_files(requests=[request]).responses[0]
+    
+    if file_response.error.message:
+        raise Exception(f"Error en Vision API: {file_response.error.message}")
+    
+    page_texts = []
+    for position, response in enumerate(file_response.responses):
+        page_number = response.context.page_number or (pages[position] if pages else position + 1)
+        if response.error.message:
+            raise Exception(f"Error en Vision API (página {page_number}): {response.error.message}")
+        page_texts.append((page_number, response.full_text_annotation.text))
+    
+    return page_texts, file_response.total_pages
+
+def ocr_document_sync(source: DocumentSource, mime_type: str, gcs_uri: str,
+                      result_bucket_name: str, file_name: str) -> str:
+    """
+    Realiza OCR de un PDF/TIFF en lotes síncronos de 5 páginas en paralelo
+    
+    El primer lote revela el número total de páginas; el resto se envía de
+    forma concurrente con un máximo de OCR_MAX_CONCURRENT_BATCHES peticiones.
+    Si el documento supera OCR_SYNC_MAX_PAGES se usa la anotación asíncrona.
+    Todos los lotes usan la misma fuente: los bytes descargados o la URI gs://.
+    
+    Returns:
+        str: Texto del documento ordenado por página
+    """
+    page_texts, total_pages = annotate_pages(source, mime_type)
+    
+    if total_pages > OCR_SYNC_MAX_PAGES:
+        logger.info(f"{file_name} tiene {total_pages} páginas, se usa OCR asíncrono")
+        return ocr_document_async(gcs_uri, mime_type, result_bucket_name, file_name)
+    
+    batches = [
+        list(range(start, min(start + SYNC_PAGES_PER_REQUEST, total_pages + 1)))
+        for start in range(SYNC_PAGES_PER_REQUEST + 1, total_pages + 1, SYNC_PAGES_PER_REQUEST)
+    ]
+    
+    if batches:
+        with ThreadPoolExecutor(max_workers=min(OCR_MAX_CONCURRENT_BATCHES, len(batches))) as executor:
+            for batch_texts, _ in executor.map(lambda pages: annotate_pages(source, mime_type, pages), batches):
+                page_texts.extend(batch_texts)
+    
+    logger.info(f"OCR síncrono de {file_name}: {total_pages} páginas en {len(batches) + 1} lotes")
+    return join_page_texts(page_texts)
+
+def ocr_document_async(gcs_uri: str, mime_type: str, result_bucket_name: str, file_name: str) -> str:
+    """
+    Realiza OCR de un PDF/TIFF grande con anotación asíncrona de ficheros
+    
+    Vision lee el documento directamente de Cloud Storage y escribe los
+    resultados en lotes de OCR_ASYNC_BATCH_SIZE páginas; los lotes se leen en
+    paralelo, se ordenan por página y se eliminan tras ensamblar el texto.
+    
+    Returns:
+        str: Texto del documento ordenado por página
+    """
+    from google.cloud import vision
+    
+    output_prefix = f"ocr_async/{file_name.replace('.', '_')}/"
+    request = vision.AsyncAnnotateFileRequest(
+        input_config=vision.InputConfig(
+            gcs_source=vision.GcsSource(uri=gcs_uri),
+            mime_type=mime_type
+        ),
+        features=[vision.Feature(type_=vision.Feature.Type.DOCUMENT_TEXT_DETECTION)],
+        output_config=vision.OutputConfig(
+            gcs_destination=vision.GcsDestination(uri=f"gs://{result_bucket_name}/{output_prefix}"),
+            batch_size=OCR_ASYNC_BATCH_SIZE
+        )
+    )
+    
+    operation = clients.vision().async_batch_annotate_files(requests=[request])
+    operation.result(timeout=OCR_ASYNC_TIMEOUT)
+    
+    result_bucket = clients.storage().bucket(result_bucket_name)
+    output_blobs = list(result_bucket.list_blobs(prefix=output_prefix))
+    
+    def read_output(blob) -> List[Tuple[int, str]]:
+        output = json.loads(blob.download_as_bytes())
+        page_texts = []
+        for response in output.get('responses', []):
+            page_number = response.get('context', {}).get('pageNumber', 0)
+            page_texts.append((page_number, response.get('fullTextAnnotation', {}).get('text', '')))
+        blob.delete()
+        return page_texts
+    
+    page_texts = []
+    if output_blobs:
+        with ThreadPoolExecutor(max_workers=min(OCR_MAX_CONCURRENT_BATCHES, len(output_blobs))) as executor:
+            for batch_texts in executor.map(read_output, output_blobs):
+                page_texts.extend(batch_texts)
+    
+    logger.info(f"OCR asíncrono de {file_name}: {len(page_texts)} páginas en {len(output_blobs)} lotes")
+    return join_page_texts(page_texts)
+
+def join_page_texts(page_texts: List[Tuple[int, str]]) -> str:
+    """Ensambla el texto de las páginas en orden"""
+    return '\n'.join(text for _, text in sorted(page_texts, key=lambda item: item[0]) if text)
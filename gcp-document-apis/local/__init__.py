@@ -0,0 +1,3 @@
+"""
+Utilidades para ejecutar el pipeline en local sin acceso a GCP
+"""
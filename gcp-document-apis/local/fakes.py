@@ -0,0 +1,700 @@
+"""
+Dobles en memoria de Cloud Storage, Pub/Sub, Vision y Document AI
+Imitan la parte de la API de los clientes de google-cloud que usa el proyecto,
+con latencia configurable para reproducir llamadas de red bloqueantes
+"""
+
+import base64
+import hashlib
+import os
+import random
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from google.api_core.exceptions import BadRequest, NotFound, PreconditionFailed, ServiceUnavailable
+
+
+def _maybe_fail(failure_rate: float, service: str):
+    """Lanza un 503 con la probabilidad indicada"""
+    if failure_rate and random.random() < failure_rate:
+        raise ServiceUnavailable(f"Fallo simulado de {service}")
+
+
+class FakeStorageClient:
+    """
+    Sustituto de `storage.Client` que guarda los objetos en memoria
+
+    Args:
+        latency: Segundos que bloquea cada llamada de red simulada
+        failure_rate: Proporción de llamadas que fallan con 503
+        rewrite_chunk_size: Bytes copiados por cada llamada a `rewrite`
+    """
+
+    def __init__(self, latency: float = 0.0, failure_rate: float = 0.0,
+                 rewrite_chunk_size: int = 8 * 1024 * 1024):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.rewrite_chunk_size = rewrite_chunk_size
+        self._buckets: Dict[str, 'FakeBucket'] = {}
+        self._lock = threading.Lock()
+        self._finalize_listeners: Dict[str, List[Callable]] = {}
+        self._local = threading.local()
+        self.calls = 0
+
+    def _simulate_network(self):
+        # Dentro de `batch()` las llamadas viajan en la petición del lote
+        if getattr(self._local, 'batched', False):
+            return
+        with self._lock:
+            self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        _maybe_fail(self.failure_rate, 'Cloud Storage')
+
+    @contextmanager
+    def batch(self, raise_exception: bool = True):
+        """Agrupa las llamadas del bloque en una sola petición de red simulada"""
+        self._simulate_network()
+        self._local.batched = True
+        try:
+            yield self
+        finally:
+            self._local.batched = False
+
+    def on_finalize(self, bucket_name: str, callback: Callable[[Dict[str, Any]], None]):
+        """Registra una función que recibe el evento `object.finalize` de cada escritura"""
+        with self._lock:
+            self._finalize_listeners.setdefault(bucket_name, []).append(callback)
+
+    def _notify_finalize(self, bucket_name: str, blob_name: str, entry: Dict[str, Any]):
+        with self._lock:
+            listeners = list(self._finalize_listeners.get(bucket_name, []))
+        event = {
+            'bucket': bucket_name,
+            'name': blob_name,
+            'contentType': entry['content_type'],
+            'size': str(len(entry['data'])),
+            'generation': str(entry['generation'])
+        }
+        for callback in listeners:
+            callback(event)
+
+    def bucket(self, bucket_name: str) -> 'FakeBucket':
+        with self._lock:
+            if bucket_name not in self._buckets:
+                self._buckets[bucket_name] = FakeBucket(self, bucket_name)
+            return self._buckets[bucket_name]
+
+
+class FakeBucket:
+    """Bucket en memoria con listado paginado y copia entre buckets"""
+
+    def __init__(self, client: FakeStorageClient, name: str):
+        self.client = client
+        self.name = name
+        self._objects: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.RLock()
+        self._generation = 0
+
+    def reload(self):
+        self.client._simulate_network()
+
+    def blob(self, blob_name: str) -> 'FakeBlob':
+        return FakeBlob(self, blob_name)
+
+    def get_blob(self, blob_name: str) -> Optional['FakeBlob']:
+        self.client._simulate_network()
+        with self._lock:
+            if blob_name not in self._objects:
+                return None
+        blob = FakeBlob(self, blob_name)
+        blob._load()
+        return blob
+
+    def list_blobs(self, prefix: Optional[str] = None, max_results: Optional[int] = None,
+                   page_token: Optional[str] = None, start_offset: Optional[str] = None,
+                   end_offset: Optional[str] = None, fields: Optional[str] = None,
+                   **kwargs) -> 'FakeBlobIterator':
+        with self._lock:
+            names = sorted(self._objects)
+
+        names = [
+            name for name in names
+            if (not prefix or name.startswith(prefix))
+            and (not start_offset or name >= start_offset)
+            and (not end_offset or name < end_offset)
+        ]
+        return FakeBlobIterator(self, names, max_results, page_token)
+
+    def copy_blob(self, blob: 'FakeBlob', destination_bucket: 'FakeBucket',
+                  new_name: Optional[str] = None, **kwargs) -> 'FakeBlob':
+        self.client._simulate_network()
+        source = blob.bucket._read(blob.name)
+        copy = destination_bucket.blob(new_name or blob.name)
+        destination_bucket._write(copy.name, source['data'], source['content_type'], None,
+                                  source['component_count'])
+        copy._load()
+        return copy
+
+    def _read(self, blob_name: str) -> Dict[str, Any]:
+        with self._lock:
+            if blob_name not in self._objects:
+                raise NotFound(f"No such object: {self.name}/{blob_name}")
+            return self._objects[blob_name]
+
+    def _write(self, blob_name: str, data: bytes, content_type: Optional[str],
+               if_generation_match: Optional[int], component_count: Optional[int] = None) -> Dict[str, Any]:
+        with self._lock:
+            current = self._objects.get(blob_name)
+            if if_generation_match is not None:
+                current_generation = current['generation'] if current else 0
+                if current_generation != if_generation_match:
+                    raise PreconditionFailed(f"Generation mismatch for {self.name}/{blob_name}")
+
+            self._generation += 1
+            entry = {
+                'data': data,
+                'content_type': content_type,
+                'generation': self._generation,
+                'time_created': datetime.now(timezone.utc),
+                'md5_hash': base64.b64encode(hashlib.md5(data).digest()).decode('ascii'),
+                'component_count': component_count
+            }
+            self._objects[blob_name] = entry
+
+        self.client._notify_finalize(self.name, blob_name, entry)
+        return entry
+
+    def _delete(self, blob_name: str, if_generation_match: Optional[int] = None):
+        with self._lock:
+            if blob_name not in self._objects:
+                raise NotFound(f"No such object: {self.name}/{blob_name}")
+            if if_generation_match is not None and self._objects[blob_name]['generation'] != if_generation_match:
+                raise PreconditionFailed(f"Generation mismatch for {self.name}/{blob_name}")
+            del self._objects[blob_name]
+
+
+class FakeBlobIterator:
+    """Iterador de listado con páginas y `next_page_token` como el cliente real"""
+
+    def __init__(self, bucket: FakeBucket, names: List[str], max_results: Optional[int],
+                 page_token: Optional[str]):
+        self.bucket = bucket
+        self._names = names
+        self._start = int(page_token) if page_token else 0
+        self._page_size = max_results or 1000
+        self.next_page_token: Optional[str] = None
+
+    @property
+    def pages(self):
+        start = self._start
+        while start < len(self._names):
+            self.bucket.client._simulate_network()
+            end = start + self._page_size
+            self.next_page_token = str(end) if end < len(self._names) else None
+            yield [self._blob(name) for name in self._names[start:end]]
+            start = end
+
+    def __iter__(self):
+        for page in self.pages:
+            yield from page
+
+    def _blob(self, name: str) -> 'FakeBlob':
+        blob = FakeBlob(self.bucket, name)
+        try:
+            blob._load()
+        except NotFound:
+            pass
+        return blob
+
+
+class FakeBlob:
+    """Objeto en memoria con la interfaz básica de `storage.Blob`"""
+
+    def __init__(self, bucket: FakeBucket, name: str):
+        self.bucket = bucket
+        self.name = name
+        self.content_type: Optional[str] = None
+        self.generation: Optional[int] = None
+        self.size: Optional[int] = None
+        self.time_created: Optional[datetime] = None
+        self.md5_hash: Optional[str] = None
+        self.component_count: Optional[int] = None
+
+    def _load(self, entry: Optional[Dict[str, Any]] = None):
+        entry = entry or self.bucket._read(self.name)
+        self.content_type = entry['content_type']
+        self.generation = entry['generation']
+        self.size = len(entry['data'])
+        self.time_created = entry['time_created']
+        self.md5_hash = entry['md5_hash']
+        self.component_count = entry['component_count']
+
+    def reload(self, **kwargs):
+        self.bucket.client._simulate_network()
+        self._load()
+
+    def exists(self, **kwargs) -> bool:
+        self.bucket.client._simulate_network()
+        try:
+            self.bucket._read(self.name)
+            return True
+        except NotFound:
+            return False
+
+    def upload_from_string(self, data, content_type: Optional[str] = None,
+                           if_generation_match: Optional[int] = None, **kwargs):
+        self.bucket.client._simulate_network()
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        self._load(self.bucket._write(self.name, bytes(data), content_type, if_generation_match))
+
+    def upload_from_file(self, file_obj, content_type: Optional[str] = None,
+                         if_generation_match: Optional[int] = None, rewind: bool = False,
+                         **kwargs):
+        if rewind:
+            file_obj.seek(0)
+
+        # Lectura por bloques como la subida reanudable del cliente real
+        chunk_size = getattr(self, 'chunk_size', None) or 8 * 1024 * 1024
+        chunks = []
+        while True:
+            chunk = file_obj.read(chunk_size)
+            if not chunk:
+                break
+            chunks.append(chunk)
+        self.upload_from_string(b''.join(chunks), content_type=content_type,
+                                if_generation_match=if_generation_match)
+
+    def download_as_bytes(self, if_generation_match: Optional[int] = None, start: Optional[int] = None,
+                          end: Optional[int] = None, **kwargs) -> bytes:
+        self.bucket.client._simulate_network()
+        entry = self.bucket._read(self.name)
+        if if_generation_match is not None and entry['generation'] != if_generation_match:
+            raise PreconditionFailed(f"Generation mismatch for {self.bucket.name}/{self.name}")
+        self._load(entry)
+        # Como en el cliente real, `end` es inclusivo
+        return entry['data'][start or 0:None if end is None else end + 1]
+
+    def download_as_text(self, encoding: str = 'utf-8', **kwargs) -> str:
+        return self.download_as_bytes(**kwargs).decode(encoding)
+
+    def delete(self, if_generation_match: Optional[int] = None, **kwargs):
+        self.bucket.client._simulate_network()
+        self.bucket._delete(self.name, if_generation_match)
+
+    def rewrite(self, source: 'FakeBlob', token: Optional[str] = None,
+                if_generation_match: Optional[int] = None, **kwargs):
+        """Copia por tramos de `rewrite_chunk_size` bytes, devolviendo un token mientras quede por copiar"""
+        self.bucket.client._simulate_network()
+        entry = source.bucket._read(source.name)
+        total = len(entry['data'])
+        written = min(total, int(token or 0) + self.bucket.client.rewrite_chunk_size)
+        if written < total:
+            return str(written), written, total
+        self._load(self.bucket._write(self.name, entry['data'], entry['content_type'], if_generation_match,
+                                      entry['component_count']))
+        return None, total, total
+
+    def compose(self, sources: List['FakeBlob'], if_generation_match: Optional[int] = None, **kwargs):
+        """Concatena los orígenes; como en Cloud Storage, el resultado no puede pasar de 1024 componentes"""
+        self.bucket.client._simulate_network()
+        entries = [source.bucket._read(source.name) for source in sources]
+        component_count = sum(entry['component_count'] or 1 for entry in entries)
+        if component_count > 1024:
+            raise BadRequest(f"The number of source components provided ({component_count}) exceeds the maximum (1024)")
+        data = b''.join(entry['data'] for entry in entries)
+        content_type = self.content_type or sources[0].content_type
+        self._load(self.bucket._write(self.name, data, content_type, if_generation_match, component_count))
+
+
+class FakeFuture:
+    """Futuro ya resuelto con la interfaz de `google.cloud.pubsub_v1`"""
+
+    def __init__(self, message_id: Optional[str], error: Optional[Exception] = None):
+        self._message_id = message_id
+        self._error = error
+
+    def result(self, timeout: Optional[float] = None) -> str:
+        if self._error is not None:
+            raise self._error
+        return self._message_id
+
+    def exception(self, timeout: Optional[float] = None) -> Optional[Exception]:
+        return self._error
+
+    def done(self) -> bool:
+        return True
+
+    def add_done_callback(self, callback: Callable):
+        callback(self)
+
+
+class FakePublisher:
+    """
+    Sustituto de `pubsub_v1.PublisherClient` que entrega los mensajes
+    a los suscriptores registrados en el mismo proceso
+
+    Args:
+        latency: Segundos que bloquea cada publicación
+        failure_rate: Proporción de publicaciones que fallan (sin entregarse)
+    """
+
+    def __init__(self, latency: float = 0.0, failure_rate: float = 0.0, **kwargs):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.messages: List[Dict[str, Any]] = []
+        self._subscribers: Dict[str, List[Callable]] = {}
+        self._lock = threading.Lock()
+
+    def topic_path(self, project: Optional[str], topic: str) -> str:
+        return f"projects/{project}/topics/{topic}"
+
+    def subscribe(self, topic_path: str, callback: Callable[[bytes, Dict[str, str]], None]):
+        """Registra una función que recibe (data, attributes) por cada mensaje"""
+        with self._lock:
+            self._subscribers.setdefault(topic_path, []).append(callback)
+
+    def publish(self, topic: str, data: bytes, **attributes) -> FakeFuture:
+        if self.latency:
+            time.sleep(self.latency)
+        try:
+            _maybe_fail(self.failure_rate, 'Pub/Sub')
+        except ServiceUnavailable as e:
+            return FakeFuture(None, e)
+
+        with self._lock:
+            message_id = str(len(self.messages) + 1)
+            self.messages.append({'topic': topic, 'data': data, 'attributes': attributes})
+            subscribers = list(self._subscribers.get(topic, []))
+
+        for callback in subscribers:
+            callback(data, attributes)
+        return FakeFuture(message_id)
+
+
+class FakeSubscriberClient:
+    """
+    Sustituto de `pubsub_v1.SubscriberClient` para suscripciones pull sobre
+    los temas de un FakePublisher
+
+    Cada mensaje entregado queda reservado hasta su plazo de confirmación;
+    si vence, se rechaza (`modify_ack_deadline` a 0) o no se confirma, vuelve
+    a entregarse.
+
+    Args:
+        publisher: Publicador cuyos temas alimentan las suscripciones
+        latency: Segundos que bloquea cada llamada
+        failure_rate: Proporción de llamadas que fallan con 503
+        max_delivery_attempts: Entregas de un mensaje antes de descartarlo
+            (como una política de dead letter); 0 para no limitarlas
+    """
+
+    def __init__(self, publisher: FakePublisher, latency: float = 0.0, failure_rate: float = 0.0,
+                 max_delivery_attempts: int = 0, **kwargs):
+        self.publisher = publisher
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.max_delivery_attempts = max_delivery_attempts
+        # Por suscripción: mensajes por entregar, reservados (ack_id -> mensaje, plazo) y descartados
+        self._queues: Dict[str, List[Dict[str, Any]]] = {}
+        self._leased: Dict[str, Dict[str, Tuple[Dict[str, Any], float]]] = {}
+        self.dead_letters: Dict[str, List[Dict[str, Any]]] = {}
+        self._ack_deadlines: Dict[str, int] = {}
+        self._available = threading.Condition()
+        self.calls: Dict[str, int] = {'pull': 0, 'acknowledge': 0, 'modify_ack_deadline': 0}
+
+    def _simulate_network(self, method: str):
+        with self._available:
+            self.calls[method] += 1
+        if self.latency:
+            time.sleep(self.latency)
+        _maybe_fail(self.failure_rate, 'Pub/Sub')
+
+    def subscription_path(self, project: Optional[str], subscription: str) -> str:
+        return f"projects/{project}/subscriptions/{subscription}"
+
+    def create_subscription(self, request: Dict[str, Any]):
+        name = request['name']
+        with self._available:
+            self._queues[name] = []
+            self._leased[name] = {}
+            self.dead_letters[name] = []
+            self._ack_deadlines[name] = request.get('ack_deadline_seconds', 10)
+
+        def enqueue(data: bytes, attributes: Dict[str, str]):
+            message = {
+                'data': data,
+                'attributes': dict(attributes),
+                'message_id': uuid.uuid4().hex,
+                'delivery_attempt': 0
+            }
+            with self._available:
+                self._queues[name].append(message)
+                self._available.notify_all()
+
+        self.publisher.subscribe(request['topic'], enqueue)
+        return SimpleNamespace(name=name, topic=request['topic'])
+
+    def _expire_leases(self, subscription: str):
+        now = time.monotonic()
+        leased = self._leased[subscription]
+        for ack_id in [ack_id for ack_id, (_, deadline) in leased.items() if deadline <= now]:
+            self._redeliver(subscription, leased.pop(ack_id)[0])
+
+    def _redeliver(self, subscription: str, message: Dict[str, Any]):
+        if self.max_delivery_attempts and message['delivery_attempt'] >= self.max_delivery_attempts:
+            self.dead_letters[subscription].append(message)
+        else:
+            self._queues[subscription].append(message)
+            self._available.notify_all()
+
+    def pull(self, request: Dict[str, Any], timeout: Optional[float] = None):
+        """Espera hasta `timeout` a que haya mensajes y reserva hasta `max_messages`"""
+        self._simulate_network('pull')
+        subscription = request['subscription']
+        deadline = time.monotonic() + (timeout if timeout is not None else 10)
+        with self._available:
+            while True:
+                self._expire_leases(subscription)
+                if self._queues[subscription]:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return SimpleNamespace(received_messages=[])
+                self._available.wait(min(remaining, 0.05))
+
+            queue = self._queues[subscription]
+            batch, self._queues[subscription] = queue[:request['max_messages']], queue[request['max_messages']:]
+            lease_until = time.monotonic() + self._ack_deadlines[subscription]
+            received = []
+            for message in batch:
+                message['delivery_attempt'] += 1
+                ack_id = uuid.uuid4().hex
+                self._leased[subscription][ack_id] = (message, lease_until)
+                received.append(SimpleNamespace(
+                    ack_id=ack_id,
+                    delivery_attempt=message['delivery_attempt'],
+                    message=SimpleNamespace(data=message['data'], attributes=message['attributes'],
+                                            message_id=message['message_id'])
+                ))
+        return SimpleNamespace(received_messages=received)
+
+    def acknowledge(self, request: Dict[str, Any]):
+        self._simulate_network('acknowledge')
+        with self._available:
+            leased = self._leased[request['subscription']]
+            for ack_id in request['ack_ids']:
+                leased.pop(ack_id, None)
+
+    def modify_ack_deadline(self, request: Dict[str, Any]):
+        self._simulate_network('modify_ack_deadline')
+        subscription = request['subscription']
+        with self._available:
+            leased = self._leased[subscription]
+            for ack_id in request['ack_ids']:
+                if ack_id not in leased:
+                    continue
+                message, _ = leased[ack_id]
+                if request['ack_deadline_seconds'] == 0:
+                    del leased[ack_id]
+                    self._redeliver(subscription, message)
+                else:
+                    leased[ack_id] = (message, time.monotonic() + request['ack_deadline_seconds'])
+
+    def backlog(self, subscription: str) -> int:
+        """Mensajes por entregar o reservados sin confirmar"""
+        with self._available:
+            self._expire_leases(subscription)
+            return len(self._queues[subscription]) + len(self._leased[subscription])
+
+
+def _fake_page_texts(content: bytes) -> List[str]:
+    """Texto de cada página de un documento sintético (páginas separadas por \\f)"""
+    return content.decode('utf-8', errors='replace').split('\f')
+
+
+def _read_gcs_uri(storage: Optional[FakeStorageClient], uri: str) -> bytes:
+    """Contenido de un objeto gs:// que lee el propio servicio (sin llamada de red de la función)"""
+    if storage is None:
+        raise ValueError(f"Se necesita un FakeStorageClient para leer {uri}")
+    bucket_name, _, blob_name = uri[len('gs://'):].partition('/')
+    return storage.bucket(bucket_name)._read(blob_name)['data']
+
+
+class FakeVisionClient:
+    """
+    Sustituto de `vision.ImageAnnotatorClient` que "lee" el contenido del fichero
+
+    Los documentos sintéticos son texto UTF-8 con las páginas separadas por
+    saltos de página (\\f), así el OCR es determinista y comprobable.
+
+    Args:
+        latency: Segundos que bloquea cada petición
+        failure_rate: Proporción de peticiones que fallan con 503
+        storage: Cloud Storage del que se leen las peticiones con URI gs://
+    """
+
+    def __init__(self, latency: float = 0.0, failure_rate: float = 0.0,
+                 storage: Optional[FakeStorageClient] = None, **kwargs):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.storage = storage
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def _simulate_network(self):
+        with self._lock:
+            self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        _maybe_fail(self.failure_rate, 'Vision')
+
+    def text_detection(self, image, **kwargs):
+        from google.cloud import vision
+
+        self._simulate_network()
+        uri = image.source.image_uri
+        content = _read_gcs_uri(self.storage, uri) if uri else image.content
+        text = ' '.join(_fake_page_texts(content))
+        return vision.AnnotateImageResponse(
+            text_annotations=[vision.EntityAnnotation(description=text)] if text.strip() else []
+        )
+
+    def batch_annotate_files(self, requests, **kwargs):
+        from google.cloud import vision
+
+        self._simulate_network()
+        file_responses = []
+        for request in requests:
+            uri = request.input_config.gcs_source.uri
+            content = _read_gcs_uri(self.storage, uri) if uri else request.input_config.content
+            pages = _fake_page_texts(content)
+            numbers = list(request.pages) or list(range(1, min(5, len(pages)) + 1))
+            file_responses.append(vision.AnnotateFileResponse(
+                responses=[
+                    vision.AnnotateImageResponse(
+                        full_text_annotation=vision.TextAnnotation(text=pages[number - 1]),
+                        context=vision.ImageAnnotationContext(page_number=number)
+                    )
+                    for number in numbers if number <= len(pages)
+                ],
+                total_pages=len(pages)
+            ))
+        return vision.BatchAnnotateFilesResponse(responses=file_responses)
+
+
+class FakeDocumentAIClient:
+    """
+    Sustituto de `documentai.DocumentProcessorServiceClient` que devuelve
+    el contenido del documento como texto, sin entidades
+
+    Los lotes (`batch_process_documents`) escriben la salida de cada documento
+    en Cloud Storage con un fragmento por página, como los documentos grandes,
+    y su operación termina `batch_latency` segundos después del envío.
+
+    Args:
+        latency: Segundos que bloquea cada petición
+        failure_rate: Proporción de peticiones que fallan con 503
+        storage: Cloud Storage del que se leen las peticiones con URI gs://
+        batch_latency: Segundos hasta que termina la operación de un lote
+    """
+
+    def __init__(self, latency: float = 0.0, failure_rate: float = 0.0,
+                 storage: Optional[FakeStorageClient] = None, batch_latency: float = 0.0, **kwargs):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.storage = storage
+        self.batch_latency = batch_latency
+        self.calls = 0
+        self.batches = 0
+        self._operations: Dict[str, Tuple[float, Any]] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def processor_path(project: Optional[str], location: str, processor: str) -> str:
+        return f"projects/{project}/locations/{location}/processors/{processor}"
+
+    def _simulate_network(self):
+        with self._lock:
+            self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        _maybe_fail(self.failure_rate, 'Document AI')
+
+    def process_document(self, request, **kwargs):
+        from google.cloud import documentai_v1 as documentai
+
+        self._simulate_network()
+        uri = request.gcs_document.gcs_uri
+        content = _read_gcs_uri(self.storage, uri) if uri else request.raw_document.content
+        pages = _fake_page_texts(content)
+        return documentai.ProcessResponse(document=documentai.Document(
+            text='\n'.join(pages),
+            pages=[documentai.Document.Page(page_number=number) for number in range(1, len(pages) + 1)]
+        ))
+
+    def batch_process_documents(self, request, **kwargs):
+        from google.cloud import documentai_v1 as documentai
+        from google.longrunning import operations_pb2
+        from google.rpc import status_pb2
+
+        self._simulate_network()
+        operation_id = uuid.uuid4().hex[:16]
+        output_bucket, _, output_prefix = request.document_output_config.gcs_output_config.gcs_uri[
+            len('gs://'):].partition('/')
+        statuses = []
+        for index, gcs_document in enumerate(request.input_documents.gcs_documents.documents):
+            uri = gcs_document.gcs_uri
+            try:
+                pages = _fake_page_texts(_read_gcs_uri(self.storage, uri))
+            except NotFound:
+                statuses.append(documentai.BatchProcessMetadata.IndividualProcessStatus(
+                    input_gcs_source=uri, status=status_pb2.Status(code=5, message=f"No such object: {uri}")))
+                continue
+            destination = f"{output_prefix.rstrip('/')}/{operation_id}/{index}"
+            stem = os.path.splitext(os.path.basename(uri))[0]
+            offset = 0
+            for shard_index, page_text in enumerate(pages):
+                text = page_text if shard_index == len(pages) - 1 else page_text + '\n'
+                shard = documentai.Document(
+                    text=text,
+                    pages=[documentai.Document.Page(page_number=shard_index + 1)],
+                    shard_info=documentai.Document.ShardInfo(
+                        shard_index=shard_index, shard_count=len(pages), text_offset=offset)
+                )
+                offset += len(text)
+                self.storage.bucket(output_bucket)._write(
+                    f"{destination}/{stem}-{shard_index}.json",
+                    documentai.Document.to_json(shard).encode('utf-8'), 'application/json', None)
+            statuses.append(documentai.BatchProcessMetadata.IndividualProcessStatus(
+                input_gcs_source=uri, output_gcs_destination=f"gs://{output_bucket}/{destination}"))
+
+        metadata = documentai.BatchProcessMetadata(
+            state=documentai.BatchProcessMetadata.State.SUCCEEDED,
+            individual_process_statuses=statuses
+        )
+        location = request.name.rsplit('/processors/', 1)[0]
+        operation = operations_pb2.Operation(name=f"{location}/operations/{operation_id}")
+        operation.metadata.Pack(documentai.BatchProcessMetadata.pb(metadata))
+        with self._lock:
+            self.batches += 1
+            self._operations[operation.name] = (time.monotonic() + self.batch_latency, operation)
+        # Como `google.api_core.operation.Operation`, la operación cruda está en `.operation`
+        return SimpleNamespace(operation=operation)
+
+    def get_operation(self, request, **kwargs):
+        from google.longrunning import operations_pb2
+
+        self._simulate_network()
+        with self._lock:
+            done_at, stored = self._operations[request.name]
+        operation = operations_pb2.Operation()
+        operation.CopyFrom(stored)
+        operation.done = time.monotonic() >= done_at
+        return operation
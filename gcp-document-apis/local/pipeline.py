@@ -0,0 +1,348 @@
+"""
+Pipeline completo en un proceso contra dobles en memoria
+Carga la API y las tres Cloud Functions con clientes falsos, entrega los eventos
+de Cloud Storage y Pub/Sub a las funciones suscritas (como lo haría Terraform)
+y mide invocaciones, invocaciones sin trabajo, fallos y latencias por etapa
+"""
+
+import base64
+import importlib.util
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+from local.fakes import FakeDocumentAIClient, FakePublisher, FakeStorageClient, FakeSubscriberClient, FakeVisionClient
+from shared import clients, routing
+from shared.batch_extraction import EXTRACTION_MODE_SYNC
+from shared.pipeline_graph import (MODE_PARALLEL, STAGE_BACKUP, STAGE_EVENTS, STAGE_EXTRACTION, STAGE_OCR, STAGES,
+                                   trigger_event)
+
+logger = logging.getLogger(__name__)
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROCESSING_BUCKET = 'document-processing'
+RESULT_BUCKET = 'document-results'
+BACKUP_BUCKET = 'document-backup'
+PROJECT_ID = 'local-project'
+
+# Temas del despliegue con un tema por evento (terraform/main.tf)
+ROUTED_TOPICS = {
+    'PUBSUB_TOPIC_NAME': 'document-processing',
+    'PUBSUB_TOPIC_OCR_COMPLETED': 'document-ocr-completed',
+    'PUBSUB_TOPIC_BACKUP_COMPLETED': 'document-backup-completed',
+    'PUBSUB_TOPIC_EXTRACTION_COMPLETED': 'document-extraction-completed'
+}
+
+# Cómo se ejecutan las etapas (stage_runtime en terraform/variables.tf): una
+# Cloud Function por evento o el worker de worker/main.py con suscripciones pull
+RUNTIME_FUNCTIONS = 'functions'
+RUNTIME_WORKER = 'worker'
+
+# Prefijo de los resultados que indican que la función no hizo trabajo
+NO_OP_PREFIXES = ('Objeto en staging ignorado', 'Documento duplicado', 'Documento restaurado',
+                  'Documento ya procesado', 'Evento ')
+
+
+def _load_module(module_name: str, path: str):
+    """Importa un main.py con un nombre propio (todas las funciones se llaman main)"""
+    spec = importlib.util.spec_from_file_location(module_name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class LocalPipeline:
+    """
+    API y funciones conectadas por Cloud Storage y Pub/Sub en memoria
+
+    Args:
+        routed: Un tema por evento; si es False, todas las etapas comparten un
+            único tema como en el despliegue original
+        latency: Latencia simulada de cada llamada a GCP
+        workers: Invocaciones de funciones simultáneas
+        failure_rate: Proporción de llamadas a GCP que fallan con 503
+        retries: Reintentos de una invocación fallida (como `retry_policy` en Pub/Sub)
+        mode: Grafo de etapas (PIPELINE_MODE): `parallel` o `sequential`
+        extraction_mode: Extracción (EXTRACTION_MODE): `sync` o `batch`; en
+            `batch`, los lotes se envían y reparten con `poll_extraction_batches`
+        batch_latency: Segundos hasta que termina cada lote de Document AI
+        runtime: `functions` (una invocación por evento) o `worker` (las tres
+            etapas en un PullWorker con `workers` hilos; los reintentos son
+            reentregas de Pub/Sub)
+    """
+
+    def __init__(self, routed: bool = True, latency: float = 0.0, workers: int = 16,
+                 failure_rate: float = 0.0, retries: int = 0, mode: str = MODE_PARALLEL,
+                 extraction_mode: str = EXTRACTION_MODE_SYNC, batch_latency: float = 0.0,
+                 runtime: str = RUNTIME_FUNCTIONS):
+        self.routed = routed
+        self.runtime = runtime
+        self.mode = mode
+        self.extraction_mode = extraction_mode
+        self.retries = retries
+        self.storage = FakeStorageClient(latency=latency, failure_rate=failure_rate)
+        self.publisher = FakePublisher(latency=latency, failure_rate=failure_rate)
+        self.subscriber = FakeSubscriberClient(self.publisher, latency=latency, failure_rate=failure_rate,
+                                               max_delivery_attempts=retries + 1)
+        self.vision = FakeVisionClient(latency=latency, failure_rate=failure_rate, storage=self.storage)
+        self.documentai = FakeDocumentAIClient(latency=latency, failure_rate=failure_rate, storage=self.storage,
+                                               batch_latency=batch_latency)
+
+        self.invocations: Counter = Counter()
+        self.no_ops: Counter = Counter()
+        self.failures: Counter = Counter()
+        # Duración y espera en cola de las invocaciones con trabajo, por función
+        self.durations: Dict[str, List[float]] = defaultdict(list)
+        self.queue_waits: Dict[str, List[float]] = defaultdict(list)
+        # Instantes de subida y de documento completado
+        self.uploaded_at: Dict[str, float] = {}
+        self.completed_at: Dict[str, float] = {}
+        self._counters_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        self._pending = 0
+        self._idle = threading.Condition()
+        self._workers = workers
+        self.worker = None
+
+        self._configure_environment()
+        self._install_fakes()
+        self.api = self._load_api()
+        self.ocr = _load_module('ocr_processor_main', os.path.join(ROOT_DIR, 'functions', 'ocr_processor', 'main.py'))
+        self.backup = _load_module('backup_manager_main', os.path.join(ROOT_DIR, 'functions', 'backup_manager', 'main.py'))
+        self.extractor = _load_module('info_extractor_main', os.path.join(ROOT_DIR, 'functions', 'info_extractor', 'main.py'))
+        self._wire_triggers()
+
+    def _configure_environment(self):
+        os.environ.update({
+            'GOOGLE_CLOUD_PROJECT': PROJECT_ID,
+            'STORAGE_BUCKET_NAME': PROCESSING_BUCKET,
+            'RESULT_BUCKET_NAME': RESULT_BUCKET,
+            'BACKUP_BUCKET_NAME': BACKUP_BUCKET,
+            'STATUS_INDEX_BACKEND': 'gcs',
+            'STATUS_INDEX_BUCKET': RESULT_BUCKET,
+            'DOCUMENT_AI_PROCESSOR_ID': 'local-processor',
+            'PIPELINE_MODE': self.mode,
+            'EXTRACTION_MODE': self.extraction_mode,
+            # Los fallos simulados se reintentan rápido para no alargar las pruebas
+            'PUBSUB_PUBLISH_RETRIES': os.environ.get('PUBSUB_PUBLISH_RETRIES', '5')
+        })
+        for variable, topic in ROUTED_TOPICS.items():
+            if self.routed or variable == 'PUBSUB_TOPIC_NAME':
+                os.environ[variable] = topic
+            else:
+                os.environ.pop(variable, None)
+
+    def _install_fakes(self):
+        from google.cloud import documentai_v1, pubsub_v1, storage, vision
+
+        storage.Client = lambda *args, **kwargs: self.storage
+        pubsub_v1.PublisherClient = lambda *args, **kwargs: self.publisher
+        pubsub_v1.SubscriberClient = lambda *args, **kwargs: self.subscriber
+        vision.ImageAnnotatorClient = lambda *args, **kwargs: self.vision
+        documentai_v1.DocumentProcessorServiceClient = lambda *args, **kwargs: self.documentai
+        # Los clientes se crean en el primer uso; los de una ejecución anterior se descartan
+        clients.reset_clients()
+
+    def _load_api(self):
+        api_dir = os.path.join(ROOT_DIR, 'api')
+        if api_dir not in sys.path:
+            sys.path.insert(0, api_dir)
+        return _load_module('api_main', os.path.join(api_dir, 'main.py'))
+
+    def _topic_path(self, event_name: str) -> str:
+        return self.publisher.topic_path(PROJECT_ID, routing.topic_for_event(event_name))
+
+    def _wire_triggers(self):
+        """Replica los event_trigger de terraform/main.tf"""
+        clients.publisher().backoff = 0.001
+
+        if self.runtime == RUNTIME_WORKER:
+            self._start_worker()
+        else:
+            self.storage.on_finalize(
+                PROCESSING_BUCKET,
+                lambda event: self._dispatch('ocr_processor', self.ocr.process_document, event)
+            )
+            self._subscribe(self._topic_path(trigger_event(STAGE_BACKUP)), 'backup_manager',
+                            self.backup.backup_document)
+            self._subscribe(self._topic_path(trigger_event(STAGE_EXTRACTION)), 'info_extractor',
+                            self.extractor.extract_document_info)
+        # El documento lo completa la última etapa en terminar, sea cual sea
+        for topic_path in {self._topic_path(event_name) for event_name in STAGE_EVENTS.values()}:
+            self.publisher.subscribe(topic_path, self._record_completion)
+
+        # Suscripciones push de la API que alimentan /events y los webhooks
+        api_topics = {self._topic_path(event_name) for event_name in self.api.NOTIFIED_EVENTS}
+        for topic_path in api_topics:
+            self.publisher.subscribe(topic_path, self._push_to_api)
+
+    def _subscribe(self, topic_path: str, name: str, function: Callable):
+        def deliver(data: bytes, attributes: Dict[str, str]):
+            event = {'data': base64.b64encode(data).decode('ascii'), 'attributes': dict(attributes)}
+            self._dispatch(name, function, event)
+
+        self.publisher.subscribe(topic_path, deliver)
+
+    def _start_worker(self):
+        """Crea las suscripciones pull de las etapas y arranca el worker sobre ellas"""
+        from worker.main import STAGE_FUNCTIONS, STAGE_SUBSCRIPTIONS, build_worker
+        from worker.pull import WORKER_ACK_DEADLINE_SECONDS
+
+        trigger_events = {STAGE_OCR: routing.START_OCR, STAGE_BACKUP: trigger_event(STAGE_BACKUP),
+                          STAGE_EXTRACTION: trigger_event(STAGE_EXTRACTION)}
+        self._subscriptions = []
+        for stage in STAGES:
+            path = self.subscriber.subscription_path(PROJECT_ID, STAGE_SUBSCRIPTIONS[stage][1])
+            self.subscriber.create_subscription(request={
+                'name': path,
+                'topic': self._topic_path(trigger_events[stage]),
+                'ack_deadline_seconds': WORKER_ACK_DEADLINE_SECONDS
+            })
+            self._subscriptions.append(path)
+
+        def observe(stage: str, messages: List[Any], errors: List[Optional[str]], queue_wait: float,
+                    duration: float):
+            name = STAGE_FUNCTIONS[stage]
+            with self._counters_lock:
+                self.invocations[name] += 1
+                failed = sum(1 for error in errors if error)
+                if failed:
+                    self.failures[name] += failed
+                else:
+                    self.durations[name].append(duration)
+                    self.queue_waits[name].append(queue_wait)
+
+        self.worker = build_worker(
+            self.subscriber,
+            list(STAGES),
+            modules={STAGE_OCR: self.ocr, STAGE_BACKUP: self.backup, STAGE_EXTRACTION: self.extractor},
+            project_id=PROJECT_ID,
+            concurrency=self._workers,
+            ack_interval=0.01,
+            pull_timeout=0.05,
+            observer=observe
+        )
+        self.worker.start()
+
+    def _push_to_api(self, data: bytes, attributes: Dict[str, str]):
+        # Como en una suscripción push, un fallo del receptor no afecta al publicador
+        event = {'data': data, 'attributes': dict(attributes)}
+        try:
+            self.api.handle_pipeline_event(*routing.decode_pubsub_event(event))
+        except Exception as e:
+            logger.debug(f"Fallo notificando a la API: {str(e)}")
+
+    def _record_completion(self, data: bytes, attributes: Dict[str, str]):
+        message_data = json.loads(data.decode('utf-8'))
+        event_name = attributes.get(routing.EVENT_ATTRIBUTE) or message_data.get('status')
+        if event_name not in STAGE_EVENTS.values():
+            return
+        if message_data.get('document_status', 'completed' if event_name == routing.EXTRACTION_COMPLETED else None) != 'completed':
+            return
+        file_name = message_data.get('file_name')
+        with self._counters_lock:
+            self.completed_at.setdefault(file_name, time.perf_counter())
+
+    def _dispatch(self, name: str, function: Callable, event: Dict[str, Any], attempt: int = 0):
+        with self._idle:
+            self._pending += 1
+        self._executor.submit(self._invoke, name, function, event, attempt, time.perf_counter())
+
+    def _invoke(self, name: str, function: Callable, event: Dict[str, Any], attempt: int, queued_at: float):
+        started_at = time.perf_counter()
+        with self._counters_lock:
+            self.invocations[name] += 1
+        try:
+            result = function(event, None)
+            with self._counters_lock:
+                if isinstance(result, str) and result.startswith(NO_OP_PREFIXES):
+                    self.no_ops[name] += 1
+                else:
+                    self.durations[name].append(time.perf_counter() - started_at)
+                    self.queue_waits[name].append(started_at - queued_at)
+        except Exception as e:
+            with self._counters_lock:
+                self.failures[name] += 1
+            logger.debug(f"Fallo en {name} (intento {attempt + 1}): {str(e)}")
+            if attempt < self.retries:
+                self._dispatch(name, function, event, attempt + 1)
+        finally:
+            with self._idle:
+                self._pending -= 1
+                self._idle.notify_all()
+
+    def poll_extraction_batches(self):
+        """Invoca el sondeo de la extracción por lotes, como el programador de terraform/main.tf"""
+        self._dispatch('extraction_batches', self.extractor.process_extraction_batches, {'data': '', 'attributes': {}})
+
+    def drain(self, timeout: Optional[float] = None) -> bool:
+        """Espera a que no queden invocaciones en curso (ni mensajes pendientes con el worker)"""
+        if self.worker is None:
+            with self._idle:
+                return self._idle.wait_for(lambda: self._pending == 0, timeout=timeout)
+
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        while not (self._pending == 0 and self.worker.idle()
+                   and not any(self.subscriber.backlog(path) for path in self._subscriptions)):
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+    async def upload(self, documents: List[bytes], concurrency: int = 16, attempts: int = 3) -> List[str]:
+        """
+        Sube documentos sintéticos por la API y devuelve los nombres de los subidos
+
+        Las respuestas 5xx se reintentan como haría un cliente; los documentos
+        que agotan los intentos no aparecen en el resultado.
+
+        Args:
+            documents: Contenido de cada documento (texto con páginas separadas por \\f)
+            concurrency: Subidas simultáneas
+            attempts: Intentos por documento
+        """
+        import asyncio
+
+        import httpx
+
+        semaphore = asyncio.Semaphore(concurrency)
+        transport = httpx.ASGITransport(app=self.api.app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://local', timeout=None) as client:
+            async def upload_one(index: int, content: bytes) -> Optional[str]:
+                async with semaphore:
+                    for _ in range(attempts):
+                        started_at = time.perf_counter()
+                        files = {'file': (f"doc_{index}.pdf", content, 'application/pdf')}
+                        response = await client.post('/upload', files=files)
+                        if response.status_code < 500:
+                            response.raise_for_status()
+                            file_name = response.json()['file_name']
+                            self.uploaded_at[file_name] = started_at
+                            return file_name
+                    logger.debug(f"Subida fallida tras {attempts} intentos: doc_{index}.pdf")
+                    return None
+
+            names = await asyncio.gather(*(upload_one(index, content) for index, content in enumerate(documents)))
+        return [name for name in names if name]
+
+    def end_to_end_latencies(self) -> List[float]:
+        """Segundos desde el inicio de la subida hasta la extracción completada"""
+        with self._counters_lock:
+            return [
+                self.completed_at[name] - uploaded_at
+                for name, uploaded_at in self.uploaded_at.items()
+                if name in self.completed_at
+            ]
+
+    def shutdown(self):
+        if self.worker is not None:
+            self.worker.stop()
+        self._executor.shutdown(wait=True)
+        self.api.gcp_io.shutdown()
@@ -0,0 +1,69 @@
+"""
+Ejecuta la API y las tres Cloud Functions en local contra dobles en memoria
+La API escucha en HTTP como en Cloud Run y cada subida recorre el pipeline
+completo (OCR, backup y extracción) dentro del mismo proceso
+
+Uso:
+    python -m local.run --port 8000 --latency 0.02 --failure-rate 0.01 --retries 3
+    python -m local.run --extraction-mode batch --batch-poll-interval 5
+    python -m local.run --runtime worker --workers 64
+"""
+
+import argparse
+import logging
+import threading
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--latency', type=float, default=0.0, help='Latencia simulada por llamada GCP (s)')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='Proporción de llamadas GCP que fallan')
+    parser.add_argument('--retries', type=int, default=3, help='Reintentos de una invocación fallida')
+    parser.add_argument('--workers', type=int, default=16,
+                        help='Invocaciones de funciones simultáneas (hilos del worker con --runtime worker)')
+    parser.add_argument('--single-topic', action='store_true', help='Todas las etapas en un único tema')
+    parser.add_argument('--mode', choices=('parallel', 'sequential'), default='parallel',
+                        help='Grafo de etapas (PIPELINE_MODE)')
+    parser.add_argument('--extraction-mode', choices=('sync', 'batch'), default='sync',
+                        help='Extracción síncrona o por lotes (EXTRACTION_MODE)')
+    parser.add_argument('--batch-poll-interval', type=float, default=60,
+                        help='Segundos entre sondeos de la extracción por lotes (como Cloud Scheduler)')
+    parser.add_argument('--runtime', choices=('functions', 'worker'), default='functions',
+                        help='Etapas como Cloud Functions por evento o en el worker con pull (worker/main.py)')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    import uvicorn
+
+    from local.pipeline import LocalPipeline
+
+    pipeline = LocalPipeline(
+        routed=not args.single_topic,
+        latency=args.latency,
+        workers=args.workers,
+        failure_rate=args.failure_rate,
+        retries=args.retries,
+        mode=args.mode,
+        extraction_mode=args.extraction_mode,
+        runtime=args.runtime
+    )
+
+    stop = threading.Event()
+    if args.extraction_mode == 'batch':
+        def poll_batches():
+            while not stop.wait(args.batch_poll_interval):
+                pipeline.poll_extraction_batches()
+
+        threading.Thread(target=poll_batches, name='extraction-batch-poll', daemon=True).start()
+    try:
+        uvicorn.run(pipeline.api.app, host=args.host, port=args.port)
+    finally:
+        stop.set()
+        pipeline.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -87,6 +87,15 @@ setup_project() {
     success "Proyecto configurado correctamente"
 }
 
+# Copiar módulos compartidos en la API y en cada Cloud Function
+stage_shared_modules() {
+    log "Copiando módulos compartidos..."
+    
+    ./scripts/stage_shared.sh
+    
+    success "Módulos compartidos copiados"
+}
+
 # Desplegar infraestructura con Terraform
 deploy_infrastructure() {
     log "Desplegando infraestructura con Terraform..."
@@ -146,6 +155,39 @@ deploy_api() {
     success "API desplegada correctamente"
 }
 
+# Construir y desplegar el worker de etapas (solo con stage_runtime = "worker")
+deploy_worker() {
+    local project_id=$(cd terraform && terraform output -raw project_id)
+    local stage_runtime=$(cd terraform && terraform output -raw stage_runtime)
+    
+    if [ "$stage_runtime" != "worker" ]; then
+        log "Etapas desplegadas como Cloud Functions, se omite el worker"
+        return
+    fi
+    
+    log "Construyendo y desplegando worker de etapas..."
+    
+    # El worker se construye desde la raíz: incluye shared/ y functions/
+    docker build -f worker/Dockerfile -t "gcr.io/$project_id/document-worker:latest" .
+    
+    log "Subiendo imagen a Container Registry..."
+    docker push "gcr.io/$project_id/document-worker:latest"
+    
+    # CPU asignada fuera de las peticiones: el worker consume Pub/Sub en segundo plano
+    log "Desplegando en Cloud Run..."
+    gcloud run deploy document-pipeline-worker \
+        --image "gcr.io/$project_id/document-worker:latest" \
+        --platform managed \
+        --region us-central1 \
+        --no-allow-unauthenticated \
+        --no-cpu-throttling \
+        --min-instances 1 \
+        --memory 2Gi \
+        --cpu 2
+    
+    success "Worker desplegado correctamente"
+}
+
 # Configurar Cloud Functions
 setup_cloud_functions() {
     log "Configurando Cloud Functions..."
@@ -212,6 +254,9 @@ main() {
     check_gcp_auth
     setup_project "$project_id"
     
+    # Preparar código compartido antes de empaquetar
+    stage_shared_modules
+    
     # Desplegar infraestructura
     deploy_infrastructure
     
@@ -221,6 +266,9 @@ main() {
     # Desplegar API
     deploy_api
     
+    # Desplegar worker de etapas
+    deploy_worker
+    
     # Configurar Cloud Functions
     setup_cloud_functions
     
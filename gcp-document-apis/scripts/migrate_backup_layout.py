@@ -0,0 +1,285 @@
+"""
+Migra los backups del formato `{tipo}/{YYYYmmdd_HHMMSS}/...` con un metadata.json
+por backup al formato particionado `{tipo}/{yyyy}/{mm}/{dd}/{archivo}/` con
+manifiestos por partición (shared/backup_layout.py)
+
+Cada backup se copia en el servidor a su nueva ruta; las entradas se añaden a
+los manifiestos por bloques y, solo después, se actualiza el índice de estado y
+se eliminan los objetos antiguos, así que el proceso puede interrumpirse y
+repetirse sin perder backups.
+
+Uso:
+    python scripts/migrate_backup_layout.py --bucket document-backup --dry-run
+    python scripts/migrate_backup_layout.py --bucket document-backup --workers 16
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from shared.backup_layout import (append_manifest, backup_object_path, document_day, manifest_path,
+                                  partition_prefix)
+from shared.bulk_delete import DeletionReport, delete_blobs
+from shared.object_copy import copy_object
+
+logger = logging.getLogger('migrate_backup_layout')
+
+LEGACY_METADATA = 'metadata.json'
+
+
+def legacy_folder(blob_name: str) -> Optional[str]:
+    """Carpeta `{tipo}/{YYYYmmdd_HHMMSS}` de un backup antiguo, o None si el objeto no lo es"""
+    parts = blob_name.split('/')
+    if len(parts) < 3:
+        return None
+    try:
+        datetime.strptime(parts[1], '%Y%m%d_%H%M%S')
+    except ValueError:
+        return None
+    return f"{parts[0]}/{parts[1]}"
+
+
+def iter_legacy_backups(bucket) -> Iterator[Tuple[str, List[Any]]]:
+    """
+    Recorre el bucket una vez agrupando los objetos de cada backup antiguo
+
+    El listado está ordenado, así que los objetos de una carpeta son
+    consecutivos y solo hace falta retener una carpeta en memoria.
+    """
+    current, blobs = None, []
+    for blob in bucket.list_blobs():
+        folder = legacy_folder(blob.name)
+        if folder != current:
+            if current and blobs:
+                yield current, blobs
+            current, blobs = folder, []
+        if folder:
+            blobs.append(blob)
+    if current and blobs:
+        yield current, blobs
+
+
+def plan_backup(folder: str, blobs: List[Any]) -> Dict[str, Any]:
+    """
+    Decide las rutas nuevas de un backup antiguo
+
+    El documento original se identifica por el metadata.json o, si falta,
+    como el único objeto que no es el resultado de OCR.
+    """
+    document_type, timestamp = folder.split('/')
+    by_name = {blob.name[len(folder) + 1:]: blob for blob in blobs}
+
+    metadata = {}
+    if LEGACY_METADATA in by_name:
+        metadata = json.loads(by_name[LEGACY_METADATA].download_as_text())
+    candidates = [name for name in by_name if name != LEGACY_METADATA and not name.endswith('_ocr.txt')]
+    file_name = metadata.get('original_file') or (candidates[0] if candidates else None)
+    if not file_name:
+        raise ValueError(f"No se encontró el documento original en {folder}")
+
+    partition = partition_prefix(metadata.get('document_type', document_type), document_day(file_name))
+    moves = []
+    for name, blob in by_name.items():
+        if name == LEGACY_METADATA:
+            continue
+        kind = 'original' if name == file_name else 'ocr'
+        moves.append((kind, blob, backup_object_path(partition, file_name, name)))
+
+    return {
+        'folder': folder,
+        'file_name': file_name,
+        'document_type': metadata.get('document_type', document_type),
+        'backup_timestamp': datetime.strptime(timestamp, '%Y%m%d_%H%M%S').isoformat(),
+        'partition': partition,
+        'moves': moves,
+        'sources': blobs
+    }
+
+
+def copy_backup(bucket, plan: Dict[str, Any]) -> Dict[str, Any]:
+    """Copia los objetos de un backup a sus rutas nuevas y devuelve su entrada de manifiesto"""
+    objects = []
+    for kind, blob, new_path in plan['moves']:
+        copy = copy_object(blob, bucket, new_path)
+        objects.append({
+            'kind': kind,
+            'path': copy.name,
+            'size': copy.size,
+            'md5_hash': copy.md5_hash,
+            'generation': copy.generation
+        })
+    return {
+        'file_name': plan['file_name'],
+        'document_type': plan['document_type'],
+        'backup_timestamp': plan['backup_timestamp'],
+        'migrated_from': plan['folder'],
+        'objects': objects
+    }
+
+
+class Migration:
+    """
+    Estado de una migración: copias en curso y entradas pendientes de registrar
+
+    Args:
+        client: Cliente de Cloud Storage
+        bucket_name: Bucket de backup
+        status_index: Índice de estado a actualizar (None para no tocarlo)
+        dry_run: Solo informar de lo que se migraría
+        keep_source: Conservar los objetos antiguos tras migrarlos
+        flush_every: Backups copiados entre cada escritura de manifiestos
+    """
+
+    def __init__(self, client, bucket_name: str, status_index=None, dry_run: bool = False,
+                 keep_source: bool = False, flush_every: int = 500):
+        self.client = client
+        self.bucket = client.bucket(bucket_name)
+        self.status_index = status_index
+        self.dry_run = dry_run
+        self.keep_source = keep_source
+        self.flush_every = flush_every
+        self.pending: List[Tuple[Dict[str, Any], Dict[str, Any]]] = []
+        self.deletions = DeletionReport(dry_run=dry_run or keep_source)
+        self.migrated = 0
+        self.failed = 0
+        self.partitions = set()
+
+    def flush(self):
+        """Registra las entradas pendientes, actualiza el índice y elimina los originales"""
+        if not self.pending:
+            return
+
+        by_manifest: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+        for plan, entry in self.pending:
+            by_manifest[manifest_path(plan['partition'], plan['file_name'])].append(entry)
+        for path, entries in by_manifest.items():
+            append_manifest(self.bucket, path, entries)
+
+        sources = []
+        for plan, entry in self.pending:
+            self._update_index(plan, entry)
+            sources.extend(plan['sources'])
+
+        delete_blobs(
+            self.client,
+            sources,
+            dry_run=self.keep_source,
+            report=self.deletions
+        )
+        self.migrated += len(self.pending)
+        logger.info(f"{self.migrated} backups migrados ({len(by_manifest)} manifiestos actualizados)")
+        self.pending = []
+
+    def _update_index(self, plan: Dict[str, Any], entry: Dict[str, Any]):
+        if self.status_index is None:
+            return
+        record = self.status_index.get(plan['file_name'])
+        if record is None:
+            return
+        new_paths = [item['path'] for item in entry['objects']]
+        original = next((item['path'] for item in entry['objects'] if item['kind'] == 'original'), None)
+        self.status_index.update(
+            plan['file_name'],
+            discard={'backup_paths': [blob.name for blob in plan['sources']]},
+            backup_path=original or record.get('backup_path'),
+            backup_paths=new_paths,
+            backup_manifest=manifest_path(plan['partition'], plan['file_name'])
+        )
+
+    def run(self, workers: int = 8, limit: Optional[int] = None) -> Dict[str, Any]:
+        start = time.perf_counter()
+        planned = 0
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            in_flight = {}
+            for folder, blobs in iter_legacy_backups(self.bucket):
+                if limit is not None and planned >= limit:
+                    break
+                try:
+                    plan = plan_backup(folder, blobs)
+                except Exception as e:
+                    self.failed += 1
+                    logger.warning(f"Backup {folder} omitido: {str(e)}")
+                    continue
+                planned += 1
+                self.partitions.add(plan['partition'])
+
+                if self.dry_run:
+                    for _, blob, new_path in plan['moves']:
+                        logger.info(f"{blob.name} -> {new_path}")
+                    self.deletions.record_matched(blobs)
+                    self.migrated += 1
+                    continue
+
+                in_flight[executor.submit(copy_backup, self.bucket, plan)] = plan
+                if len(in_flight) >= workers * 2:
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    self._collect(in_flight, done)
+
+            self._collect(in_flight, list(in_flight))
+
+        self.flush()
+        return {
+            'dry_run': self.dry_run,
+            'migrated': self.migrated,
+            'failed': self.failed,
+            'partitions': len(self.partitions),
+            'source_objects': self.deletions.to_dict()['matched'],
+            'source_bytes': self.deletions.to_dict()['bytes'],
+            'elapsed': round(time.perf_counter() - start, 2)
+        }
+
+    def _collect(self, in_flight: Dict[Any, Dict[str, Any]], done):
+        for future in done:
+            plan = in_flight.pop(future)
+            try:
+                self.pending.append((plan, future.result()))
+            except Exception as e:
+                self.failed += 1
+                logger.warning(f"No se pudo copiar el backup {plan['folder']}: {str(e)}")
+        if len(self.pending) >= self.flush_every:
+            self.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--bucket', default=os.environ.get('BACKUP_BUCKET_NAME', 'document-backup'),
+                        help='Bucket de backup')
+    parser.add_argument('--dry-run', action='store_true', help='Solo mostrar las rutas nuevas')
+    parser.add_argument('--keep-source', action='store_true', help='No eliminar los objetos antiguos')
+    parser.add_argument('--skip-index', action='store_true', help='No actualizar el índice de estado')
+    parser.add_argument('--workers', type=int, default=8, help='Backups copiados en paralelo')
+    parser.add_argument('--flush-every', type=int, default=500, help='Backups entre escrituras de manifiestos')
+    parser.add_argument('--limit', type=int, help='Migrar como máximo este número de backups')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+
+    from google.cloud import storage
+
+    from shared.status_index import get_status_index
+
+    client = storage.Client()
+    migration = Migration(
+        client,
+        args.bucket,
+        status_index=None if args.skip_index or args.dry_run else get_status_index(client),
+        dry_run=args.dry_run,
+        keep_source=args.keep_source,
+        flush_every=args.flush_every
+    )
+    print(json.dumps(migration.run(workers=args.workers, limit=args.limit), indent=2))
+
+
+if __name__ == '__main__':
+    main()
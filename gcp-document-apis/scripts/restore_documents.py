@@ -0,0 +1,117 @@
+"""
+Restaura documentos desde el backup y los reprocesa desde una etapa del pipeline
+
+Selecciona los backups por tipo, rango de fechas de subida, hash o nombre (ver
+shared/restore.py), devuelve los originales al bucket de procesamiento con un
+pool de hilos acotado y los reencola a un ritmo limitado para respetar las
+cuotas de Vision y Document AI. Pensado para reprocesados grandes, que no
+deben depender de la vida de una instancia de la API.
+
+Uso:
+    python scripts/restore_documents.py --type invoice --from 2024-01-01 --to 2024-03-31 --dry-run
+    python scripts/restore_documents.py --type invoice --from 2024-01-01 --stage extraction --max-per-second 10
+    python scripts/restore_documents.py --file 20240105_101500_factura.pdf --file 20240105_101501_contrato.pdf
+    python scripts/restore_documents.py --type contract --from 2023-01-01 --extraction-mode batch --max-per-second 0
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import threading
+from datetime import datetime
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from shared.batch_extraction import EXTRACTION_MODES
+from shared.rate_limit import RateLimiter
+from shared.restore import REPROCESS_FROM_OCR, REPROCESS_STAGES, RESTORE_MAX_PER_SECOND, RESTORE_WORKERS, RestoreJob
+
+logger = logging.getLogger('restore_documents')
+
+
+def parse_day(value: str) -> datetime:
+    try:
+        return datetime.strptime(value, '%Y-%m-%d')
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Fecha inválida '{value}', formato esperado YYYY-MM-DD")
+
+
+def report_progress(job: RestoreJob, done: threading.Event, interval: float):
+    """Escribe el progreso del trabajo periódicamente hasta que termina"""
+    while not done.wait(interval):
+        progress = job.to_dict()
+        logger.info(
+            f"{progress['matched']} seleccionados, {progress['enqueued']} reencolados "
+            f"({progress['restored']} restaurados), {progress['failed']} fallidos"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--stage', choices=REPROCESS_STAGES, default=REPROCESS_FROM_OCR,
+                        help='Etapa desde la que se reprocesa')
+    parser.add_argument('--type', dest='document_type', help='Tipo de documento')
+    parser.add_argument('--from', dest='date_from', type=parse_day, help='Primer día de subida (YYYY-MM-DD)')
+    parser.add_argument('--to', dest='date_to', type=parse_day, help='Último día de subida (YYYY-MM-DD)')
+    parser.add_argument('--sha256', help='Hash de contenido')
+    parser.add_argument('--file', dest='file_names', action='append', help='Documento concreto (repetible)')
+    parser.add_argument('--limit', type=int, help='Restaurar como máximo este número de documentos')
+    parser.add_argument('--dry-run', action='store_true', help='Solo mostrar la selección')
+    parser.add_argument('--max-per-second', type=float, default=RESTORE_MAX_PER_SECOND,
+                        help='Documentos reencolados por segundo (0 sin límite)')
+    parser.add_argument('--workers', type=int, default=RESTORE_WORKERS, help='Restauraciones simultáneas')
+    parser.add_argument('--extraction-mode', choices=EXTRACTION_MODES,
+                        help='Extracción síncrona o por lotes de Document AI (por defecto, EXTRACTION_MODE)')
+    parser.add_argument('--progress-interval', type=float, default=10, help='Segundos entre informes de progreso')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+
+    from google.cloud import storage
+
+    from shared.publishing import create_publisher_from_env
+    from shared.status_index import get_status_index
+
+    client = storage.Client()
+    try:
+        job = RestoreJob(
+            client,
+            get_status_index(client),
+            create_publisher_from_env(),
+            backup_bucket=os.environ.get('BACKUP_BUCKET_NAME', 'document-backup'),
+            processing_bucket=os.environ.get('STORAGE_BUCKET_NAME', 'document-processing'),
+            result_bucket=os.environ.get('RESULT_BUCKET_NAME', 'document-results'),
+            stage=args.stage,
+            document_type=args.document_type,
+            date_from=args.date_from,
+            date_to=args.date_to,
+            sha256=args.sha256,
+            file_names=args.file_names,
+            dry_run=args.dry_run,
+            limit=args.limit,
+            max_workers=args.workers,
+            limiter=RateLimiter(args.max_per_second),
+            extraction_mode=args.extraction_mode
+        )
+    except ValueError as e:
+        parser.error(str(e))
+
+    done = threading.Event()
+    threading.Thread(target=report_progress, args=(job, done, args.progress_interval), daemon=True).start()
+    try:
+        summary = job.run()
+    except KeyboardInterrupt:
+        job.cancel()
+        summary = job.to_dict()
+    finally:
+        done.set()
+
+    print(json.dumps(summary, indent=2, ensure_ascii=False))
+    sys.exit(1 if summary['state'] == 'failed' else 0)
+
+
+if __name__ == '__main__':
+    main()
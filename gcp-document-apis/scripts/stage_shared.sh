@@ -0,0 +1,18 @@
+#!/bin/bash
+
+# Copia el paquete shared/ dentro de la API y de cada Cloud Function
+# Terraform empaqueta cada función desde su propio directorio y Docker
+# construye la API con ./api como contexto, por lo que el código común
+# debe estar presente en cada uno antes de desplegar
+
+set -e
+
+ROOT_DIR="$(cd "$(dirname "$0")/.." && pwd)"
+
+for target in "$ROOT_DIR/api" "$ROOT_DIR"/functions/*/; do
+    target="${target%/}"
+    rm -rf "$target/shared"
+    cp -r "$ROOT_DIR/shared" "$target/shared"
+    find "$target/shared" -name "__pycache__" -type d -prune -exec rm -rf {} +
+    echo "shared/ copiado en ${target#$ROOT_DIR/}"
+done
@@ -0,0 +1,4 @@
+"""
+Módulos compartidos por la API y las Cloud Functions
+Se copian en cada componente antes del despliegue (ver scripts/stage_shared.sh)
+"""
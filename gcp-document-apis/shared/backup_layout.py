@@ -0,0 +1,341 @@
+"""
+Organización de los backups por tipo y día con un manifiesto por partición
+Cada backup se guarda en `{tipo}/{yyyy}/{mm}/{dd}/{archivo}/` y se registra en
+el manifiesto JSON Lines de su partición (`{partición}/_manifest/{shard}.jsonl`),
+al que solo se añaden líneas. Consultas, retención y restauraciones leen el
+manifiesto en lugar de listar los objetos de la partición. Opcionalmente, los
+ficheros de cada backup se agrupan en un único paquete tar (`{archivo}.tar`)
+"""
+
+import hashlib
+import json
+import logging
+import os
+import random
+import tarfile
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from google.api_core.exceptions import NotFound, PreconditionFailed
+
+logger = logging.getLogger(__name__)
+
+# Directorio de los manifiestos dentro de cada partición
+MANIFEST_DIR = '_manifest'
+
+# Cloud Storage admite ~1 escritura por segundo en un mismo objeto: cada
+# partición reparte sus líneas entre varios manifiestos para admitir ráfagas
+MANIFEST_SHARDS = int(os.environ.get('BACKUP_MANIFEST_SHARDS', 8))
+
+# Cloud Storage rechaza (400) componer objetos de más de 1024 componentes: al
+# acercarse al límite, el añadido reescribe el objeto entero en un solo componente
+COMPOSE_MAX_COMPONENTS = 1024
+COMPACT_COMPONENTS = min(int(os.environ.get('BACKUP_COMPACT_COMPONENTS', 1000)), COMPOSE_MAX_COMPONENTS - 1)
+
+MANIFEST_CONTENT_TYPE = 'application/x-ndjson'
+BUNDLE_CONTENT_TYPE = 'application/x-tar'
+
+
+def partition_prefix(document_type: str, day: datetime) -> str:
+    """Prefijo de la partición de un tipo de documento y un día"""
+    return f"{document_type}/{day.strftime('%Y/%m/%d')}"
+
+
+def document_day(file_name: str) -> datetime:
+    """
+    Día de subida de un documento según el prefijo `YYYYmmdd_` de su nombre
+
+    Ubicar el backup por el día de subida (y no el del backup) hace que los
+    reintentos escriban siempre en la misma partición.
+    """
+    try:
+        return datetime.strptime(file_name[:8], '%Y%m%d')
+    except ValueError:
+        return datetime.now()
+
+
+def parse_partition(blob_name: str) -> Optional[Tuple[str, datetime]]:
+    """
+    Extrae el tipo de documento y el día de una ruta `{tipo}/{yyyy}/{mm}/{dd}/...`
+
+    Returns:
+        Tuple: Tipo y día de la partición, o None si la ruta no sigue el formato
+    """
+    parts = blob_name.split('/')
+    if len(parts) < 5:
+        return None
+    try:
+        return parts[0], datetime.strptime('/'.join(parts[1:4]), '%Y/%m/%d')
+    except ValueError:
+        return None
+
+
+def backup_object_path(partition: str, file_name: str, object_name: str) -> str:
+    """Ruta de un objeto del backup de un documento dentro de su partición"""
+    return f"{partition}/{file_name}/{object_name}"
+
+
+def manifest_path(partition: str, file_name: str, shards: int = MANIFEST_SHARDS) -> str:
+    """Manifiesto de la partición en el que se registra un documento"""
+    shard = int(hashlib.sha1(file_name.encode('utf-8')).hexdigest()[:8], 16) % max(1, shards)
+    return f"{partition}/{MANIFEST_DIR}/{shard:02d}.jsonl"
+
+
+def manifest_partition(path: str) -> str:
+    """Partición a la que pertenece un manifiesto"""
+    return path.split(f"/{MANIFEST_DIR}/", 1)[0]
+
+
+def iter_partitions(bucket, document_type: Optional[str] = None, day_from: Optional[datetime] = None,
+                    day_to: Optional[datetime] = None) -> Iterator[Tuple[str, datetime]]:
+    """
+    Recorre en orden las particiones existentes sin listar sus objetos
+
+    El listado de Cloud Storage está ordenado, así que cada partición se
+    descubre consultando un único objeto a partir de un cursor y se salta
+    después a la siguiente: el coste depende del número de particiones, no de
+    backups. Los directorios fuera del formato (p. ej. backups sin migrar) se
+    saltan enteros.
+
+    Args:
+        bucket: Bucket de backup
+        document_type: Limitar a un tipo de documento
+        day_from: Primer día incluido
+        day_to: Último día incluido
+
+    Yields:
+        Tuple: Tipo de documento y día de cada partición
+    """
+    cursor = f"{document_type}/" if document_type else ''
+    while True:
+        probe = next(iter(bucket.list_blobs(start_offset=cursor or None, max_results=1)), None)
+        if probe is None or (document_type and not probe.name.startswith(f"{document_type}/")):
+            return
+
+        parsed = parse_partition(probe.name)
+        if parsed is None:
+            parts = probe.name.split('/')
+            cursor = f"{parts[0]}/{parts[1]}0" if len(parts) > 2 else probe.name + '\x00'
+            continue
+
+        partition_type, day = parsed
+        if day_from and day < day_from:
+            cursor = partition_prefix(partition_type, day_from)
+            continue
+        if day_to and day > day_to:
+            # El resto de particiones de este tipo son posteriores: saltar al siguiente tipo
+            cursor = f"{partition_type}0"
+            continue
+
+        yield partition_type, day
+        cursor = partition_prefix(partition_type, day + timedelta(days=1))
+
+
+def append_object(bucket, path: str, data: bytes, content_type: str, create: bool = True,
+                  max_retries: int = 10) -> bool:
+    """
+    Añade bytes al final de un objeto de forma atómica
+
+    La primera escritura crea el objeto con `if_generation_match=0`; las
+    siguientes suben los bytes a un fragmento temporal y lo concatenan al
+    objeto con `compose`, condicionado a la generación leída, de modo que
+    dos escrituras concurrentes nunca se pisan (la perdedora reintenta).
+    Cuando el objeto llega a COMPACT_COMPONENTS componentes, el añadido lo
+    descarga y lo vuelve a subir entero, con la misma condición, para no
+    alcanzar el límite de componentes de `compose`.
+
+    Args:
+        bucket: Bucket del objeto
+        path: Ruta del objeto
+        data: Bytes a añadir
+        content_type: Tipo de contenido del objeto
+        create: Crear el objeto si no existe
+        max_retries: Reintentos ante escrituras concurrentes
+
+    Returns:
+        bool: False si el objeto no existía y `create` es False
+    """
+    for attempt in range(max_retries + 1):
+        current = bucket.get_blob(path)
+        try:
+            if current is None:
+                if not create:
+                    return False
+                bucket.blob(path).upload_from_string(data, content_type=content_type, if_generation_match=0)
+                return True
+
+            if (current.component_count or 1) >= COMPACT_COMPONENTS:
+                content = current.download_as_bytes(if_generation_match=current.generation)
+                bucket.blob(path).upload_from_string(content + data, content_type=current.content_type or content_type,
+                                                     if_generation_match=current.generation)
+                logger.info(f"{path} compactado tras {current.component_count} componentes")
+                return True
+
+            fragment = bucket.blob(f"{path}.{uuid.uuid4().hex}.part")
+            fragment.upload_from_string(data, content_type=content_type)
+            try:
+                current.compose([current, fragment], if_generation_match=current.generation)
+                return True
+            finally:
+                try:
+                    fragment.delete()
+                except NotFound:
+                    pass
+        except PreconditionFailed:
+            if attempt == max_retries:
+                raise
+            time.sleep(random.uniform(0, min(2.0, 0.05 * (2 ** attempt))))
+    return False
+
+
+def append_manifest(bucket, path: str, entries: Iterable[Dict[str, Any]], max_retries: int = 10):
+    """
+    Añade entradas a un manifiesto (una línea JSON cada una)
+
+    Args:
+        bucket: Bucket de backup
+        path: Ruta del manifiesto
+        entries: Entradas a añadir
+        max_retries: Reintentos ante escrituras concurrentes
+    """
+    data = ''.join(json.dumps(entry, ensure_ascii=False, sort_keys=True) + '\n' for entry in entries)
+    if data:
+        append_object(bucket, path, data.encode('utf-8'), MANIFEST_CONTENT_TYPE, max_retries=max_retries)
+
+
+def bundle_path(partition: str, file_name: str) -> str:
+    """Ruta del paquete con todos los ficheros del backup de un documento"""
+    return f"{partition}/{file_name}.tar"
+
+
+def tar_member(name: str, data: bytes) -> Tuple[bytes, int]:
+    """
+    Serializa un fichero como miembro tar (cabecera, datos y relleno a 512 bytes)
+
+    Returns:
+        Tuple: Bytes del miembro y tamaño de su cabecera
+    """
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    info.mtime = int(time.time())
+    info.mode = 0o644
+    header = info.tobuf(format=tarfile.PAX_FORMAT, encoding='utf-8', errors='strict')
+    return header + data + b'\0' * (-len(data) % tarfile.BLOCKSIZE), len(header)
+
+
+def build_bundle(members: Iterable[Tuple[str, str, bytes]]) -> Tuple[bytes, Dict[str, Dict[str, Any]]]:
+    """
+    Construye un paquete tar con los ficheros de un backup
+
+    El paquete se escribe sin el bloque final de tar para poder añadirle
+    miembros después con `compose` (p. ej. el resultado de la extracción);
+    `tar` y `tarfile` lo leen igualmente.
+
+    Args:
+        members: Tuplas (tipo, nombre, contenido)
+
+    Returns:
+        Tuple: Bytes del paquete y posición de cada miembro por tipo
+        ({tipo: {name, offset, size}}), para leerlos con una petición por rango
+    """
+    parts = []
+    index = {}
+    offset = 0
+    for kind, name, data in members:
+        member, header_size = tar_member(name, data)
+        index[kind] = {'name': name, 'offset': offset + header_size, 'size': len(data)}
+        parts.append(member)
+        offset += len(member)
+    return b''.join(parts), index
+
+
+def append_bundle_member(bucket, path: str, name: str, data: bytes) -> bool:
+    """
+    Añade un fichero al paquete de un backup sin reescribirlo
+
+    Returns:
+        bool: False si el paquete no existe
+    """
+    member, _ = tar_member(name, data)
+    return append_object(bucket, path, member, BUNDLE_CONTENT_TYPE, create=False)
+
+
+def read_bundle_member(bucket, item: Dict[str, Any], kind: str) -> Optional[bytes]:
+    """
+    Lee un fichero de un paquete con una petición por rango
+
+    Args:
+        bucket: Bucket de backup
+        item: Objeto `bundle` de una entrada del manifiesto
+        kind: Tipo del miembro (`original`, `ocr`...)
+
+    Returns:
+        bytes: Contenido del miembro, o None si el paquete no lo incluye
+    """
+    member = (item.get('members') or {}).get(kind)
+    if member is None:
+        return None
+    if not member['size']:
+        return b''
+    return bucket.blob(item['path']).download_as_bytes(
+        start=member['offset'],
+        end=member['offset'] + member['size'] - 1
+    )
+
+
+def _parse_lines(text: str) -> List[Dict[str, Any]]:
+    entries = []
+    for line in text.splitlines():
+        if line.strip():
+            entries.append(json.loads(line))
+    return entries
+
+
+def read_manifest_entries(bucket, partition: str) -> List[Dict[str, Any]]:
+    """
+    Lee todas las líneas de los manifiestos de una partición, en orden de escritura por manifiesto
+
+    Lista solo el directorio de manifiestos (pocos objetos), no la partición.
+    """
+    entries = []
+    for blob in bucket.list_blobs(prefix=f"{partition}/{MANIFEST_DIR}/"):
+        if blob.name.endswith('.jsonl'):
+            entries.extend(_parse_lines(blob.download_as_text()))
+    return entries
+
+
+def latest_entries(entries: Iterable[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """Última entrada de cada documento, sin los documentos eliminados después"""
+    latest: Dict[str, Dict[str, Any]] = {}
+    for entry in entries:
+        if entry.get('deleted'):
+            latest.pop(entry['file_name'], None)
+        else:
+            latest[entry['file_name']] = entry
+    return latest
+
+
+def find_backup(bucket, partition: str, file_name: str) -> Optional[Dict[str, Any]]:
+    """
+    Busca el backup de un documento leyendo solo su manifiesto
+
+    Returns:
+        Dict: Entrada del manifiesto, o None si no hay backup vigente
+    """
+    blob = bucket.blob(manifest_path(partition, file_name))
+    try:
+        entries = _parse_lines(blob.download_as_text())
+    except NotFound:
+        entries = []
+    return latest_entries(entry for entry in entries if entry['file_name'] == file_name).get(file_name)
+
+
+def manifest_objects(entries: Iterable[Dict[str, Any]]) -> List[str]:
+    """Rutas de todos los objetos registrados en las entradas (sin repetir)"""
+    paths: Dict[str, None] = {}
+    for entry in entries:
+        for item in entry.get('objects') or []:
+            paths.setdefault(item['path'])
+    return list(paths)
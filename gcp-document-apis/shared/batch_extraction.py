@@ -0,0 +1,316 @@
+"""
+Extracción por lotes con Document AI (`batch_process_documents`)
+En modo `batch` la extracción no llama a Document AI por cada mensaje: deja el
+documento pendiente como un marcador en el bucket de resultados, y los
+pendientes se envían juntos en una operación de lote cuando se reúnen
+EXTRACT_BATCH_MAX_DOCUMENTS o el más antiguo lleva EXTRACT_BATCH_WINDOW_SECONDS
+esperando. La operación no se espera: el lote se registra con el nombre de la
+operación y un sondeo periódico consulta si terminó y reparte por documento
+los resultados que Document AI escribió en Cloud Storage. Los lotes no tienen
+el límite de páginas de las peticiones síncronas ni consumen su cuota, por eso
+están pensados para backfills y reprocesados; las subidas interactivas siguen
+usando la petición síncrona
+"""
+
+import json
+import logging
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from google.api_core.exceptions import NotFound, PreconditionFailed
+
+from shared.bulk_delete import delete_blobs
+
+logger = logging.getLogger(__name__)
+
+EXTRACTION_MODE_SYNC = 'sync'
+EXTRACTION_MODE_BATCH = 'batch'
+EXTRACTION_MODES = (EXTRACTION_MODE_SYNC, EXTRACTION_MODE_BATCH)
+
+# Ventana de acumulación de un lote
+EXTRACT_BATCH_MAX_DOCUMENTS = int(os.environ.get('EXTRACT_BATCH_MAX_DOCUMENTS', 100))
+EXTRACT_BATCH_WINDOW_SECONDS = float(os.environ.get('EXTRACT_BATCH_WINDOW_SECONDS', 300))
+
+# Envíos de un documento cuya operación de lote falla entera antes de darlo por fallido
+EXTRACT_BATCH_MAX_ATTEMPTS = int(os.environ.get('EXTRACT_BATCH_MAX_ATTEMPTS', 3))
+
+# Marcadores leídos y reclamados en paralelo al enviar un lote
+EXTRACT_BATCH_WORKERS = int(os.environ.get('EXTRACT_BATCH_WORKERS', 8))
+
+# Objetos de los lotes en el bucket de resultados
+PENDING_PREFIX = 'extraction_batches/pending/'
+JOBS_PREFIX = 'extraction_batches/jobs/'
+OUTPUT_PREFIX = 'extraction_batches/output/'
+
+
+def extraction_mode(message: Dict[str, Any]) -> str:
+    """Modo de extracción de un mensaje: el que pida (p. ej. una restauración) o el de EXTRACTION_MODE"""
+    mode = message.get('extraction_mode') or os.environ.get('EXTRACTION_MODE', EXTRACTION_MODE_SYNC)
+    if mode not in EXTRACTION_MODES:
+        raise ValueError(f"Modo de extracción no soportado: {mode}. Permitidos: {', '.join(EXTRACTION_MODES)}")
+    return mode
+
+
+def pending_path(file_name: str) -> str:
+    """Marcador de un documento pendiente de extracción por lotes"""
+    return f"{PENDING_PREFIX}{file_name}.json"
+
+
+def job_path(batch_id: str) -> str:
+    """Registro de un lote enviado a Document AI"""
+    return f"{JOBS_PREFIX}{batch_id}.json"
+
+
+def split_gcs_uri(uri: str) -> Tuple[str, str]:
+    """Bucket y nombre (o prefijo) de una URI gs://"""
+    bucket_name, _, name = uri[len('gs://'):].partition('/')
+    return bucket_name, name
+
+
+def merge_shards(shards: List[Any]):
+    """
+    Une en un solo documento los fragmentos en que Document AI divide la salida
+    de un documento grande
+
+    Los anclajes de texto de cada fragmento son posiciones en el texto completo
+    (`shard_info.text_offset` es donde empieza el suyo), así que basta con
+    concatenar textos, páginas y entidades en orden de fragmento.
+    """
+    from google.cloud import documentai_v1 as documentai
+
+    shards = sorted(shards, key=lambda shard: shard.shard_info.shard_index)
+    if len(shards) == 1:
+        return shards[0]
+    merged = documentai.Document(text=''.join(shard.text for shard in shards))
+    for shard in shards:
+        merged.pages.extend(shard.pages)
+        merged.entities.extend(shard.entities)
+    return merged
+
+
+class ExtractionBatchQueue:
+    """
+    Documentos pendientes de extracción por lotes y lotes en curso en Document AI
+
+    Cada pendiente es un marcador propio, así que encolar no compite con otras
+    instancias. Al enviar un lote, cada marcador se reclama borrándolo con su
+    generación: si dos instancias envían a la vez, cada documento entra en un
+    solo lote, y la parte reclamada que no llena un lote vuelve a la cola
+    mientras dure su ventana.
+
+    Args:
+        bucket: Bucket de resultados (marcadores, lotes y salida de Document AI)
+        documentai_client: Cliente de Document AI
+        processor_name: Ruta del procesador
+        max_documents: Documentos por lote
+        window_seconds: Espera máxima del pendiente más antiguo antes de enviar
+        max_workers: Marcadores leídos y reclamados en paralelo
+    """
+
+    def __init__(self, bucket, documentai_client, processor_name: str,
+                 max_documents: int = EXTRACT_BATCH_MAX_DOCUMENTS,
+                 window_seconds: float = EXTRACT_BATCH_WINDOW_SECONDS,
+                 max_workers: int = EXTRACT_BATCH_WORKERS):
+        self.bucket = bucket
+        self.documentai_client = documentai_client
+        self.processor_name = processor_name
+        self.max_documents = max(1, max_documents)
+        self.window_seconds = window_seconds
+        self.max_workers = max(1, max_workers)
+
+    def enqueue(self, file_name: str, gcs_uri: str, mime_type: str, **fields):
+        """
+        Deja un documento pendiente para el próximo lote
+
+        Args:
+            file_name: Nombre del documento
+            gcs_uri: URI gs:// que Document AI lee
+            mime_type: Tipo MIME del documento
+            **fields: Datos que se devuelven con el resultado (tipo, traza, intentos...)
+        """
+        entry = {
+            'file_name': file_name,
+            'gcs_uri': gcs_uri,
+            'mime_type': mime_type,
+            'queued_at': datetime.now(timezone.utc).isoformat(),
+            **fields
+        }
+        self.bucket.blob(pending_path(file_name)).upload_from_string(
+            json.dumps(entry), content_type='application/json')
+
+    def pending(self) -> List[Any]:
+        """Marcadores pendientes, del más antiguo al más reciente"""
+        markers = list(self.bucket.list_blobs(prefix=PENDING_PREFIX))
+        return sorted(markers, key=lambda blob: blob.time_created)
+
+    def window_ready(self, markers: List[Any]) -> bool:
+        """Indica si los pendientes llenan un lote o el más antiguo agotó su ventana"""
+        if not markers:
+            return False
+        if len(markers) >= self.max_documents:
+            return True
+        waited = (datetime.now(timezone.utc) - markers[0].time_created).total_seconds()
+        return waited >= self.window_seconds
+
+    def flush(self, force: bool = False) -> List[Dict[str, Any]]:
+        """
+        Envía los lotes cuya ventana se cumplió (todos los pendientes con `force`)
+
+        Returns:
+            List: Registros de los lotes enviados
+        """
+        submitted = []
+        while True:
+            markers = self.pending()
+            if not (markers if force else self.window_ready(markers)):
+                break
+            documents = self._claim(markers[:self.max_documents])
+            if not documents:
+                break
+            if not force and len(documents) < self.max_documents and not self.window_expired(documents):
+                # Otra instancia reclamó parte de los marcadores: el resto no se
+                # envía como lote pequeño, vuelve a la cola hasta llenarlo o
+                # agotar su ventana
+                self.requeue(documents, keep_queued_at=True)
+                break
+            submitted.append(self.submit(documents))
+            if len(markers) <= self.max_documents:
+                break
+        return submitted
+
+    def window_expired(self, documents: List[Dict[str, Any]]) -> bool:
+        """Indica si el documento reclamado más antiguo agotó su ventana"""
+        oldest = min(datetime.fromisoformat(document['queued_at']) for document in documents)
+        return (datetime.now(timezone.utc) - oldest).total_seconds() >= self.window_seconds
+
+    def _claim(self, markers: List[Any]) -> List[Dict[str, Any]]:
+        """Lee y borra los marcadores; los que ya reclamó otra instancia se omiten"""
+        def claim(marker) -> Optional[Dict[str, Any]]:
+            try:
+                entry = json.loads(marker.download_as_bytes(if_generation_match=marker.generation))
+                marker.delete(if_generation_match=marker.generation)
+                return entry
+            except (NotFound, PreconditionFailed):
+                return None
+
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(markers))) as executor:
+            return [entry for entry in executor.map(claim, markers) if entry]
+
+    def submit(self, documents: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Envía un lote a Document AI sin esperar a la operación
+
+        Si el envío falla, los documentos vuelven a quedar pendientes.
+
+        Returns:
+            Dict: Registro del lote (identificador, operación, salida y documentos)
+        """
+        from google.cloud import documentai_v1 as documentai
+
+        batch_id = f"{datetime.now(timezone.utc).strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}"
+        output_uri = f"gs://{self.bucket.name}/{OUTPUT_PREFIX}{batch_id}/"
+        request = documentai.BatchProcessRequest(
+            name=self.processor_name,
+            input_documents=documentai.BatchDocumentsInputConfig(
+                gcs_documents=documentai.GcsDocuments(documents=[
+                    documentai.GcsDocument(gcs_uri=document['gcs_uri'], mime_type=document['mime_type'])
+                    for document in documents
+                ])
+            ),
+            document_output_config=documentai.DocumentOutputConfig(
+                gcs_output_config=documentai.DocumentOutputConfig.GcsOutputConfig(gcs_uri=output_uri)
+            )
+        )
+
+        try:
+            operation = self.documentai_client.batch_process_documents(request=request)
+        except Exception:
+            self.requeue(documents)
+            raise
+
+        job = {
+            'batch_id': batch_id,
+            'operation': operation.operation.name,
+            'submitted_at': datetime.now(timezone.utc).isoformat(),
+            'output_uri': output_uri,
+            'documents': documents
+        }
+        self.bucket.blob(job_path(batch_id)).upload_from_string(json.dumps(job), content_type='application/json')
+        logger.info(f"Lote {batch_id} enviado a Document AI con {len(documents)} documentos")
+        return job
+
+    def requeue(self, documents: List[Dict[str, Any]], keep_queued_at: bool = False):
+        """
+        Vuelve a dejar pendientes unos documentos, conservando sus datos
+
+        Con `keep_queued_at` conservan también la hora de encolado, de modo que
+        su ventana no vuelve a empezar.
+        """
+        excluded = {'file_name', 'gcs_uri', 'mime_type'}
+        if not keep_queued_at:
+            excluded.add('queued_at')
+        for document in documents:
+            fields = {key: value for key, value in document.items() if key not in excluded}
+            self.enqueue(document['file_name'], document['gcs_uri'], document['mime_type'], **fields)
+
+    def jobs(self) -> List[Dict[str, Any]]:
+        """Lotes enviados cuyos resultados aún no se repartieron"""
+        return [json.loads(blob.download_as_bytes()) for blob in self.bucket.list_blobs(prefix=JOBS_PREFIX)]
+
+    def poll(self, job: Dict[str, Any]) -> Optional[List[Tuple[Dict[str, Any], Optional[str], Optional[str]]]]:
+        """
+        Consulta la operación de un lote sin esperarla
+
+        Returns:
+            List: None si la operación sigue en curso; si terminó, por cada
+            documento del lote (documento, URI de su salida, error)
+        """
+        from google.cloud import documentai_v1 as documentai
+        from google.longrunning import operations_pb2
+
+        operation = self.documentai_client.get_operation(
+            request=operations_pb2.GetOperationRequest(name=job['operation']))
+        if not operation.done:
+            return None
+        if operation.error.code:
+            return [(document, None, operation.error.message) for document in job['documents']]
+
+        metadata = documentai.BatchProcessMetadata.deserialize(operation.metadata.value)
+        statuses = {status.input_gcs_source: status for status in metadata.individual_process_statuses}
+        results = []
+        for document in job['documents']:
+            status = statuses.get(document['gcs_uri'])
+            if status is None:
+                results.append((document, None, 'Document AI no devolvió resultado para el documento'))
+            elif status.status.code:
+                results.append((document, None, status.status.message))
+            else:
+                results.append((document, status.output_gcs_destination, None))
+        return results
+
+    def read_document(self, output_uri: str):
+        """Documento procesado a partir de los fragmentos JSON de su salida"""
+        from google.cloud import documentai_v1 as documentai
+
+        bucket_name, prefix = split_gcs_uri(output_uri)
+        bucket = self.bucket if bucket_name == self.bucket.name else self.bucket.client.bucket(bucket_name)
+        shards = [
+            documentai.Document.from_json(blob.download_as_bytes(), ignore_unknown_fields=True)
+            for blob in bucket.list_blobs(prefix=prefix.rstrip('/') + '/')
+            if blob.name.endswith('.json')
+        ]
+        if not shards:
+            raise ValueError(f"Sin salida de Document AI en {output_uri}")
+        return merge_shards(shards)
+
+    def finish(self, job: Dict[str, Any]):
+        """Borra la salida de Document AI y el registro de un lote ya repartido"""
+        _, prefix = split_gcs_uri(job['output_uri'])
+        delete_blobs(self.bucket.client, self.bucket.list_blobs(prefix=prefix))
+        try:
+            self.bucket.blob(job_path(job['batch_id'])).delete()
+        except NotFound:
+            pass
@@ -0,0 +1,168 @@
+"""
+Borrado masivo de objetos de Cloud Storage
+Agrupa los borrados en peticiones batch (una petición HTTP por lote) y envía
+varios lotes en paralelo, con un número acotado de lotes en vuelo para que la
+memoria no dependa del número de objetos. En modo simulación solo cuenta lo
+que se borraría
+"""
+
+import logging
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from google.api_core.exceptions import NotFound
+
+logger = logging.getLogger(__name__)
+
+# Límite de operaciones por petición batch de Cloud Storage
+MAX_BATCH_SIZE = 100
+
+# Nombres de objeto incluidos en el informe como muestra
+REPORT_SAMPLE_SIZE = 100
+
+
+class DeletionReport:
+    """
+    Progreso y resultado de un borrado masivo
+
+    Attributes:
+        matched: Objetos seleccionados para borrar
+        deleted: Objetos borrados
+        missing: Objetos que ya no existían al borrarlos
+        failed: Objetos que no pudieron borrarse
+        bytes: Tamaño total de los objetos seleccionados
+        sample: Primeros nombres seleccionados
+    """
+
+    def __init__(self, dry_run: bool = False):
+        self.dry_run = dry_run
+        self.matched = 0
+        self.deleted = 0
+        self.missing = 0
+        self.failed = 0
+        self.bytes = 0
+        self.sample: List[str] = []
+        self._lock = threading.Lock()
+
+    def record_matched(self, blobs: List[Any]):
+        with self._lock:
+            self.matched += len(blobs)
+            self.bytes += sum(blob.size or 0 for blob in blobs)
+            room = REPORT_SAMPLE_SIZE - len(self.sample)
+            if room > 0:
+                self.sample.extend(blob.name for blob in blobs[:room])
+
+    def record_bytes(self, size: int):
+        """Suma tamaños conocidos por otra vía (p. ej. un manifiesto) para objetos sin metadatos"""
+        with self._lock:
+            self.bytes += size
+
+    def record_result(self, deleted: int, missing: int, failed: int):
+        with self._lock:
+            self.deleted += deleted
+            self.missing += missing
+            self.failed += failed
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'dry_run': self.dry_run,
+                'matched': self.matched,
+                'deleted': self.deleted,
+                'missing': self.missing,
+                'failed': self.failed,
+                'bytes': self.bytes,
+                'sample': list(self.sample)
+            }
+
+
+def _chunks(items: Iterable[Any], size: int) -> Iterable[List[Any]]:
+    chunk: List[Any] = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _delete_batch(client, blobs: List[Any]) -> Tuple[int, int, int]:
+    """
+    Borra un lote en una petición batch
+
+    Si la petición falla (por ejemplo, porque algún objeto ya no existe), el
+    lote se repite objeto a objeto para distinguir ausentes de fallos reales.
+
+    Returns:
+        Tuple: Borrados, ausentes y fallidos
+    """
+    try:
+        with client.batch():
+            for blob in blobs:
+                blob.delete()
+        return len(blobs), 0, 0
+    except Exception as e:
+        logger.debug(f"Lote de {len(blobs)} borrados fallido ({str(e)}), se reintenta uno a uno")
+
+    deleted = missing = failed = 0
+    for blob in blobs:
+        try:
+            blob.delete()
+            deleted += 1
+        except NotFound:
+            missing += 1
+        except Exception as e:
+            failed += 1
+            logger.warning(f"No se pudo eliminar {blob.name}: {str(e)}")
+    return deleted, missing, failed
+
+
+def delete_blobs(client, blobs: Iterable[Any], dry_run: bool = False, batch_size: int = MAX_BATCH_SIZE,
+                 max_workers: int = 8, report: Optional[DeletionReport] = None,
+                 progress: Optional[Callable[[DeletionReport], None]] = None) -> DeletionReport:
+    """
+    Borra objetos en lotes paralelos
+
+    Args:
+        client: Cliente de Cloud Storage (para las peticiones batch)
+        blobs: Objetos a borrar; puede ser un iterador de listado perezoso
+        dry_run: Solo contar los objetos, sin borrarlos
+        batch_size: Objetos por petición batch (máximo 100)
+        max_workers: Lotes enviados en paralelo
+        report: Informe a acumular (para varias llamadas sucesivas)
+        progress: Función llamada con el informe tras cada lote
+
+    Returns:
+        DeletionReport: Informe acumulado
+    """
+    report = report or DeletionReport(dry_run=dry_run)
+    batch_size = max(1, min(batch_size, MAX_BATCH_SIZE))
+
+    if dry_run:
+        for chunk in _chunks(blobs, batch_size):
+            report.record_matched(chunk)
+            if progress:
+                progress(report)
+        return report
+
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='bulk-delete') as executor:
+        in_flight = set()
+        for chunk in _chunks(blobs, batch_size):
+            report.record_matched(chunk)
+            in_flight.add(executor.submit(_delete_batch, client, chunk))
+            # Como mucho dos lotes por worker en memoria
+            if len(in_flight) >= max_workers * 2:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    report.record_result(*future.result())
+                    if progress:
+                        progress(report)
+
+        for future in in_flight:
+            report.record_result(*future.result())
+            if progress:
+                progress(report)
+
+    return report
@@ -0,0 +1,175 @@
+"""
+Clasificación del tipo de documento a partir del texto del OCR
+Modelo lineal de palabras clave con peso: el texto se normaliza una vez
+(minúsculas, puntuación ASCII a espacios), se cuentan sus palabras con
+`Counter` y solo se puntúan las que están en el vocabulario del modelo, así que
+el coste es de decenas de microsegundos por KB. Las frases de varias palabras se
+buscan con límites de palabra en el texto normalizado, y solo si aparece su
+primera palabra.
+
+El modelo por defecto está en DEFAULT_MODEL; CLASSIFIER_MODEL_PATH apunta a un
+JSON con la misma forma (p. ej. pesos exportados de una regresión logística).
+"""
+
+import json
+import logging
+import os
+import string
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DOCUMENT_TYPE = 'general'
+
+# Pesos por tipo de documento; las claves pueden ser palabras o frases
+DEFAULT_MODEL: Dict[str, Any] = {
+    'threshold': 3.0,
+    'max_occurrences': 3,
+    'labels': {
+        'invoice': {
+            'keywords': {
+                'factura': 3, 'invoice': 3, 'recibo': 2, 'receipt': 2, 'bill': 1,
+                'importe total': 2, 'total a pagar': 2, 'total amount': 2, 'amount due': 2,
+                'base imponible': 2, 'iva': 1.5, 'vat': 1.5, 'subtotal': 1.5,
+                'nif': 1, 'cif': 1, 'vencimiento': 1, 'due date': 1.5
+            }
+        },
+        'contract': {
+            'keywords': {
+                'contrato': 3, 'contract': 3, 'agreement': 2, 'acuerdo': 1.5,
+                'cláusula': 2, 'clausula': 2, 'clause': 2, 'las partes': 2, 'the parties': 2,
+                'arrendamiento': 2, 'arrendador': 2, 'arrendatario': 2, 'vigencia': 1.5,
+                'rescisión': 1.5, 'rescision': 1.5, 'termination': 1.5, 'firmado': 1, 'signed': 1
+            }
+        },
+        'identification': {
+            'keywords': {
+                'dni': 3, 'pasaporte': 3, 'passport': 3, 'documento nacional de identidad': 3,
+                'identity card': 3, 'fecha de nacimiento': 2, 'date of birth': 2,
+                'nacionalidad': 2, 'nationality': 2, 'fecha de caducidad': 1.5,
+                'date of expiry': 1.5, 'lugar de nacimiento': 1.5, 'place of birth': 1.5
+            }
+        },
+        'report': {
+            'keywords': {
+                'informe': 3, 'reporte': 3, 'report': 3, 'resumen ejecutivo': 2,
+                'executive summary': 2, 'conclusiones': 2, 'conclusions': 2,
+                'metodología': 1.5, 'metodologia': 1.5, 'methodology': 1.5, 'recomendaciones': 1
+            }
+        }
+    }
+}
+
+# Caracteres leídos por documento: el tipo se decide con las primeras páginas
+CLASSIFIER_MAX_CHARS = int(os.environ.get('CLASSIFIER_MAX_CHARS', 20000))
+
+# La puntuación ASCII separa palabras; los bytes UTF-8 de letras acentuadas no se tocan
+_PUNCTUATION = bytes.maketrans(string.punctuation.encode('ascii'), b' ' * len(string.punctuation))
+
+
+def _normalize(value: str) -> bytes:
+    return value.lower().encode('utf-8').translate(_PUNCTUATION)
+
+
+class DocumentClassifier:
+    """
+    Clasificador lineal de palabras clave
+
+    Args:
+        labels: Por tipo, `keywords` (palabra o frase -> peso) y `bias` opcional
+        threshold: Puntuación mínima para asignar un tipo; por debajo, `general`
+        max_occurrences: Apariciones máximas que puntúa cada palabra clave
+        max_chars: Caracteres del texto que se analizan
+    """
+
+    def __init__(self, labels: Dict[str, Dict[str, Any]], threshold: float = 3.0, max_occurrences: int = 3,
+                 max_chars: int = CLASSIFIER_MAX_CHARS):
+        self.threshold = threshold
+        self.max_occurrences = max_occurrences
+        self.max_chars = max_chars
+        self.bias = {label: float(config.get('bias', 0)) for label, config in labels.items()}
+        self._words: Dict[bytes, List[Tuple[str, float]]] = {}
+        # Frases indexadas por su primera palabra: solo se buscan si esa palabra aparece
+        self._phrases: Dict[bytes, List[Tuple[bytes, str, float]]] = {}
+        for label, config in labels.items():
+            for keyword, weight in config.get('keywords', {}).items():
+                tokens = _normalize(keyword).split()
+                if len(tokens) == 1:
+                    self._words.setdefault(tokens[0], []).append((label, float(weight)))
+                elif tokens:
+                    self._phrases.setdefault(tokens[0], []).append((b' ' + b' '.join(tokens) + b' ', label, float(weight)))
+        self._vocabulary = self._words.keys()
+        self._phrase_starts = self._phrases.keys()
+
+    @classmethod
+    def from_model(cls, model: Dict[str, Any], **kwargs) -> 'DocumentClassifier':
+        """Crea el clasificador a partir de un modelo con la forma de DEFAULT_MODEL"""
+        return cls(
+            model['labels'],
+            threshold=model.get('threshold', 3.0),
+            max_occurrences=model.get('max_occurrences', 3),
+            **kwargs
+        )
+
+    @classmethod
+    def from_file(cls, path: str, **kwargs) -> 'DocumentClassifier':
+        """Carga un modelo JSON local"""
+        with open(path, 'r', encoding='utf-8') as model_file:
+            return cls.from_model(json.load(model_file), **kwargs)
+
+    def scores(self, text: str) -> Dict[str, float]:
+        """Puntuación de cada tipo de documento para el texto"""
+        tokens = _normalize(text[:self.max_chars]).split()
+        counts = Counter(tokens)
+        scores = dict(self.bias)
+        for word in counts.keys() & self._vocabulary:
+            occurrences = min(counts[word], self.max_occurrences)
+            for label, weight in self._words[word]:
+                scores[label] += weight * occurrences
+
+        starts = counts.keys() & self._phrase_starts
+        if starts:
+            joined = b' ' + b' '.join(tokens) + b' '
+            for start in starts:
+                for phrase, label, weight in self._phrases[start]:
+                    occurrences = joined.count(phrase)
+                    if occurrences:
+                        scores[label] += weight * min(occurrences, self.max_occurrences)
+        return scores
+
+    def classify(self, text: str) -> str:
+        """
+        Clasifica el tipo de documento basado en el contenido extraído
+
+        Args:
+            text: Texto extraído del documento
+
+        Returns:
+            str: Tipo con mayor puntuación, o `general` si no supera el umbral
+            o empata con otro
+        """
+        if not text:
+            return DEFAULT_DOCUMENT_TYPE
+        ranked = sorted(self.scores(text).items(), key=lambda item: item[1], reverse=True)
+        if not ranked or ranked[0][1] < self.threshold:
+            return DEFAULT_DOCUMENT_TYPE
+        if len(ranked) > 1 and ranked[1][1] == ranked[0][1]:
+            return DEFAULT_DOCUMENT_TYPE
+        return ranked[0][0]
+
+
+def create_classifier_from_env() -> DocumentClassifier:
+    """
+    Clasificador del modelo de CLASSIFIER_MODEL_PATH o, si no se define, del modelo por defecto
+
+    Un modelo que no se puede cargar no detiene la función: se usa el modelo
+    por defecto y se registra el error.
+    """
+    path: Optional[str] = os.environ.get('CLASSIFIER_MODEL_PATH')
+    if path:
+        try:
+            return DocumentClassifier.from_file(path)
+        except (OSError, ValueError, KeyError) as e:
+            logger.error(f"No se pudo cargar el modelo de clasificación {path}: {str(e)}")
+    return DocumentClassifier.from_model(DEFAULT_MODEL)
@@ -0,0 +1,89 @@
+"""
+Clientes de Google Cloud creados en el primer uso
+Importar una librería de google-cloud cuesta cientos de milisegundos y crear su
+cliente resuelve credenciales y abre canales. Cada accesor difiere ambas cosas
+hasta la primera llamada que lo necesita y reutiliza el cliente en las
+siguientes, de modo que un arranque en frío solo paga los clientes del camino
+que ejecuta: el OCR de un objeto en staging, por ejemplo, no crea Vision ni
+Pub/Sub, y la API no importa Pub/Sub hasta la primera subida
+"""
+
+import os
+import threading
+from typing import Callable, Generic, Optional, TypeVar
+
+from shared.publishing import create_publisher_from_env
+from shared.status_index import get_status_index
+
+T = TypeVar('T')
+
+
+class LazyClient(Generic[T]):
+    """
+    Accesor que construye un cliente en la primera llamada y lo reutiliza
+
+    La construcción se serializa: los hilos que llegan a la vez esperan al
+    mismo cliente en lugar de crear uno cada uno.
+
+    Args:
+        factory: Función sin argumentos que crea el cliente
+    """
+
+    def __init__(self, factory: Callable[[], T]):
+        self._factory = factory
+        self._lock = threading.Lock()
+        self._instance: Optional[T] = None
+
+    def __call__(self) -> T:
+        instance = self._instance
+        if instance is None:
+            with self._lock:
+                if self._instance is None:
+                    self._instance = self._factory()
+                instance = self._instance
+        return instance
+
+    def peek(self) -> Optional[T]:
+        """Devuelve el cliente si ya se creó, sin crearlo"""
+        return self._instance
+
+    def reset(self):
+        """Descarta el cliente; la siguiente llamada crea uno nuevo"""
+        with self._lock:
+            self._instance = None
+
+
+def _create_storage_client():
+    from google.cloud import storage
+    return storage.Client()
+
+
+def _create_vision_client():
+    from google.cloud import vision
+    return vision.ImageAnnotatorClient()
+
+
+def _create_documentai_client():
+    from google.cloud import documentai_v1
+    return documentai_v1.DocumentProcessorServiceClient()
+
+
+def _create_status_index():
+    # El backend sqlite no necesita Cloud Storage
+    backend = os.environ.get('STATUS_INDEX_BACKEND', 'gcs').lower()
+    return get_status_index(storage() if backend == 'gcs' else None)
+
+
+storage = LazyClient(_create_storage_client)
+vision = LazyClient(_create_vision_client)
+documentai = LazyClient(_create_documentai_client)
+publisher = LazyClient(create_publisher_from_env)
+status_index = LazyClient(_create_status_index)
+
+ALL_CLIENTS = (storage, vision, documentai, publisher, status_index)
+
+
+def reset_clients():
+    """Descarta todos los clientes (p. ej., tras sustituir las clases por dobles en pruebas)"""
+    for client in ALL_CLIENTS:
+        client.reset()
@@ -0,0 +1,12 @@
+"""
+Convenciones de nombres de objetos compartidas por la API y las funciones
+"""
+
+# Prefijo de las subidas en curso: el OCR ignora estos objetos hasta que la
+# API los publica con su nombre definitivo
+INCOMING_PREFIX = '_incoming/'
+
+
+def is_staging_object(name: str) -> bool:
+    """Indica si el objeto es una subida aún no publicada"""
+    return name.startswith(INCOMING_PREFIX)
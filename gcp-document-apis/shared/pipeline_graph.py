@@ -0,0 +1,139 @@
+"""
+Grafo de etapas del pipeline
+Cada etapa declara las etapas de las que depende y se dispara con el evento
+de finalización de su última dependencia, o con `start_ocr` si no depende de
+ninguna. Las etapas sin dependencias entre sí se ejecutan en paralelo
+(fan-out) y el documento está completo cuando terminan todas (fan-in). El
+progreso de cada etapa se registra en el índice de estado y cada mensaje de
+finalización incluye las etapas ya completadas y el estado del documento, de
+modo que la etapa que termina la última anuncia el documento completo
+
+En modo `parallel` (por defecto) el OCR de Vision y la extracción de Document
+AI arrancan con la subida; el backup espera al OCR porque su partición y la
+copia del texto dependen de la clasificación. `sequential` reproduce la
+cadena original OCR -> backup -> extracción.
+"""
+
+import os
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from shared.routing import BACKUP_COMPLETED, EXTRACTION_COMPLETED, OCR_COMPLETED, START_OCR
+
+STAGE_OCR = 'ocr'
+STAGE_BACKUP = 'backup'
+STAGE_EXTRACTION = 'extraction'
+
+# Orden de declaración; también es un orden topológico válido de ambos grafos
+STAGES = (STAGE_OCR, STAGE_BACKUP, STAGE_EXTRACTION)
+
+# Campo de progreso en el índice de estado y evento que publica cada etapa al terminar
+STAGE_FIELDS = {
+    STAGE_OCR: 'ocr_completed',
+    STAGE_BACKUP: 'backup_completed',
+    STAGE_EXTRACTION: 'extraction_completed'
+}
+STAGE_EVENTS = {
+    STAGE_OCR: OCR_COMPLETED,
+    STAGE_BACKUP: BACKUP_COMPLETED,
+    STAGE_EXTRACTION: EXTRACTION_COMPLETED
+}
+
+MODE_PARALLEL = 'parallel'
+MODE_SEQUENTIAL = 'sequential'
+
+# Dependencias de cada etapa en cada modo
+PIPELINE_GRAPHS: Dict[str, Dict[str, Tuple[str, ...]]] = {
+    MODE_PARALLEL: {
+        STAGE_OCR: (),
+        STAGE_BACKUP: (STAGE_OCR,),
+        STAGE_EXTRACTION: ()
+    },
+    MODE_SEQUENTIAL: {
+        STAGE_OCR: (),
+        STAGE_BACKUP: (STAGE_OCR,),
+        STAGE_EXTRACTION: (STAGE_BACKUP,)
+    }
+}
+
+
+def pipeline_graph(mode: Optional[str] = None) -> Dict[str, Tuple[str, ...]]:
+    """Dependencias de cada etapa en el modo indicado (por defecto, el de PIPELINE_MODE)"""
+    mode = mode or os.environ.get('PIPELINE_MODE', MODE_PARALLEL)
+    if mode not in PIPELINE_GRAPHS:
+        raise ValueError(f"Modo de pipeline no soportado: {mode}. Permitidos: {', '.join(PIPELINE_GRAPHS)}")
+    return PIPELINE_GRAPHS[mode]
+
+
+def trigger_event(stage: str, mode: Optional[str] = None) -> str:
+    """Evento que dispara una etapa: la finalización de su última dependencia o `start_ocr`"""
+    requires = pipeline_graph(mode)[stage]
+    return STAGE_EVENTS[requires[-1]] if requires else START_OCR
+
+
+def trigger_events(stage: str, mode: Optional[str] = None) -> Tuple[str, ...]:
+    """Eventos que pueden disparar una etapa (los de cualquiera de sus dependencias)"""
+    requires = pipeline_graph(mode)[stage]
+    return tuple(STAGE_EVENTS[required] for required in requires) if requires else (START_OCR,)
+
+
+def ready_to_run(stage: str, event_name: Optional[str], load_record: Callable[[], Optional[Dict[str, Any]]],
+                 mode: Optional[str] = None) -> bool:
+    """
+    Indica si un evento dispara una etapa
+
+    Con una sola dependencia basta el evento; con varias (fan-in), la etapa
+    se ejecuta cuando el índice registra todas, así que solo la dispara el
+    evento de la última en terminar.
+
+    Args:
+        stage: Etapa
+        event_name: Evento recibido
+        load_record: Devuelve el registro del documento (solo se llama con varias dependencias)
+    """
+    if event_name not in trigger_events(stage, mode):
+        return False
+    if len(pipeline_graph(mode)[stage]) <= 1:
+        return True
+    return dependencies_met(stage, load_record(), mode)
+
+
+def dependencies_met(stage: str, record: Optional[Dict[str, Any]], mode: Optional[str] = None) -> bool:
+    """Indica si todas las dependencias de una etapa constan como terminadas en el índice"""
+    record = record or {}
+    return all(record.get(STAGE_FIELDS[required]) for required in pipeline_graph(mode)[stage])
+
+
+def downstream_stages(stage: str, mode: Optional[str] = None) -> List[str]:
+    """
+    Etapas que hay que repetir al reprocesar desde una etapa, en orden topológico
+
+    Reprocesar desde el OCR equivale a una subida nueva y repite todas las
+    etapas; desde cualquier otra, la etapa y las que dependen de ella.
+    """
+    graph = pipeline_graph(mode)
+    if stage == STAGE_OCR:
+        return list(STAGES)
+    selected = {stage}
+    for candidate in STAGES:
+        if any(required in selected for required in graph[candidate]):
+            selected.add(candidate)
+    return [candidate for candidate in STAGES if candidate in selected]
+
+
+def entry_stages(stages: List[str], mode: Optional[str] = None) -> List[str]:
+    """Etapas de un conjunto que no se disparan desde otra etapa del mismo conjunto"""
+    graph = pipeline_graph(mode)
+    return [stage for stage in stages if not any(required in stages for required in graph[stage])]
+
+
+def stage_progress(record: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Campos de progreso para un mensaje de finalización de etapa
+
+    Returns:
+        Dict: Etapas terminadas según el índice y estado del documento
+    """
+    return {
+        'completed_stages': [stage for stage in STAGES if record.get(STAGE_FIELDS[stage])],
+        'document_status': record.get('status', 'processing')
+    }
@@ -0,0 +1,239 @@
+"""
+Publicación de mensajes en Pub/Sub con lotes, control de flujo y confirmación
+El cliente agrupa los mensajes según los límites de lote configurados y bloquea
+al publicar si hay demasiados pendientes. Cada publicación espera su futuro y se
+reintenta si falla, de modo que una Cloud Function no termina (ni su instancia se
+congela) con mensajes sin entregar
+"""
+
+import json
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, List, Optional
+
+from shared.routing import EVENT_ATTRIBUTE, topic_for_event
+from shared.tracing import TRACE_ATTRIBUTE, current_trace_id, span
+
+logger = logging.getLogger(__name__)
+
+# Muestras de latencia conservadas para los percentiles
+LATENCY_SAMPLES = 1024
+
+
+class PublishMetrics:
+    """Contadores de publicación: latencia, reintentos y mensajes pendientes"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=LATENCY_SAMPLES)
+        self.published = 0
+        self.failed = 0
+        self.retries = 0
+        self.outstanding = 0
+        self.max_outstanding = 0
+
+    def started(self):
+        with self._lock:
+            self.outstanding += 1
+            self.max_outstanding = max(self.max_outstanding, self.outstanding)
+
+    def finished(self, latency: float, success: bool):
+        with self._lock:
+            self.outstanding -= 1
+            if success:
+                self.published += 1
+                self._latencies.append(latency)
+            else:
+                self.failed += 1
+
+    def retried(self):
+        with self._lock:
+            self.retries += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            latencies = sorted(self._latencies)
+            return {
+                'published': self.published,
+                'failed': self.failed,
+                'retries': self.retries,
+                'outstanding': self.outstanding,
+                'max_outstanding': self.max_outstanding,
+                'latency_ms': {
+                    'p50': _percentile_ms(latencies, 50),
+                    'p95': _percentile_ms(latencies, 95),
+                    'p99': _percentile_ms(latencies, 99)
+                }
+            }
+
+
+def _percentile_ms(ordered: List[float], pct: float) -> float:
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered))) - 1))
+    return round(ordered[index] * 1000, 2)
+
+
+class MessagePublisher:
+    """
+    Publica mensajes JSON en un tema y espera su confirmación
+
+    Args:
+        client: Cliente de Pub/Sub (con sus ajustes de lote y control de flujo)
+        topic_path: Ruta completa del tema por defecto
+        project_id: Proyecto de los temas de cada evento
+        timeout: Segundos máximos de espera por cada intento
+        max_retries: Reintentos de una publicación fallida
+        backoff: Espera base entre reintentos (exponencial con jitter)
+    """
+
+    def __init__(self, client, topic_path: str, project_id: Optional[str] = None,
+                 timeout: float = 30, max_retries: int = 3, backoff: float = 0.5):
+        self.client = client
+        self.topic_path = topic_path
+        self.project_id = project_id
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.metrics = PublishMetrics()
+        self._pending_lock = threading.Lock()
+        self._pending = set()
+
+    def publish(self, message: Dict[str, Any], topic_path: Optional[str] = None, **attributes):
+        """
+        Encola un mensaje sin esperar a su entrega
+
+        La confirmación se registra en las métricas; usa `flush` antes de
+        terminar o `publish_and_wait` si el llamante necesita el resultado.
+
+        Returns:
+            Futuro de la publicación
+        """
+        data = json.dumps(message).encode('utf-8')
+        started_at = time.perf_counter()
+        self.metrics.started()
+        try:
+            future = self.client.publish(topic_path or self.topic_path, data, **attributes)
+        except Exception:
+            self.metrics.finished(time.perf_counter() - started_at, success=False)
+            raise
+
+        with self._pending_lock:
+            self._pending.add(future)
+
+        def on_done(done_future):
+            with self._pending_lock:
+                self._pending.discard(done_future)
+            error = done_future.exception()
+            self.metrics.finished(time.perf_counter() - started_at, success=error is None)
+            if error is not None:
+                logger.error(f"Mensaje no entregado: {str(error)}")
+
+        future.add_done_callback(on_done)
+        return future
+
+    def publish_and_wait(self, message: Dict[str, Any], topic_path: Optional[str] = None,
+                         **attributes) -> str:
+        """
+        Publica un mensaje y espera a que Pub/Sub lo confirme, con reintentos
+
+        Returns:
+            str: ID del mensaje publicado
+        """
+        for attempt in range(self.max_retries + 1):
+            try:
+                return self.publish(message, topic_path, **attributes).result(timeout=self.timeout)
+            except Exception as e:
+                if attempt == self.max_retries:
+                    logger.error(f"Publicación fallida tras {attempt + 1} intentos: {str(e)}")
+                    raise
+                self.metrics.retried()
+                delay = self.backoff * (2 ** attempt) * (0.5 + random.random())
+                logger.warning(f"Error publicando mensaje, reintento en {delay:.2f} s: {str(e)}")
+                time.sleep(delay)
+
+    def publish_event(self, event_name: str, message: Dict[str, Any], **attributes) -> str:
+        """
+        Publica un evento del pipeline en su tema con el atributo `event`
+        y el identificador de la traza activa
+
+        Args:
+            event_name: Evento (ver `shared.routing`)
+            message: Contenido del mensaje
+
+        Returns:
+            str: ID del mensaje publicado
+        """
+        topic_path = self.client.topic_path(self.project_id, topic_for_event(event_name))
+        attributes[EVENT_ATTRIBUTE] = event_name
+        trace_id = current_trace_id()
+        if trace_id:
+            attributes.setdefault(TRACE_ATTRIBUTE, trace_id)
+
+        with span('pubsub.publish', event=event_name, file_name=message.get('file_name')):
+            return self.publish_and_wait(message, topic_path, **attributes)
+
+    def flush(self, timeout: Optional[float] = None) -> int:
+        """
+        Espera a que se confirmen todas las publicaciones pendientes
+
+        Returns:
+            int: Número de publicaciones que fallaron
+        """
+        with self._pending_lock:
+            pending = list(self._pending)
+
+        failed = 0
+        for future in pending:
+            try:
+                future.result(timeout=timeout or self.timeout)
+            except Exception:
+                failed += 1
+        return failed
+
+
+def create_publisher_from_env(project_id: Optional[str] = None,
+                              topic_name: Optional[str] = None) -> MessagePublisher:
+    """
+    Construye el publicador a partir del entorno
+
+    Variables de entorno:
+        PUBSUB_BATCH_MAX_MESSAGES: Mensajes por lote (por defecto 100)
+        PUBSUB_BATCH_MAX_LATENCY: Segundos máximos que espera un lote (por defecto 0.01)
+        PUBSUB_BATCH_MAX_BYTES: Bytes por lote (por defecto 1 MB)
+        PUBSUB_FLOW_MAX_MESSAGES: Mensajes pendientes antes de bloquear (por defecto 1000)
+        PUBSUB_FLOW_MAX_BYTES: Bytes pendientes antes de bloquear (por defecto 10 MB)
+        PUBSUB_PUBLISH_TIMEOUT: Segundos de espera por confirmación (por defecto 30)
+        PUBSUB_PUBLISH_RETRIES: Reintentos por mensaje (por defecto 3)
+    """
+    # La librería de Pub/Sub se importa al crear el publicador, no al importar el módulo
+    from google.cloud import pubsub_v1
+
+    batch_settings = pubsub_v1.types.BatchSettings(
+        max_messages=int(os.environ.get('PUBSUB_BATCH_MAX_MESSAGES', 100)),
+        max_latency=float(os.environ.get('PUBSUB_BATCH_MAX_LATENCY', 0.01)),
+        max_bytes=int(os.environ.get('PUBSUB_BATCH_MAX_BYTES', 1024 * 1024))
+    )
+    flow_control = pubsub_v1.types.PublishFlowControl(
+        message_limit=int(os.environ.get('PUBSUB_FLOW_MAX_MESSAGES', 1000)),
+        byte_limit=int(os.environ.get('PUBSUB_FLOW_MAX_BYTES', 10 * 1024 * 1024)),
+        limit_exceeded_behavior=pubsub_v1.types.LimitExceededBehavior.BLOCK
+    )
+    client = pubsub_v1.PublisherClient(
+        batch_settings=batch_settings,
+        publisher_options=pubsub_v1.types.PublisherOptions(flow_control=flow_control)
+    )
+
+    project_id = project_id or os.environ.get('GOOGLE_CLOUD_PROJECT')
+    topic_name = topic_name or os.environ.get('PUBSUB_TOPIC_NAME', 'document-processing')
+    return MessagePublisher(
+        client,
+        client.topic_path(project_id, topic_name),
+        project_id=project_id,
+        timeout=float(os.environ.get('PUBSUB_PUBLISH_TIMEOUT', 30)),
+        max_retries=int(os.environ.get('PUBSUB_PUBLISH_RETRIES', 3))
+    )
@@ -0,0 +1,62 @@
+"""
+Limitación de ritmo para trabajos masivos
+Cubo de fichas compartido por los hilos de un proceso: cada operación consume
+una ficha y las fichas se reponen a ritmo constante, de modo que un trabajo de
+cientos de miles de documentos no agota las cuotas de Vision y Document AI
+"""
+
+import threading
+import time
+from typing import Optional
+
+
+class RateLimiter:
+    """
+    Cubo de fichas seguro entre hilos
+
+    Args:
+        rate: Operaciones por segundo (0 o None desactiva el límite)
+        burst: Operaciones que pueden acumularse en reposo (por defecto, un segundo de ritmo)
+    """
+
+    def __init__(self, rate: Optional[float], burst: Optional[float] = None):
+        self.rate = rate or 0
+        self.burst = max(1.0, burst if burst is not None else self.rate)
+        self._tokens = self.burst
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+        self.waited = 0.0
+
+    def _refill(self, now: float):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    def acquire(self, tokens: float = 1.0, stop: Optional[threading.Event] = None) -> bool:
+        """
+        Espera hasta disponer de las fichas indicadas
+
+        Args:
+            tokens: Fichas a consumir
+            stop: Evento que interrumpe la espera
+
+        Returns:
+            bool: True si se consumieron las fichas, False si se interrumpió
+        """
+        if self.rate <= 0:
+            return True
+
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return True
+                wait = (tokens - self._tokens) / self.rate
+                self.waited += wait
+
+            if stop is not None:
+                if stop.wait(wait):
+                    return False
+            else:
+                time.sleep(wait)
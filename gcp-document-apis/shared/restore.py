@@ -0,0 +1,366 @@
+"""
+Restauración de documentos desde el backup y reprocesado del pipeline
+Selecciona backups por tipo, rango de días, hash de contenido o nombre leyendo
+los manifiestos de las particiones, devuelve los originales (y el OCR si hace
+falta) a sus buckets con un pool de hilos acotado y reencola cada documento en
+la etapa elegida a un ritmo limitado para no agotar las cuotas de Vision y
+Document AI
+"""
+
+import logging
+import mimetypes
+import os
+import threading
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from shared.backup_layout import (document_day, find_backup, iter_partitions, latest_entries, manifest_partition,
+                                  manifest_path, partition_prefix, read_bundle_member, read_manifest_entries)
+from shared.batch_extraction import EXTRACTION_MODES
+from shared.object_copy import copy_object
+from shared.pipeline_graph import (STAGE_BACKUP, STAGE_EXTRACTION, STAGE_FIELDS, STAGE_OCR, STAGES, downstream_stages,
+                                   entry_stages, trigger_event)
+from shared.rate_limit import RateLimiter
+from shared.routing import BACKUP_COMPLETED, OCR_COMPLETED, START_OCR
+from shared.tracing import TRACE_ATTRIBUTE, current_trace_id, span, trace_context
+
+logger = logging.getLogger(__name__)
+
+# Etapas desde las que puede reprocesarse un documento
+REPROCESS_FROM_OCR = STAGE_OCR
+REPROCESS_FROM_BACKUP = STAGE_BACKUP
+REPROCESS_FROM_EXTRACTION = STAGE_EXTRACTION
+REPROCESS_STAGES = STAGES
+
+# Documentos reencolados por segundo y restauraciones simultáneas por defecto
+RESTORE_MAX_PER_SECOND = float(os.environ.get('RESTORE_MAX_PER_SECOND', 5))
+RESTORE_WORKERS = int(os.environ.get('RESTORE_WORKERS', 8))
+
+# Documentos y errores incluidos en el informe como muestra
+REPORT_SAMPLE_SIZE = 100
+
+
+def ocr_result_path(file_name: str) -> str:
+    """Ruta del resultado de OCR de un documento en el bucket de resultados"""
+    return f"ocr_results/{file_name.replace('.', '_')}_ocr.txt"
+
+
+class RestoreJob:
+    """
+    Restauración y reprocesado de un conjunto de documentos
+
+    Args:
+        storage_client: Cliente de Cloud Storage
+        status_index: Índice de estado
+        publisher: Publicador de eventos del pipeline
+        backup_bucket: Bucket de backup
+        processing_bucket: Bucket de procesamiento (destino de los originales)
+        result_bucket: Bucket de resultados (destino del OCR restaurado)
+        stage: Etapa desde la que se reprocesa (`ocr`, `backup` o `extraction`)
+        document_type: Filtrar por tipo de documento
+        date_from: Primer día de subida incluido
+        date_to: Último día de subida incluido
+        sha256: Filtrar por hash de contenido
+        file_names: Documentos concretos a restaurar
+        dry_run: Solo seleccionar, sin copiar ni reencolar
+        limit: Número máximo de documentos
+        max_workers: Restauraciones simultáneas
+        limiter: Límite de ritmo (compartido entre trabajos del mismo proceso)
+        extraction_mode: Modo de extracción de los documentos reprocesados
+            (`sync` o `batch`); por defecto, el de EXTRACTION_MODE
+    """
+
+    def __init__(self, storage_client, status_index, publisher, backup_bucket: str, processing_bucket: str,
+                 result_bucket: str, stage: str = REPROCESS_FROM_OCR, document_type: Optional[str] = None,
+                 date_from: Optional[datetime] = None, date_to: Optional[datetime] = None,
+                 sha256: Optional[str] = None, file_names: Optional[List[str]] = None, dry_run: bool = False,
+                 limit: Optional[int] = None, max_workers: int = RESTORE_WORKERS,
+                 limiter: Optional[RateLimiter] = None, extraction_mode: Optional[str] = None):
+        if stage not in REPROCESS_STAGES:
+            raise ValueError(f"Etapa no soportada: {stage}. Permitidas: {', '.join(REPROCESS_STAGES)}")
+        if extraction_mode and extraction_mode not in EXTRACTION_MODES:
+            raise ValueError(f"Modo de extracción no soportado: {extraction_mode}. "
+                             f"Permitidos: {', '.join(EXTRACTION_MODES)}")
+        if not (document_type or date_from or date_to or sha256 or file_names):
+            raise ValueError("Indica al menos un criterio: tipo, rango de fechas, hash o documentos")
+
+        self.job_id = uuid.uuid4().hex[:16]
+        self.storage_client = storage_client
+        self.status_index = status_index
+        self.publisher = publisher
+        self.backup_bucket = storage_client.bucket(backup_bucket)
+        self.processing_bucket = storage_client.bucket(processing_bucket)
+        self.result_bucket = storage_client.bucket(result_bucket)
+        self.stage = stage
+        self.document_type = document_type
+        self.date_from = date_from
+        self.date_to = date_to
+        self.sha256 = sha256
+        self.file_names = list(file_names or [])
+        self.dry_run = dry_run
+        self.limit = limit
+        self.max_workers = max(1, max_workers)
+        self.limiter = limiter or RateLimiter(RESTORE_MAX_PER_SECOND)
+        self.extraction_mode = extraction_mode
+
+        self.state = 'pending'
+        self.error: Optional[str] = None
+        self.created_at = datetime.now().isoformat()
+        self.finished_at: Optional[str] = None
+        self.matched = 0
+        self.restored = 0
+        self.enqueued = 0
+        self.skipped = 0
+        self.failed = 0
+        self.sample: List[str] = []
+        self.errors: List[Dict[str, str]] = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def select(self) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """
+        Backups seleccionados, como pares (partición, entrada del manifiesto)
+
+        Los documentos concretos y los hashes se localizan por el índice (un
+        solo manifiesto por documento); el resto de filtros recorre las
+        particiones del rango sin listar sus objetos.
+        """
+        if self.file_names or (self.sha256 and not (self.document_type or self.date_from or self.date_to)):
+            names = list(self.file_names)
+            if self.sha256:
+                owner = self.status_index.get_hash_owner(self.sha256)
+                if owner:
+                    names.append(owner)
+                else:
+                    self._record_error(self.sha256, 'Hash no registrado en el índice')
+            seen = set()
+            for file_name in names:
+                record = self.status_index.get(file_name) or {}
+                # Los duplicados comparten el backup del documento original
+                if record.get('duplicate_of'):
+                    file_name = record['duplicate_of']
+                    record = self.status_index.get(file_name) or {}
+                if file_name in seen:
+                    continue
+                seen.add(file_name)
+                if record.get('backup_manifest'):
+                    partition = manifest_partition(record['backup_manifest'])
+                elif record.get('document_type') or self.document_type:
+                    partition = partition_prefix(record.get('document_type') or self.document_type,
+                                                 document_day(file_name))
+                else:
+                    self._record_error(file_name, 'Sin tipo de documento para localizar el backup')
+                    continue
+                entry = find_backup(self.backup_bucket, partition, file_name)
+                if entry is None:
+                    self._record_error(file_name, f"Sin backup en {partition}")
+                    continue
+                yield partition, entry
+            return
+
+        for document_type, day in iter_partitions(self.backup_bucket, self.document_type,
+                                                  self.date_from, self.date_to):
+            partition = partition_prefix(document_type, day)
+            for entry in latest_entries(read_manifest_entries(self.backup_bucket, partition)).values():
+                if self.sha256 and entry.get('sha256') != self.sha256:
+                    continue
+                yield partition, entry
+
+    def run(self) -> Dict[str, Any]:
+        """Ejecuta el trabajo en el hilo actual y devuelve su informe"""
+        self.state = 'running'
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='restore') as executor:
+                in_flight = set()
+                for partition, entry in self.select():
+                    if self._stop.is_set() or (self.limit is not None and self.matched >= self.limit):
+                        break
+                    with self._lock:
+                        self.matched += 1
+                        if len(self.sample) < REPORT_SAMPLE_SIZE:
+                            self.sample.append(entry['file_name'])
+                    if self.dry_run:
+                        continue
+
+                    # El ritmo se aplica al reencolar: cada documento consume cuota de Vision y Document AI
+                    if not self.limiter.acquire(stop=self._stop):
+                        break
+                    in_flight.add(executor.submit(self._restore_one, partition, entry))
+                    # Como mucho dos documentos por worker en memoria
+                    if len(in_flight) >= self.max_workers * 2:
+                        _, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                wait(in_flight)
+            self.state = 'cancelled' if self._stop.is_set() else 'completed'
+        except Exception as e:
+            self.state = 'failed'
+            self.error = str(e)
+            logger.error(f"Trabajo de restauración {self.job_id} fallido: {str(e)}")
+        self.finished_at = datetime.now().isoformat()
+        return self.to_dict()
+
+    def start(self) -> threading.Thread:
+        """Ejecuta el trabajo en un hilo en segundo plano"""
+        thread = threading.Thread(target=self.run, name=f"restore-{self.job_id}", daemon=True)
+        thread.start()
+        return thread
+
+    def cancel(self):
+        """Deja de reencolar documentos; los que están en curso terminan"""
+        self._stop.set()
+
+    def _restore_one(self, partition: str, entry: Dict[str, Any]):
+        file_name = entry['file_name']
+        try:
+            with trace_context():
+                with span('restore.document', file_name=file_name, stage=self.stage):
+                    outcome = self.restore_document(partition, entry)
+            with self._lock:
+                if outcome == 'skipped':
+                    self.skipped += 1
+                else:
+                    self.enqueued += 1
+                if outcome == 'restored':
+                    self.restored += 1
+        except Exception as e:
+            self._record_error(file_name, str(e))
+            logger.warning(f"No se pudo restaurar {file_name}: {str(e)}")
+
+    def restore_document(self, partition: str, entry: Dict[str, Any]) -> str:
+        """
+        Restaura un documento y lo reencola en la etapa del trabajo
+
+        El índice se actualiza antes de copiar el original, porque la copia
+        dispara el OCR: si se reprocesa desde una etapa posterior, el OCR ve
+        `reprocess_stage` y no repite el trabajo. El original solo se copia si
+        falta en el bucket de procesamiento o si se reprocesa desde el OCR.
+
+        Returns:
+            str: 'restored' si se copió el original, 'enqueued' si ya existía,
+            'skipped' si el documento comparte los resultados de otro
+        """
+        file_name = entry['file_name']
+        objects = {item['kind']: item for item in entry.get('objects') or []}
+        if 'original' not in objects and 'original' not in (objects.get('bundle') or {}).get('members', {}):
+            raise ValueError(f"El backup de {file_name} no incluye el documento original")
+
+        record = self.status_index.get(file_name) or {}
+        if record.get('duplicate_of'):
+            return 'skipped'
+
+        document_type = entry.get('document_type') or record.get('document_type') or 'general'
+        backup_path = (objects.get('original') or objects['bundle'])['path']
+        manifest = manifest_path(partition, file_name)
+
+        # Etapas que se repiten según el grafo del pipeline
+        stages = downstream_stages(self.stage)
+        
+        # En un bucket vacío el OCR del backup vuelve a su sitio para el backup
+        ocr_path = record.get('ocr_result_path') or ocr_result_path(file_name)
+        needs_ocr = STAGE_BACKUP in stages and STAGE_OCR not in stages
+        if needs_ocr and not self.result_bucket.blob(ocr_path).exists():
+            if not self._restore_object(objects, 'ocr', self.result_bucket, ocr_path):
+                raise ValueError(f"Sin resultado de OCR en el backup de {file_name}; reprocesa desde el OCR")
+
+        # La traza del reprocesado sustituye a la de la subida para que el OCR la continúe
+        fields = {STAGE_FIELDS[stage]: False for stage in stages}
+        fields.update(
+            reprocess_stage=self.stage,
+            restored_at=datetime.now().isoformat(),
+            document_type=document_type,
+            backup_path=backup_path,
+            backup_paths=[item['path'] for item in objects.values()],
+            backup_manifest=manifest,
+            # El backup lo pasa a la extracción cuando esta depende de él (modo secuencial)
+            extraction_mode=self.extraction_mode,
+            **{TRACE_ATTRIBUTE: current_trace_id()}
+        )
+        if self.stage != REPROCESS_FROM_OCR:
+            fields['ocr_result_path'] = ocr_path
+        if entry.get('sha256') and not record.get('sha256'):
+            fields['sha256'] = entry['sha256']
+        self.status_index.update(file_name, **fields)
+
+        restored = False
+        target = self.processing_bucket.blob(file_name)
+        if self.stage == REPROCESS_FROM_OCR or not target.exists():
+            self._restore_object(objects, 'original', self.processing_bucket, file_name)
+            restored = True
+
+        # Las etapas que no dependen de otra repetida se reencolan con su evento
+        # (una vez por evento). El OCR de las Cloud Functions lo dispara la copia
+        # del original; el del worker (worker/main.py), el mensaje start_ocr
+        messages = {
+            START_OCR: {
+                'file_name': file_name,
+                'timestamp': datetime.now().isoformat(),
+                'extraction_mode': self.extraction_mode,
+                'action': START_OCR
+            },
+            OCR_COMPLETED: {
+                'file_name': file_name,
+                'ocr_result_path': ocr_path,
+                'sha256': entry.get('sha256') or record.get('sha256'),
+                'document_type': document_type,
+                'status': OCR_COMPLETED
+            },
+            BACKUP_COMPLETED: {
+                'file_name': file_name,
+                'backup_path': backup_path,
+                'document_type': document_type,
+                'backup_manifest': manifest,
+                'extraction_mode': self.extraction_mode,
+                'status': BACKUP_COMPLETED
+            }
+        }
+        for event_name in dict.fromkeys(trigger_event(stage) for stage in entry_stages(stages)):
+            self.publisher.publish_event(event_name, messages[event_name])
+
+        return 'restored' if restored else 'enqueued'
+
+    def _restore_object(self, objects: Dict[str, Dict[str, Any]], kind: str, bucket, path: str) -> bool:
+        """Copia un fichero del backup a `path`, desde su propio objeto o desde el paquete del documento"""
+        if kind in objects:
+            copy_object(self.backup_bucket.blob(objects[kind]['path']), bucket, path)
+            return True
+        data = read_bundle_member(self.backup_bucket, objects['bundle'], kind) if 'bundle' in objects else None
+        if data is None:
+            return False
+        content_type = (mimetypes.guess_type(path)[0] or 'application/octet-stream') if kind == 'original' else 'text/plain'
+        bucket.blob(path).upload_from_string(data, content_type=content_type)
+        return True
+
+    def _record_error(self, file_name: str, error: str):
+        with self._lock:
+            self.failed += 1
+            if len(self.errors) < REPORT_SAMPLE_SIZE:
+                self.errors.append({'file_name': file_name, 'error': error})
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'job_id': self.job_id,
+                'state': self.state,
+                'stage': self.stage,
+                'extraction_mode': self.extraction_mode,
+                'dry_run': self.dry_run,
+                'filters': {
+                    'document_type': self.document_type,
+                    'date_from': self.date_from.strftime('%Y-%m-%d') if self.date_from else None,
+                    'date_to': self.date_to.strftime('%Y-%m-%d') if self.date_to else None,
+                    'sha256': self.sha256,
+                    'file_names': self.file_names[:REPORT_SAMPLE_SIZE]
+                },
+                'matched': self.matched,
+                'restored': self.restored,
+                'enqueued': self.enqueued,
+                'skipped': self.skipped,
+                'failed': self.failed,
+                'rate_limited_seconds': round(self.limiter.waited, 2),
+                'sample': list(self.sample),
+                'errors': list(self.errors),
+                'error': self.error,
+                'created_at': self.created_at,
+                'finished_at': self.finished_at
+            }
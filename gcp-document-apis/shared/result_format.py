@@ -0,0 +1,129 @@
+"""
+Formato compacto de los resultados de extracción
+Cada resultado es un flujo gzip con un miembro por sección (resumen, entidades,
+pares clave-valor, tablas y texto). Descomprimido completo es JSON Lines con una
+línea `{"section": ..., "data": ...}` por sección (legible con `zcat`), y cada
+miembro se descomprime por separado, de modo que una sección se lee con una
+petición por rango a partir de los desplazamientos guardados en el índice de
+estado (`extracted_info_sections`)
+"""
+
+import gzip
+import json
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+SECTION_SUMMARY = 'summary'
+SECTION_ENTITIES = 'entities'
+SECTION_KEY_VALUE_PAIRS = 'key_value_pairs'
+SECTION_TABLES = 'tables'
+SECTION_TEXT = 'text'
+
+# Orden de escritura: las secciones pequeñas primero y el texto, la mayor, al final
+SECTIONS = (SECTION_SUMMARY, SECTION_ENTITIES, SECTION_KEY_VALUE_PAIRS, SECTION_TABLES, SECTION_TEXT)
+
+RESULT_CONTENT_TYPE = 'application/gzip'
+RESULT_SUFFIX = '_info.jsonl.gz'
+
+# Nivel de compresión: el texto y las tablas se reducen a una fracción con un coste de CPU bajo
+COMPRESSION_LEVEL = 6
+
+
+def result_path(file_name: str) -> str:
+    """Ruta del resultado de extracción de un documento en el bucket de resultados"""
+    return f"extracted_info/{file_name.replace('.', '_')}{RESULT_SUFFIX}"
+
+
+def is_compact_result(path: str) -> bool:
+    """Indica si un resultado usa el formato por secciones (los anteriores son JSON)"""
+    return path.endswith('.gz')
+
+
+def split_sections(info: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Reparte un resultado entre sus secciones
+
+    El resumen agrupa los campos que no tienen sección propia (tipo de
+    documento, páginas y datos específicos del tipo).
+    """
+    sections = {SECTION_SUMMARY: {key: value for key, value in info.items() if key not in SECTIONS}}
+    for section in SECTIONS[1:]:
+        if section in info:
+            sections[section] = info[section]
+    return sections
+
+
+def merge_sections(sections: Dict[str, Any]) -> Dict[str, Any]:
+    """Reconstruye el resultado (o la parte proyectada) a partir de sus secciones"""
+    info = dict(sections.get(SECTION_SUMMARY) or {})
+    for section, data in sections.items():
+        if section != SECTION_SUMMARY:
+            info[section] = data
+    return info
+
+
+def encode_result(info: Dict[str, Any]) -> Tuple[bytes, Dict[str, List[int]]]:
+    """
+    Serializa un resultado en el formato compacto
+
+    Returns:
+        Tuple: Contenido y desplazamiento y tamaño comprimido de cada sección
+    """
+    members = []
+    index = {}
+    offset = 0
+    for section, data in split_sections(info).items():
+        line = json.dumps({'section': section, 'data': data}, ensure_ascii=False, separators=(',', ':')) + '\n'
+        member = gzip.compress(line.encode('utf-8'), compresslevel=COMPRESSION_LEVEL, mtime=0)
+        index[section] = [offset, len(member)]
+        members.append(member)
+        offset += len(member)
+    return b''.join(members), index
+
+
+def decode_sections(data: bytes) -> Dict[str, Any]:
+    """Secciones contenidas en uno o varios miembros gzip consecutivos"""
+    sections = {}
+    for line in gzip.decompress(data).decode('utf-8').splitlines():
+        if line.strip():
+            item = json.loads(line)
+            sections[item['section']] = item['data']
+    return sections
+
+
+def read_sections(blob, index: Dict[str, List[int]], sections: Iterable[str]) -> Dict[str, Any]:
+    """
+    Lee solo las secciones indicadas de un resultado
+
+    Las secciones contiguas se piden en un mismo rango, así que el resultado
+    completo cuesta una sola descarga.
+
+    Args:
+        blob: Objeto del resultado
+        index: Desplazamientos de las secciones (`extracted_info_sections`)
+        sections: Secciones a leer; las que no existen se ignoran
+
+    Returns:
+        Dict: Datos de cada sección leída
+    """
+    wanted = set(sections)
+    ranges: List[List[int]] = []
+    for offset, size in sorted(index[section] for section in wanted if section in index):
+        if ranges and ranges[-1][1] == offset:
+            ranges[-1][1] = offset + size
+        else:
+            ranges.append([offset, offset + size])
+
+    found = {}
+    for start, end in ranges:
+        found.update(decode_sections(blob.download_as_bytes(start=start, end=end - 1)))
+    return {section: data for section, data in found.items() if section in wanted}
+
+
+def project_result(info: Dict[str, Any], sections: Optional[Iterable[str]]) -> Dict[str, Any]:
+    """Proyección de un resultado completo (formato JSON anterior) sobre las secciones indicadas"""
+    if sections is None:
+        return info
+    wanted = set(sections)
+    return merge_sections({
+        section: data for section, data in split_sections(info).items() if section in wanted
+    })
@@ -0,0 +1,62 @@
+"""
+Enrutado de eventos del pipeline entre etapas
+Cada evento se publica en su propio tema (configurable por entorno) y lleva el
+atributo `event`, de modo que cada función solo se suscribe a la etapa que
+consume y descarta sin trabajo cualquier otro mensaje que le llegue
+"""
+
+import base64
+import json
+import os
+from typing import Any, Dict, Optional, Tuple
+
+# Atributo de Pub/Sub con el nombre del evento
+EVENT_ATTRIBUTE = 'event'
+
+# Eventos del pipeline en orden
+START_OCR = 'start_ocr'
+OCR_COMPLETED = 'ocr_completed'
+BACKUP_COMPLETED = 'backup_completed'
+EXTRACTION_COMPLETED = 'extraction_completed'
+
+# Variable de entorno con el tema de cada evento; sin definir se usa PUBSUB_TOPIC_NAME
+EVENT_TOPIC_ENV = {
+    START_OCR: 'PUBSUB_TOPIC_START_OCR',
+    OCR_COMPLETED: 'PUBSUB_TOPIC_OCR_COMPLETED',
+    BACKUP_COMPLETED: 'PUBSUB_TOPIC_BACKUP_COMPLETED',
+    EXTRACTION_COMPLETED: 'PUBSUB_TOPIC_EXTRACTION_COMPLETED'
+}
+
+
+def topic_for_event(event_name: str) -> str:
+    """Nombre del tema en el que se publica un evento"""
+    default_topic = os.environ.get('PUBSUB_TOPIC_NAME', 'document-processing')
+    return os.environ.get(EVENT_TOPIC_ENV[event_name]) or default_topic
+
+
+def decode_pubsub_event(event: Dict[str, Any]) -> Tuple[Optional[str], Dict[str, Any]]:
+    """
+    Decodifica el evento de Pub/Sub que recibe una Cloud Function
+
+    Acepta `data` en base64 (formato de Cloud Functions), en bytes o un mensaje
+    ya decodificado. El nombre del evento se toma del atributo `event` y, para
+    mensajes publicados sin él, de los campos `status` o `action`.
+
+    Returns:
+        Tuple: Nombre del evento y contenido del mensaje
+    """
+    if 'data' in event:
+        data = event['data']
+        if isinstance(data, str):
+            data = base64.b64decode(data)
+        message_data = json.loads(data.decode('utf-8'))
+    else:
+        message_data = event
+
+    attributes = event.get('attributes') or {}
+    event_name = (
+        attributes.get(EVENT_ATTRIBUTE)
+        or message_data.get('status')
+        or message_data.get('action')
+    )
+    return event_name, message_data
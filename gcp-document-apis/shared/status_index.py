@@ -0,0 +1,379 @@
+"""
+Índice de estado por documento
+Mantiene un registro por archivo con el progreso de cada etapa del pipeline
+(OCR, backup y extracción) para que la API resuelva estado, información y
+borrado con una única búsqueda por clave en lugar de recorrer el bucket de backup
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, Any, Iterable, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Etapas del pipeline que determinan si un documento está completo
+PIPELINE_STAGES = ('ocr_completed', 'backup_completed', 'extraction_completed')
+
+# Campos de tipo lista que se acumulan entre actualizaciones
+ACCUMULATED_FIELDS = ('backup_paths', 'duplicates')
+
+
+def derive_status(record: Dict[str, Any]) -> str:
+    """
+    Calcula el estado global de un documento a partir de su registro
+
+    Args:
+        record: Registro del índice
+
+    Returns:
+        str: 'completed' si todas las etapas terminaron, 'processing' en otro caso
+    """
+    if all(record.get(stage) for stage in PIPELINE_STAGES):
+        return 'completed'
+    return 'processing'
+
+
+def merge_record(current: Dict[str, Any], fields: Dict[str, Any],
+                 discard: Optional[Dict[str, List[str]]] = None) -> Dict[str, Any]:
+    """
+    Combina los campos nuevos con el registro existente
+
+    Las listas de ACCUMULATED_FIELDS (rutas de backup, duplicados) se acumulan
+    para no perder elementos escritos por invocaciones anteriores; `discard`
+    indica elementos a retirar de esas listas.
+    """
+    record = dict(current)
+    for key, value in fields.items():
+        if key in ACCUMULATED_FIELDS and value:
+            existing = list(record.get(key) or [])
+            record[key] = existing + [item for item in value if item not in existing]
+        else:
+            record[key] = value
+
+    for key, values in (discard or {}).items():
+        if record.get(key):
+            record[key] = [item for item in record[key] if item not in values]
+
+    record['status'] = derive_status(record)
+    record['updated_at'] = datetime.now().isoformat()
+    return record
+
+
+class StatusIndex:
+    """Interfaz común de los backends del índice de estado"""
+
+    def get(self, file_name: str) -> Optional[Dict[str, Any]]:
+        """Devuelve el registro del documento o None si no está indexado"""
+        raise NotImplementedError
+
+    def get_many(self, file_names: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+        """Devuelve los registros existentes de varios documentos"""
+        records = {}
+        for file_name in file_names:
+            record = self.get(file_name)
+            if record is not None:
+                records[file_name] = record
+        return records
+
+    def update(self, file_name: str, discard: Optional[Dict[str, List[str]]] = None,
+               **fields) -> Dict[str, Any]:
+        """Crea o actualiza el registro del documento y lo devuelve"""
+        raise NotImplementedError
+
+    def delete(self, file_name: str) -> None:
+        """Elimina el registro del documento si existe"""
+        raise NotImplementedError
+
+    def get_hash_owner(self, sha256: str) -> Optional[str]:
+        """Devuelve el documento canónico asociado a un hash de contenido"""
+        raise NotImplementedError
+
+    def set_hash_owner(self, sha256: str, file_name: str, only_if_absent: bool = False) -> str:
+        """
+        Asocia un hash de contenido a su documento canónico
+
+        Returns:
+            str: Documento asociado al hash tras la operación
+        """
+        raise NotImplementedError
+
+    def delete_hash_owner(self, sha256: str) -> None:
+        """Elimina la asociación de un hash de contenido"""
+        raise NotImplementedError
+
+
+class SQLiteStatusIndex(StatusIndex):
+    """
+    Backend local basado en SQLite
+
+    Pensado para desarrollo y pruebas sin conexión; los registros completos se
+    guardan como JSON y las columnas auxiliares permiten filtrar y paginar.
+    """
+
+    def __init__(self, path: str = 'status_index.db'):
+        self.path = path
+        self._lock = threading.Lock()
+        with self._connect() as conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS documents (
+                    file_name TEXT PRIMARY KEY,
+                    status TEXT,
+                    document_type TEXT,
+                    uploaded_at TEXT,
+                    updated_at TEXT,
+                    data TEXT NOT NULL
+                )
+                """
+            )
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS content_hashes (
+                    sha256 TEXT PRIMARY KEY,
+                    file_name TEXT NOT NULL
+                )
+                """
+            )
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            conn.execute('PRAGMA journal_mode=WAL')
+            yield conn
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+    def get(self, file_name: str) -> Optional[Dict[str, Any]]:
+        with self._connect() as conn:
+            row = conn.execute(
+                'SELECT data FROM documents WHERE file_name = ?', (file_name,)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def get_many(self, file_names: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+        names = list(file_names)
+        if not names:
+            return {}
+
+        placeholders = ','.join('?' for _ in names)
+        with self._connect() as conn:
+            rows = conn.execute(
+                f'SELECT file_name, data FROM documents WHERE file_name IN ({placeholders})',
+                names
+            ).fetchall()
+        return {name: json.loads(data) for name, data in rows}
+
+    def update(self, file_name: str, discard: Optional[Dict[str, List[str]]] = None,
+               **fields) -> Dict[str, Any]:
+        with self._lock, self._connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute(
+                'SELECT data FROM documents WHERE file_name = ?', (file_name,)
+            ).fetchone()
+            current = json.loads(row[0]) if row else {'file_name': file_name}
+            record = merge_record(current, fields, discard)
+            conn.execute(
+                """
+                INSERT OR REPLACE INTO documents
+                    (file_name, status, document_type, uploaded_at, updated_at, data)
+                VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                (
+                    file_name,
+                    record['status'],
+                    record.get('document_type'),
+                    record.get('uploaded_at'),
+                    record['updated_at'],
+                    json.dumps(record, ensure_ascii=False)
+                )
+            )
+        return record
+
+    def delete(self, file_name: str) -> None:
+        with self._lock, self._connect() as conn:
+            conn.execute('DELETE FROM documents WHERE file_name = ?', (file_name,))
+
+    def get_hash_owner(self, sha256: str) -> Optional[str]:
+        with self._connect() as conn:
+            row = conn.execute(
+                'SELECT file_name FROM content_hashes WHERE sha256 = ?', (sha256,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def set_hash_owner(self, sha256: str, file_name: str, only_if_absent: bool = False) -> str:
+        verb = 'INSERT OR IGNORE' if only_if_absent else 'INSERT OR REPLACE'
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                f'{verb} INTO content_hashes (sha256, file_name) VALUES (?, ?)',
+                (sha256, file_name)
+            )
+            row = conn.execute(
+                'SELECT file_name FROM content_hashes WHERE sha256 = ?', (sha256,)
+            ).fetchone()
+        return row[0]
+
+    def delete_hash_owner(self, sha256: str) -> None:
+        with self._lock, self._connect() as conn:
+            conn.execute('DELETE FROM content_hashes WHERE sha256 = ?', (sha256,))
+
+
+class GCSStatusIndex(StatusIndex):
+    """
+    Backend en Cloud Storage con un objeto JSON por documento
+
+    Cada lectura es un único GET por clave y las escrituras usan
+    precondiciones de generación para que varias funciones puedan
+    actualizar el mismo registro sin pisarse.
+    """
+
+    def __init__(self, bucket, prefix: str = '_index/documents', max_retries: int = 5,
+                 max_workers: int = 16, hash_prefix: str = '_index/hashes'):
+        self.bucket = bucket
+        self.prefix = prefix.rstrip('/')
+        self.hash_prefix = hash_prefix.rstrip('/')
+        self.max_retries = max_retries
+        self.max_workers = max_workers
+
+    def _key(self, file_name: str) -> str:
+        return f"{self.prefix}/{file_name}.json"
+
+    def get(self, file_name: str) -> Optional[Dict[str, Any]]:
+        from google.api_core.exceptions import NotFound
+
+        try:
+            return json.loads(self.bucket.blob(self._key(file_name)).download_as_text())
+        except NotFound:
+            return None
+
+    def get_many(self, file_names: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+        names = list(file_names)
+        if not names:
+            return {}
+
+        # Las lecturas son independientes: se resuelven en paralelo
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(names))) as executor:
+            results = executor.map(self.get, names)
+            return {name: record for name, record in zip(names, results) if record is not None}
+
+    def update(self, file_name: str, discard: Optional[Dict[str, List[str]]] = None,
+               **fields) -> Dict[str, Any]:
+        from google.api_core.exceptions import NotFound, PreconditionFailed
+
+        key = self._key(file_name)
+        for attempt in range(self.max_retries):
+            blob = self.bucket.get_blob(key)
+            current = {'file_name': file_name}
+            generation = 0
+            if blob is not None:
+                generation = blob.generation
+                try:
+                    current = json.loads(blob.download_as_text(if_generation_match=generation))
+                except (NotFound, PreconditionFailed):
+                    continue
+
+            record = merge_record(current, fields, discard)
+            try:
+                self.bucket.blob(key).upload_from_string(
+                    json.dumps(record, ensure_ascii=False),
+                    content_type='application/json',
+                    if_generation_match=generation
+                )
+                return record
+            except PreconditionFailed:
+                logger.info(f"Conflicto actualizando índice para {file_name}, reintento {attempt + 1}")
+
+        raise RuntimeError(f"No se pudo actualizar el índice de estado para {file_name}")
+
+    def delete(self, file_name: str) -> None:
+        from google.api_core.exceptions import NotFound
+
+        try:
+            self.bucket.blob(self._key(file_name)).delete()
+        except NotFound:
+            pass
+
+    def _hash_key(self, sha256: str) -> str:
+        return f"{self.hash_prefix}/{sha256}.json"
+
+    def get_hash_owner(self, sha256: str) -> Optional[str]:
+        from google.api_core.exceptions import NotFound
+
+        try:
+            data = json.loads(self.bucket.blob(self._hash_key(sha256)).download_as_text())
+        except NotFound:
+            return None
+        return data['file_name']
+
+    def set_hash_owner(self, sha256: str, file_name: str, only_if_absent: bool = False) -> str:
+        from google.api_core.exceptions import PreconditionFailed
+
+        try:
+            self.bucket.blob(self._hash_key(sha256)).upload_from_string(
+                json.dumps({'sha256': sha256, 'file_name': file_name}),
+                content_type='application/json',
+                if_generation_match=0 if only_if_absent else None
+            )
+            return file_name
+        except PreconditionFailed:
+            return self.get_hash_owner(sha256) or file_name
+
+    def delete_hash_owner(self, sha256: str) -> None:
+        from google.api_core.exceptions import NotFound
+
+        try:
+            self.bucket.blob(self._hash_key(sha256)).delete()
+        except NotFound:
+            pass
+
+
+def get_status_index(storage_client=None) -> StatusIndex:
+    """
+    Construye el backend del índice según la configuración del entorno
+
+    Variables de entorno:
+        STATUS_INDEX_BACKEND: 'gcs' (por defecto) o 'sqlite'
+        STATUS_INDEX_BUCKET: Bucket del índice en modo 'gcs'
+        STATUS_INDEX_PATH: Ruta del fichero en modo 'sqlite'
+
+    Args:
+        storage_client: Cliente de Cloud Storage, requerido en modo 'gcs'
+
+    Returns:
+        StatusIndex: Backend configurado
+    """
+    backend = os.environ.get('STATUS_INDEX_BACKEND', 'gcs').lower()
+
+    if backend == 'sqlite':
+        return SQLiteStatusIndex(os.environ.get('STATUS_INDEX_PATH', 'status_index.db'))
+
+    if backend == 'gcs':
+        if storage_client is None:
+            raise ValueError("El backend 'gcs' del índice requiere un cliente de Cloud Storage")
+        bucket_name = os.environ.get(
+            'STATUS_INDEX_BUCKET',
+            os.environ.get('RESULT_BUCKET_NAME', 'document-results')
+        )
+        return GCSStatusIndex(storage_client.bucket(bucket_name))
+
+    raise ValueError(f"Backend de índice de estado no soportado: {backend}")
+
+
+def list_backup_paths(record: Optional[Dict[str, Any]]) -> List[str]:
+    """Devuelve todas las rutas de backup registradas para un documento"""
+    if not record:
+        return []
+    paths = list(record.get('backup_paths') or [])
+    if record.get('backup_path') and record['backup_path'] not in paths:
+        paths.insert(0, record['backup_path'])
+    return paths
@@ -0,0 +1,121 @@
+"""
+Extracción de datos estructurados de las respuestas de Document AI
+Recorre el documento una sola vez sobre el mensaje protobuf subyacente, sin los
+envoltorios de proto-plus que cada acceso a un campo crea de nuevo. Los textos
+de campos, celdas y entidades se resuelven con los desplazamientos de sus
+segmentos en `document.text`, y los campos específicos de cada tipo de
+documento se reconocen con patrones precompilados en la misma pasada
+"""
+
+import re
+from typing import Any, Dict, List, Optional, Pattern, Tuple
+
+# Clave del resultado y fragmentos de tipo de entidad de los campos específicos de cada tipo
+TYPE_SPECIFIC_FIELDS = {
+    'invoice': ('invoice_specific', ('invoice_number', 'date', 'total_amount', 'vendor_name', 'customer_name')),
+    'contract': ('contract_specific', ('contract_number', 'start_date', 'end_date', 'parties', 'amount')),
+    'identification': ('id_specific', ('id_number', 'name', 'date_of_birth', 'expiry_date', 'nationality'))
+}
+
+# Un patrón por tipo sustituye las comprobaciones de subcadena campo a campo
+TYPE_MATCHERS: Dict[str, Tuple[str, Pattern]] = {
+    document_type: (key, re.compile('|'.join(re.escape(field) for field in fields)))
+    for document_type, (key, fields) in TYPE_SPECIFIC_FIELDS.items()
+}
+
+
+def raw_message(message):
+    """Mensaje protobuf subyacente de un mensaje proto-plus (o el propio mensaje si ya lo es)"""
+    pb = getattr(type(message), 'pb', None)
+    return pb(message) if pb is not None else message
+
+
+def anchor_text(text: str, anchor) -> str:
+    """
+    Texto de un anclaje a partir de los desplazamientos de sus segmentos
+
+    Document AI no siempre rellena `content`; los segmentos apuntan a
+    `document.text` y son la referencia. Sin segmentos se usa `content`.
+    """
+    segments = anchor.text_segments
+    if not segments:
+        return anchor.content
+    if len(segments) == 1:
+        segment = segments[0]
+        return text[segment.start_index:segment.end_index]
+    return ''.join(text[segment.start_index:segment.end_index] for segment in segments)
+
+
+def _rows_text(text: str, rows, data: List[List[str]]):
+    for row in rows:
+        data.append([anchor_text(text, cell.layout.text_anchor) for cell in row.cells])
+
+
+def extract_structured_data(document, document_type: str) -> Dict[str, Any]:
+    """
+    Extrae información estructurada del documento procesado
+
+    Args:
+        document: Documento procesado por Document AI (proto-plus o protobuf)
+        document_type: Tipo de documento
+
+    Returns:
+        Dict: Información extraída estructurada
+    """
+    document = raw_message(document)
+    text = document.text
+    matcher: Optional[Tuple[str, Pattern]] = TYPE_MATCHERS.get(document_type)
+
+    # Entidades y campos específicos del tipo en una sola pasada
+    entities: Dict[str, List[Dict[str, Any]]] = {}
+    specific: Dict[str, Dict[str, Any]] = {}
+    for entity in document.entities:
+        entity_type = entity.type_
+        mention_text = entity.mention_text
+        confidence = entity.confidence
+        page_refs = entity.page_anchor.page_refs
+
+        mentions = entities.get(entity_type)
+        if mentions is None:
+            mentions = entities[entity_type] = []
+        mentions.append({
+            'text': mention_text,
+            'confidence': confidence,
+            'page_anchor': page_refs[0].page if page_refs else None
+        })
+
+        if matcher is not None:
+            lowered = entity_type.lower()
+            if matcher[1].search(lowered):
+                specific[lowered] = {'value': mention_text, 'confidence': confidence}
+
+    # Pares clave-valor y tablas en una sola pasada por las páginas
+    key_value_pairs: Dict[str, Dict[str, Any]] = {}
+    tables: List[Dict[str, Any]] = []
+    for page in document.pages:
+        page_number = page.page_number
+        for form_field in page.form_fields:
+            field_name = form_field.field_name
+            key_value_pairs[anchor_text(text, field_name.text_anchor)] = {
+                'value': anchor_text(text, form_field.field_value.text_anchor),
+                'confidence': field_name.confidence,
+                'page': page_number
+            }
+        for table in page.tables:
+            table_data: List[List[str]] = []
+            _rows_text(text, table.header_rows, table_data)
+            _rows_text(text, table.body_rows, table_data)
+            tables.append({'page': page_number, 'data': table_data})
+
+    extracted_data = {
+        'document_type': document_type,
+        'text': text,
+        'pages': len(document.pages),
+        'entities': entities,
+        'key_value_pairs': key_value_pairs,
+        'tables': tables
+    }
+    if matcher is not None:
+        extracted_data[matcher[0]] = specific
+
+    return extracted_data
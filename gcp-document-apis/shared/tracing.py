@@ -0,0 +1,280 @@
+"""
+Trazas y métricas del pipeline de documentos
+Un identificador de traza nace en la subida, viaja en el índice de estado y en el
+atributo `trace_id` de cada mensaje de Pub/Sub, y acompaña a cada span (paso de
+E/S cronometrado). Los spans se escriben como logs JSON estructurados, que Cloud
+Logging agrupa por traza, y alimentan histogramas exportables en formato Prometheus
+"""
+
+import bisect
+import contextvars
+import functools
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger('pipeline.trace')
+
+# Cada span es una línea JSON en stdout, sin el prefijo `INFO:pipeline.trace:` de
+# basicConfig, para que Cloud Logging la lea como jsonPayload; el nivel sigue
+# heredándose de la configuración del proceso
+if not logger.handlers:
+    _span_handler = logging.StreamHandler(sys.stdout)
+    _span_handler.setFormatter(logging.Formatter('%(message)s'))
+    logger.addHandler(_span_handler)
+    logger.propagate = False
+
+# Atributo de Pub/Sub, cabecera HTTP y campo del índice con el identificador de traza
+TRACE_ATTRIBUTE = 'trace_id'
+TRACE_HEADER = 'X-Trace-Id'
+
+# Límites (segundos) de los histogramas de duración
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_current_trace: contextvars.ContextVar = contextvars.ContextVar('trace_id', default=None)
+
+
+def new_trace_id() -> str:
+    """Identificador de traza de 32 caracteres hexadecimales (formato W3C)"""
+    return uuid.uuid4().hex
+
+
+def current_trace_id() -> Optional[str]:
+    return _current_trace.get()
+
+
+@contextmanager
+def trace_context(trace_id: Optional[str] = None) -> Iterator[str]:
+    """Fija la traza activa durante el bloque (crea una nueva si no se indica)"""
+    trace_id = trace_id or new_trace_id()
+    token = _current_trace.set(trace_id)
+    try:
+        yield trace_id
+    finally:
+        _current_trace.reset(token)
+
+
+def adopt_trace(trace_id: Optional[str]):
+    """
+    Sustituye la traza activa dentro del `trace_context` en curso
+
+    Lo usa el OCR, que solo conoce la traza de la subida tras leer el índice;
+    el valor anterior se restaura al salir del `trace_context` que lo envuelve.
+    """
+    if trace_id:
+        _current_trace.set(trace_id)
+
+
+def trace_id_from_event(event: Dict[str, Any], record: Optional[Dict[str, Any]] = None) -> Optional[str]:
+    """
+    Recupera la traza de un evento de Cloud Functions
+
+    Los mensajes de Pub/Sub la llevan como atributo; los eventos de Cloud Storage
+    no tienen atributos, así que se toma del registro del documento en el índice.
+    """
+    attributes = event.get('attributes') or {}
+    metadata = event.get('metadata') or {}
+    return (
+        attributes.get(TRACE_ATTRIBUTE)
+        or metadata.get(TRACE_ATTRIBUTE)
+        or (record or {}).get(TRACE_ATTRIBUTE)
+    )
+
+
+class Histogram:
+    """Histograma acumulativo con etiquetas, como el tipo `histogram` de Prometheus"""
+
+    def __init__(self, name: str, help_text: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        # etiquetas -> [conteos por bucket..., +Inf], suma
+        self._series: Dict[Tuple[Tuple[str, str], ...], List[Any]] = {}
+
+    def observe(self, value: float, **labels):
+        key = tuple(sorted((name, str(label)) for name, label in labels.items()))
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.setdefault(key, [[0] * (len(self.buckets) + 1), 0.0])
+            series[0][index] += 1
+            series[1] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {key: ([*counts], total) for key, (counts, total) in self._series.items()}
+        for key, (counts, total) in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip((*self.buckets, '+Inf'), counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_labels(key, le=bound)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(key)} {total:.6f}")
+            lines.append(f"{self.name}_count{_labels(key)} {cumulative}")
+        return lines
+
+
+class Counter:
+    """Contador monótono con etiquetas"""
+
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help_text = help_text
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[Tuple[str, str], ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(sorted((name, str(label)) for name, label in labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = dict(self._values)
+        for key, value in sorted(values.items()):
+            lines.append(f"{self.name}{_labels(key)} {value:g}")
+        return lines
+
+
+def _labels(key: Tuple[Tuple[str, str], ...], **extra) -> str:
+    pairs = [*key, *((name, str(value)) for name, value in extra.items())]
+    if not pairs:
+        return ''
+    escaped = (value.replace('\\', '\\\\').replace('"', '\\"') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+class MetricsRegistry:
+    """
+    Registro de métricas del proceso con exportación en texto de Prometheus
+
+    Además de contadores e histogramas admite gauges calculados al exportar a
+    partir de los contadores que ya mantienen otros componentes.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics: Dict[str, Any] = {}
+        self._gauges: List[Tuple[str, str, Callable[[], Dict[Tuple[Tuple[str, str], ...], float]]]] = []
+
+    def histogram(self, name: str, help_text: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        with self._lock:
+            return self._metrics.setdefault(name, Histogram(name, help_text, buckets))
+
+    def counter(self, name: str, help_text: str) -> Counter:
+        with self._lock:
+            return self._metrics.setdefault(name, Counter(name, help_text))
+
+    def gauge(self, name: str, help_text: str, read: Callable[[], Any]):
+        """
+        Registra un gauge leído al exportar
+
+        Args:
+            read: Devuelve un número o un dict {etiquetas(dict o tupla): valor}
+        """
+        with self._lock:
+            self._gauges.append((name, help_text, read))
+
+    def render(self) -> str:
+        lines: List[str] = []
+        with self._lock:
+            metrics = list(self._metrics.values())
+            gauges = list(self._gauges)
+        for metric in metrics:
+            lines.extend(metric.render())
+        for name, help_text, read in gauges:
+            lines.extend([f"# HELP {name} {help_text}", f"# TYPE {name} gauge"])
+            try:
+                value = read()
+            except Exception as e:
+                logger.warning(f"No se pudo leer el gauge {name}: {str(e)}")
+                continue
+            values = value if isinstance(value, dict) else {(): value}
+            for labels, number in values.items():
+                key = tuple(sorted(labels.items())) if isinstance(labels, dict) else labels
+                lines.append(f"{name}{_labels(key)} {float(number):g}")
+        return '\n'.join(lines) + '\n'
+
+
+# Registro compartido por todos los módulos del proceso
+metrics = MetricsRegistry()
+
+span_duration = metrics.histogram(
+    'pipeline_span_duration_seconds',
+    'Duración de cada paso instrumentado del pipeline'
+)
+span_errors = metrics.counter(
+    'pipeline_span_errors_total',
+    'Pasos del pipeline que terminaron con excepción'
+)
+
+
+def _log_trace_field(trace_id: str) -> Dict[str, str]:
+    """Campo que Cloud Logging usa para agrupar las entradas de una traza"""
+    project = os.environ.get('GOOGLE_CLOUD_PROJECT')
+    if not project:
+        return {}
+    return {'logging.googleapis.com/trace': f"projects/{project}/traces/{trace_id}"}
+
+
+@contextmanager
+def span(name: str, **attributes) -> Iterator[Dict[str, Any]]:
+    """
+    Cronometra un paso del pipeline y escribe un log estructurado al terminar
+
+    Args:
+        name: Nombre del paso (p. ej. `ocr.vision`)
+        **attributes: Campos adicionales del log (documento, páginas, bytes...)
+
+    Yields:
+        Dict: Atributos del span, ampliables dentro del bloque
+    """
+    started_at = time.perf_counter()
+    status = 'ok'
+    try:
+        yield attributes
+    except Exception:
+        status = 'error'
+        span_errors.inc(span=name)
+        raise
+    finally:
+        duration = time.perf_counter() - started_at
+        span_duration.observe(duration, span=name)
+
+        trace_id = current_trace_id()
+        entry = {
+            'severity': 'INFO' if status == 'ok' else 'ERROR',
+            'message': f"span {name} {duration * 1000:.1f} ms",
+            'span': name,
+            'duration_ms': round(duration * 1000, 3),
+            'status': status,
+            TRACE_ATTRIBUTE: trace_id,
+            **attributes
+        }
+        if trace_id:
+            entry.update(_log_trace_field(trace_id))
+        logger.info(json.dumps(entry, default=str, ensure_ascii=False))
+
+
+def traced_function(name: str):
+    """
+    Decorador para los puntos de entrada de Cloud Functions `(event, context)`
+
+    Abre la traza del evento (o una nueva) y mide la invocación completa como
+    el span `{name}.total`.
+    """
+    def decorator(func: Callable) -> Callable:
+        @functools.wraps(func)
+        def wrapper(event: Dict[str, Any], context):
+            with trace_context(trace_id_from_event(event)):
+                with span(f"{name}.total"):
+                    return func(event, context)
+        return wrapper
+    return decorator
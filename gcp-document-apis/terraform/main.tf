@@ -1,7 +1,7 @@
 # Configuración principal de Terraform para GCP Document Processing APIs
 
 terraform {
-  required_version = ">= 1.0"
+  required_version = ">= 1.1"
   required_providers {
     google = {
       source  = "hashicorp/google"
@@ -27,7 +27,8 @@ resource "google_project_service" "required_apis" {
     "documentai.googleapis.com",
     "pubsub.googleapis.com",
     "run.googleapis.com",
-    "logging.googleapis.com"
+    "logging.googleapis.com",
+    "cloudscheduler.googleapis.com"
   ])
   
   service = each.value
@@ -101,43 +102,138 @@ resource "google_storage_bucket" "document_results" {
   depends_on = [google_project_service.required_apis]
 }
 
-# Tópico de Pub/Sub para procesamiento de documentos
+# Tópico de Pub/Sub para procesamiento de documentos (eventos start_ocr)
 resource "google_pubsub_topic" "document_processing" {
   name = "document-processing"
   
   depends_on = [google_project_service.required_apis]
 }
 
-# Suscripción para OCR Processor
+# Un tópico por evento del pipeline: cada etapa solo recibe el evento que consume
+resource "google_pubsub_topic" "ocr_completed" {
+  name = "document-ocr-completed"
+  
+  depends_on = [google_project_service.required_apis]
+}
+
+resource "google_pubsub_topic" "backup_completed" {
+  name = "document-backup-completed"
+  
+  depends_on = [google_project_service.required_apis]
+}
+
+resource "google_pubsub_topic" "extraction_completed" {
+  name = "document-extraction-completed"
+  
+  depends_on = [google_project_service.required_apis]
+}
+
+# Plazo de confirmación de las suscripciones de las etapas; el worker renueva
+# la reserva de los mensajes que tardan más (WORKER_ACK_DEADLINE_SECONDS)
+locals {
+  worker_ack_deadline_seconds = 60
+  stage_functions             = var.stage_runtime == "functions" ? 1 : 0
+  stage_worker                = var.stage_runtime == "worker" ? 1 : 0
+  extraction_batch_poll       = var.extraction_mode == "batch" || var.extraction_batch_poll ? 1 : 0
+}
+
+# Tópico del sondeo periódico de la extracción por lotes; el sondeo (tópico,
+# función y programador) solo se despliega con extraction_mode = "batch" o
+# extraction_batch_poll, para no invocar cada minuto una función sin lotes
+moved {
+  from = google_pubsub_topic.extraction_batch_poll
+  to   = google_pubsub_topic.extraction_batch_poll[0]
+}
+
+resource "google_pubsub_topic" "extraction_batch_poll" {
+  count = local.extraction_batch_poll
+  
+  name = "document-extraction-batch-poll"
+  
+  depends_on = [google_project_service.required_apis]
+}
+
+# Suscripción para OCR Processor; solo existe con stage_runtime = "worker", que es
+# quien la consume: las Cloud Functions usan la de su event_trigger y una
+# suscripción sin consumidor acumularía los eventos hasta cambiar al worker
+moved {
+  from = google_pubsub_subscription.ocr_processor
+  to   = google_pubsub_subscription.ocr_processor[0]
+}
+
 resource "google_pubsub_subscription" "ocr_processor" {
+  count = local.stage_worker
+  
   name  = "ocr-processor-subscription"
   topic = google_pubsub_topic.document_processing.name
   
-  ack_deadline_seconds = 20
+  ack_deadline_seconds = local.worker_ack_deadline_seconds
+  
+  # Los mensajes que el worker rechaza se reentregan con espera creciente
+  retry_policy {
+    minimum_backoff = "10s"
+    maximum_backoff = "600s"
+  }
   
   expiration_policy {
     ttl = "2678400s" # 31 días
   }
 }
 
-# Suscripción para Backup Manager
+# Suscripción para Backup Manager; solo existe con stage_runtime = "worker", que es
+# quien la consume: las Cloud Functions usan la de su event_trigger y una
+# suscripción sin consumidor acumularía los eventos hasta cambiar al worker
+moved {
+  from = google_pubsub_subscription.backup_manager
+  to   = google_pubsub_subscription.backup_manager[0]
+}
+
 resource "google_pubsub_subscription" "backup_manager" {
+  count = local.stage_worker
+  
   name  = "backup-manager-subscription"
-  topic = google_pubsub_topic.document_processing.name
+  topic = google_pubsub_topic.ocr_completed.name
   
-  ack_deadline_seconds = 20
+  ack_deadline_seconds = local.worker_ack_deadline_seconds
+  
+  # Los mensajes que el worker rechaza se reentregan con espera creciente
+  retry_policy {
+    minimum_backoff = "10s"
+    maximum_backoff = "600s"
+  }
   
   expiration_policy {
     ttl = "2678400s" # 31 días
   }
 }
 
-# Suscripción para Info Extractor
+# Tema que dispara la extracción según el grafo de etapas (shared/pipeline_graph.py):
+# en paralelo arranca con la subida (start_ocr), en secuencial tras el backup
+locals {
+  info_extractor_trigger_topic = var.pipeline_mode == "parallel" ? google_pubsub_topic.document_processing.name : google_pubsub_topic.backup_completed.name
+}
+
+# Suscripción para Info Extractor; solo existe con stage_runtime = "worker", que es
+# quien la consume: las Cloud Functions usan la de su event_trigger y una
+# suscripción sin consumidor acumularía los eventos hasta cambiar al worker
+moved {
+  from = google_pubsub_subscription.info_extractor
+  to   = google_pubsub_subscription.info_extractor[0]
+}
+
 resource "google_pubsub_subscription" "info_extractor" {
+  count = local.stage_worker
+  
   name  = "info-extractor-subscription"
-  topic = google_pubsub_topic.document_processing.name
+  topic = local.info_extractor_trigger_topic
   
-  ack_deadline_seconds = 20
+  ack_deadline_seconds = local.worker_ack_deadline_seconds
+  
+  # Los mensajes que el worker rechaza se reentregan con espera creciente
+  retry_policy {
+    minimum_backoff = "10s"
+    maximum_backoff = "600s"
+  }
   
   expiration_policy {
     ttl = "2678400s" # 31 días
@@ -157,12 +253,20 @@ data "archive_file" "ocr_processor" {
   output_path = "/tmp/ocr-processor.zip"
 }
 
+moved {
+  from = google_cloudfunctions_function.ocr_processor
+  to   = google_cloudfunctions_function.ocr_processor[0]
+}
+
 resource "google_cloudfunctions_function" "ocr_processor" {
+  count = local.stage_functions
+  
   name        = "ocr-processor"
   description = "Procesa documentos usando Google Cloud Vision API para OCR"
   runtime     = "python39"
   
   available_memory_mb   = 512
+  timeout               = 540
   source_archive_bucket = google_storage_bucket.document_processing.name
   source_archive_object = google_storage_bucket_object.ocr_processor_zip.name
  
@@ -175,8 +279,16 @@ resource "google_cloudfunctions_function" "ocr_processor" {
   entry_point = "process_document"
   
   environment_variables = {
-    RESULT_BUCKET_NAME = google_storage_bucket.document_results.name
-    PUBSUB_TOPIC_NAME  = google_pubsub_topic.document_processing.name
+    RESULT_BUCKET_NAME  = google_storage_bucket.document_results.name
+    PUBSUB_TOPIC_NAME   = google_pubsub_topic.document_processing.name
+    STATUS_INDEX_BUCKET = google_storage_bucket.document_results.name
+    
+    PUBSUB_TOPIC_OCR_COMPLETED = google_pubsub_topic.ocr_completed.name
+    
+    OCR_MAX_CONCURRENT_BATCHES = 4
+    OCR_SYNC_MAX_PAGES         = 30
+    OCR_ASYNC_TIMEOUT          = 480
+    OCR_INLINE_MAX_MB          = 1
   }
   
   depends_on = [google_project_service.required_apis]
@@ -195,7 +307,14 @@ data "archive_file" "backup_manager" {
   output_path = "/tmp/backup-manager.zip"
 }
 
+moved {
+  from = google_cloudfunctions_function.backup_manager
+  to   = google_cloudfunctions_function.backup_manager[0]
+}
+
 resource "google_cloudfunctions_function" "backup_manager" {
+  count = local.stage_functions
+  
   name        = "backup-manager"
   description = "Gestiona backup y clasificación de documentos"
   runtime     = "python39"
@@ -207,7 +326,7 @@ resource "google_cloudfunctions_function" "backup_manager" {
   
   event_trigger {
     event_type = "google.pubsub.topic.publish"
-    resource   = google_pubsub_topic.document_processing.name
+    resource   = google_pubsub_topic.ocr_completed.name
   }
   
   entry_point = "backup_document"
@@ -215,12 +334,37 @@ resource "google_cloudfunctions_function" "backup_manager" {
   environment_variables = {
     STORAGE_BUCKET_NAME = google_storage_bucket.document_processing.name
     BACKUP_BUCKET_NAME  = google_storage_bucket.document_backup.name
+    RESULT_BUCKET_NAME  = google_storage_bucket.document_results.name
     PUBSUB_TOPIC_NAME   = google_pubsub_topic.document_processing.name
+    STATUS_INDEX_BUCKET = google_storage_bucket.document_results.name
+    
+    PUBSUB_TOPIC_BACKUP_COMPLETED = google_pubsub_topic.backup_completed.name
+    PIPELINE_MODE                 = var.pipeline_mode
   }
   
   depends_on = [google_project_service.required_apis]
 }
 
+# Document AI lee de Cloud Storage los documentos que superan EXTRACT_INLINE_MAX_MB
+# y los de los lotes, y escribe la salida de los lotes en el bucket de resultados
+data "google_project" "current" {}
+
+resource "google_storage_bucket_iam_member" "documentai_processing_reader" {
+  bucket = google_storage_bucket.document_processing.name
+  role   = "roles/storage.objectViewer"
+  member = "serviceAccount:service-${data.google_project.current.number}@gcp-sa-prod-dai-core.iam.gserviceaccount.com"
+  
+  depends_on = [google_project_service.required_apis]
+}
+
+resource "google_storage_bucket_iam_member" "documentai_results_writer" {
+  bucket = google_storage_bucket.document_results.name
+  role   = "roles/storage.objectAdmin"
+  member = "serviceAccount:service-${data.google_project.current.number}@gcp-sa-prod-dai-core.iam.gserviceaccount.com"
+  
+  depends_on = [google_project_service.required_apis]
+}
+
 # Cloud Function para Info Extractor
 resource "google_storage_bucket_object" "info_extractor_zip" {
   name   = "info-extractor-${data.archive_file.info_extractor.output_md5}.zip"
@@ -234,38 +378,213 @@ data "archive_file" "info_extractor" {
   output_path = "/tmp/info-extractor.zip"
 }
 
+moved {
+  from = google_cloudfunctions_function.info_extractor
+  to   = google_cloudfunctions_function.info_extractor[0]
+}
+
 resource "google_cloudfunctions_function" "info_extractor" {
+  count = local.stage_functions
+  
   name        = "info-extractor"
   description = "Extrae información estructurada usando Google Cloud Document AI"
   runtime     = "python39"
   
-  available_memory_mb   = 1024
+  available_memory_mb   = 512
   source_archive_bucket = google_storage_bucket.document_processing.name
   source_archive_object = google_storage_bucket_object.info_extractor_zip.name
   
   
   event_trigger {
     event_type = "google.pubsub.topic.publish"
-    resource   = google_pubsub_topic.document_processing.name
+    resource   = local.info_extractor_trigger_topic
   }
   
   entry_point = "extract_document_info"
   
   environment_variables = {
     STORAGE_BUCKET_NAME = google_storage_bucket.document_processing.name
+    BACKUP_BUCKET_NAME  = google_storage_bucket.document_backup.name
+    RESULT_BUCKET_NAME  = google_storage_bucket.document_results.name
+    PUBSUB_TOPIC_NAME   = google_pubsub_topic.document_processing.name
+    STATUS_INDEX_BUCKET = google_storage_bucket.document_results.name
+    
+    DOCUMENT_AI_PROCESSOR_ID = var.document_ai_processor_id
+    
+    PUBSUB_TOPIC_EXTRACTION_COMPLETED = google_pubsub_topic.extraction_completed.name
+    PIPELINE_MODE                     = var.pipeline_mode
+    EXTRACT_INLINE_MAX_MB             = 1
+    
+    EXTRACTION_MODE              = var.extraction_mode
+    EXTRACT_BATCH_MAX_DOCUMENTS  = var.extraction_batch_max_documents
+    EXTRACT_BATCH_WINDOW_SECONDS = var.extraction_batch_window_seconds
+  }
+  
+  depends_on = [google_project_service.required_apis]
+}
+
+# Sondeo de la extracción por lotes: envía los lotes cuya ventana se cumplió y
+# reparte los terminados. Una sola instancia, mismo código que Info Extractor
+moved {
+  from = google_cloudfunctions_function.info_extractor_batches
+  to   = google_cloudfunctions_function.info_extractor_batches[0]
+}
+
+resource "google_cloudfunctions_function" "info_extractor_batches" {
+  count = local.extraction_batch_poll
+  
+  name        = "info-extractor-batches"
+  description = "Envía y reparte los lotes de extracción de Document AI"
+  runtime     = "python39"
+  
+  available_memory_mb   = 512
+  timeout               = 540
+  max_instances         = 1
+  source_archive_bucket = google_storage_bucket.document_processing.name
+  source_archive_object = google_storage_bucket_object.info_extractor_zip.name
+  
+  event_trigger {
+    event_type = "google.pubsub.topic.publish"
+    resource   = google_pubsub_topic.extraction_batch_poll[0].name
+  }
+  
+  entry_point = "process_extraction_batches"
+  
+  environment_variables = {
+    STORAGE_BUCKET_NAME = google_storage_bucket.document_processing.name
+    BACKUP_BUCKET_NAME  = google_storage_bucket.document_backup.name
     RESULT_BUCKET_NAME  = google_storage_bucket.document_results.name
     PUBSUB_TOPIC_NAME   = google_pubsub_topic.document_processing.name
+    STATUS_INDEX_BUCKET = google_storage_bucket.document_results.name
+    
+    DOCUMENT_AI_PROCESSOR_ID = var.document_ai_processor_id
+    
+    PUBSUB_TOPIC_EXTRACTION_COMPLETED = google_pubsub_topic.extraction_completed.name
+    
+    EXTRACT_BATCH_MAX_DOCUMENTS  = var.extraction_batch_max_documents
+    EXTRACT_BATCH_WINDOW_SECONDS = var.extraction_batch_window_seconds
+  }
+  
+  depends_on = [google_project_service.required_apis]
+}
+
+moved {
+  from = google_cloud_scheduler_job.extraction_batch_poll
+  to   = google_cloud_scheduler_job.extraction_batch_poll[0]
+}
+
+resource "google_cloud_scheduler_job" "extraction_batch_poll" {
+  count = local.extraction_batch_poll
+  
+  name        = "extraction-batch-poll"
+  description = "Sondeo de la extracción por lotes de Document AI"
+  region      = var.region
+  schedule    = "* * * * *"
+  
+  pubsub_target {
+    topic_name = google_pubsub_topic.extraction_batch_poll[0].id
+    data       = base64encode("poll")
+  }
+  
+  depends_on = [google_project_service.required_apis]
+}
+
+# Worker de etapas (worker/main.py) en Cloud Run, alternativa a las tres Cloud
+# Functions: consume con pull las suscripciones de OCR, backup y extracción con
+# los clientes compartidos entre mensajes. La CPU queda asignada fuera de las
+# peticiones HTTP (solo la comprobación de salud las recibe) y min_instances
+# mantiene una instancia consumiendo
+resource "google_cloud_run_service" "pipeline_worker" {
+  count = local.stage_worker
+  
+  name     = "document-pipeline-worker"
+  location = var.region
+  
+  template {
+    metadata {
+      annotations = {
+        "autoscaling.knative.dev/minScale"  = var.worker_min_instances
+        "autoscaling.knative.dev/maxScale"  = var.worker_max_instances
+        "run.googleapis.com/cpu-throttling" = "false"
+      }
+    }
+    
+    spec {
+      containers {
+        image = "gcr.io/${var.project_id}/document-worker:latest"
+        
+        ports {
+          container_port = 8080
+        }
+        
+        resources {
+          limits = {
+            cpu    = "2"
+            memory = "2Gi"
+          }
+        }
+        
+        dynamic "env" {
+          for_each = {
+            GOOGLE_CLOUD_PROJECT = var.project_id
+            STORAGE_BUCKET_NAME  = google_storage_bucket.document_processing.name
+            BACKUP_BUCKET_NAME   = google_storage_bucket.document_backup.name
+            RESULT_BUCKET_NAME   = google_storage_bucket.document_results.name
+            PUBSUB_TOPIC_NAME    = google_pubsub_topic.document_processing.name
+            STATUS_INDEX_BUCKET  = google_storage_bucket.document_results.name
+            
+            PUBSUB_TOPIC_OCR_COMPLETED        = google_pubsub_topic.ocr_completed.name
+            PUBSUB_TOPIC_BACKUP_COMPLETED     = google_pubsub_topic.backup_completed.name
+            PUBSUB_TOPIC_EXTRACTION_COMPLETED = google_pubsub_topic.extraction_completed.name
+            PIPELINE_MODE                     = var.pipeline_mode
+            
+            OCR_MAX_CONCURRENT_BATCHES = 4
+            OCR_SYNC_MAX_PAGES         = 30
+            OCR_ASYNC_TIMEOUT          = 480
+            OCR_INLINE_MAX_MB          = 1
+            
+            DOCUMENT_AI_PROCESSOR_ID     = var.document_ai_processor_id
+            EXTRACT_INLINE_MAX_MB        = 1
+            EXTRACTION_MODE              = var.extraction_mode
+            EXTRACT_BATCH_MAX_DOCUMENTS  = var.extraction_batch_max_documents
+            EXTRACT_BATCH_WINDOW_SECONDS = var.extraction_batch_window_seconds
+            
+            WORKER_OCR_SUBSCRIPTION        = google_pubsub_subscription.ocr_processor[0].name
+            WORKER_BACKUP_SUBSCRIPTION     = google_pubsub_subscription.backup_manager[0].name
+            WORKER_EXTRACTION_SUBSCRIPTION = google_pubsub_subscription.info_extractor[0].name
+            WORKER_CONCURRENCY             = var.worker_concurrency
+            WORKER_MAX_MESSAGES            = var.worker_max_messages
+            WORKER_ACK_DEADLINE_SECONDS    = local.worker_ack_deadline_seconds
+          }
+          
+          content {
+            name  = env.key
+            value = env.value
+          }
+        }
+      }
+    }
   }
   
   depends_on = [google_project_service.required_apis]
 }
 
 # Cloud Run para API principal
+# Los trabajos de POST /restore siguen en segundo plano tras responder: la CPU
+# queda asignada fuera de las peticiones y min_instances evita que se recicle
+# la instancia ociosa a mitad de un trabajo
 resource "google_cloud_run_service" "document_api" {
   name     = "document-processing-api"
   location = var.region
   
   template {
+    metadata {
+      annotations = {
+        "autoscaling.knative.dev/minScale"  = var.api_min_instances
+        "run.googleapis.com/cpu-throttling" = "false"
+      }
+    }
+    
     spec {
       containers {
         image = "gcr.io/${var.project_id}/document-api:latest"
@@ -298,6 +617,60 @@ resource "google_cloud_run_service" "document_api" {
           name  = "PUBSUB_TOPIC_NAME"
           value = google_pubsub_topic.document_processing.name
         }
+        
+        # Temas en los que POST /restore reencola documentos en etapas posteriores al OCR
+        env {
+          name  = "PUBSUB_TOPIC_OCR_COMPLETED"
+          value = google_pubsub_topic.ocr_completed.name
+        }
+        
+        env {
+          name  = "PUBSUB_TOPIC_BACKUP_COMPLETED"
+          value = google_pubsub_topic.backup_completed.name
+        }
+        
+        env {
+          name  = "STATUS_INDEX_BUCKET"
+          value = google_storage_bucket.document_results.name
+        }
+        
+        # Grafo de etapas con el que POST /restore decide qué eventos reencolar
+        env {
+          name  = "PIPELINE_MODE"
+          value = var.pipeline_mode
+        }
+        
+        # POST /restore solo acepta extraction_mode = batch si el sondeo de lotes está desplegado
+        env {
+          name  = "EXTRACTION_MODE"
+          value = var.extraction_mode
+        }
+        
+        env {
+          name  = "EXTRACTION_BATCH_POLL"
+          value = local.extraction_batch_poll == 1 ? "true" : "false"
+        }
+        
+        env {
+          name  = "PUSH_VERIFICATION_TOKEN"
+          value = var.notification_push_token
+        }
+        
+        env {
+          name  = "WEBHOOK_SECRET"
+          value = var.webhook_secret
+        }
+        
+        env {
+          name  = "WEBHOOK_ALLOWED_HOSTS"
+          value = var.webhook_allowed_hosts
+        }
+        
+        # Los endpoints /restore solo aceptan este token, aunque la API sea pública
+        env {
+          name  = "RESTORE_API_TOKEN"
+          value = var.restore_api_token
+        }
       }
     }
   }
@@ -305,6 +678,29 @@ resource "google_cloud_run_service" "document_api" {
   depends_on = [google_project_service.required_apis]
 }
 
+# Suscripciones push de la API a los eventos de etapa: alimentan GET /events
+# y los webhooks de finalización sin que los clientes consulten /status
+resource "google_pubsub_subscription" "api_notifications" {
+  for_each = {
+    ocr        = google_pubsub_topic.ocr_completed.name
+    backup     = google_pubsub_topic.backup_completed.name
+    extraction = google_pubsub_topic.extraction_completed.name
+  }
+  
+  name  = "document-api-${each.key}-notifications"
+  topic = each.value
+  
+  ack_deadline_seconds = 20
+  
+  push_config {
+    push_endpoint = "${google_cloud_run_service.document_api.status[0].url}/events/pubsub?token=${var.notification_push_token}"
+  }
+  
+  expiration_policy {
+    ttl = "2678400s" # 31 días
+  }
+}
+
 # IAM para permitir acceso público a la API
 resource "google_cloud_run_service_iam_member" "public_access" {
   location = google_cloud_run_service.document_api.location
@@ -341,3 +737,7 @@ output "pubsub_topic" {
 output "api_url" {
   value = google_cloud_run_service.document_api.status[0].url
 }
+
+output "stage_runtime" {
+  value = var.stage_runtime
+}
@@ -63,3 +63,111 @@ variable "processing_result_retention_days" {
   type        = number
   default     = 30
 }
+
+variable "notification_push_token" {
+  description = "Token que Pub/Sub envía a /events/pubsub en las suscripciones push de la API"
+  type        = string
+  sensitive   = true
+  default     = ""
+}
+
+variable "webhook_secret" {
+  description = "Clave HMAC con la que la API firma los webhooks de finalización"
+  type        = string
+  sensitive   = true
+  default     = ""
+}
+
+variable "webhook_allowed_hosts" {
+  description = "Hosts permitidos en las URL de callback, separados por comas (vacío: cualquier host público)"
+  type        = string
+  default     = ""
+}
+
+variable "restore_api_token" {
+  description = "Token Bearer que exigen los endpoints /restore de la API (vacío: deshabilitados)"
+  type        = string
+  sensitive   = true
+  default     = ""
+}
+
+variable "api_min_instances" {
+  description = "Instancias de la API siempre activas, para que terminen los trabajos de restauración"
+  type        = number
+  default     = 1
+}
+
+variable "pipeline_mode" {
+  description = "Grafo de etapas: parallel (OCR y extracción a la vez) o sequential (OCR, backup y extracción en cadena)"
+  type        = string
+  default     = "parallel"
+  
+  validation {
+    condition     = contains(["parallel", "sequential"], var.pipeline_mode)
+    error_message = "El modo del pipeline debe ser parallel o sequential."
+  }
+}
+
+variable "extraction_mode" {
+  description = "Extracción de Document AI: sync (una petición por documento) o batch (lotes con ventana de acumulación)"
+  type        = string
+  default     = "sync"
+  
+  validation {
+    condition     = contains(["sync", "batch"], var.extraction_mode)
+    error_message = "El modo de extracción debe ser sync o batch."
+  }
+}
+
+variable "extraction_batch_max_documents" {
+  description = "Documentos por lote de extracción"
+  type        = number
+  default     = 100
+}
+
+variable "extraction_batch_window_seconds" {
+  description = "Espera máxima de un documento pendiente antes de enviar su lote"
+  type        = number
+  default     = 300
+}
+
+variable "extraction_batch_poll" {
+  description = "Desplegar el sondeo de la extracción por lotes aunque extraction_mode sea sync (reprocesados con extraction_mode = batch)"
+  type        = bool
+  default     = false
+}
+
+variable "stage_runtime" {
+  description = "Ejecución de las etapas: functions (una Cloud Function por evento) o worker (un servicio de Cloud Run que consume las suscripciones con pull)"
+  type        = string
+  default     = "functions"
+  
+  validation {
+    condition     = contains(["functions", "worker"], var.stage_runtime)
+    error_message = "La ejecución de las etapas debe ser functions o worker."
+  }
+}
+
+variable "worker_concurrency" {
+  description = "Mensajes que procesa a la vez cada instancia del worker"
+  type        = number
+  default     = 32
+}
+
+variable "worker_max_messages" {
+  description = "Mensajes recibidos y sin resolver por suscripción en cada instancia del worker (prefetch)"
+  type        = number
+  default     = 64
+}
+
+variable "worker_min_instances" {
+  description = "Instancias del worker siempre activas"
+  type        = number
+  default     = 1
+}
+
+variable "worker_max_instances" {
+  description = "Instancias máximas del worker"
+  type        = number
+  default     = 3
+}
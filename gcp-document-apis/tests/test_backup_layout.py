@@ -0,0 +1,51 @@
+"""
+Tests de los añadidos a manifiestos y paquetes de backup sobre el Cloud Storage en memoria
+"""
+
+import pytest
+from google.api_core.exceptions import BadRequest
+
+from local.fakes import FakeStorageClient
+from shared.backup_layout import (COMPACT_COMPONENTS, append_bundle_member, append_manifest, build_bundle,
+                                  read_bundle_member, read_manifest_entries)
+
+
+@pytest.fixture
+def bucket():
+    return FakeStorageClient().bucket('document-backup')
+
+
+def test_compose_rejects_more_than_1024_components(bucket):
+    target = bucket.blob('composite')
+    target.upload_from_string(b'x')
+    part = bucket.blob('part')
+    part.upload_from_string(b'y')
+    for _ in range(1023):
+        target.compose([target, part])
+    assert target.component_count == 1024
+    with pytest.raises(BadRequest):
+        target.compose([target, part])
+
+
+def test_append_manifest_past_component_limit(bucket):
+    path = 'invoice/2024/01/01/_manifest/00.jsonl'
+    appends = 1100
+    for index in range(appends):
+        append_manifest(bucket, path, [{'file_name': f"20240101_000000_{index}.pdf"}])
+
+    assert bucket.get_blob(path).component_count < COMPACT_COMPONENTS
+    entries = read_manifest_entries(bucket, 'invoice/2024/01/01')
+    assert [entry['file_name'] for entry in entries] == [f"20240101_000000_{index}.pdf" for index in range(appends)]
+    assert not [blob.name for blob in bucket.list_blobs(prefix=f"{path}.")]
+
+
+def test_append_bundle_member_past_component_limit(bucket):
+    path = 'invoice/2024/01/01/20240101_000000_doc.pdf.tar'
+    data, index = build_bundle([('original', 'doc.pdf', b'%PDF original')])
+    bucket.blob(path).upload_from_string(data)
+    for count in range(1100):
+        assert append_bundle_member(bucket, path, f"extra_{count}.txt", b'resultado')
+
+    item = {'path': path, 'members': index}
+    assert read_bundle_member(bucket, item, 'original') == b'%PDF original'
+    assert bucket.get_blob(path).component_count < COMPACT_COMPONENTS
@@ -0,0 +1,3 @@
+"""
+Worker de larga duración que consume con pull las suscripciones de las etapas
+"""
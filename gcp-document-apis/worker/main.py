@@ -0,0 +1,246 @@
+"""
+Worker de larga duración para las etapas del pipeline
+Alternativa a las Cloud Functions, que atienden un evento por invocación: un
+único proceso (Cloud Run con CPU siempre asignada o una VM) consume con pull
+las suscripciones de las etapas de terraform/main.tf y ejecuta el mismo código
+de functions/, compartiendo entre mensajes los clientes de GCP, el índice de
+estado y el clasificador. El OCR parte del mensaje start_ocr de la API (o de la
+restauración) en lugar del evento de Cloud Storage, y los backups de un mismo
+pull se hacen juntos con `backup_documents`, con una escritura por manifiesto.
+Un puerto HTTP devuelve las estadísticas del worker, como comprobación de
+salud para Cloud Run.
+
+Uso:
+    python -m worker.main
+    python -m worker.main --stages backup extraction --concurrency 64 --max-messages 128
+"""
+
+import argparse
+import importlib.util
+import json
+import logging
+import os
+import signal
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+
+from shared import clients
+from shared.pipeline_graph import STAGE_BACKUP, STAGE_EXTRACTION, STAGE_OCR, STAGES, ready_to_run
+from shared.routing import START_OCR, decode_pubsub_event
+from shared.tracing import TRACE_ATTRIBUTE
+from worker.pull import (WORKER_ACK_DEADLINE_SECONDS, WORKER_CONCURRENCY, WORKER_MAX_LEASE_SECONDS,
+                         WORKER_MAX_MESSAGES, Handler, PullWorker, Subscription, per_message)
+
+logger = logging.getLogger(__name__)
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Cloud Function y suscripción (variable de entorno y valor por defecto) de cada etapa
+STAGE_FUNCTIONS = {
+    STAGE_OCR: 'ocr_processor',
+    STAGE_BACKUP: 'backup_manager',
+    STAGE_EXTRACTION: 'info_extractor'
+}
+STAGE_SUBSCRIPTIONS = {
+    STAGE_OCR: ('WORKER_OCR_SUBSCRIPTION', 'ocr-processor-subscription'),
+    STAGE_BACKUP: ('WORKER_BACKUP_SUBSCRIPTION', 'backup-manager-subscription'),
+    STAGE_EXTRACTION: ('WORKER_EXTRACTION_SUBSCRIPTION', 'info-extractor-subscription')
+}
+
+# Etapas que consume el worker
+WORKER_STAGES = [stage for stage in os.environ.get('WORKER_STAGES', ','.join(STAGES)).split(',') if stage]
+
+# Mensajes de backup de un mismo pull que se copian y registran juntos
+WORKER_BACKUP_BATCH_SIZE = int(os.environ.get('WORKER_BACKUP_BATCH_SIZE', 32))
+
+# Segundos que se espera a los mensajes en curso al recibir SIGTERM (Cloud Run concede 10)
+WORKER_SHUTDOWN_SECONDS = float(os.environ.get('WORKER_SHUTDOWN_SECONDS', 8))
+
+
+def load_function(stage: str):
+    """Importa el main.py de la Cloud Function de una etapa con un nombre propio"""
+    name = STAGE_FUNCTIONS[stage]
+    spec = importlib.util.spec_from_file_location(f"{name}_main", os.path.join(ROOT_DIR, 'functions', name, 'main.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def pubsub_event(received) -> Dict[str, Any]:
+    """Evento con el formato que reciben las Cloud Functions a partir de un mensaje recibido con pull"""
+    return {'data': received.message.data, 'attributes': dict(received.message.attributes)}
+
+
+def ocr_handler(module) -> Handler:
+    """
+    OCR a partir de los mensajes start_ocr
+
+    El mensaje se traduce al evento de Cloud Storage del objeto; el tamaño y el
+    tipo se leen del bucket cuando el mensaje no los trae (restauraciones).
+    """
+    def handle(received):
+        event = pubsub_event(received)
+        event_name, message = decode_pubsub_event(event)
+        if event_name != START_OCR:
+            return
+        bucket_name = os.environ.get('STORAGE_BUCKET_NAME', 'document-processing')
+        file_name = message.get('file_name')
+        if not file_name:
+            logger.error("Mensaje start_ocr sin file_name descartado")
+            return
+        size, content_type = message.get('size'), message.get('content_type')
+        if size is None:
+            blob = clients.storage().bucket(bucket_name).get_blob(file_name)
+            if blob is None:
+                logger.warning(f"{file_name} no existe en {bucket_name}, se omite el OCR")
+                return
+            size, content_type = blob.size, content_type or blob.content_type
+        module.process_document({
+            'bucket': bucket_name,
+            'name': file_name,
+            'contentType': content_type,
+            'size': size,
+            'attributes': event['attributes']
+        }, None)
+
+    return per_message(handle)
+
+
+def backup_handler(module) -> Handler:
+    """Backup de todos los documentos de un grupo de mensajes en una llamada a `backup_documents`"""
+    def handle(batch: List[Any]) -> List[Optional[str]]:
+        errors: List[Optional[str]] = [None] * len(batch)
+        documents, owners = [], []
+        for index, received in enumerate(batch):
+            try:
+                event_name, message = decode_pubsub_event(pubsub_event(received))
+            except ValueError as e:
+                # Un mensaje ilegible no se procesará nunca: se confirma para no reentregarlo
+                logger.error(f"Mensaje de backup ilegible descartado: {str(e)}")
+                continue
+            grouped = message.get('documents') or [message]
+            if not ready_to_run(STAGE_BACKUP, event_name,
+                                lambda: clients.status_index().get(grouped[0].get('file_name'))):
+                continue
+            # Cada documento continúa la traza de su mensaje
+            trace_id = received.message.attributes.get(TRACE_ATTRIBUTE)
+            for document in grouped:
+                documents.append({TRACE_ATTRIBUTE: trace_id, **document} if trace_id else document)
+                owners.append(index)
+
+        if documents:
+            logger.info(f"Procesando backup de {len(documents)} documentos de {len(batch)} mensajes")
+            for owner, result in zip(owners, module.backup_documents(documents)):
+                if result.get('error'):
+                    # Un fallo reentrega el mensaje completo, como en la Cloud Function
+                    errors[owner] = f"{result['file_name']}: {result['error']}"
+        return errors
+
+    return handle
+
+
+def extraction_handler(module) -> Handler:
+    """Extracción de cada mensaje con el punto de entrada de la Cloud Function"""
+    return per_message(lambda received: module.extract_document_info(pubsub_event(received), None))
+
+
+STAGE_HANDLERS = {
+    STAGE_OCR: ocr_handler,
+    STAGE_BACKUP: backup_handler,
+    STAGE_EXTRACTION: extraction_handler
+}
+
+
+def build_worker(subscriber, stages: List[str], modules: Optional[Dict[str, Any]] = None,
+                 project_id: Optional[str] = None, **options) -> PullWorker:
+    """
+    Crea el worker de unas etapas
+
+    Args:
+        subscriber: Cliente `pubsub_v1.SubscriberClient`
+        stages: Etapas a consumir
+        modules: main.py ya importado de cada etapa; las que falten se importan
+        project_id: Proyecto de las suscripciones (GOOGLE_CLOUD_PROJECT por defecto)
+        **options: Opciones de `PullWorker` (concurrency, max_messages...)
+    """
+    project_id = project_id or os.environ.get('GOOGLE_CLOUD_PROJECT')
+    modules = modules or {}
+    subscriptions = []
+    for stage in stages:
+        variable, default = STAGE_SUBSCRIPTIONS[stage]
+        module = modules.get(stage) or load_function(stage)
+        subscriptions.append(Subscription(
+            stage,
+            subscriber.subscription_path(project_id, os.environ.get(variable, default)),
+            STAGE_HANDLERS[stage](module),
+            batch_size=WORKER_BACKUP_BATCH_SIZE if stage == STAGE_BACKUP else 1
+        ))
+    return PullWorker(subscriber, subscriptions, **options)
+
+
+def serve_health(worker: PullWorker, port: int) -> ThreadingHTTPServer:
+    """Atiende en segundo plano GET en `port` con las estadísticas del worker"""
+    class HealthHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = json.dumps(worker.snapshot()).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(('0.0.0.0', port), HealthHandler)
+    threading.Thread(target=server.serve_forever, name='worker-health', daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=WORKER_STAGES,
+                        help='Etapas a consumir (WORKER_STAGES)')
+    parser.add_argument('--concurrency', type=int, default=WORKER_CONCURRENCY,
+                        help='Mensajes procesados a la vez (WORKER_CONCURRENCY)')
+    parser.add_argument('--max-messages', type=int, default=WORKER_MAX_MESSAGES,
+                        help='Mensajes sin resolver por suscripción (WORKER_MAX_MESSAGES)')
+    parser.add_argument('--ack-deadline', type=int, default=WORKER_ACK_DEADLINE_SECONDS,
+                        help='Plazo de confirmación de las suscripciones en segundos (WORKER_ACK_DEADLINE_SECONDS)')
+    parser.add_argument('--max-lease', type=int, default=WORKER_MAX_LEASE_SECONDS,
+                        help='Segundos máximos que se renueva la reserva de un mensaje (WORKER_MAX_LEASE_SECONDS)')
+    parser.add_argument('--port', type=int, default=int(os.environ.get('PORT', 8080)),
+                        help='Puerto de la comprobación de salud (PORT)')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    from google.cloud import pubsub_v1
+
+    worker = build_worker(
+        pubsub_v1.SubscriberClient(),
+        args.stages,
+        concurrency=args.concurrency,
+        max_messages=args.max_messages,
+        ack_deadline_seconds=args.ack_deadline,
+        max_lease_seconds=args.max_lease
+    )
+
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+
+    server = serve_health(worker, args.port)
+    worker.start()
+    while not stop.wait(1):
+        pass
+
+    logger.info("Deteniendo el worker")
+    if not worker.stop(timeout=WORKER_SHUTDOWN_SECONDS):
+        logger.warning("Quedaron mensajes en curso; Pub/Sub los reentregará")
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
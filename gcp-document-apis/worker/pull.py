@@ -0,0 +1,324 @@
+"""
+Consumo de suscripciones pull de Pub/Sub con un pool de hilos
+Cada suscripción tiene su hilo de pull, que deja de pedir mensajes mientras
+tiene `max_messages` sin resolver (prefetch); los mensajes se procesan en un
+pool de `concurrency` hilos compartido por todas las suscripciones. Un hilo de
+mantenimiento renueva la reserva de los mensajes que siguen en curso antes de
+que venza su plazo y envía las confirmaciones y los rechazos acumulados en una
+petición por suscripción, en lugar de una por mensaje
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+from google.api_core.exceptions import DeadlineExceeded
+from google.api_core.retry import if_transient_error
+
+logger = logging.getLogger(__name__)
+
+# Mensajes procesados a la vez (hilos del pool)
+WORKER_CONCURRENCY = int(os.environ.get('WORKER_CONCURRENCY', 32))
+
+# Mensajes recibidos y sin resolver por suscripción antes de dejar de pedir más
+WORKER_MAX_MESSAGES = int(os.environ.get('WORKER_MAX_MESSAGES', 64))
+
+# Plazo de confirmación de las suscripciones (ack_deadline_seconds) y de cada renovación
+WORKER_ACK_DEADLINE_SECONDS = int(os.environ.get('WORKER_ACK_DEADLINE_SECONDS', 60))
+
+# Tiempo máximo que se renueva la reserva de un mensaje; después Pub/Sub lo reentrega
+WORKER_MAX_LEASE_SECONDS = int(os.environ.get('WORKER_MAX_LEASE_SECONDS', 3600))
+
+# Cada cuánto se envían las confirmaciones acumuladas
+WORKER_ACK_INTERVAL_SECONDS = float(os.environ.get('WORKER_ACK_INTERVAL_SECONDS', 0.1))
+
+# Espera máxima de cada pull sin mensajes
+WORKER_PULL_TIMEOUT_SECONDS = float(os.environ.get('WORKER_PULL_TIMEOUT_SECONDS', 30))
+
+# Identificadores por petición de acknowledge o modify_ack_deadline
+MAX_ACK_IDS_PER_REQUEST = 1000
+
+# Recibe mensajes de un mismo pull y devuelve, por mensaje, None para
+# confirmarlo o el error por el que se rechaza
+Handler = Callable[[List[Any]], List[Optional[str]]]
+
+
+def per_message(function: Callable[[Any], Any]) -> Handler:
+    """Handler que procesa los mensajes uno a uno; se rechaza el que lanza una excepción"""
+    def handle(messages: List[Any]) -> List[Optional[str]]:
+        errors = []
+        for message in messages:
+            try:
+                function(message)
+                errors.append(None)
+            except Exception as e:
+                errors.append(str(e) or type(e).__name__)
+        return errors
+    return handle
+
+
+class Subscription:
+    """
+    Suscripción atendida por el worker
+
+    Args:
+        name: Nombre corto (la etapa) para logs y estadísticas
+        path: Ruta completa de la suscripción
+        handler: Procesa los mensajes recibidos (ver `Handler`)
+        batch_size: Mensajes de un mismo pull que recibe el handler de una vez
+    """
+
+    def __init__(self, name: str, path: str, handler: Handler, batch_size: int = 1):
+        self.name = name
+        self.path = path
+        self.handler = handler
+        self.batch_size = max(1, batch_size)
+
+
+class PullWorker:
+    """
+    Consume varias suscripciones pull con un pool de hilos compartido
+
+    Args:
+        subscriber: Cliente `pubsub_v1.SubscriberClient`
+        subscriptions: Suscripciones a consumir
+        concurrency: Hilos que procesan mensajes
+        max_messages: Mensajes sin resolver por suscripción (prefetch)
+        ack_deadline_seconds: Plazo de confirmación de las suscripciones; la
+            reserva de un mensaje se renueva cuando ha consumido la mitad
+        max_lease_seconds: Tiempo máximo que se renueva la reserva de un mensaje
+        ack_interval: Segundos entre envíos de confirmaciones acumuladas
+        pull_timeout: Espera máxima de cada pull
+        observer: Función opcional que recibe (suscripción, mensajes, errores,
+            espera en cola, duración) tras procesar cada grupo
+    """
+
+    def __init__(self, subscriber, subscriptions: List[Subscription],
+                 concurrency: int = WORKER_CONCURRENCY,
+                 max_messages: int = WORKER_MAX_MESSAGES,
+                 ack_deadline_seconds: int = WORKER_ACK_DEADLINE_SECONDS,
+                 max_lease_seconds: int = WORKER_MAX_LEASE_SECONDS,
+                 ack_interval: float = WORKER_ACK_INTERVAL_SECONDS,
+                 pull_timeout: float = WORKER_PULL_TIMEOUT_SECONDS,
+                 observer: Optional[Callable] = None):
+        self.subscriber = subscriber
+        self.subscriptions = {subscription.name: subscription for subscription in subscriptions}
+        self.concurrency = max(1, concurrency)
+        self.max_messages = max(1, max_messages)
+        self.ack_deadline_seconds = ack_deadline_seconds
+        self.max_lease_seconds = max_lease_seconds
+        self.ack_interval = ack_interval
+        self.pull_timeout = pull_timeout
+        self.observer = observer
+
+        self.stats: Dict[str, Counter] = {name: Counter() for name in self.subscriptions}
+        # Por suscripción: mensajes sin resolver, reservas en curso (ack_id -> [recibido, vence])
+        # y confirmaciones y rechazos pendientes de enviar
+        self._outstanding = {name: 0 for name in self.subscriptions}
+        self._leases: Dict[str, Dict[str, List[float]]] = {name: {} for name in self.subscriptions}
+        self._acks: Dict[str, List[str]] = {name: [] for name in self.subscriptions}
+        self._nacks: Dict[str, List[str]] = {name: [] for name in self.subscriptions}
+        self._lock = threading.Condition()
+        self._executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='worker')
+        self._stopping = threading.Event()
+        self._closed = threading.Event()
+        self._pullers: List[threading.Thread] = []
+        self._maintainer: Optional[threading.Thread] = None
+
+    def start(self):
+        """Arranca un hilo de pull por suscripción y el de mantenimiento"""
+        for subscription in self.subscriptions.values():
+            thread = threading.Thread(target=self._pull_loop, args=(subscription,),
+                                      name=f"pull-{subscription.name}", daemon=True)
+            thread.start()
+            self._pullers.append(thread)
+        self._maintainer = threading.Thread(target=self._maintain, name='pull-maintenance', daemon=True)
+        self._maintainer.start()
+        logger.info(f"Worker consumiendo {', '.join(self.subscriptions)} con {self.concurrency} hilos "
+                    f"y hasta {self.max_messages} mensajes por suscripción")
+
+    def stop(self, timeout: Optional[float] = None) -> bool:
+        """
+        Deja de pedir mensajes, rechaza los que no empezaron y espera a los que
+        están en curso
+
+        Returns:
+            bool: True si terminaron todos antes de `timeout`
+        """
+        self._stopping.set()
+        with self._lock:
+            self._lock.notify_all()
+        for thread in self._pullers:
+            thread.join()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        with self._lock:
+            finished = self._lock.wait_for(lambda: not any(self._outstanding.values()), timeout=timeout)
+        self._closed.set()
+        if self._maintainer:
+            self._maintainer.join()
+        self._flush()
+        return finished
+
+    def idle(self) -> bool:
+        """Indica si no hay mensajes en curso ni confirmaciones por enviar"""
+        with self._lock:
+            return not any(any(pending.values()) for pending in (self._outstanding, self._acks, self._nacks))
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Estadísticas por suscripción y mensajes en curso"""
+        with self._lock:
+            return {
+                name: {**self.stats[name], 'outstanding': self._outstanding[name]}
+                for name in self.subscriptions
+            }
+
+    def _pull_loop(self, subscription: Subscription):
+        name = subscription.name
+        while not self._stopping.is_set():
+            with self._lock:
+                self._lock.wait_for(
+                    lambda: self._outstanding[name] < self.max_messages or self._stopping.is_set())
+                if self._stopping.is_set():
+                    break
+                room = self.max_messages - self._outstanding[name]
+
+            try:
+                response = self.subscriber.pull(
+                    request={'subscription': subscription.path, 'max_messages': room},
+                    timeout=self.pull_timeout
+                )
+            except DeadlineExceeded:
+                continue
+            except Exception as e:
+                logger.warning(f"Error en pull de {name}: {str(e)}")
+                with self._lock:
+                    self.stats[name]['pull_errors'] += 1
+                self._stopping.wait(1.0)
+                continue
+
+            received = list(response.received_messages)
+            if not received:
+                continue
+            pulled_at = time.monotonic()
+            with self._lock:
+                self._outstanding[name] += len(received)
+                for message in received:
+                    self._leases[name][message.ack_id] = [pulled_at, pulled_at + self.ack_deadline_seconds]
+                self.stats[name]['received'] += len(received)
+
+            for start in range(0, len(received), subscription.batch_size):
+                self._submit(subscription, received[start:start + subscription.batch_size], pulled_at)
+
+    def _submit(self, subscription: Subscription, messages: List[Any], pulled_at: float):
+        def on_done(future):
+            # Las tareas que no llegaron a empezar al detener el worker se reentregan
+            if future.cancelled():
+                self._settle(subscription, messages, ['Worker detenido'] * len(messages))
+
+        try:
+            self._executor.submit(self._process, subscription, messages, pulled_at).add_done_callback(on_done)
+        except RuntimeError:
+            self._settle(subscription, messages, ['Worker detenido'] * len(messages))
+
+    def _process(self, subscription: Subscription, messages: List[Any], pulled_at: float):
+        started_at = time.monotonic()
+        try:
+            errors = subscription.handler(messages)
+        except Exception as e:
+            logger.error(f"Error procesando {len(messages)} mensajes de {subscription.name}: {str(e)}")
+            errors = [str(e)] * len(messages)
+        self._settle(subscription, messages, errors)
+        if self.observer:
+            self.observer(subscription.name, messages, errors, started_at - pulled_at, time.monotonic() - started_at)
+
+    def _settle(self, subscription: Subscription, messages: List[Any], errors: List[Optional[str]]):
+        name = subscription.name
+        with self._lock:
+            for message, error in zip(messages, errors):
+                self._leases[name].pop(message.ack_id, None)
+                if error:
+                    self._nacks[name].append(message.ack_id)
+                    self.stats[name]['nacked'] += 1
+                else:
+                    self._acks[name].append(message.ack_id)
+                    self.stats[name]['acked'] += 1
+            self.stats[name]['batches'] += 1
+            self._outstanding[name] -= len(messages)
+            self._lock.notify_all()
+
+    def _maintain(self):
+        while not self._closed.wait(self.ack_interval):
+            self._flush()
+            self._extend_leases()
+
+    def _flush(self):
+        """Envía las confirmaciones y los rechazos acumulados de cada suscripción"""
+        for name, subscription in self.subscriptions.items():
+            with self._lock:
+                acks, self._acks[name] = self._acks[name], []
+                nacks, self._nacks[name] = self._nacks[name], []
+            # Un rechazo es un plazo de 0 segundos: Pub/Sub reentrega el mensaje enseguida.
+            # Lo que falla por un error transitorio se reintenta en el siguiente envío
+            failed_acks = self._send(subscription, 'acknowledge', acks)
+            failed_nacks = self._send(subscription, 'modify_ack_deadline', nacks, ack_deadline_seconds=0)
+            with self._lock:
+                self._acks[name].extend(failed_acks)
+                self._nacks[name].extend(failed_nacks)
+
+    def _extend_leases(self):
+        """Renueva la reserva de los mensajes en curso que consumieron la mitad de su plazo"""
+        now = time.monotonic()
+        for name, subscription in self.subscriptions.items():
+            due = []
+            with self._lock:
+                leases = self._leases[name]
+                for ack_id, (pulled_at, expires_at) in list(leases.items()):
+                    if now - pulled_at >= self.max_lease_seconds:
+                        # Se deja vencer: si el mensaje termina después, su confirmación se ignora
+                        del leases[ack_id]
+                        self.stats[name]['lease_expired'] += 1
+                        logger.warning(f"Mensaje de {name} en curso desde hace {now - pulled_at:.0f} s; "
+                                       f"se deja de renovar su reserva")
+                    elif expires_at - now <= self.ack_deadline_seconds / 2:
+                        due.append(ack_id)
+            if not due:
+                continue
+
+            failed = set(self._send(subscription, 'modify_ack_deadline', due,
+                                    ack_deadline_seconds=self.ack_deadline_seconds))
+            with self._lock:
+                for ack_id in due:
+                    lease = self._leases[name].get(ack_id)
+                    if lease and ack_id not in failed:
+                        lease[1] = now + self.ack_deadline_seconds
+                        self.stats[name]['lease_extensions'] += 1
+
+    def _send(self, subscription: Subscription, method: str, ack_ids: List[str], **fields) -> List[str]:
+        """
+        Envía `acknowledge` o `modify_ack_deadline` en peticiones de hasta
+        MAX_ACK_IDS_PER_REQUEST identificadores
+
+        Returns:
+            List: Identificadores de las peticiones que fallaron con un error
+            transitorio; los de otros errores se descartan y Pub/Sub reentrega
+            sus mensajes al vencer el plazo
+        """
+        retry = []
+        for start in range(0, len(ack_ids), MAX_ACK_IDS_PER_REQUEST):
+            chunk = ack_ids[start:start + MAX_ACK_IDS_PER_REQUEST]
+            try:
+                getattr(self.subscriber, method)(request={'subscription': subscription.path, 'ack_ids': chunk,
+                                                          **fields})
+                with self._lock:
+                    self.stats[subscription.name][f"{method}_requests"] += 1
+            except Exception as e:
+                logger.warning(f"Error en {method} de {len(chunk)} mensajes de {subscription.name}: {str(e)}")
+                with self._lock:
+                    self.stats[subscription.name][f"{method}_errors"] += 1
+                if if_transient_error(e):
+                    retry.extend(chunk)
+        return retry